@@ -0,0 +1,296 @@
+"""Contrôle d'admission de !ask : limites par utilisateur, file d'attente équitable et regroupement.
+
+- `UserRateLimiter` : un seau à jetons par utilisateur (N demandes par minute, rafale bornée).
+- `FairQueue` : au plus `max_active` demandes traitées à la fois ; les autres attendent dans
+  l'ordre d'arrivée et sont prévenues de leur position à chaque avancée de la file.
+- `Coalescer` : deux demandes identiques en cours partagent le même calcul (et les morceaux de texte
+  déjà diffusés, pour les synthèses en streaming).
+- `call_with_backoff` : nouvelle tentative des appels refusés en 429, en respectant Retry-After.
+"""
+import asyncio
+import collections
+import email.utils
+import random
+import time
+from dataclasses import dataclass
+
+RETRY_AFTER_MS_HEADERS = ("retry-after-ms", "x-ms-retry-after-ms")
+
+
+# ----- 429 -----
+
+def _header(headers, name: str):
+    if not headers:
+        return None
+    try:
+        value = headers.get(name)
+    except AttributeError:
+        return None
+    if value is not None:
+        return value
+    for key, value in headers.items():  # Dictionnaires simples : casse quelconque.
+        if key.lower() == name:
+            return value
+    return None
+
+
+def retry_after_seconds(error) -> float | None:
+    """Délai demandé par le serveur (Retry-After, retry-after-ms, x-ms-retry-after-ms), en secondes."""
+    response = getattr(error, "response", None)
+    for headers in (getattr(error, "headers", None), getattr(response, "headers", None)):
+        for name in RETRY_AFTER_MS_HEADERS:
+            value = _header(headers, name)
+            if value is not None:
+                try:
+                    return max(0.0, float(value) / 1000)
+                except ValueError:
+                    pass
+        value = _header(headers, "retry-after")
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def is_rate_limited(error) -> bool:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+
+async def call_with_backoff(call, max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 30.0,
+                            on_retry=None):
+    """`await call()` ; en cas de 429, nouvel essai après Retry-After ou un délai exponentiel (avec gigue).
+
+    `on_retry(attempt, delay, error)` est attendu avant chaque pause. Les autres erreurs, et le 429 du
+    dernier essai, remontent telles quelles.
+    """
+    attempt = 1
+    while True:
+        try:
+            return await call()
+        except Exception as e:
+            if not is_rate_limited(e) or attempt >= max_attempts:
+                raise
+            delay = retry_after_seconds(e)
+            if delay is None:
+                delay = base_delay * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+            delay = min(delay, max_delay)
+            if on_retry:
+                await on_retry(attempt, delay, e)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+# ----- Limites par utilisateur -----
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float, now: float | None = None):
+        self.rate = rate_per_second
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self, now: float | None = None) -> float:
+        """Prend un jeton ; renvoie 0, ou le nombre de secondes avant qu'un jeton soit disponible."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class UserRateLimiter:
+    """`per_minute` demandes par minute et par utilisateur, avec une rafale de `burst` demandes."""
+
+    def __init__(self, per_minute: float, burst: int = 2):
+        self.per_minute = per_minute
+        self.burst = max(1, burst)
+        self._buckets: dict = {}
+
+    def check(self, user_id, now: float | None = None) -> float:
+        """0 si la demande est admise (un jeton est consommé), sinon l'attente en secondes."""
+        if self.per_minute <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= 1000:  # Seaux pleins = utilisateurs inactifs : on les oublie.
+                self._buckets = {key: b for key, b in self._buckets.items() if not b.is_full(now)}
+            bucket = self._buckets[user_id] = TokenBucket(self.per_minute / 60, self.burst, now)
+        return bucket.take(now)
+
+
+# ----- File d'attente -----
+
+@dataclass
+class _Waiter:
+    moved: asyncio.Event
+    granted: bool = False
+
+
+class FairQueue:
+    """Sémaphore premier arrivé, premier servi, qui annonce sa position à chaque demande en attente."""
+
+    def __init__(self, max_active: int = 2):
+        self.max_active = max(1, max_active)
+        self.active = 0
+        self._waiters: collections.deque[_Waiter] = collections.deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, on_position=None) -> int:
+        """Attend une place ; `on_position(position)` est attendu à l'entrée en file puis à chaque avancée.
+
+        Renvoie la position d'entrée (0 = traité tout de suite).
+        """
+        if self.active < self.max_active and not self._waiters:
+            self.active += 1
+            return 0
+        waiter = _Waiter(asyncio.Event())
+        self._waiters.append(waiter)
+        entry_position = position = len(self._waiters)
+        try:
+            if on_position:
+                await on_position(position)
+            while not waiter.granted:
+                await waiter.moved.wait()
+                waiter.moved.clear()
+                if not waiter.granted and on_position and self._waiters.index(waiter) + 1 != position:
+                    position = self._waiters.index(waiter) + 1
+                    await on_position(position)
+        except BaseException:
+            if waiter.granted:
+                self.release()  # Place obtenue pendant l'annulation : on la passe au suivant.
+            else:
+                self._waiters.remove(waiter)
+                self._notify_moved()
+            raise
+        return entry_position
+
+    def release(self):
+        if self._waiters:
+            waiter = self._waiters.popleft()  # La place passe directement au suivant.
+            waiter.granted = True
+            waiter.moved.set()
+            self._notify_moved()
+        else:
+            self.active -= 1
+
+    def _notify_moved(self):
+        for waiter in self._waiters:
+            waiter.moved.set()
+
+    def slot(self, on_position=None):
+        return _QueueSlot(self, on_position)
+
+
+class _QueueSlot:
+    def __init__(self, queue: FairQueue, on_position):
+        self.queue = queue
+        self.on_position = on_position
+        self.entry_position = 0
+
+    async def __aenter__(self):
+        self.entry_position = await self.queue.acquire(self.on_position)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.queue.release()
+
+
+# ----- Regroupement des demandes identiques -----
+
+class _Listener:
+    """Reçoit les morceaux déjà diffusés puis les suivants, dans l'ordre et une seule fois chacun."""
+
+    def __init__(self, on_delta):
+        self.on_delta = on_delta
+        self.sent = 0
+        self.lock = asyncio.Lock()
+        self.failed = False
+
+    async def pump(self, parts: list):
+        async with self.lock:
+            while self.sent < len(parts) and not self.failed:
+                part = parts[self.sent]
+                self.sent += 1
+                try:
+                    await self.on_delta(part)
+                except Exception:
+                    self.failed = True  # Un affichage en échec ne bloque pas les autres demandes.
+
+
+class _Flight:
+    def __init__(self):
+        self.parts: list = []
+        self.listeners: list[_Listener] = []
+        self.pumps: set = set()
+        self.task: asyncio.Task | None = None
+
+    async def emit(self, part):
+        self.parts.append(part)
+        for listener in self.listeners:
+            pump = asyncio.ensure_future(listener.pump(self.parts))
+            self.pumps.add(pump)
+            pump.add_done_callback(self.pumps.discard)
+
+
+class Coalescer:
+    """`run(key, factory)` : un seul `factory(emit)` par clé en cours ; les demandes identiques l'attendent.
+
+    `factory` reçoit `emit`, à appeler avec chaque morceau de texte produit ; chaque demande reçoit
+    tous les morceaux (y compris ceux émis avant son arrivée) via son propre `on_delta`. Le calcul
+    partagé continue même si la demande qui l'a lancé est annulée.
+    """
+
+    def __init__(self):
+        self._flights: dict = {}
+        self.stats = {"started": 0, "shared": 0}
+
+    def in_flight(self, key) -> bool:
+        return key in self._flights
+
+    async def run(self, key, factory, on_delta=None) -> tuple[object, bool]:
+        """(résultat, partagé ?) ; partagé vaut True si un calcul identique était déjà en cours."""
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.ensure_future(factory(flight.emit))
+            flight.task.add_done_callback(lambda _: self._flights.pop(key, None) if self._flights.get(key) is flight else None)
+            self.stats["started"] += 1
+        else:
+            self.stats["shared"] += 1
+        listener = None
+        if on_delta is not None:
+            listener = _Listener(on_delta)
+            flight.listeners.append(listener)
+            await listener.pump(flight.parts)
+        try:
+            result = await asyncio.shield(flight.task)
+        finally:
+            if listener is not None:
+                flight.listeners.remove(listener)
+        if listener is not None:
+            await listener.pump(flight.parts)  # Derniers morceaux pas encore affichés.
+        return result, shared
@@ -0,0 +1,115 @@
+"""Réponses de !ask aux requêtes d'agrégat (COUNT, SUM, MIN, MAX, AVG, GROUP BY).
+
+Ces résultats ne sont pas des messages : ils sont mis en forme ici au lieu de partir à la synthèse.
+Cosmos n'accepte pas ORDER BY avec GROUP BY : les groupes sont classés ici par leur premier agrégat,
+du plus grand au plus petit (du plus ancien au plus récent pour MIN), et seuls les premiers sont affichés.
+"""
+import cosmos_sql
+from prompt_builder import format_paris_minute
+
+MAX_GROUPS_SHOWN = 10
+
+# Champ agrégé -> (singulier, pluriel) de l'unité affichée.
+UNITS = {
+    None: ("message", "messages"),
+    "reactions_count": ("réaction", "réactions"),
+    "attachments_count": ("pièce jointe", "pièces jointes"),
+}
+FIELD_LABELS = {
+    "author_name": "auteur", "author_display_name": "pseudo", "channel_id": "salon", "guild_id": "serveur",
+    "author_id": "auteur", "author_bot": "bot", "reactions_count": "réactions", "attachments_count": "pièces jointes",
+    "timestamp_iso": "date",
+}
+
+
+def aggregate_query(sql: str) -> cosmos_sql.Query | None:
+    """Requête analysée si `sql` est un agrégat, sinon None (requête de messages ou syntaxe non gérée)."""
+    try:
+        query = cosmos_sql.parse(sql)
+    except cosmos_sql.CosmosSqlError:
+        return None
+    return query if query.is_aggregate else None
+
+
+def _aggregate_of(expr) -> tuple[str, str | None] | None:
+    """(fonction, champ) d'une projection d'agrégat ; champ None pour COUNT."""
+    if not isinstance(expr, cosmos_sql.Call) or expr.name not in cosmos_sql.AGGREGATE_FUNCTIONS:
+        return None
+    if expr.name == "COUNT":
+        return "COUNT", None
+    argument = expr.args[0] if expr.args else None
+    field = argument.parts[-1] if isinstance(argument, cosmos_sql.Path) and argument.parts else None
+    return expr.name, field
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:.2f}"
+    return str(int(value)) if isinstance(value, (int, float)) and not isinstance(value, bool) else str(value)
+
+
+def _with_unit(value, field: str | None) -> str:
+    singular, plural = UNITS.get(field, ("", ""))
+    if not singular:
+        return _number(value)
+    return f"{_number(value)} {singular if isinstance(value, (int, float)) and abs(value) <= 1 else plural}"
+
+
+def _describe_value(function: str, field: str | None, value) -> str:
+    if field == "timestamp_iso" and isinstance(value, str):
+        return f"{'premier' if function == 'MIN' else 'dernier'} message le {format_paris_minute(value)}"
+    if function in ("COUNT", "SUM"):
+        return _with_unit(value, field)
+    label = FIELD_LABELS.get(field, field or "valeur")
+    prefix = {"MIN": "minimum", "MAX": "maximum", "AVG": "moyenne"}[function]
+    return f"{prefix} de {label} : {_number(value)}" + (" par message" if function == "AVG" else "")
+
+
+def _group_label(field: str, value) -> str:
+    if value is None or value is cosmos_sql.UNDEFINED:
+        return "(inconnu)"
+    if field == "channel_id":
+        return f"<#{value}>"
+    if field == "author_bot":
+        return "bots" if value else "humains"
+    return str(value)
+
+
+def render_aggregate(query: cosmos_sql.Query, rows: list, max_groups: int = MAX_GROUPS_SHOWN) -> str:
+    """Texte de réponse pour les lignes d'une requête d'agrégat."""
+    projections = [(cosmos_sql._projection_name(p, i), p.expr) for i, p in enumerate(query.projections or [])]
+    measures = [(name, aggregate) for name, expr in projections if (aggregate := _aggregate_of(expr))]
+    if not rows or not measures:
+        return "Aucun message ne correspond à votre demande."
+
+    if not query.group_by:
+        row = rows[0]
+        if query.value:
+            function, field = measures[0][1]
+            if function == "COUNT":
+                return f"J'ai trouvé {_number(row)} message(s) correspondant à votre demande."
+            return f"Résultat : {_describe_value(function, field, row)}."
+        parts = [_describe_value(function, field, row[name]) for name, (function, field) in measures if name in row]
+        return "Résultat : " + ", ".join(parts) + "." if parts else "Aucun message ne correspond à votre demande."
+
+    keys = [(name, expr.parts[-1]) for name, expr in projections
+            if isinstance(expr, cosmos_sql.Path) and expr.parts and expr in query.group_by]
+    sort_name, (sort_function, _) = measures[0]
+
+    def sort_key(row):
+        value = row.get(sort_name) if isinstance(row, dict) else row
+        return cosmos_sql._sort_key(value if value is not None else cosmos_sql.UNDEFINED)
+
+    ranked = sorted(rows, key=sort_key, reverse=sort_function != "MIN")
+    lines = []
+    for position, row in enumerate(ranked[:max_groups], start=1):
+        if not isinstance(row, dict):
+            label, values = _number(row), ""
+        else:
+            label = " / ".join(_group_label(field_name, row.get(name)) for name, field_name in keys) or "(tous)"
+            values = ", ".join(_describe_value(f, fld, row[name]) for name, (f, fld) in measures if name in row)
+        lines.append(f"{position}. **{label}** : {values}" if values else f"{position}. {label}")
+    if len(ranked) > max_groups:
+        lines.append(f"… et {len(ranked) - max_groups} autre(s).")
+    dimension = ", ".join(FIELD_LABELS.get(field_name, field_name) for _, field_name in keys) or "groupe"
+    return f"Classement par {dimension} ({len(ranked)} au total) :\n" + "\n".join(lines)
@@ -0,0 +1,289 @@
+"""Sessions de !ask : une question de suivi affine le dernier résultat au lieu de relancer la recherche.
+
+Après un !ask résumé, la session de l'utilisateur dans ce canal garde les messages lus et les résumés
+déjà produits. Une question de suivi reconnue localement ("et seulement ceux de Fly ?", "résume
+plutôt la partie sur le jeu", "et ceux d'hier ?") est appliquée à ces messages : filtre par auteur ou
+par période, classement par mots-clés (avec les messages voisins pour le contexte), N derniers.
+Pas de génération SQL ni de requête Cosmos ; seul le sous-ensemble retenu part à la synthèse, et un
+sous-ensemble déjà résumé dans la session ne coûte plus de tokens.
+
+Comme intent_parser (dont la détection des pseudos est reprise), tout mot non reconnu fait échouer
+l'analyse : la question repart alors dans le circuit complet et remplace la session. Un "de X" qui
+n'est pas un pseudo, une exclusion qui n'est pas un auteur ou une portée de salon aussi. "plutôt" repart du résultat d'origine ; sinon les affinages
+se cumulent sur le dernier sous-ensemble affiché.
+
+Sessions en LRU borné en nombre et en octets (estimés), expirées après `ttl_seconds` d'inactivité.
+"""
+import collections
+import json
+import re
+import time
+from dataclasses import dataclass, field
+
+from intent_parser import AUTHOR_RE, FILLER_WORDS, NUMBER_RE, NUMBER_WORDS, TIME_PATTERNS, is_author_name
+from sql_cache import normalize_question, resolve_time_window
+
+REFINEMENT_MARKER_RE = re.compile(
+    r"^(?:et|mais|puis|ok)\b|\b(?:seulement|uniquement|juste|plutot|parmi|dedans|la-dedans|"
+    r"ceux|celles|ceux-ci|celles-ci|ceux-la|celles-la|sauf)\b|\bces messages\b"
+)
+INSTEAD_RE = re.compile(r"\bplutot\b")
+TOPIC_RE = re.compile(
+    r"\b(?:sur|concernant|a propos d(?:e|u|es|')|parl\w* d(?:e|u|es|')|qui mentionnent|avec le mot|contenant)\s*"
+    r"(?P<topic>[^,]+)$"
+)
+SCOPE_RE = re.compile(r"\b(?:dans|sur|en) (?:le |la |l'|les |ce |cet |ces )?(?:canal|canaux|salon|salons|chan|serveur|vocal|dm|mp)\b")
+EXCLUDE_RE = re.compile(r"\b(?:sauf|sans|hors|pas)\s+(?:ceux |celles |les messages |ceux-la )?(?:de |d'|par )?(?P<name>[\w.\-]+)")
+LAST_N_RE = re.compile(rf"\b(?:les |ces )?{NUMBER_RE} (?P<dir>derniers|premiers)(?: (?:messages|msgs))?\b")
+
+REFINEMENT_WORDS = {
+    "et", "mais", "puis", "ok", "seulement", "uniquement", "juste", "que", "qu'", "plutot", "parmi", "eux", "elles",
+    "ceux", "celles", "ceux-ci", "celles-ci", "ceux-la", "celles-la", "ces", "dedans", "la-dedans", "partie",
+    "passage", "passages", "moment", "garde", "filtre", "ne", "n'", "refais", "refait", "fais", "fait", "avec",
+    "alors", "plus", "mot", "mots", "sujet", "sujets", "seul", "seuls", "seules", "pour",
+}
+TIME_LABELS = {"day_before_yesterday": "avant-hier", "today": "aujourd'hui", "yesterday": "hier", "last_week": "semaine dernière",
+               "week": "cette semaine", "last_month": "mois dernier", "month": "ce mois-ci", "last_year": "année dernière",
+               "year": "cette année"}
+STOP_WORDS = FILLER_WORDS | REFINEMENT_WORDS | {"l", "d", "qu", "aux", "et", "ou", "son", "sa", "ses", "leur", "leurs"}
+
+
+@dataclass
+class Refinement:
+    authors: tuple[str, ...] = ()
+    excluded_authors: tuple[str, ...] = ()
+    keywords: tuple[str, ...] = ()
+    time_range: str | None = None
+    limit: int | None = None
+    oldest_first: bool = False
+    instead: bool = False  # "plutôt" : repartir du résultat d'origine, pas du dernier affinage.
+
+    def describe(self) -> str:
+        parts = []
+        if self.authors:
+            parts.append("de " + ", ".join(self.authors))
+        if self.excluded_authors:
+            parts.append("sauf " + ", ".join(self.excluded_authors))
+        if self.keywords:
+            parts.append("sur " + ", ".join(self.keywords))
+        if self.time_range:
+            parts.append(TIME_LABELS[self.time_range])
+        if self.limit:
+            parts.append(f"{self.limit} {'premiers' if self.oldest_first else 'derniers'}")
+        return ", ".join(parts)
+
+
+def parse_refinement(question: str) -> Refinement | None:
+    """Refinement si la question affine visiblement le résultat précédent, sinon None (circuit complet)."""
+    if "#" in question or "<" in question or '"' in question:
+        return None  # Salon, mention ou texte exact : hors du résultat précédent, circuit complet.
+    text = normalize_question(question)
+    text = re.sub(r"^ask\s+", "", text)
+    if not REFINEMENT_MARKER_RE.search(text) or SCOPE_RE.search(text):
+        return None
+    refinement = Refinement(instead=bool(INSTEAD_RE.search(text)))
+
+    def cut(match):
+        nonlocal text
+        text = text[:match.start()] + " " + text[match.end():]
+
+    for name, pattern in TIME_PATTERNS:
+        match = re.search(pattern, text)
+        if match:
+            if refinement.time_range:
+                return None
+            refinement.time_range = name
+            cut(match)
+
+    if (match := LAST_N_RE.search(text)):
+        raw_n = match.group("n")
+        refinement.limit = int(raw_n) if raw_n.isdigit() else NUMBER_WORDS[raw_n]
+        refinement.oldest_first = match.group("dir") == "premiers"
+        cut(match)
+
+    excluded = []
+    while (match := EXCLUDE_RE.search(text)):
+        if not is_author_name(match.group("name")):
+            return None  # "sans images", "sauf lundi" : pas une exclusion d'auteur, on ne devine pas.
+        excluded.append(match.group("name"))
+        cut(match)
+    refinement.excluded_authors = tuple(excluded)
+
+    if (match := TOPIC_RE.search(text)):
+        refinement.keywords = tuple(word for word in re.split(r"[\s']+", match.group("topic"))
+                                    if word and word not in STOP_WORDS)
+        if not refinement.keywords:
+            return None
+        cut(match)
+
+    authors = []
+    for match in list(AUTHOR_RE.finditer(text)):
+        if match.group("name") in STOP_WORDS:
+            continue
+        if not is_author_name(match.group("name")):
+            return None  # "ceux de janvier", "ceux de 2023" : pas un pseudo, laissé au circuit complet.
+        authors.append(match.group("name"))
+    text = AUTHOR_RE.sub(" ", text)
+    refinement.authors = tuple(authors)
+
+    residual = re.sub(r"\b[ldjmstn]'|\bqu'", " ", text)
+    if any(word not in STOP_WORDS for word in residual.split()):
+        return None  # Mot inconnu : on ne devine pas, la question repart à l'IA.
+    if not (refinement.authors or refinement.excluded_authors or refinement.keywords
+            or refinement.time_range or refinement.limit):
+        return None
+    return refinement
+
+
+def _author_matches(item: dict, names: tuple[str, ...]) -> bool:
+    author = normalize_question(f"{item.get('author_name') or ''} {item.get('author_display_name') or ''}")
+    return any(name in author for name in names)
+
+
+def _in_time_range(item: dict, time_range: str, window: dict[str, str]) -> bool:
+    timestamp = item.get("timestamp_iso") or ""
+    if time_range in ("week", "last_week"):
+        prefix = "" if time_range == "week" else "last_"
+        return window[f"{prefix}week_start"] <= timestamp[:10] <= window[f"{prefix}week_end"]
+    return timestamp.startswith(window[time_range])
+
+
+def apply_refinement(items: list[dict], refinement: Refinement, now, context: int = 1) -> list[dict]:
+    """Messages de `items` retenus par `refinement`, dans l'ordre d'origine.
+
+    Avec des mots-clés, les messages qui les contiennent sont retenus avec leurs `context` voisins
+    (dans l'ordre chronologique du même canal) : une réponse sans le mot reste dans la partie.
+    """
+    kept = items
+    if refinement.time_range:
+        window = resolve_time_window(now)
+        kept = [item for item in kept if _in_time_range(item, refinement.time_range, window)]
+    if refinement.authors:
+        kept = [item for item in kept if _author_matches(item, refinement.authors)]
+    if refinement.excluded_authors:
+        kept = [item for item in kept if not _author_matches(item, refinement.excluded_authors)]
+    if refinement.keywords:
+        patterns = [re.compile(r"\b" + re.escape(keyword)) for keyword in refinement.keywords]
+        chronological = sorted(kept, key=lambda item: (str(item.get("channel_id")), item.get("timestamp_iso") or ""))
+        selected = set()
+        for index, item in enumerate(chronological):
+            content = normalize_question(item.get("content") or "")
+            if any(pattern.search(content) for pattern in patterns):
+                for neighbour in chronological[max(0, index - context):index + context + 1]:
+                    if neighbour.get("channel_id") == item.get("channel_id"):
+                        selected.add(id(neighbour))
+        kept = [item for item in kept if id(item) in selected]
+    if refinement.limit:
+        ordered = sorted(kept, key=lambda item: item.get("timestamp_iso") or "", reverse=not refinement.oldest_first)
+        chosen = {id(item) for item in ordered[:refinement.limit]}
+        kept = [item for item in kept if id(item) in chosen]
+    return kept
+
+
+@dataclass
+class AskSession:
+    question: str
+    items: list[dict]
+    request_charge: float  # RU de la lecture d'origine : évitées à chaque affinage.
+    size_bytes: int
+    current: list[dict] = field(default_factory=list)  # Dernier sous-ensemble affiché.
+    summaries: collections.OrderedDict = field(default_factory=collections.OrderedDict)
+    last_used: float = field(default_factory=time.monotonic)
+    refinements: int = 0
+    saved_queries: int = 0
+    saved_request_charge: float = 0.0
+    tokens_sent: int = 0
+    tokens_avoided: int = 0
+    reused_summaries: int = 0
+
+    max_summaries = 16
+
+    def summary_for(self, key) -> str | None:
+        summary = self.summaries.get(key)
+        if summary is not None:
+            self.summaries.move_to_end(key)
+        return summary
+
+    def remember_summary(self, key, summary: str):
+        self.summaries[key] = summary
+        self.summaries.move_to_end(key)
+        while len(self.summaries) > self.max_summaries:
+            self.summaries.popitem(last=False)
+
+    def record_refinement(self, sent_tokens: int, base_tokens: int, reused: bool):
+        """Un affinage servi sans génération SQL ni requête Cosmos."""
+        self.refinements += 1
+        self.saved_queries += 1
+        self.saved_request_charge += self.request_charge
+        self.tokens_sent += sent_tokens
+        self.tokens_avoided += max(0, base_tokens - sent_tokens)
+        self.reused_summaries += reused
+
+    def report(self) -> str:
+        return (f"{self.refinements} affinage(s), {self.saved_queries} requête(s) et {self.saved_request_charge:.1f} RU évitées, "
+                f"~{self.tokens_sent} tokens envoyés / ~{self.tokens_avoided} évités, {self.reused_summaries} résumé(s) réutilisé(s)")
+
+
+class AskSessionStore:
+    def __init__(self, ttl_seconds: float = 900.0, max_sessions: int = 200, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._sessions: collections.OrderedDict[tuple, AskSession] = collections.OrderedDict()
+        self.stats = {"started": 0, "refinements": 0, "saved_queries": 0, "saved_request_charge": 0.0,
+                      "tokens_avoided": 0, "expired": 0, "evicted": 0}
+
+    @property
+    def active(self) -> int:
+        return len(self._sessions)
+
+    def get(self, key: tuple) -> AskSession | None:
+        session = self._sessions.get(key)
+        if session is None:
+            return None
+        if time.monotonic() - session.last_used > self.ttl_seconds:
+            self.forget(key)
+            self.stats["expired"] += 1
+            return None
+        self._sessions.move_to_end(key)
+        return session
+
+    def start(self, key: tuple, question: str, items: list[dict], request_charge: float,
+              summary_key=None, summary: str | None = None) -> AskSession | None:
+        """Nouvelle session pour `key` (remplace la précédente) ; None si le résultat est trop gros."""
+        self.forget(key)
+        size = len(json.dumps(items, default=str))
+        if size > self.max_bytes // 4:
+            return None
+        session = AskSession(question, items, request_charge, size, current=items)
+        if summary_key is not None and summary:
+            session.remember_summary(summary_key, summary)
+        self._sessions[key] = session
+        self.bytes += size
+        self.stats["started"] += 1
+        self._evict()
+        return session
+
+    def record_refinement(self, session: AskSession, sent_tokens: int, base_tokens: int, reused: bool):
+        session.record_refinement(sent_tokens, base_tokens, reused)
+        session.last_used = time.monotonic()
+        self.stats["refinements"] += 1
+        self.stats["saved_queries"] += 1
+        self.stats["saved_request_charge"] += session.request_charge
+        self.stats["tokens_avoided"] += max(0, base_tokens - sent_tokens)
+
+    def forget(self, key: tuple):
+        session = self._sessions.pop(key, None)
+        if session is not None:
+            self.bytes -= session.size_bytes
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [key for key, session in self._sessions.items() if now - session.last_used > self.ttl_seconds]:
+            self.forget(key)
+            self.stats["expired"] += 1
+        while self._sessions and (len(self._sessions) > self.max_sessions or self.bytes > self.max_bytes):
+            _, session = self._sessions.popitem(last=False)
+            self.bytes -= session.size_bytes
+            self.stats["evicted"] += 1
@@ -0,0 +1,147 @@
+"""Archive Parquet : débit d'export et latence des agrégats historiques sur plusieurs millions de messages.
+
+Deux temps :
+- exactitude : quelques milliers de messages dans un conteneur en mémoire (moitié v1, moitié au
+  schéma compact), exportés en deux passes incrémentales (éditions et nouveaux messages entre les
+  deux), puis chaque requête comparée à l'évaluateur cosmos_sql ;
+- volume : --messages messages générés page par page (sans les garder en mémoire), exportés, puis
+  chaque requête exécutée à froid (archive rouverte) et à chaud. Les RU Cosmos évitées sont estimées
+  comme InMemoryCosmosRepository (parcours de tout le conteneur).
+
+    python benchmarks/bench_archive.py [--messages 2000000] [--channels 8] [--runs 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from fakes import make_fake_message
+
+import cosmos_sql
+from compact_schema import CompactRepository, DocumentHashStore
+from cosmos_repository import InMemoryCosmosRepository, estimate_request_charge
+from message_schema import format_message_to_json
+from parquet_archive import ArchiveExporter, ArchiveProgressStore, ArchiveRepository, ParquetArchive, plan
+
+QUERIES = [
+    "SELECT VALUE COUNT(1) FROM c WHERE STARTSWITH(c.timestamp_iso, '2024')",
+    "SELECT c.author_name, COUNT(1) AS messages FROM c WHERE c.timestamp_iso < '2025-01-01' GROUP BY c.author_name",
+    "SELECT VALUE SUM(c.reactions_count) FROM c WHERE c.channel_id = '1001' AND STARTSWITH(c.timestamp_iso, '2024-03')",
+    "SELECT COUNT(1) AS n, MIN(c.timestamp_iso) AS premier FROM c WHERE CONTAINS(LOWER(c.content), 'valorant') "
+    "AND c.timestamp_iso < '2025-01-01'",
+    "SELECT c.channel_id, SUM(c.attachments_count) AS fichiers, AVG(c.reactions_count) AS reactions FROM c "
+    "WHERE c.author_name IN ('airzya', 'flyxowl') AND c.timestamp_iso BETWEEN '2024-01-01' AND '2024-06-30' GROUP BY c.channel_id",
+    "SELECT VALUE MAX(c.timestamp_iso) FROM c WHERE c.author_name = 'hezek112' AND c.attachments_count > 0 "
+    "AND c.timestamp_iso < '2025-01-01'",
+]
+
+
+def message_doc(index: int, channels: int) -> dict:
+    return format_message_to_json(make_fake_message(index, channel_id=1000 + index % channels))
+
+
+class GeneratedSource:
+    """Dépôt en lecture seule : génère les pages à la demande ; mesure le temps passé à générer."""
+
+    def __init__(self, count: int, channels: int):
+        self.count = count
+        self.channels = channels
+        self.seconds = 0.0
+
+    async def query_pages(self, query: str, parameters=None, page_size: int = 100, continuation_token=None, **kwargs):
+        offset = int(continuation_token or 0)
+        while offset < self.count:
+            started = time.perf_counter()
+            written = int(time.time())
+            page = [dict(message_doc(index, self.channels), _ts=written)
+                    for index in range(offset, min(offset + page_size, self.count))]
+            self.seconds += time.perf_counter() - started
+            offset += len(page)
+            yield page, (str(offset) if offset < self.count else None)
+
+
+def normalized(rows) -> list[str]:
+    return sorted(json.dumps(row, sort_keys=True) for row in rows)
+
+
+async def check_results(workdir: str, count: int, channels: int) -> int:
+    raw = InMemoryCosmosRepository()
+    repo = CompactRepository(raw, DocumentHashStore(os.path.join(workdir, "state.sqlite3"), "bench"))
+    docs = [message_doc(index, channels) for index in range(count)]
+    for index, doc in enumerate(docs):
+        await (repo.upsert_item(doc) if index % 2 else raw.upsert_item(doc))
+    exporter = ArchiveExporter(os.path.join(workdir, "check"), ArchiveProgressStore(os.path.join(workdir, "state.sqlite3")),
+                               flush_rows=count // 3)
+    await exporter.export(repo, page_size=500)
+    for doc in docs[::50]:
+        doc["content"] += " valorant"
+        await repo.upsert_item(doc)
+    for index in range(count, count + count // 20):
+        docs.append(message_doc(index, channels))
+        await repo.upsert_item(docs[-1])
+    await exporter.export(repo, page_size=500)
+    archive = ArchiveRepository(repo, ParquetArchive(os.path.join(workdir, "check")))
+    same = 0
+    for sql in QUERIES:
+        same += normalized(await archive.query_items(sql)) == normalized(cosmos_sql.execute(sql, docs))
+    print(f"exactitude : {same}/{len(QUERIES)} résultats identiques à cosmos_sql sur {len(docs)} messages "
+          f"(2 passes, {exporter.stats['partitions_rewritten']} partitions réécrites), "
+          f"{archive.stats['answered']} requêtes servies par l'archive")
+    return same
+
+
+async def run(args, workdir: str):
+    same = await check_results(workdir, args.check_messages, args.channels)
+
+    source = GeneratedSource(args.messages, args.channels)
+    exporter = ArchiveExporter(os.path.join(workdir, "archive"), ArchiveProgressStore(os.path.join(workdir, "state.sqlite3")),
+                               flush_rows=args.flush_rows)
+    started = time.perf_counter()
+    exported = await exporter.export(source, page_size=args.page_size)
+    export_seconds = time.perf_counter() - started - source.seconds
+    json_bytes = len(json.dumps(message_doc(0, args.channels))) * args.messages  # Ordre de grandeur.
+    print(f"\nexport : {exported:,} messages en {export_seconds:.1f}s hors génération "
+          f"({exported / export_seconds:,.0f} messages/s), {exporter.stats['files_written']} fichiers, "
+          f"{exporter.stats['bytes_written'] / 1e6:,.1f} Mo sur disque (~{json_bytes / 1e6:,.0f} Mo en JSON)")
+
+    print(f"\n{'requête':72} {'froid':>8} {'chaud':>8} {'RU évitées':>11}")
+    for sql in QUERIES:
+        cold_archive = ParquetArchive(os.path.join(workdir, "archive"))
+        planned = plan(sql)
+        started = time.perf_counter()
+        cold_archive.run_query(planned)
+        cold = time.perf_counter() - started
+        warm = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            results = cold_archive.run_query(plan(sql))
+            warm.append(time.perf_counter() - started)
+        charge = estimate_request_charge("query", len(json.dumps(results)), scanned_documents=args.messages)
+        label = sql if len(sql) <= 72 else sql[:69] + "..."
+        print(f"{label:72} {cold * 1000:>6.0f}ms {statistics.median(warm) * 1000:>6.0f}ms {charge:>11,.0f}")
+    if same != len(QUERIES):
+        print("\nATTENTION : résultats différents de cosmos_sql.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2_000_000)
+    parser.add_argument("--channels", type=int, default=8)
+    parser.add_argument("--check-messages", type=int, default=6000, help="messages de la vérification d'exactitude")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--flush-rows", type=int, default=200_000)
+    parser.add_argument("--runs", type=int, default=5, help="exécutions à chaud par requête (médiane)")
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="bebzia_archive_")
+    try:
+        asyncio.run(run(args, workdir))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""Rejeu hors ligne de !ask et de rattrapages à travers bot.py, sans Discord, Azure OpenAI ni Cosmos.
+
+Le module bot est importé tel quel, puis ses dépendances externes sont remplacées par des doublures :
+conteneur InMemoryCosmosRepository (requêtes évaluées par cosmos_sql), client OpenAI simulé (latence
+et tokens configurables), salons et contexte de commande Discord simulés. Une charge synthétique (ou
+enregistrée, en JSONL) de questions et de rattrapages est rejouée par `--concurrency` clients : le
+rapport donne le débit, les latences (p50/p95/p99), le pic de mémoire résidente et les RU / tokens
+consommés. `--report` enregistre les chiffres en JSON et `--compare` les met en regard d'un rapport
+précédent, pour repérer une régression.
+
+    python benchmarks/bench_ask_replay.py [--messages 20000] [--asks 30] [--backfills 2] [--concurrency 8]
+    python benchmarks/bench_ask_replay.py --workload charge.jsonl --report apres.json --compare avant.json
+
+Les réglages du bot (ASK_MAX_CONCURRENT, SUMMARY_CHUNK_TOKENS...) se passent par l'environnement,
+comme en production. Une ligne de charge est soit {"type": "ask", "question": "...", "user": "airzya",
+"sql": "réponse de l'IA, optionnelle"}, soit {"type": "backfill", "channel_id": 5000, "messages": 2000}.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import importlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from fakes import AUTHORS, FakeChannel, FakeContext, FakeOpenAIClient, make_fake_message
+import pytz
+
+from cosmos_repository import InMemoryCosmosRepository
+from message_schema import format_message_to_json
+from metrics import quantile
+from prompt_builder import TokenEstimator
+
+ASK_CHANNEL_ID = 999
+BACKFILL_CHANNEL_ID = 5000
+SELECT_FIELDS = "c.id, c.channel_id, c.guild_id, c.author_name, c.author_display_name, c.content, c.timestamp_iso"
+REPLIES = (("Aucun message ne correspond", "vide"), ("J'ai trouvé", "comptage"), ("Classement", "classement"),
+           ("Résultat :", "agrégat"), ("Doucement", "limité"))
+
+
+def bot_environment(workdir: str) -> dict:
+    """Services externes désactivés (remplacés après import), état local dans `workdir`."""
+    return {
+        "DISCORD_BOT_TOKEN": "", "COSMOS_DB_ENDPOINT": "", "COSMOS_DB_KEY": "", "AZURE_OPENAI_ENDPOINT": "",
+        "AZURE_OPENAI_KEY": "", "ALLOWED_USER_IDS": "", "LOG_CHANNEL_ID": "", "METRICS_HTTP_PORT": "0",
+        "SQL_CACHE_PATH": "", "LIVE_INGESTION_ENABLED": "0", "CHECKPOINT_BACKEND": "sqlite",
+        "LOCAL_REPLICA_ENABLED": "0", "ROLLUPS_ENABLED": "0", "SEMANTIC_SEARCH_ENABLED": "0",
+        "LOCAL_STATE_PATH": os.path.join(workdir, "state.sqlite3"),
+        "DATABASE_NAME": "bench", "CONTAINER_NAME": "messages", "AZURE_OPENAI_DEPLOYMENT_NAME": "bench",
+    }
+
+
+def load_bot(workdir: str):
+    """Importe bot.py sans ses traces de démarrage ; les réglages !ask restent ceux de l'environnement."""
+    os.environ.update(bot_environment(workdir))
+    for name, value in (("ASK_USER_RATE_PER_MINUTE", "0"), ("LOG_LEVEL", "ERROR"), ("METRICS_WINDOW", "100000")):
+        os.environ.setdefault(name, value)
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot_module = importlib.import_module("bot")
+    for handler in bot_module.console_log_listener.handlers:
+        handler.setStream(sys.stdout)
+    return bot_module
+
+
+def generic_sql(question: str) -> str:
+    """Réponse de l'IA simulée pour une question enregistrée sans SQL : recherche du mot le plus long."""
+    word = max(question.replace("'", " ").split(), key=len)
+    return f'SELECT {SELECT_FIELDS} FROM c WHERE CONTAINS(c.content, "{word}", true) ORDER BY c.timestamp_iso DESC'
+
+
+def synthetic_questions(now: datetime.datetime) -> list[tuple[str, str | None]]:
+    """(question, SQL que l'IA produirait) ; None quand l'analyseur local doit répondre seul."""
+    today = now.strftime("%Y-%m-%d")
+    yesterday = (now - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    monday = (now - datetime.timedelta(days=now.weekday())).strftime("%Y-%m-%d")
+    sunday = (now + datetime.timedelta(days=6 - now.weekday())).strftime("%Y-%m-%d")
+    week = f'c.timestamp_iso >= "{monday}T00:00:00.000Z" AND c.timestamp_iso <= "{sunday}T23:59:59.999Z"'
+    questions = [
+        ("combien de messages aujourd'hui", None),
+        ("combien de messages cette semaine", None),
+        ("combien de messages j'ai envoyé cette semaine", None),
+        ("que s'est-il passé aujourd'hui",
+         f'SELECT {SELECT_FIELDS} FROM c WHERE STARTSWITH(c.timestamp_iso, "{today}") ORDER BY c.timestamp_iso DESC'),
+    ]
+    for _, name, _ in AUTHORS[:4]:
+        questions.append((f"combien de messages de {name} ce mois-ci", None))
+        questions.append((f"de quoi a parlé {name} hier",
+                          f'SELECT {SELECT_FIELDS} FROM c WHERE CONTAINS(c.author_name, "{name}", true) '
+                          f'AND STARTSWITH(c.timestamp_iso, "{yesterday}") ORDER BY c.timestamp_iso DESC'))
+        questions.append((f"les 20 derniers messages de {name}",
+                          f'SELECT TOP 20 {SELECT_FIELDS} FROM c WHERE CONTAINS(c.author_name, "{name}", true) '
+                          f'ORDER BY c.timestamp_iso DESC'))
+    for word in ("valorant", "minecraft", "resto", "exam"):
+        questions.append((f"résume ce qu'on a dit sur {word} cette semaine",
+                          f'SELECT {SELECT_FIELDS} FROM c WHERE CONTAINS(c.content, "{word}", true) AND {week} '
+                          f'ORDER BY c.timestamp_iso DESC'))
+    return questions
+
+
+def synthetic_workload(args, rng: random.Random, now: datetime.datetime) -> list[dict]:
+    questions = synthetic_questions(now)
+    events = []
+    for _ in range(args.asks):
+        question, sql = rng.choice(questions)
+        event = {"type": "ask", "question": question, "user": rng.choice(AUTHORS)[1]}
+        if sql:
+            event["sql"] = sql
+        events.append(event)
+    for index in range(args.backfills):
+        events.insert(rng.randint(0, len(events)), {"type": "backfill", "channel_id": BACKFILL_CHANNEL_ID + index,
+                                                    "messages": args.backfill_messages})
+    return events
+
+
+def load_workload(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def classify(ctx: FakeContext) -> str:
+    """Issue d'un !ask d'après ce que le bot a envoyé en dernier."""
+    for message in reversed(ctx.sent):
+        if message.embed is not None:
+            return "résumé"
+        for prefix, outcome in REPLIES:
+            if (message.content or "").startswith(prefix):
+                return outcome
+    return "échec"
+
+
+def latency_summary(values: list[float]) -> dict:
+    values = sorted(values)
+    return {"count": len(values), "p50": quantile(values, 0.5), "p95": quantile(values, 0.95),
+            "p99": quantile(values, 0.99), "max": values[-1] if values else None}
+
+
+def format_summary(summary: dict) -> str:
+    if not summary["count"]:
+        return "—"
+    return (f"p50 {summary['p50']:.2f}s · p95 {summary['p95']:.2f}s · p99 {summary['p99']:.2f}s · "
+            f"max {summary['max']:.2f}s ({summary['count']})")
+
+
+def metric_summary(bot_module, name: str, **labels) -> dict:
+    histogram = bot_module.metrics.histogram(name, **labels)
+    return latency_summary(histogram.values())
+
+
+async def wrap_repository(bot_module, repository, args, workdir: str):
+    """Mêmes enveloppes que bot.py (réplique, rollups, filigrane du cache de résultats), copiées depuis le conteneur simulé avant le rejeu."""
+    from local_replica import LocalReplica, ReplicatedRepository
+    from result_cache import WatermarkedRepository
+    from rollups import RollupRepository, RollupStore
+
+    async def log_error(message):
+        await bot_module.send_bot_log_message(message, source="BENCH")
+
+    if args.replica:
+        repository = ReplicatedRepository(repository, LocalReplica(os.path.join(workdir, "replica.sqlite3")), on_error=log_error)
+        await repository.bootstrap()
+    if args.rollups:
+        repository = RollupRepository(repository, RollupStore(os.path.join(workdir, "rollups.sqlite3")), on_error=log_error)
+        await repository.bootstrap()
+    if bot_module.result_cache:
+        repository = WatermarkedRepository(repository, bot_module.ingestion_watermarks)
+    return repository
+
+
+async def replay(args, workdir: str) -> dict:
+    bot_module = load_bot(workdir)
+    rng = random.Random(args.seed)
+    now = datetime.datetime.now(pytz.timezone("Europe/Paris"))
+    events = load_workload(args.workload) if args.workload else synthetic_workload(args, rng, now)
+    if args.save_workload:
+        with open(args.save_workload, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(event, ensure_ascii=False) + "\n" for event in events)
+
+    # Archive terminée maintenant, rattrapages compris : les questions "aujourd'hui" ont des réponses.
+    backfill_total = sum(event.get("messages", 0) for event in events if event["type"] == "backfill")
+    start = now.astimezone(datetime.timezone.utc) - datetime.timedelta(seconds=37 * (args.messages + backfill_total))
+    container = InMemoryCosmosRepository(latency_seconds=args.cosmos_latency_ms / 1000)
+    for index in range(args.messages):
+        doc = format_message_to_json(make_fake_message(index, channel_id=1000 + index % args.channels, start=start))
+        container.documents[doc["id"]] = doc
+    repository = await wrap_repository(bot_module, container, args, workdir)
+
+    discord_latency = args.discord_latency_ms / 1000
+    channels = {ASK_CHANNEL_ID: FakeChannel(ASK_CHANNEL_ID, latency_seconds=discord_latency)}
+    next_index = args.messages
+    for event in events:
+        if event["type"] == "backfill":
+            channels[event["channel_id"]] = FakeChannel(
+                event["channel_id"], latency_seconds=discord_latency, history_count=event["messages"],
+                history_start_index=next_index, history_start=start, page_latency_seconds=args.history_page_ms / 1000)
+            next_index += event["messages"]
+
+    sql_by_question = {event["question"]: event["sql"] for event in events if event["type"] == "ask" and event.get("sql")}
+    openai_client = FakeOpenAIClient(lambda question: sql_by_question.get(question) or generic_sql(question),
+                                     TokenEstimator().count, first_token_seconds=args.openai_first_token_ms / 1000,
+                                     seconds_per_token=args.openai_ms_per_token / 1000,
+                                     completion_tokens=args.completion_tokens)
+    bot_module.cosmos_repo = repository
+    bot_module.azure_openai_client = openai_client
+    bot_module.IS_AZURE_OPENAI_CONFIGURED = True
+    bot_module.bot.get_channel = channels.get
+    setup_charge = repository.total_request_charge
+    users = {name: int(user_id) for user_id, name, _ in AUTHORS}
+
+    ask_seconds, backfill_seconds, outcomes = [], [], {}
+    backfilled = 0
+    pending = asyncio.Queue()
+    for event in events:
+        pending.put_nowait(event)
+
+    async def client():
+        nonlocal backfilled
+        while not pending.empty():
+            event = pending.get_nowait()
+            started = time.perf_counter()
+            if event["type"] == "ask":
+                user = event.get("user", AUTHORS[0][1])
+                ctx = FakeContext(channels[ASK_CHANNEL_ID], users.get(user, 1), user)
+                await bot_module.ask_command.callback(ctx, question=event["question"])
+                ask_seconds.append(time.perf_counter() - started)
+                outcome = classify(ctx)
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            else:
+                stats = await bot_module.main_message_fetch_logic(event["channel_id"])
+                backfill_seconds.append(time.perf_counter() - started)
+                backfilled += stats.written
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(max(1, args.concurrency))))
+    elapsed = time.perf_counter() - started
+    await repository.close()
+    bot_module.console_log_listener.stop()
+
+    metrics = bot_module.metrics
+    tokens = openai_client.prompt_tokens + openai_client.output_tokens
+    request_units = repository.total_request_charge - setup_charge
+    return {
+        "elapsed_seconds": elapsed,
+        "asks": len(ask_seconds),
+        "asks_per_second": len(ask_seconds) / elapsed,
+        "ask_latency": latency_summary(ask_seconds),
+        "ask_queue_wait": metric_summary(bot_module, "ask_queue_wait_seconds"),
+        "ask_stages": {stage: metric_summary(bot_module, "ask_stage_seconds", stage=stage)
+                       for stage in ("sql_generation", "query", "summary")},
+        "outcomes": outcomes,
+        "backfills": len(backfill_seconds),
+        "backfill_latency": latency_summary(backfill_seconds),
+        "backfilled_messages": backfilled,
+        "backfill_messages_per_second": backfilled / max(sum(backfill_seconds), 1e-9),
+        "request_units": request_units,
+        "request_units_ask": metrics.total("cosmos_request_units_total", operation="ask"),
+        "request_units_ingest": metrics.total("cosmos_request_units_total", operation="ingest"),
+        "openai_calls": openai_client.calls,
+        "prompt_tokens": openai_client.prompt_tokens,
+        "completion_tokens": openai_client.output_tokens,
+        "result_cache": dict(bot_module.result_cache.stats) if bot_module.result_cache else {},
+        "sql_sources": {source: metrics.total("sql_generation_total", source=source) for source in ("local", "cache", "openai")},
+        "cost_usd": request_units / 1e6 * args.usd_per_million_ru + tokens / 1000 * args.usd_per_1k_tokens,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def print_report(report: dict):
+    print(f"{report['asks']} !ask et {report['backfills']} rattrapage(s) rejoués en {report['elapsed_seconds']:.1f}s "
+          f"({report['asks_per_second']:.2f} !ask/s)")
+    print(f"  !ask (file comprise) : {format_summary(report['ask_latency'])}")
+    print(f"  attente en file      : {format_summary(report['ask_queue_wait'])}")
+    for stage, summary in report["ask_stages"].items():
+        print(f"  {stage:20} : {format_summary(summary)}")
+    print(f"  issues : {', '.join(f'{count} {outcome}' for outcome, count in sorted(report['outcomes'].items()))}")
+    print(f"  SQL : {report['sql_sources']['local']:.0f} locales, {report['sql_sources']['cache']:.0f} en cache, "
+          f"{report['sql_sources']['openai']:.0f} via l'IA")
+    if report["result_cache"]:
+        cache = report["result_cache"]
+        print(f"  résultats en cache : {cache['hits']}/{cache['hits'] + cache['misses']} ({cache['summary_hits']} avec résumé), "
+              f"{cache['saved_request_charge']:,.0f} RU évitées, {cache['invalidated']} invalidés par l'ingestion")
+    if report["backfills"]:
+        print(f"  rattrapages : {report['backfilled_messages']} messages ({report['backfill_messages_per_second']:.0f} msg/s "
+              f"par rattrapage), {format_summary(report['backfill_latency'])}")
+    print(f"  Cosmos : {report['request_units']:,.0f} RU ({report['request_units_ask']:,.0f} pour !ask, "
+          f"{report['request_units_ingest']:,.0f} pour l'ingestion)")
+    print(f"  OpenAI : {report['openai_calls']} appels, {report['prompt_tokens']:,} tokens de prompt, "
+          f"{report['completion_tokens']:,} générés")
+    if report["cost_usd"]:
+        print(f"  coût simulé : {report['cost_usd']:.4f} $")
+    print(f"  pic de mémoire résidente : {report['peak_rss_mb']:.0f} Mo")
+
+
+def flatten(report: dict, prefix: str = "") -> dict:
+    values = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def print_comparison(previous: dict, report: dict):
+    """Écart relatif de chaque chiffre commun aux deux rapports."""
+    before, after = flatten(previous), flatten(report)
+    print("\ncomparaison avec le rapport précédent :")
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = f"{100 * (new - old) / old:+.1f} %" if old else "—"
+        print(f"  {key:32} {old:>12.3f} -> {new:>12.3f}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000, help="messages déjà archivés avant le rejeu")
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--asks", type=int, default=30, help="questions de la charge synthétique")
+    parser.add_argument("--backfills", type=int, default=2, help="rattrapages de la charge synthétique")
+    parser.add_argument("--backfill-messages", type=int, default=2000)
+    parser.add_argument("--workload", help="charge enregistrée (JSONL) au lieu de la charge synthétique")
+    parser.add_argument("--save-workload", help="enregistre la charge rejouée (JSONL)")
+    parser.add_argument("--concurrency", type=int, default=8, help="clients simultanés")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cosmos-latency-ms", type=float, default=10.0, help="par appel ou page Cosmos")
+    parser.add_argument("--discord-latency-ms", type=float, default=50.0, help="par envoi ou édition Discord")
+    parser.add_argument("--history-page-ms", type=float, default=150.0, help="par page d'historique (100 messages)")
+    parser.add_argument("--openai-first-token-ms", type=float, default=400.0)
+    parser.add_argument("--openai-ms-per-token", type=float, default=5.0)
+    parser.add_argument("--completion-tokens", type=int, default=250, help="tokens produits par synthèse")
+    parser.add_argument("--replica", action="store_true", help="sert !ask depuis la réplique locale (LocalReplica)")
+    parser.add_argument("--rollups", action="store_true", help="sert les comptages depuis les rollups")
+    parser.add_argument("--usd-per-million-ru", type=float, default=0.0)
+    parser.add_argument("--usd-per-1k-tokens", type=float, default=0.0)
+    parser.add_argument("--report", help="enregistre le rapport (JSON)")
+    parser.add_argument("--compare", help="rapport JSON précédent à comparer")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bebzia_replay_")
+    try:
+        report = asyncio.run(replay(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Benchmark du backfill : boucle série historique vs BackfillPipeline, sur historique et conteneur simulés.
+
+Usage : python benchmarks/bench_backfill.py --messages 50000 --latency-ms 20 --in-flight 32
+"""
+import argparse
+import asyncio
+import time
+
+from fakes import fake_history
+
+from cosmos_repository import InMemoryCosmosRepository
+from ingestion import BackfillPipeline
+from message_schema import format_message_to_json
+
+
+async def run_serial(count: int, latency: float, page_latency: float) -> tuple[float, float]:
+    repo = InMemoryCosmosRepository(latency_seconds=latency)
+    started = time.perf_counter()
+    async for message in fake_history(count, page_latency_seconds=page_latency):
+        await repo.upsert_item(format_message_to_json(message))
+    return time.perf_counter() - started, repo.total_request_charge
+
+
+async def run_pipeline(count: int, latency: float, page_latency: float, in_flight: int,
+                       ru_per_second: float | None):
+    repo = InMemoryCosmosRepository(latency_seconds=latency)
+    pipeline = BackfillPipeline(repo, format_message_to_json, max_in_flight=in_flight, ru_per_second=ru_per_second)
+    stats = await pipeline.run(fake_history(count, page_latency_seconds=page_latency))
+    assert len(repo.documents) == count, (len(repo.documents), count)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latence simulée par upsert Cosmos (hors région)")
+    parser.add_argument("--page-latency-ms", type=float, default=150.0, help="latence simulée par page d'historique (100 msgs)")
+    parser.add_argument("--in-flight", type=int, default=32)
+    parser.add_argument("--ru-per-second", type=float, default=0, help="0 = pas de limite RU")
+    parser.add_argument("--skip-serial", action="store_true")
+    args = parser.parse_args()
+
+    latency, page_latency = args.latency_ms / 1000, args.page_latency_ms / 1000
+    if not args.skip_serial:
+        serial_seconds, serial_ru = asyncio.run(run_serial(args.messages, latency, page_latency))
+        print(f"série    : {args.messages} msgs en {serial_seconds:.2f}s "
+              f"({args.messages / serial_seconds:.0f} msg/s, {serial_ru:.0f} RU)")
+    stats = asyncio.run(run_pipeline(args.messages, latency, page_latency, args.in_flight,
+                                     args.ru_per_second or None))
+    print(f"pipeline : {stats.written} msgs en {stats.elapsed_seconds:.2f}s "
+          f"({stats.messages_per_second:.0f} msg/s, {stats.request_charge:.0f} RU, {stats.failed} échecs)")
+    if not args.skip_serial:
+        print(f"accélération : x{serial_seconds / stats.elapsed_seconds:.1f}")
+
+
+if __name__ == "__main__":
+    main()
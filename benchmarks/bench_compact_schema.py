@@ -0,0 +1,130 @@
+"""Schéma compact (v2) contre v1 : octets stockés, RU d'écriture et de lecture pour 10k messages.
+
+Trois passes sur un conteneur en mémoire (coût RU estimé comme InMemoryCosmosRepository) :
+écriture initiale, réingestion de la même archive (URLs de pièces jointes re-signées par le CDN,
+quelques éditions et réactions ajoutées), puis requêtes dans la forme du prompt. Les résultats v2
+sont comparés à ceux de v1, sur un conteneur tout compact et sur un conteneur mixte (moitié v1).
+
+    python benchmarks/bench_compact_schema.py [--messages 10000] [--edits 0.02] [--reactions 0.05]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+
+from fakes import make_fake_message
+
+from compact_schema import CompactRepository, DocumentHashStore
+from cosmos_repository import InMemoryCosmosRepository
+from message_schema import format_message_to_json
+
+QUERIES = [
+    "SELECT VALUE COUNT(1) FROM c",
+    "SELECT c.author_name, COUNT(1) AS messages FROM c GROUP BY c.author_name",
+    'SELECT * FROM c WHERE c.author_name = "airzya" ORDER BY c.timestamp_iso DESC OFFSET 0 LIMIT 50',
+    'SELECT c.content, c.author_name, c.timestamp_iso FROM c WHERE CONTAINS(LOWER(c.content), "valorant")',
+    'SELECT VALUE SUM(c.reactions_count) FROM c WHERE c.channel_id = "1001"',
+    "SELECT TOP 20 c.content, c.edited_timestamp_iso FROM c WHERE c.attachments_count > 0 ORDER BY c.timestamp_iso DESC",
+    "SELECT VALUE MAX(c.message_id_int) FROM c WHERE c.channel_id = '1000'",
+    "SELECT c.author_display_name, c.reactions FROM c WHERE ARRAY_LENGTH(c.reactions) > 0 AND c.author_discriminator = '0'",
+    "SELECT c.content FROM c WHERE IS_DEFINED(c.edited_timestamp_iso) AND c.edited_timestamp_iso != null",
+]
+
+
+def archive(count: int, channels: int, generation: int, edits: float, reactions: float) -> list[dict]:
+    """Messages v1 tels que relus depuis Discord à la `generation`-ième passe."""
+    rng = random.Random(generation)
+    docs = []
+    for index in range(count):
+        doc = format_message_to_json(make_fake_message(index, channel_id=1000 + index % channels))
+        for attachment in doc["attachments"]:
+            attachment["url"] += f"?ex={generation:08x}&hm={rng.getrandbits(64):016x}"  # Signature CDN.
+        if generation and rng.random() < edits:
+            doc["content"] += " (édité)"
+            doc["edited_timestamp_iso"] = doc["timestamp_iso"]
+        if generation and rng.random() < reactions:
+            doc["reactions"] = doc["reactions"] + [{"emoji": "🔥", "count": 1}]
+            doc["reactions_count"] += 1
+        docs.append(doc)
+    return docs
+
+
+def stored_bytes(repo: InMemoryCosmosRepository) -> int:
+    return sum(len(json.dumps(doc, default=str)) for doc in repo.documents.values())
+
+
+async def write_all(repo, docs: list[dict]) -> float:
+    charge = repo.total_request_charge
+    for doc in docs:
+        await repo.upsert_item(doc)
+    return repo.total_request_charge - charge
+
+
+def normalized(rows) -> list[str]:
+    """Résultats comparables : pièces jointes et embeds exclus (lus à part en v2), ordre des clés ignoré."""
+    cleaned = [{k: v for k, v in row.items() if k not in ("attachments", "embeds", "pk", "_ts")} if isinstance(row, dict) else row
+               for row in rows]
+    return sorted(json.dumps(row, sort_keys=True, default=str) for row in cleaned)
+
+
+async def run(args, workdir: str):
+    first = archive(args.messages, args.channels, 0, args.edits, args.reactions)
+    again = archive(args.messages, args.channels, 1, args.edits, args.reactions)
+    per_10k = 10_000 / args.messages
+
+    v1 = InMemoryCosmosRepository()
+    v2_raw = InMemoryCosmosRepository()
+    v2 = CompactRepository(v2_raw, DocumentHashStore(os.path.join(workdir, "state.sqlite3"), "bench"), mixed=False)
+    v1_first, v2_first = await write_all(v1, first), await write_all(v2, first)
+    v1_bytes, v2_bytes = stored_bytes(v1), stored_bytes(v2_raw)
+    v1_again, v2_again = await write_all(v1, again), await write_all(v2, again)
+    side_docs = sum(1 for doc in v2_raw.documents.values() if "x" in doc)
+
+    print(f"{args.messages} messages ({side_docs} annexes en v2), valeurs ramenées à 10k messages :")
+    print(f"{'':28} {'v1':>12} {'v2':>12} {'écart':>8}")
+    for label, before, after in (("octets stockés", v1_bytes, v2_bytes), ("RU écriture initiale", v1_first, v2_first),
+                                 ("RU réingestion", v1_again, v2_again)):
+        print(f"{label:28} {before * per_10k:>12,.0f} {after * per_10k:>12,.0f} {(after - before) / before:>+8.0%}")
+    print(f"réingestion : {v2.stats['skipped']} messages inchangés non réécrits, "
+          f"{v2.stats['written'] - args.messages} réécrits (éditions, réactions)")
+
+    mixed_raw = InMemoryCosmosRepository()
+    mixed = CompactRepository(mixed_raw, DocumentHashStore(os.path.join(workdir, "state.sqlite3"), "mixed"))
+    for index, doc in enumerate(again):
+        await (mixed.upsert_item(doc) if index % 2 else mixed_raw.upsert_item(doc))
+
+    print(f"\n{'requête':70} {'RU v1':>7} {'RU v2':>7}  identiques (compact / mixte)")
+    mismatches = 0
+    for sql in QUERIES:
+        charges = []
+        results = []
+        for repo, raw in ((v1, v1), (v2, v2_raw), (mixed, mixed_raw)):
+            charge = raw.total_request_charge
+            results.append(normalized(await repo.query_items(sql)))
+            charges.append(raw.total_request_charge - charge)
+        same = [results[0] == results[1], results[0] == results[2]]
+        mismatches += same.count(False)
+        label = sql if len(sql) <= 70 else sql[:67] + "..."
+        print(f"{label:70} {charges[0]:>7.1f} {charges[1]:>7.1f}  {'oui' if same[0] else 'NON'} / {'oui' if same[1] else 'NON'}")
+    print(f"\n{2 * len(QUERIES) - mismatches}/{2 * len(QUERIES)} résultats identiques au schéma v1")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--edits", type=float, default=0.02, help="part des messages édités entre les deux passes")
+    parser.add_argument("--reactions", type=float, default=0.05, help="part des messages ayant reçu une réaction")
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="bebzia_compact_")
+    try:
+        asyncio.run(run(args, workdir))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Couverture et latence de l'analyse locale des questions (intent_parser) sur un corpus annoté.
+
+Chaque ligne de intent_corpus.jsonl donne la question et l'analyse attendue ; "intent": null signifie
+que la question doit partir à l'IA. "@self" désigne l'auteur de la question.
+
+    python benchmarks/bench_intent_parser.py [--repeat 2000]
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import time
+
+import fakes  # noqa: F401  (ajoute la racine du dépôt au chemin)
+import pytz
+
+import cosmos_sql
+from intent_parser import parse_question
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_corpus.jsonl")
+USER_NAME = "FlyXOwl"
+
+
+def load_corpus(path: str = CORPUS_PATH) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000, help="analyses par question pour la latence")
+    args = parser.parse_args()
+
+    now = datetime.datetime.now(pytz.timezone("Europe/Paris"))
+    corpus = load_corpus()
+    expected_local = [row for row in corpus if row["intent"]]
+    matched = correct = false_positives = 0
+    errors = []
+    for row in corpus:
+        result = parse_question(row["question"], USER_NAME, now)
+        if result is None:
+            if row["intent"]:
+                errors.append(f"raté      : {row['question']}")
+            continue
+        cosmos_sql.parse(result.sql)  # La requête produite doit rester dans le dialecte supporté.
+        if not row["intent"]:
+            false_positives += 1
+            errors.append(f"à tort    : {row['question']} -> {result.sql}")
+            continue
+        matched += 1
+        expected_author = USER_NAME if row["author"] == "@self" else row["author"]
+        got = (result.intent, result.author, result.time_range, result.limit)
+        if got == (row["intent"], expected_author, row["time_range"], row["limit"]):
+            correct += 1
+        else:
+            errors.append(f"incorrect : {row['question']} -> {got}")
+
+    latencies = []
+    for row in corpus:
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            parse_question(row["question"], USER_NAME, now)
+        latencies.append((time.perf_counter() - started) / args.repeat * 1e6)
+    latencies.sort()
+
+    print(f"Corpus : {len(corpus)} questions dont {len(expected_local)} attendues en local.")
+    print(f"Couverture : {matched}/{len(expected_local)} ({matched / max(len(expected_local), 1):.0%}), "
+          f"correctes : {correct}/{matched}, faux positifs : {false_positives}.")
+    print(f"Latence par question : médiane {statistics.median(latencies):.1f} µs, "
+          f"max {latencies[-1]:.1f} µs (contre ~1 s et ~1 500 tokens pour un appel IA).")
+    for line in errors:
+        print("  " + line)
+
+
+if __name__ == "__main__":
+    main()
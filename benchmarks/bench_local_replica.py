@@ -0,0 +1,143 @@
+"""Latence et coût des requêtes !ask : réplique locale SQLite/FTS5 contre Cosmos, sur une archive synthétique.
+
+L'archive (1M messages par défaut, répartis sur plusieurs canaux) est chargée dans une réplique
+temporaire, puis chaque requête typique (analyse locale des questions et requêtes de l'IA) est
+exécutée sur la réplique. Côté Cosmos, pas d'Azure ici : le coût RU est estimé (parcours
+cross-partition) et la latence est celle de l'évaluateur en mémoire, mesurée sur un échantillon et
+extrapolée à la taille de l'archive. L'échantillon sert aussi à vérifier que la réplique renvoie
+exactement les résultats de cosmos_sql.
+
+    python benchmarks/bench_local_replica.py [--messages 1000000] [--channels 20] [--sample 20000]
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from fakes import make_fake_message
+import pytz
+
+import cosmos_sql
+from cosmos_repository import estimate_request_charge
+from intent_parser import parse_question
+from local_replica import LocalReplica, translate
+from message_schema import format_message_to_json
+
+USER_NAME = "flyxowl"
+FIELDS = "c.id, c.channel_id, c.guild_id, c.author_name, c.author_display_name, c.content, c.timestamp_iso"
+QUESTIONS = (
+    "combien de messages aujourd'hui",
+    "combien de messages j'ai envoyé cette semaine",
+    "les 10 derniers messages de airzya",
+    "résume les messages d'hier",
+    "dernier message de hezek112",
+)
+
+
+def make_docs(start: int, count: int, channels: int) -> list[dict]:
+    return [format_message_to_json(make_fake_message(i, channel_id=1000 + i % channels)) for i in range(start, start + count)]
+
+
+def llm_queries(last_doc: dict) -> list[str]:
+    """Requêtes dans la forme produite par le prompt de get_ai_analysis."""
+    day = last_doc["timestamp_iso"][:10]
+    month = last_doc["timestamp_iso"][:7]
+    channel = last_doc["channel_id"]
+    return [
+        f'SELECT {FIELDS} FROM c WHERE CONTAINS(c.content, "valorant", true) AND STARTSWITH(c.timestamp_iso, "{month}") ORDER BY c.timestamp_iso DESC',
+        f'SELECT TOP 50 {FIELDS} FROM c WHERE CONTAINS(c.content, "qui est chaud", true) ORDER BY c.timestamp_iso DESC',
+        f'SELECT VALUE COUNT(1) FROM c WHERE CONTAINS(c.content, "minecraft", true)',
+        f'SELECT {FIELDS} FROM c WHERE c.channel_id = "{channel}" AND STARTSWITH(c.timestamp_iso, "{day}") ORDER BY c.timestamp_iso',
+        f"SELECT VALUE MAX(c.timestamp_unix) FROM c WHERE c.channel_id = '{channel}'",
+        f'SELECT c.author_name, COUNT(1) AS messages FROM c WHERE STARTSWITH(c.timestamp_iso, "{month}") GROUP BY c.author_name',
+    ]
+
+
+def median_ms(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--sample", type=int, default=20000, help="messages comparés à cosmos_sql (et base de l'extrapolation)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=20000)
+    parser.add_argument("--keep", action="store_true", help="garder les fichiers SQLite générés")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bebzia_replica_")
+    replica = LocalReplica(os.path.join(workdir, "replica.sqlite3"))
+    sample_replica = LocalReplica(os.path.join(workdir, "sample.sqlite3"))
+
+    started = time.perf_counter()
+    load_seconds = 0.0
+    sample_docs, last_doc = [], None
+    for start in range(0, args.messages, args.batch):
+        docs = make_docs(start, min(args.batch, args.messages - start), args.channels)
+        if len(sample_docs) < args.sample:
+            sample_docs.extend(docs[:args.sample - len(sample_docs)])
+        load_started = time.perf_counter()
+        replica.write_documents(docs)
+        load_seconds += time.perf_counter() - load_started
+        last_doc = docs[-1]
+    generation_seconds = time.perf_counter() - started - load_seconds
+    sample_replica.write_documents(sample_docs)
+    size_mb = sum(os.path.getsize(os.path.join(workdir, f)) for f in os.listdir(workdir) if f.startswith("replica")) / 1e6
+    print(f"{args.messages} messages sur {args.channels} canaux : génération {generation_seconds:.1f} s, "
+          f"chargement {load_seconds:.1f} s ({args.messages / load_seconds:,.0f} msg/s), réplique {size_mb:,.0f} Mo")
+
+    now = datetime.datetime.fromisoformat(last_doc["timestamp_iso"][:19]).replace(
+        tzinfo=datetime.timezone.utc).astimezone(pytz.timezone("Europe/Paris"))
+    queries = [parse_question(q, USER_NAME, now).sql for q in QUESTIONS if parse_question(q, USER_NAME, now)]
+    queries += llm_queries(last_doc)
+
+    sample_last = sample_docs[-1]
+    sample_queries = [q.replace(last_doc["timestamp_iso"][:7], sample_last["timestamp_iso"][:7])
+                      .replace(last_doc["timestamp_iso"][:10], sample_last["timestamp_iso"][:10]) for q in queries]
+    mismatches = 0
+    for sql in sample_queries:
+        expected = cosmos_sql.execute(sql, sample_docs)
+        got = sample_replica.run_query(translate(sql))
+        ordered = "ORDER BY" in sql
+        if (expected if ordered else sorted(expected, key=repr)) != (got if ordered else sorted(got, key=repr)):
+            mismatches += 1
+            print(f"  ÉCART : {sql}\n    cosmos_sql {len(expected)} résultats, réplique {len(got)}")
+    print(f"vérification sur {len(sample_docs)} messages : {len(sample_queries) - mismatches}/{len(sample_queries)} requêtes identiques")
+
+    scale = args.messages / len(sample_docs)
+    total_local = total_cosmos_ms = total_ru = 0.0
+    print(f"\n{'requête':70} {'résultats':>9} {'réplique':>10} {'Cosmos (extrap.)':>17} {'RU Cosmos':>10}")
+    for sql, sample_sql in zip(queries, sample_queries):
+        translated = translate(sql)
+        results = replica.run_query(translated)
+        local_ms = median_ms(lambda: replica.run_query(translated), args.repeat)
+        parsed = cosmos_sql.parse(sample_sql)
+        cosmos_ms = median_ms(lambda: cosmos_sql.execute(parsed, sample_docs), max(1, args.repeat // 2)) * scale
+        payload = len(json.dumps(results, default=str).encode("utf-8"))
+        ru = estimate_request_charge("query", payload, scanned_documents=args.messages)
+        total_local += local_ms
+        total_cosmos_ms += cosmos_ms
+        total_ru += ru
+        label = sql if len(sql) <= 70 else sql[:67] + "..."
+        print(f"{label:70} {len(results):>9} {local_ms:>8.1f}ms {cosmos_ms:>15.0f}ms {ru:>10.0f}")
+    print(f"\ntotal : réplique {total_local:.1f} ms, Cosmos ~{total_cosmos_ms / 1000:.1f} s et ~{total_ru:,.0f} RU estimés "
+          f"(0 RU consommé par la réplique)")
+    if args.keep:
+        print(f"réplique gardée dans {workdir}")
+    else:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
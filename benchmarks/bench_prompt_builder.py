@@ -0,0 +1,83 @@
+"""Micro-benchmark de l'assemblage du prompt de synthèse sur des messages synthétiques.
+
+Compare l'ancienne construction (dateutil + concaténation `+=`) au PromptBuilder (formatage et
+comptage une fois par message, join), et mesure l'écart de l'estimateur local à tiktoken s'il est
+installé.
+
+    python benchmarks/bench_prompt_builder.py [--messages 10000] [--budget 6000]
+"""
+import argparse
+import datetime
+import time
+
+import dateutil.parser
+import pytz
+from fakes import make_fake_message
+
+from message_schema import format_message_to_json
+from prompt_builder import PromptBuilder, TokenEstimator, _estimate_tokens_locally, tiktoken
+
+
+def legacy_format(messages: list[dict]) -> str:
+    """Formatage d'origine de get_ai_summary."""
+    formatted_messages = ""
+    paris_tz = pytz.timezone('Europe/Paris')
+    for item in messages:
+        author = item.get("author_display_name", item.get("author_name", "Auteur inconnu"))
+        timestamp_str, content = item.get("timestamp_iso"), item.get("content", "")
+        date_fmt = "Date inconnue"
+        if timestamp_str:
+            try:
+                dt_obj = dateutil.parser.isoparse(timestamp_str)
+                if dt_obj.tzinfo is None: dt_obj = dt_obj.replace(tzinfo=datetime.timezone.utc)
+                date_fmt = dt_obj.astimezone(paris_tz).strftime("%Y-%m-%d %H:%M")
+            except Exception: date_fmt = timestamp_str
+        formatted_messages += f"[{author}] ({date_fmt}): {content}\n---\n"
+    return formatted_messages
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--budget", type=int, default=6000, help="budget de tokens pour un prompt")
+    args = parser.parse_args()
+
+    docs = [format_message_to_json(make_fake_message(i)) for i in range(args.messages)]
+    for i in range(0, len(docs), 50):  # Quelques répétitions et messages vides, comme dans un vrai salon.
+        docs[i]["content"] = "mdr"
+        if i + 1 < len(docs):
+            docs[i + 1].update(content="mdr", author_name=docs[i]["author_name"], author_display_name=docs[i]["author_display_name"])
+        if i + 2 < len(docs):
+            docs[i + 2]["content"] = "..."
+
+    legacy_text, legacy_seconds = timed(legacy_format, docs)
+    builder = PromptBuilder()
+    first, cold_seconds = timed(builder.pack, docs, 10**9)
+    _, warm_seconds = timed(builder.pack, docs, 10**9)
+    budgeted, budget_seconds = timed(builder.pack, [dict(d) for d in docs], args.budget)
+
+    print(f"{args.messages} messages")
+    print(f"  ancien (+= / dateutil)     : {legacy_seconds * 1000:8.1f} ms, {len(legacy_text)} caractères, tokens inconnus")
+    print(f"  PromptBuilder (à froid)    : {cold_seconds * 1000:8.1f} ms, {len(first.text)} caractères, {first.tokens} tokens estimés "
+          f"({first.collapsed} répétitions regroupées, {first.skipped_empty} vides ignorés)")
+    print(f"  PromptBuilder (lignes en cache) : {warm_seconds * 1000:8.1f} ms")
+    print(f"  budget {args.budget} tokens     : {budget_seconds * 1000:8.1f} ms, {len(budgeted.included)} messages retenus, "
+          f"{budgeted.dropped_for_budget} laissés au map-reduce")
+
+    if tiktoken is not None and TokenEstimator().exact:
+        encoding = tiktoken.get_encoding("cl100k_base")
+        exact = len(encoding.encode(first.text))
+        local = _estimate_tokens_locally(first.text)
+        print(f"  estimateur local : {local} tokens contre {exact} (tiktoken), écart {100 * (local - exact) / exact:+.1f} %")
+    else:
+        print("  tiktoken non installé : estimateur local utilisé (pip install tiktoken pour comparer).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Comptages !ask servis par les rollups, contre la réplique locale et un parcours Cosmos, sur une archive synthétique.
+
+Les messages sont écrits par lots dans les rollups et dans une réplique SQLite (référence exacte à
+grande échelle), avec une part de mises à jour et de suppressions. Pour chaque question de comptage :
+latence des rollups, latence de la réplique (COUNT sur index), et coût RU estimé d'un parcours Cosmos.
+Les résultats des rollups sont comparés à ceux de la réplique.
+
+    python benchmarks/bench_rollups.py [--messages 1000000] [--channels 20]
+"""
+import argparse
+import datetime
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from fakes import make_fake_message
+import pytz
+
+from cosmos_repository import estimate_request_charge
+from intent_parser import parse_question
+from local_replica import LocalReplica, translate
+from message_schema import format_message_to_json
+from rollups import RollupStore, plan
+
+USER_NAME = "flyxowl"
+QUESTIONS = (
+    "combien de messages aujourd'hui",
+    "combien de messages cette semaine",
+    "combien de messages la semaine dernière",
+    "combien de messages de airzya ce mois-ci",
+    "combien de messages j'ai envoyé cette année",
+    "combien de messages",
+)
+
+
+def extra_queries(last_doc: dict) -> list[str]:
+    """Agrégats dans la forme produite par le prompt de get_ai_analysis."""
+    year, month = last_doc["timestamp_iso"][:4], last_doc["timestamp_iso"][:7]
+    return [
+        f'SELECT c.author_name, COUNT(1) AS messages FROM c WHERE STARTSWITH(c.timestamp_iso, "{year}") GROUP BY c.author_name',
+        f'SELECT c.channel_id, COUNT(1) AS messages FROM c WHERE STARTSWITH(c.timestamp_iso, "{month}") GROUP BY c.channel_id',
+        f'SELECT VALUE SUM(c.reactions_count) FROM c WHERE c.channel_id = "{last_doc["channel_id"]}"',
+        f'SELECT VALUE COUNT(1) FROM c WHERE c.timestamp_iso >= "{month}-03T14:20:00.000Z" AND c.timestamp_iso < "{month}-09T08:00"',
+    ]
+
+
+def median_ms(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bebzia_rollups_")
+    store = RollupStore(os.path.join(workdir, "rollups.sqlite3"))
+    replica = LocalReplica(os.path.join(workdir, "replica.sqlite3"))
+    rollup_seconds = 0.0
+    last_doc = None
+    for start in range(0, args.messages, args.batch):
+        docs = [format_message_to_json(make_fake_message(i, channel_id=1000 + i % args.channels))
+                for i in range(start, min(start + args.batch, args.messages))]
+        for doc in docs[::50]:
+            doc["reactions_count"] += 1  # Réactions ajoutées après coup : mise à jour de la contribution.
+        replayed = docs[::50]
+        removed = [doc["id"] for doc in docs[::97]]
+        replica.write_documents(docs)
+        replica.remove_messages(removed)
+        started = time.perf_counter()
+        store.write_documents(docs)
+        store.write_documents(replayed)
+        store.remove_messages(removed)
+        rollup_seconds += time.perf_counter() - started
+        last_doc = docs[-1]
+    buckets = store.conn.execute("SELECT COUNT(*) FROM rollup_buckets").fetchone()[0]
+    print(f"{args.messages} messages : mise à jour des rollups {rollup_seconds:.1f} s "
+          f"({args.messages / rollup_seconds:,.0f} msg/s), {buckets:,} seaux, "
+          f"fichier {os.path.getsize(store.path) / 1e6:,.0f} Mo")
+
+    now = datetime.datetime.fromisoformat(last_doc["timestamp_iso"][:19]).replace(
+        tzinfo=datetime.timezone.utc).astimezone(pytz.timezone("Europe/Paris"))
+    queries = [match.sql for match in (parse_question(q, USER_NAME, now) for q in QUESTIONS) if match]
+    queries += extra_queries(last_doc)
+
+    mismatches = 0
+    total_rollups = total_replica = total_ru = 0.0
+    print(f"\n{'requête':70} {'rollups':>9} {'réplique':>10} {'RU Cosmos':>10}")
+    for sql in queries:
+        planned, translated = plan(sql), translate(sql)
+        got, expected = store.run_query(planned), replica.run_query(translated)
+        if sorted(map(repr, got)) != sorted(map(repr, expected)):
+            mismatches += 1
+            print(f"  ÉCART : {sql}\n    rollups {got[:3]}, réplique {expected[:3]}")
+        rollup_ms = median_ms(lambda: store.run_query(planned), args.repeat)
+        replica_ms = median_ms(lambda: replica.run_query(translated), args.repeat)
+        ru = estimate_request_charge("query", 0, scanned_documents=args.messages)
+        total_rollups += rollup_ms
+        total_replica += replica_ms
+        total_ru += ru
+        label = sql if len(sql) <= 70 else sql[:67] + "..."
+        print(f"{label:70} {rollup_ms:>7.1f}ms {replica_ms:>8.1f}ms {ru:>10.0f}")
+    print(f"\n{len(queries) - mismatches}/{len(queries)} résultats identiques à la réplique ; total rollups "
+          f"{total_rollups:.1f} ms, réplique {total_replica:.1f} ms, parcours Cosmos ~{total_ru:,.0f} RU estimés")
+    shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
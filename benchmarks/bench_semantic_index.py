@@ -0,0 +1,101 @@
+"""Débit du plongement par lots et latence de la recherche sémantique à 1M vecteurs.
+
+1. Plongement : messages synthétiques passés par MessageEmbedder avec le fournisseur local
+   (HashingEmbeddingProvider), une latence simulée par appel imitant l'API, pour plusieurs tailles de lot.
+2. Recherche : index de `--vectors` vecteurs (plongements des messages synthétiques complétés par
+   des vecteurs aléatoires), en int8 et en float32 ; latence des k plus proches, mémoire, et
+   recouvrement du top-k int8 par rapport au float32 exact.
+
+    python benchmarks/bench_semantic_index.py [--vectors 1000000] [--dim 256] [--api-latency-ms 150]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+from fakes import make_fake_message
+
+from message_schema import format_message_to_json
+from semantic_index import HashingEmbeddingProvider, MessageEmbedder, VectorIndex
+
+QUERIES = ("qui est chaud pour une partie ce soir", "le film de demain", "ranked valorant", "exam et cours",
+           "musique et série", "photo du resto", "serveur minecraft", "trop bien mdr")
+
+
+async def embedding_throughput(docs: list[dict], dim: int, batch_size: int, latency: float, max_parallel: int) -> float:
+    provider = HashingEmbeddingProvider(dim=dim, latency_seconds=latency)
+    embedder = MessageEmbedder(provider, VectorIndex(), batch_size=batch_size, max_parallel=max_parallel,
+                               max_pending=len(docs) + 1)
+    started = time.perf_counter()
+    await embedder.submit(docs)
+    await embedder.flush()
+    return embedder.stats.embedded / (time.perf_counter() - started)
+
+
+def build_index(base: np.ndarray, total: int, dim: int, quantize: bool, seed: int = 0) -> VectorIndex:
+    rng = np.random.default_rng(seed)
+    index = VectorIndex(dim=dim, quantize=quantize, capacity=total)
+    index.add(np.arange(len(base)), base, timestamps=np.arange(len(base)))
+    for start in range(len(base), total, 100_000):
+        count = min(100_000, total - start)
+        vectors = rng.standard_normal((count, dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index.add(np.arange(start, start + count), vectors, timestamps=np.arange(start, start + count))
+    return index
+
+
+def timed_searches(index: VectorIndex, queries: np.ndarray, k: int, **filters) -> tuple[float, list]:
+    timings, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(index.search(query, k=k, **filters))
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--messages", type=int, default=20000, help="messages synthétiques réellement plongés")
+    parser.add_argument("--api-latency-ms", type=float, default=150.0, help="latence simulée d'un appel d'embedding")
+    parser.add_argument("--k", type=int, default=100)
+    args = parser.parse_args()
+
+    docs = [format_message_to_json(make_fake_message(i)) for i in range(args.messages)]
+    latency = args.api_latency_ms / 1000
+    print(f"plongement ({args.api_latency_ms:.0f} ms simulées par appel, dim {args.dim}) :")
+    for batch_size, max_parallel in ((1, 1), (16, 1), (64, 1), (256, 1), (256, 4)):
+        sample = docs[:min(len(docs), batch_size * max_parallel * 20)]
+        rate = asyncio.run(embedding_throughput(sample, args.dim, batch_size, latency, max_parallel))
+        print(f"  lots de {batch_size:>3}, {max_parallel} appel(s) en parallèle : {rate:>9,.0f} messages/s")
+    provider = HashingEmbeddingProvider(dim=args.dim)
+    started = time.perf_counter()
+    base = provider.embed_sync([d["content"] for d in docs])
+    print(f"  calcul local seul (HashingEmbeddingProvider) : {len(docs) / (time.perf_counter() - started):,.0f} messages/s")
+
+    queries = provider.embed_sync(list(QUERIES))
+    exact = None
+    print(f"\nrecherche des {args.k} plus proches parmi {args.vectors:,} vecteurs :")
+    for quantize in (False, True):
+        started = time.perf_counter()
+        index = build_index(base, args.vectors, args.dim, quantize)
+        build_seconds = time.perf_counter() - started
+        median, results = timed_searches(index, queries, args.k)
+        filtered, _ = timed_searches(index, queries, args.k, since=args.vectors // 2, until=args.vectors // 2 + 50_000)
+        label = "int8   " if quantize else "float32"
+        line = (f"  {label} : {index.nbytes / 1e6:7,.0f} Mo, construction {build_seconds:5.1f} s, "
+                f"recherche {median:6.1f} ms (médiane), avec filtre de période {filtered:6.1f} ms")
+        if exact is None:
+            exact = results
+        else:
+            overlap = statistics.mean(len({i for i, _ in a} & {i for i, _ in b}) / max(len(a), 1)
+                                      for a, b in zip(results, exact))
+            line += f", top-{args.k} identique au float32 à {overlap * 100:.1f} %"
+        print(line)
+        del index
+
+
+if __name__ == "__main__":
+    main()
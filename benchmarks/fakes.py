@@ -0,0 +1,188 @@
+"""Doublures locales (historique Discord, messages, contexte de commande, client OpenAI) pour les benchmarks, sans réseau."""
+import asyncio
+import datetime
+import itertools
+import os
+import random
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+AUTHORS = [
+    ("292657007779905547", "lamerdeoffline", "Lamerde"),
+    ("957249973064446032", "hezek112", "hezekiel"),
+    ("532526003407290381", "flyxowl", "Fly"),
+    ("503242253272350741", "airzya", "azyria"),
+    ("728678866654330921", "wkda_ledauphin", "ledauphin"),
+    ("813047875591340072", "viv1dvivi", "vivi"),
+]
+
+DISCORD_EPOCH_MS = 1420070400000
+
+WORDS = ("jeu partie ce soir demain ranked valorant minecraft serveur photo vidéo lol mdr grave "
+         "trop bien qui est chaud pour une game exam cours resto film série musique").split()
+
+
+class FakeEmbed:
+    def __init__(self, title: str):
+        self.title = title
+
+    def to_dict(self):
+        return {"type": "rich", "title": self.title, "description": " ".join(WORDS[:12])}
+
+
+def make_fake_message(index: int, channel_id: int = 1000, guild_id: int = 2000,
+                      start: datetime.datetime | None = None, rng: random.Random | None = None):
+    """Objet imitant discord.Message pour les champs lus par format_message_to_json."""
+    rng = rng or random.Random(index)
+    start = start or datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    author_id, name, display = AUTHORS[index % len(AUTHORS)]
+    created_at = start + datetime.timedelta(seconds=37 * index)
+    attachments = []
+    if index % 17 == 0:
+        attachments.append(SimpleNamespace(id=index * 10, filename=f"img_{index}.png",
+                                           url=f"https://cdn.example/att/{index}.png",
+                                           content_type="image/png", size=123456))
+    reactions = [SimpleNamespace(emoji="😂", count=rng.randint(1, 4))] if index % 5 == 0 else []
+    snowflake = ((int(created_at.timestamp() * 1000) - DISCORD_EPOCH_MS) << 22) + (index % 4096)
+    return SimpleNamespace(
+        id=snowflake,
+        channel=SimpleNamespace(id=channel_id, name=f"canal-{channel_id}"),
+        guild=SimpleNamespace(id=guild_id),
+        author=SimpleNamespace(id=int(author_id), name=name, discriminator="0", display_name=display, bot=False),
+        content=" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 25))),
+        created_at=created_at,
+        edited_at=None,
+        attachments=attachments,
+        embeds=[FakeEmbed(f"lien {index}")] if index % 23 == 0 else [],
+        reactions=reactions,
+    )
+
+
+async def fake_history(count: int, page_size: int = 100, page_latency_seconds: float = 0.0,
+                       channel_id: int = 1000, start_index: int = 0, start: datetime.datetime | None = None):
+    """Itérateur asynchrone imitant channel.history(oldest_first=True), paginé comme l'API REST."""
+    for index in range(start_index, start_index + count):
+        if page_latency_seconds and (index - start_index) % page_size == 0:
+            await asyncio.sleep(page_latency_seconds)
+        yield make_fake_message(index, channel_id=channel_id, start=start)
+
+
+class FakeSentMessage:
+    """Message envoyé par le bot : garde le dernier contenu et compte les éditions."""
+
+    def __init__(self, channel, content=None, embed=None):
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.edits = 0
+
+    async def edit(self, content=None, embed=None, **_):
+        await self.channel.simulate_latency()
+        self.content = content if content is not None else self.content
+        self.embed = embed if embed is not None else self.embed
+        self.edits += 1
+        return self
+
+
+class FakeChannel:
+    """Salon Discord : envois et éditions avec latence simulée, historique synthétique pour le rattrapage."""
+
+    def __init__(self, channel_id: int = 1000, guild_id: int = 2000, latency_seconds: float = 0.0,
+                 history_count: int = 0, history_start_index: int = 0, history_start: datetime.datetime | None = None,
+                 page_latency_seconds: float = 0.0):
+        self.id = channel_id
+        self.name = f"canal-{channel_id}"
+        self.guild = SimpleNamespace(id=guild_id, name=f"serveur-{guild_id}")
+        self.last_message_id = None
+        self.latency_seconds = latency_seconds
+        self.history_count = history_count
+        self.history_start_index = history_start_index
+        self.history_start = history_start
+        self.page_latency_seconds = page_latency_seconds
+        self.sent: list[FakeSentMessage] = []
+
+    async def simulate_latency(self):
+        await asyncio.sleep(self.latency_seconds)
+
+    async def send(self, content=None, embed=None, **_):
+        await self.simulate_latency()
+        message = FakeSentMessage(self, content, embed)
+        self.sent.append(message)
+        return message
+
+    def history(self, limit=None, after=None, oldest_first=True, **_):
+        # `after` est ignoré : l'historique simulé ne contient que les messages à rattraper.
+        return fake_history(self.history_count, page_latency_seconds=self.page_latency_seconds, channel_id=self.id,
+                            start_index=self.history_start_index, start=self.history_start)
+
+
+class FakeContext:
+    """commands.Context réduit à ce que lisent les commandes : auteur, salon et send()."""
+
+    def __init__(self, channel: FakeChannel, author_id: int, author_name: str):
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = SimpleNamespace(id=author_id, name=author_name, display_name=author_name, bot=False)
+        self.sent: list[FakeSentMessage] = []
+
+    async def send(self, content=None, embed=None, **kwargs):
+        message = await self.channel.send(content, embed=embed, **kwargs)
+        self.sent.append(message)
+        return message
+
+
+class FakeOpenAIClient:
+    """Client AsyncAzureOpenAI réduit à chat.completions.create, latence et tokens simulés.
+
+    La génération SQL renvoie `sql_for(question)` ; les synthèses renvoient `completion_tokens` mots
+    (au plus `max_tokens`). Latence : `first_token_seconds` avant le premier morceau, puis
+    `seconds_per_token` par token produit, en streaming ou non. Les tokens du prompt sont comptés par
+    `count_tokens`.
+    """
+
+    STREAM_CHUNK_TOKENS = 4
+
+    def __init__(self, sql_for, count_tokens, first_token_seconds: float = 0.5, seconds_per_token: float = 0.02,
+                 completion_tokens: int = 300):
+        self.sql_for = sql_for
+        self.count_tokens = count_tokens
+        self.first_token_seconds = first_token_seconds
+        self.seconds_per_token = seconds_per_token
+        self.completion_tokens = completion_tokens
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _answer(self, messages: list[dict], max_tokens: int) -> str:
+        system = messages[0]["content"]
+        if "requêtes SQL" in system:
+            return self.sql_for(messages[-1]["content"])
+        words = itertools.islice(itertools.cycle(WORDS), min(max_tokens, self.completion_tokens))
+        return " ".join(words) + "."
+
+    async def create(self, model=None, messages=(), max_tokens: int = 1500, stream: bool = False, **_):
+        self.calls += 1
+        text = self._answer(messages, max_tokens)
+        prompt_tokens = sum(self.count_tokens(message["content"]) for message in messages)
+        completion_tokens = self.count_tokens(text)
+        self.prompt_tokens += prompt_tokens
+        self.output_tokens += completion_tokens
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+        await asyncio.sleep(self.first_token_seconds)
+        if stream:
+            return self._stream(text, usage)
+        await asyncio.sleep(self.seconds_per_token * completion_tokens)
+        return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+    async def _stream(self, text: str, usage):
+        words = text.split(" ")
+        for start in range(0, len(words), self.STREAM_CHUNK_TOKENS):
+            part = " ".join(words[start:start + self.STREAM_CHUNK_TOKENS])
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(
+                content=part if start == 0 else " " + part))])
+            await asyncio.sleep(self.seconds_per_token * self.STREAM_CHUNK_TOKENS)
+        yield SimpleNamespace(usage=usage, choices=[])
@@ -1,16 +1,45 @@
 import discord
 from discord.ext import commands, tasks
 import os
+import asyncio
 import datetime
+import time
 import json
+import logging
 from dotenv import load_dotenv
-from azure.cosmos import CosmosClient, PartitionKey, exceptions
+from azure.cosmos import exceptions
 import traceback 
 import pytz
-import dateutil.parser 
 import sys 
 import collections 
+import zlib
 import re # Ajouté pour l'extraction des causes de filtrage
+from cosmos_repository import CosmosRepository, DualWriteRepository, RepositoryTimeoutError
+from container_layout import LAYOUTS, LAYOUT_V2
+from message_schema import format_message_to_json
+from ingestion import BackfillPipeline, LiveIngestionBuffer
+from checkpoints import SqliteCheckpointStore, CosmosCheckpointStore, DEFAULT_STATE_PATH
+from channel_scheduler import ChannelSyncScheduler
+from sql_cache import SqlGenerationCache
+from intent_parser import parse_question
+from summarizer import ChunkSummaryCache, MapReduceSummarizer
+from prompt_builder import PromptBuilder
+from discord_streaming import StreamingEmbedWriter
+from result_fetcher import FetchResult, fetch_results
+from aggregate_answers import aggregate_query, render_aggregate
+from local_replica import LocalReplica, ReplicatedRepository, DEFAULT_REPLICA_PATH
+from rollups import DEFAULT_ROLLUP_PATH, RollupRepository, RollupStore
+from parquet_archive import DEFAULT_ARCHIVE_PATH, ArchiveRepository, ParquetArchive
+from compact_schema import CompactRepository, DocumentHashStore
+from result_cache import IngestionWatermarks, ResultCache, SharedWatermarks, WatermarkedRepository
+from startup import StartupOrchestrator, VerifiedSchemaStore
+from ask_sessions import AskSessionStore, apply_refinement, parse_refinement
+from log_sink import LOGGER_NAME, LogRecord, LogSink, setup_console_logging
+from metrics import MetricsRegistry
+from admission import Coalescer, FairQueue, UserRateLimiter, call_with_backoff
+from sql_cache import SELF_REFERENCE_RE, normalize_question
+from semantic_index import (AzureOpenAIEmbeddingProvider, HashingEmbeddingProvider, IndexedRepository, MessageEmbedder,
+                            SemanticSearch, VectorIndex, question_time_bounds)
 
 print("DEBUG: Script starting...")
 
@@ -21,7 +50,15 @@ COSMOS_DB_ENDPOINT = os.getenv("COSMOS_DB_ENDPOINT")
 COSMOS_DB_KEY = os.getenv("COSMOS_DB_KEY")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 CONTAINER_NAME = os.getenv("CONTAINER_NAME")
+CONTAINER_LAYOUT = os.getenv("CONTAINER_LAYOUT", "v1") # Disposition de CONTAINER_NAME : v1 (/id) ou v2 (/pk canal:mois)
+CONTAINER_NAME_V2 = os.getenv("CONTAINER_NAME_V2") # Conteneur v2 en cours de migration : écritures doublées
+COSMOS_READ_FROM = os.getenv("COSMOS_READ_FROM", "v1") # "v2" pour lire dans CONTAINER_NAME_V2 pendant la bascule
+MESSAGE_SCHEMA = os.getenv("MESSAGE_SCHEMA", "v1") # "v2" : documents compacts, messages inchangés non réécrits (compact_schema)
+MESSAGE_SCHEMA_UPGRADED = os.getenv("MESSAGE_SCHEMA_UPGRADED", "0") == "1" # Plus aucun document v1 (upgrade_schema.py terminé) : requêtes sans repli sur les noms longs
 TARGET_CHANNEL_ID_STR = os.getenv("TARGET_CHANNEL_ID")
+TARGET_CHANNEL_IDS_STR = os.getenv("TARGET_CHANNEL_IDS") # Liste "id1,id2" en plus de TARGET_CHANNEL_ID
+SYNC_GUILD_IDS_STR = os.getenv("SYNC_GUILD_IDS") # Serveurs synchronisés en entier (canaux texte lisibles)
+SYNC_CHANNEL_DENYLIST_STR = os.getenv("SYNC_CHANNEL_DENYLIST") # Canaux exclus, même dans un serveur synchronisé
 LOG_CHANNEL_ID_STR = os.getenv("LOG_CHANNEL_ID") 
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY")
@@ -29,76 +66,134 @@ AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
 
 print("DEBUG: Env variables loaded.")
 
-MAX_MESSAGES_FOR_SUMMARY_CONFIG = 100 
+MAX_MESSAGES_FOR_SUMMARY_CONFIG = int(os.getenv("MAX_MESSAGES_FOR_SUMMARY", "5000")) # Au-delà d'un lot, synthèse map-reduce
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))
+SUMMARY_CHUNK_MAX_TOKENS = int(os.getenv("SUMMARY_CHUNK_MAX_TOKENS", "400"))
+SUMMARY_MAX_PARALLEL_CALLS = int(os.getenv("SUMMARY_MAX_PARALLEL_CALLS", "4"))
+SUMMARY_CONTEXT_TOKENS = int(os.getenv("SUMMARY_CONTEXT_TOKENS", "16000")) # Fenêtre de contexte du déploiement de synthèse
+SUMMARY_MAX_OUTPUT_TOKENS = 1500
+ASK_RESULT_TOKEN_BUDGET = int(os.getenv("ASK_RESULT_TOKEN_BUDGET", "120000")) # Lecture des résultats !ask arrêtée au-delà
+ASK_RESULT_PAGE_SIZE = int(os.getenv("ASK_RESULT_PAGE_SIZE", "100"))
+SUMMARY_STREAMING_ENABLED = os.getenv("SUMMARY_STREAMING_ENABLED", "1") != "0" # Résumé affiché au fil de la génération
+SUMMARY_STREAM_EDIT_INTERVAL = float(os.getenv("SUMMARY_STREAM_EDIT_INTERVAL", "1.0")) # Secondes minimum entre deux éditions Discord
+INGEST_FORMAT_WORKERS = int(os.getenv("INGEST_FORMAT_WORKERS", "2"))
+INGEST_MAX_IN_FLIGHT = int(os.getenv("INGEST_MAX_IN_FLIGHT", "16"))
+LIVE_INGESTION_ENABLED = os.getenv("LIVE_INGESTION_ENABLED", "1") != "0"
+LIVE_FLUSH_SECONDS = float(os.getenv("LIVE_FLUSH_SECONDS", "5"))
+LIVE_FLUSH_MAX_MESSAGES = int(os.getenv("LIVE_FLUSH_MAX_MESSAGES", "50"))
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "sqlite").lower() # "sqlite" (fichier local) ou "cosmos"
+LOCAL_STATE_PATH = os.getenv("LOCAL_STATE_PATH", DEFAULT_STATE_PATH)
+SCHEMA_VERIFIED_TTL_HOURS = float(os.getenv("SCHEMA_VERIFIED_TTL_HOURS", "24")) # Existence de la base et du conteneur Cosmos revérifiée au-delà (0 = à chaque démarrage)
+LOCAL_REPLICA_ENABLED = os.getenv("LOCAL_REPLICA_ENABLED", "0") == "1" # Réplique SQLite/FTS5 des messages pour servir !ask sans Cosmos
+LOCAL_REPLICA_PATH = os.getenv("LOCAL_REPLICA_PATH", DEFAULT_REPLICA_PATH)
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "0") == "1" # Comptages !ask servis par des agrégats précalculés (SQLite local)
+ROLLUPS_PATH = os.getenv("ROLLUPS_PATH", DEFAULT_ROLLUP_PATH)
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "0") == "1" # Agrégats historiques !ask servis par l'archive Parquet (export_archive.py)
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", DEFAULT_ARCHIVE_PATH)
+SEMANTIC_SEARCH_ENABLED = os.getenv("SEMANTIC_SEARCH_ENABLED", "0") == "1" # Recherche par plongements pour !ask (préfixe ~ ou repli)
+SEMANTIC_EMBEDDING_PROVIDER = os.getenv("SEMANTIC_EMBEDDING_PROVIDER", "azure").lower() # "azure" ou "local" (hachage, sans appel réseau)
+SEMANTIC_EMBEDDING_DEPLOYMENT = os.getenv("SEMANTIC_EMBEDDING_DEPLOYMENT") # Ex: text-embedding-3-small
+SEMANTIC_EMBEDDING_DIMENSIONS = int(os.getenv("SEMANTIC_EMBEDDING_DIMENSIONS", "256")) or None
+SEMANTIC_INDEX_PATH = os.getenv("SEMANTIC_INDEX_PATH", "bebzia_vectors") # Dossier de l'index vectoriel
+SEMANTIC_TOP_K = int(os.getenv("SEMANTIC_TOP_K", "100"))
+SEMANTIC_MIN_SCORE = float(os.getenv("SEMANTIC_MIN_SCORE", "0.3"))
+SEMANTIC_EMBED_BATCH = int(os.getenv("SEMANTIC_EMBED_BATCH", "64"))
+SEMANTIC_INDEX_SAVE_SECONDS = float(os.getenv("SEMANTIC_INDEX_SAVE_SECONDS", "300"))
+SEMANTIC_INDEX_BOOTSTRAP = os.getenv("SEMANTIC_INDEX_BOOTSTRAP", "1") != "0" # Plonger l'archive déjà dans Cosmos au démarrage
+SYNC_MAX_CONCURRENT_CHANNELS = int(os.getenv("SYNC_MAX_CONCURRENT_CHANNELS", "3"))
+INGEST_RU_PER_SECOND = float(os.getenv("INGEST_RU_PER_SECOND", "0")) or None # Ex: 300 pour laisser de la marge à !ask sur 400 RU/s provisionnées
+LOCAL_INTENT_PARSER_ENABLED = os.getenv("LOCAL_INTENT_PARSER_ENABLED", "1") != "0" # Questions simples traduites sans appel IA
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "1") != "0"
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "500"))
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") != "0" # Résultats et résumés !ask réutilisés tant que les canaux lus n'ont pas reçu d'écriture
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "200"))
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "64"))
+ASK_SESSION_ENABLED = os.getenv("ASK_SESSION_ENABLED", "1") != "0" # Questions de suivi de !ask servies depuis le résultat précédent
+ASK_SESSION_TTL_SECONDS = float(os.getenv("ASK_SESSION_TTL_SECONDS", "900")) # Session oubliée après cette inactivité
+ASK_SESSION_MAX = int(os.getenv("ASK_SESSION_MAX", "200"))
+ASK_SESSION_MAX_MB = float(os.getenv("ASK_SESSION_MAX_MB", "64"))
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH") # Fichier JSON pour garder le cache entre deux redémarrages (optionnel)
+ASK_USER_RATE_PER_MINUTE = float(os.getenv("ASK_USER_RATE_PER_MINUTE", "4")) # 0 = pas de limite par utilisateur
+ASK_USER_BURST = int(os.getenv("ASK_USER_BURST", "2"))
+ASK_MAX_CONCURRENT = int(os.getenv("ASK_MAX_CONCURRENT", "2")) # !ask traités en même temps, les autres attendent leur tour
+OPENAI_MAX_CONCURRENT_CALLS = int(os.getenv("OPENAI_MAX_CONCURRENT_CALLS", "4"))
+COSMOS_MAX_CONCURRENT_QUERIES = int(os.getenv("COSMOS_MAX_CONCURRENT_QUERIES", "2"))
+RATE_LIMIT_MAX_ATTEMPTS = int(os.getenv("RATE_LIMIT_MAX_ATTEMPTS", "4")) # Essais sur 429 (OpenAI et Cosmos)
+RATE_LIMIT_MAX_DELAY_SECONDS = float(os.getenv("RATE_LIMIT_MAX_DELAY_SECONDS", "30"))
+BOT_ROLE = os.getenv("BOT_ROLE", "all").lower() # "all", "commands" (commandes seules) ou "ingest" (rattrapage et temps réel seuls), voir supervisor.py
+COMMANDS_ENABLED = BOT_ROLE in ("all", "commands")
+INGEST_ENABLED = BOT_ROLE in ("all", "ingest")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024")) # Observations gardées par histogramme (mémoire constante)
+METRICS_HTTP_PORT = int(os.getenv("METRICS_HTTP_PORT", "0")) # Ex: 9108 pour exposer /metrics (format Prometheus) ; 0 = désactivé
+METRICS_HTTP_HOST = os.getenv("METRICS_HTTP_HOST", "127.0.0.1")
+STATS_WINDOW_SECONDS = float(os.getenv("STATS_WINDOW_SECONDS", "3600")) # Période des latences affichées par !stats
+LOG_FLUSH_SECONDS = float(os.getenv("LOG_FLUSH_SECONDS", "2")) # Regroupement des logs envoyés sur le canal Discord
+LOG_MAX_PENDING = int(os.getenv("LOG_MAX_PENDING", "200")) # Au-delà, les logs Discord les plus anciens sont abandonnés
 GLOBAL_ASK_COMMAND_LOGS = collections.deque(maxlen=50)
 
 from openai import AsyncAzureOpenAI, APIError, APIConnectionError, RateLimitError
 
-azure_openai_client = None
-IS_AZURE_OPENAI_CONFIGURED = False
+azure_openai_client = None  # Créé par init_azure_openai(), étape de démarrage en tâche de fond.
+IS_AZURE_OPENAI_CONFIGURED = bool(AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_KEY and AZURE_OPENAI_DEPLOYMENT_NAME)
 
-if AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_KEY and AZURE_OPENAI_DEPLOYMENT_NAME:
-    try:
-        azure_openai_client = AsyncAzureOpenAI(
-            api_version="2023-07-01-preview", # Assurez-vous que cette version est compatible avec les détails de content_filter_result
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_key=AZURE_OPENAI_KEY,
-        )
-        IS_AZURE_OPENAI_CONFIGURED = True
-        print("Client AsyncAzureOpenAI initialisé avec succès.")
-    except Exception as e:
-        print(f"ERREUR CRITIQUE lors de l'initialisation du client AsyncAzureOpenAI: {e}\n{traceback.format_exc()}")
-        azure_openai_client = None
-else:
+if not IS_AZURE_OPENAI_CONFIGURED:
     print("AVERTISSEMENT: Variables d'environnement pour Azure OpenAI manquantes ou incomplètes. Les fonctionnalités IA seront désactivées.")
 
-print("DEBUG: Azure OpenAI init complete.")
+summary_chunk_cache = ChunkSummaryCache()
+summary_prompt_builder = PromptBuilder(context_tokens=SUMMARY_CONTEXT_TOKENS, max_output_tokens=SUMMARY_MAX_OUTPUT_TOKENS)
+metrics = MetricsRegistry(window=METRICS_WINDOW)
+startup = StartupOrchestrator(on_error=lambda message: send_bot_log_message(message, source="STARTUP"),
+                              on_ready=lambda orchestrator: report_startup_time(orchestrator))
+startup.expect("discord")
+if IS_AZURE_OPENAI_CONFIGURED: startup.expect("openai")
+ask_rate_limiter = UserRateLimiter(ASK_USER_RATE_PER_MINUTE, burst=ASK_USER_BURST)
+ask_queue = FairQueue(max_active=ASK_MAX_CONCURRENT)
+ask_coalescer = Coalescer()
+asks_in_flight = collections.Counter()
+openai_call_limiter = asyncio.Semaphore(max(1, OPENAI_MAX_CONCURRENT_CALLS))
+cosmos_query_limiter = asyncio.Semaphore(max(1, COSMOS_MAX_CONCURRENT_QUERIES))
+sql_generation_cache = SqlGenerationCache(max_entries=SQL_CACHE_MAX_ENTRIES, persist_path=SQL_CACHE_PATH) if SQL_CACHE_ENABLED else None
+# Ingestion dans un autre processus : filigranes lus et avancés dans le fichier d'état partagé.
+ingestion_watermarks = IngestionWatermarks() if BOT_ROLE == "all" else SharedWatermarks(LOCAL_STATE_PATH)
+result_cache = ResultCache(ingestion_watermarks, max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024)) if RESULT_CACHE_ENABLED and COMMANDS_ENABLED else None
+ask_sessions = AskSessionStore(ttl_seconds=ASK_SESSION_TTL_SECONDS, max_sessions=ASK_SESSION_MAX, max_bytes=int(ASK_SESSION_MAX_MB * 1024 * 1024)) if ASK_SESSION_ENABLED and COMMANDS_ENABLED else None
 
 LOG_CHANNEL_ID_VAR_FOR_SEND = None
 
-async def send_bot_log_message(message_content: str, source: str = "BOT", send_to_discord_channel: bool = False, is_openai_filter_log: bool = False):
-    now_utc = discord.utils.utcnow()
-    timestamp_utc_display = now_utc.strftime('%Y-%m-%d %H:%M:%S UTC')
-    log_prefix = f"[{source.upper()}]"
-    
-    console_message = f"[{timestamp_utc_display}] {log_prefix} {message_content}"
-    print(console_message)
+def _log_level(source: str, message_content: str, send_to_discord_channel: bool) -> int:
+    if "ERREUR" in message_content[:40].upper() or "ERROR" in source: return logging.ERROR
+    if send_to_discord_channel or message_content.startswith("AVERTISSEMENT"): return logging.WARNING
+    return logging.INFO
 
+async def send_log_channel_message(text: str):
+    await bot.wait_until_ready()
+    log_channel_obj = bot.get_channel(LOG_CHANNEL_ID_VAR_FOR_SEND)
+    if log_channel_obj: await log_channel_obj.send(text)
+    else: bot_logger.warning(f"[SEND_LOG_WARN] Log channel ID {LOG_CHANNEL_ID_VAR_FOR_SEND} non trouvé pour envoi Discord.")
+
+console_log_listener = setup_console_logging(getattr(logging, LOG_LEVEL, logging.INFO))
+bot_logger = logging.getLogger(LOGGER_NAME)
+log_sink = LogSink(send_log_channel_message, flush_interval=LOG_FLUSH_SECONDS, max_pending=LOG_MAX_PENDING)
+
+async def send_bot_log_message(message_content: str, source: str = "BOT", send_to_discord_channel: bool = False, is_openai_filter_log: bool = False, level: int | None = None):
+    """Ne bloque pas : console via logging, flux de !caca, et canal de logs Discord par lots (log_sink)."""
     source_upper = source.upper()
+    record = LogRecord(source_upper, message_content, level=level or _log_level(source_upper, message_content, send_to_discord_channel),
+                       to_discord=send_to_discord_channel and bool(LOG_CHANNEL_ID_VAR_FOR_SEND), is_openai_filter_log=is_openai_filter_log)
+
     if source_upper.startswith("ASK-CMD") or \
        source_upper.startswith("AI-QUERY-SQL-GEN") or \
        source_upper.startswith("AI-SUMMARY") or \
        source_upper == "AI-TOKEN-USAGE":
         
-        log_entry_for_caca = f"{timestamp_utc_display} {log_prefix} {message_content}"
+        log_entry_for_caca = f"{record.timestamp} [{source_upper}] {message_content}"
         max_single_log_entry_len = 500 
         if len(log_entry_for_caca) > max_single_log_entry_len:
             log_entry_for_caca = log_entry_for_caca[:max_single_log_entry_len - 20] + "... (entry truncated)"
         GLOBAL_ASK_COMMAND_LOGS.append(log_entry_for_caca)
 
-    if send_to_discord_channel and LOG_CHANNEL_ID_VAR_FOR_SEND and 'bot' in globals() and bot.is_ready():
-        try:
-            log_channel_obj = bot.get_channel(LOG_CHANNEL_ID_VAR_FOR_SEND)
-            if log_channel_obj:
-                discord_message_content = message_content
-                if is_openai_filter_log: 
-                    discord_message_content = f"❌ {message_content}"
-                
-                full_log_message_for_discord = f"{timestamp_utc_display} {log_prefix}\n{discord_message_content}"
-                
-                max_discord_len = 1900 
-                if len(full_log_message_for_discord) > max_discord_len:
-                    chars_to_remove = len(full_log_message_for_discord) - max_discord_len + 25 
-                    if chars_to_remove > 0 :
-                         original_content_len = len(discord_message_content)
-                         discord_message_content = discord_message_content[:max(0, original_content_len - chars_to_remove)] + "... (Tronqué)"
-                    full_log_message_for_discord = f"{timestamp_utc_display} {log_prefix}\n{discord_message_content}"
-
-                await log_channel_obj.send(f"```\n{full_log_message_for_discord}\n```")
-            else:
-                print(f"[{timestamp_utc_display}] [SEND_LOG_WARN] Log channel ID {LOG_CHANNEL_ID_VAR_FOR_SEND} non trouvé pour envoi Discord.")
-        except Exception as e:
-            print(f"[{timestamp_utc_display}] [SEND_LOG_ERROR] Erreur envoi log Discord: {e}\n{traceback.format_exc()}")
+    log_sink.emit(record)
 
 def _extract_openai_filter_details(e: APIError) -> str:
     """Tente d'extraire les détails du filtrage de contenu d'une APIError."""
@@ -149,17 +244,43 @@ def _extract_openai_filter_details(e: APIError) -> str:
     return f"Erreur API OpenAI : {detailed_error_message}"
 
 
+def rate_limit_retry_logger(what: str, requesting_user_name_with_id: str):
+    async def log_retry(attempt, delay, error):
+        await send_bot_log_message(f"429 {what} : essai {attempt + 1}/{RATE_LIMIT_MAX_ATTEMPTS} dans {delay:.1f}s. Demandé par: {requesting_user_name_with_id}", source="RATE-LIMIT")
+    return log_retry
+
+
 async def get_ai_analysis(user_query: str, requesting_user_name_with_id: str) -> str | None:
     log_source_prefix = "AI-QUERY-SQL-GEN"
-    if not IS_AZURE_OPENAI_CONFIGURED or not azure_openai_client:
-        await send_bot_log_message(f"Tentative d'appel à l'IA (analyse SQL) alors que la configuration Azure OpenAI est manquante ou a échoué. Demandé par: {requesting_user_name_with_id}", source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True)
-        return None
-
     paris_tz = pytz.timezone('Europe/Paris')
     current_time_paris = datetime.datetime.now(paris_tz) 
     system_current_time_reference = current_time_paris.strftime("%Y-%m-%d %H:%M:%S %Z")
     requesting_user_name_for_prompt = requesting_user_name_with_id.split(" (ID:")[0]
 
+    if LOCAL_INTENT_PARSER_ENABLED:
+        intent_match = parse_question(user_query, requesting_user_name_for_prompt, current_time_paris)
+        if intent_match:
+            metrics.counter("sql_generation_total", "Requêtes SQL produites, par origine", source="local").inc()
+            await send_bot_log_message(f"Question reconnue localement ({intent_match.intent}), appel IA évité. Demandé par: {requesting_user_name_with_id} pour la question: '{user_query}'", source=log_source_prefix)
+            return intent_match.sql
+
+    if not IS_AZURE_OPENAI_CONFIGURED or not azure_openai_client:
+        await send_bot_log_message(f"Tentative d'appel à l'IA (analyse SQL) alors que la configuration Azure OpenAI est manquante ou a échoué. Demandé par: {requesting_user_name_with_id}", source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True)
+        return None
+
+    if sql_generation_cache:
+        cached = sql_generation_cache.lookup(user_query, requesting_user_name_for_prompt, current_time_paris)
+        if cached:
+            cached_query, cache_level, saved_tokens = cached
+            metrics.counter("sql_generation_total", "Requêtes SQL produites, par origine", source="cache").inc()
+            await send_bot_log_message(
+                f"Cache SQL ({cache_level}) : appel IA évité, ~{saved_tokens} tokens économisés. "
+                f"Taux de succès {sql_generation_cache.hit_rate:.0%}, total économisé {sql_generation_cache.stats['saved_tokens']} tokens.\n"
+                f"Demandé par: {requesting_user_name_with_id} pour la question: '{user_query}'",
+                source="AI-TOKEN-USAGE"
+            )
+            return cached_query
+
     system_prompt = f"""
 Tu es un assistant IA spécialisé dans la conversion de questions en langage naturel en requêtes SQL optimisées pour Azure Cosmos DB.
 Ta tâche est d'analyser la question de l'utilisateur et de générer UNIQUEMENT la requête SQL correspondante pour interroger une base de données Cosmos DB contenant des messages Discord.
@@ -201,19 +322,33 @@ Instructions pour la génération de la requête :
 8.  **Ordre de tri :** Par défaut `ORDER BY c.timestamp_iso DESC`. Pour "premier message" ou "plus ancien", utilise `ASC`.
 9.  Pour "combien", utilise `SELECT VALUE COUNT(1) FROM c WHERE ...`.
 10. Pour limiter le nombre de résultats ("le dernier message", "les 5 messages"), utilise `TOP N` après `SELECT`.
+11. **Classements et totaux** (servis sans parcourir les messages, la réponse est un chiffre ou un classement, pas un résumé) :
+    * "qui a le plus parlé / posté", "les plus actifs", "classement des membres" : `SELECT c.author_name, COUNT(1) AS messages FROM c WHERE ... GROUP BY c.author_name`.
+    * "quel salon est le plus actif" : `SELECT c.channel_id, COUNT(1) AS messages FROM c WHERE ... GROUP BY c.channel_id`.
+    * "combien de réactions", "combien de pièces jointes" : `SELECT VALUE SUM(c.reactions_count) FROM c WHERE ...` (ou `c.attachments_count`) ; par auteur : `SELECT c.author_name, SUM(c.reactions_count) AS reactions FROM c WHERE ... GROUP BY c.author_name`.
+    * "en moyenne combien de réactions par message" : `SELECT VALUE AVG(c.reactions_count) FROM c WHERE ...` ; par auteur ou par salon, `AVG(...) AS reactions` avec `GROUP BY`.
+    * "le plus de réactions reçues par un seul message" (le chiffre, pas le message) : `SELECT VALUE MAX(c.reactions_count) FROM c WHERE ...`.
+    * "depuis quand", "à quelle date" X a posté pour la première / dernière fois : `SELECT VALUE MIN(c.timestamp_iso) FROM c WHERE ...` (ou `MAX`) ; par auteur : `SELECT c.author_name, MIN(c.timestamp_iso) AS premier FROM c WHERE ... GROUP BY c.author_name`.
+    * Avec GROUP BY, jamais d'`ORDER BY` ni de `TOP` (refusés par Cosmos DB) : le bot trie lui-même le classement.
 """
     try:
-        response = await azure_openai_client.chat.completions.create(
-            model=AZURE_OPENAI_DEPLOYMENT_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_query}
-            ],
-            temperature=0.2, max_tokens=350, top_p=0.95,
-            frequency_penalty=0, presence_penalty=0, stop=None
-        )
+        metrics.counter("sql_generation_total", "Requêtes SQL produites, par origine", source="openai").inc()
+        async with openai_call_limiter, metrics.histogram("openai_call_seconds", "Durée des appels Azure OpenAI", call="sql").time():
+            response = await call_with_backoff(
+                lambda: azure_openai_client.chat.completions.create(
+                    model=AZURE_OPENAI_DEPLOYMENT_NAME,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_query}
+                    ],
+                    temperature=0.2, max_tokens=350, top_p=0.95,
+                    frequency_penalty=0, presence_penalty=0, stop=None
+                ),
+                max_attempts=RATE_LIMIT_MAX_ATTEMPTS, max_delay=RATE_LIMIT_MAX_DELAY_SECONDS,
+                on_retry=rate_limit_retry_logger("Azure OpenAI (SQL Gen)", requesting_user_name_with_id))
         
         if response.usage:
+            metrics.counter("openai_tokens_total", "Tokens Azure OpenAI consommés", call="sql").inc(response.usage.total_tokens)
             await send_bot_log_message(
                 f"Utilisation des tokens (SQL Gen): Prompt={response.usage.prompt_tokens}, Completion={response.usage.completion_tokens}, Total={response.usage.total_tokens}\nDemandé par: {requesting_user_name_with_id} pour la question: '{user_query}'",
                 source="AI-TOKEN-USAGE" 
@@ -227,6 +362,9 @@ Instructions pour la génération de la requête :
             if not generated_query.upper().startswith("SELECT"):
                 await send_bot_log_message(f"L'IA a retourné un format invalide (non SELECT) : '{generated_query}' pour : '{user_query}'. Demandé par: {requesting_user_name_with_id}", source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True)
                 return "INVALID_QUERY_FORMAT"
+            if sql_generation_cache:
+                tokens_used = response.usage.total_tokens if response.usage else 0
+                sql_generation_cache.store(user_query, requesting_user_name_for_prompt, current_time_paris, generated_query, tokens_used)
             return generated_query
         else:
             await send_bot_log_message(f"Aucune réponse ou contenu de message valide d'Azure OpenAI pour : '{user_query}'. Demandé par: {requesting_user_name_with_id}", source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True)
@@ -246,42 +384,14 @@ Instructions pour la génération de la requête :
         await send_bot_log_message(error_message, source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True); return None
 
 
-async def get_ai_summary(messages_list: list[dict], requesting_user_name_with_id: str) -> str | None:
-    log_source_prefix = "AI-SUMMARY"
-    if not IS_AZURE_OPENAI_CONFIGURED or not azure_openai_client:
-        await send_bot_log_message(f"Tentative d'appel à l'IA (Synthèse) alors que la configuration Azure OpenAI est manquante ou a échoué. Demandé par: {requesting_user_name_with_id}", source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True)
-        return None
-    if not messages_list:
-        return "Aucun message à résumer."
-
-    # ... (le reste de la préparation des messages pour get_ai_summary est identique)
-    messages_to_summarize = messages_list[:MAX_MESSAGES_FOR_SUMMARY_CONFIG]
-    formatted_messages = ""
-    paris_tz = pytz.timezone('Europe/Paris')
+def build_summary_system_prompt(input_description: str, input_section: str, first_item: dict | None) -> str:
     first_message_id_for_link, first_channel_id_for_link, first_guild_id_for_link = None, None, None
-
-    for i, item in enumerate(messages_to_summarize):
-        author = item.get("author_display_name", item.get("author_name", "Auteur inconnu"))
-        timestamp_str, content = item.get("timestamp_iso"), item.get("content", "")
-        message_id, channel_id, guild_id = item.get("id"), item.get("channel_id"), item.get("guild_id")
-
-        if i == 0 and message_id and channel_id and guild_id:
-            first_message_id_for_link, first_channel_id_for_link, first_guild_id_for_link = message_id, channel_id, guild_id
-
-        date_fmt = "Date inconnue"
-        if timestamp_str:
-            try:
-                dt_obj = dateutil.parser.isoparse(timestamp_str)
-                if dt_obj.tzinfo is None: dt_obj = dt_obj.replace(tzinfo=datetime.timezone.utc)
-                date_fmt = dt_obj.astimezone(paris_tz).strftime("%Y-%m-%d %H:%M")
-            except Exception: date_fmt = timestamp_str 
-        formatted_messages += f"[{author}] ({date_fmt}): {content}\n---\n"
-    
-    system_prompt = f"""
+    if first_item and first_item.get("id") and first_item.get("channel_id") and first_item.get("guild_id"):
+        first_message_id_for_link, first_channel_id_for_link, first_guild_id_for_link = first_item["id"], first_item["channel_id"], first_item["guild_id"]
+    return f"""
 Tu es un assistant IA spécialisé dans la synthèse de conversations Discord.
-Tu recevras une liste d'environ {len(messages_to_summarize)} messages Discord dans un format [NomAuteur] (AAAA-MM-JJ HH:MM): Contenu du message.
-Chaque message est séparé par une ligne "---".
-Ton objectif est de lire attentivement ces messages et de fournir un résumé concis et cohérent de la discussion qu'ils représentent, **en te basant UNIQUEMENT ET EXCLUSIVEMENT sur le contenu textuel et les auteurs des messages qui te sont fournis dans la section "Voici les messages à résumer :".**
+{input_description}
+Ton objectif est de lire attentivement ces messages et de fournir un résumé concis et cohérent de la discussion qu'ils représentent, **en te basant UNIQUEMENT ET EXCLUSIVEMENT sur le contenu textuel et les auteurs des messages qui te sont fournis dans la section "{input_section}".**
 **Ne mentionne AUCUN participant ni AUCUN sujet qui ne soit pas explicitement présent et identifiable dans les messages que tu analyses pour CE résumé spécifique.**
 **Ignore toute connaissance préalable sur les membres du groupe qui ne serait pas confirmée par les messages actuels.**
 Mets en évidence les sujets principaux, les points clés, et les informations importantes partagées DANS CES MESSAGES.
@@ -307,45 +417,142 @@ N'invente pas de lien si les IDs ne sont pas explicitement disponibles.
 Ne mentionne pas les IDs dans le résumé lui-même, seulement le lien formaté à la fin s'il est applicable. Par exemple: [Lien vers le message](URL_CONSTRUITE)
 Essaie de maintenir le résumé relativement court (quelques phrases, idéalement environ 300 mots mais tu peux aller sur les 1000-2000 mots pour des requetes avec beaucoup de messages).
 """
-    user_message = f"Voici les messages à résumer :\n\n---\n{formatted_messages}\n\nRésumé de la discussion :"
 
 
-    try:
-        response = await azure_openai_client.chat.completions.create(
-            model=AZURE_OPENAI_DEPLOYMENT_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.3, max_tokens=1500, top_p=0.95,
-            frequency_penalty=0, presence_penalty=0, stop=None
-        )
+SUMMARY_CHUNK_SYSTEM_PROMPT = """
+Tu es un assistant IA qui prépare la synthèse d'une longue conversation Discord.
+Tu reçois UN lot de messages consécutifs (format [NomAuteur] (AAAA-MM-JJ HH:MM): Contenu, séparés par "---").
+Rédige des notes factuelles et concises en français (150 à 250 mots) : sujets abordés, qui a dit ou proposé quoi (garde les pseudos tels quels), décisions, informations importantes, avec les dates quand elles comptent.
+N'invente rien, ne cite pas les messages textuellement, n'ajoute ni introduction ni conclusion, ni lien.
+"""
 
-        if response.usage:
-            await send_bot_log_message(
-                f"Utilisation des tokens (Synthèse): Prompt={response.usage.prompt_tokens}, Completion={response.usage.completion_tokens}, Total={response.usage.total_tokens}\nPour {len(messages_to_summarize)} messages. Demandé par: {requesting_user_name_with_id}",
-                source="AI-TOKEN-USAGE"
-            )
 
-        if response.choices and response.choices[0].message and response.choices[0].message.content:
-            summary = response.choices[0].message.content.strip()
-            return summary
-        else:
-            await send_bot_log_message(f"Aucune réponse ou contenu valide reçu d'Azure OpenAI pour la synthèse. Demandé par: {requesting_user_name_with_id}", source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True)
-            return None
+async def _summary_completion(system_prompt: str, user_message: str, requesting_user_name_with_id: str, max_tokens: int = 1500, on_delta=None) -> tuple[str | None, int]:
+    """Un appel de synthèse ; renvoie (texte ou None, tokens consommés). Les erreurs sont journalisées ici.
+
+    Avec `on_delta`, la réponse est demandée en streaming et chaque morceau de texte lui est passé dès réception.
+    """
+    log_source_prefix = "AI-SUMMARY"
+    try:
+        async with openai_call_limiter, metrics.histogram("openai_call_seconds", "Durée des appels Azure OpenAI", call="summary").time(): # Tenu jusqu'à la fin du streaming
+            response = await call_with_backoff(
+                lambda: azure_openai_client.chat.completions.create(
+                    model=AZURE_OPENAI_DEPLOYMENT_NAME,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message}
+                    ],
+                    temperature=0.3, max_tokens=max_tokens, top_p=0.95,
+                    frequency_penalty=0, presence_penalty=0, stop=None,
+                    stream=on_delta is not None
+                ),
+                max_attempts=RATE_LIMIT_MAX_ATTEMPTS, max_delay=RATE_LIMIT_MAX_DELAY_SECONDS,
+                on_retry=rate_limit_retry_logger("Azure OpenAI (Synthèse)", requesting_user_name_with_id))
+            if on_delta is not None:
+                parts, tokens_used = [], 0
+                async for chunk in response:
+                    if getattr(chunk, "usage", None):
+                        tokens_used = chunk.usage.total_tokens
+                    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        await on_delta(chunk.choices[0].delta.content)
+                streamed_text = "".join(parts).strip()
+                if not tokens_used:  # Les anciennes versions d'API ne renvoient pas l'usage en streaming.
+                    estimator = summary_prompt_builder.estimator
+                    tokens_used = estimator.count(system_prompt) + estimator.count(user_message) + estimator.count(streamed_text)
+                if streamed_text:
+                    return streamed_text, tokens_used
+            else:
+                tokens_used = response.usage.total_tokens if response.usage else 0
+                if response.choices and response.choices[0].message and response.choices[0].message.content:
+                    return response.choices[0].message.content.strip(), tokens_used
+        await send_bot_log_message(f"Aucune réponse ou contenu valide reçu d'Azure OpenAI pour la synthèse. Demandé par: {requesting_user_name_with_id}", source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True)
+        return None, tokens_used
     except APIError as e:
         error_details = _extract_openai_filter_details(e)
         error_message_to_log = f"{error_details}. Demandé par: {requesting_user_name_with_id}"
-        await send_bot_log_message(error_message_to_log, source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True); return None
+        await send_bot_log_message(error_message_to_log, source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True); return None, 0
     except APIConnectionError as e:
         error_message = f"Erreur de connexion Azure OpenAI (Synthèse) : {e}. Demandé par: {requesting_user_name_with_id}"
-        await send_bot_log_message(error_message, source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True); return None
+        await send_bot_log_message(error_message, source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True); return None, 0
     except RateLimitError as e:
         error_message = f"Erreur de limite de taux Azure OpenAI (Synthèse) : {e}. Demandé par: {requesting_user_name_with_id}"
-        await send_bot_log_message(error_message, source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True); return None
+        await send_bot_log_message(error_message, source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True); return None, 0
     except Exception as e:
         error_message = f"Erreur inattendue lors de l'appel à Azure OpenAI (Synthèse) : {e}\n{traceback.format_exc()}\nDemandé par: {requesting_user_name_with_id}"
-        await send_bot_log_message(error_message, source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True); return None
+        await send_bot_log_message(error_message, source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True); return None, 0
+
+
+async def _map_reduce_summary(messages_to_summarize: list[dict], requesting_user_name_with_id: str, on_delta=None) -> str | None:
+    first_item = messages_to_summarize[0]
+    chronological = sorted(messages_to_summarize, key=lambda item: item.get("timestamp_iso") or "")
+
+    async def summarize_chunk(chunk, index, total):
+        packed = summary_prompt_builder.pack(chunk, budget_tokens=chunk_budget)
+        user_message = f"Lot {index + 1}/{total} ({len(packed.included)} messages) :\n\n---\n{packed.text}\n\nNotes :"
+        return await _summary_completion(SUMMARY_CHUNK_SYSTEM_PROMPT, user_message, requesting_user_name_with_id, max_tokens=SUMMARY_CHUNK_MAX_TOKENS)
+
+    async def reduce_partials(partials, items, final):
+        description = (f"Tu recevras {len(partials)} résumés partiels, dans l'ordre chronologique, qui couvrent ensemble {len(items)} messages Discord.\n"
+                       f"Chaque résumé partiel est séparé par une ligne \"---\". Fusionne-les en un seul résumé, sans répéter les mêmes faits.")
+        if final:
+            system_prompt = build_summary_system_prompt(description, "Voici les résumés partiels à fusionner :", first_item)
+            max_tokens = SUMMARY_MAX_OUTPUT_TOKENS
+        else:
+            system_prompt = SUMMARY_CHUNK_SYSTEM_PROMPT + description
+            max_tokens = SUMMARY_CHUNK_MAX_TOKENS * 2
+        user_message = "Voici les résumés partiels à fusionner :\n\n---\n" + "\n---\n".join(partials) + "\n\nRésumé de la discussion :"
+        return await _summary_completion(system_prompt, user_message, requesting_user_name_with_id, max_tokens=max_tokens,
+                                         on_delta=on_delta if final else None)
+
+    chunk_budget = min(SUMMARY_CHUNK_TOKENS, summary_prompt_builder.budget_for(SUMMARY_CHUNK_SYSTEM_PROMPT, max_output_tokens=SUMMARY_CHUNK_MAX_TOKENS))
+    reduce_budget = summary_prompt_builder.budget_for(build_summary_system_prompt("", "", first_item))
+    summarizer = MapReduceSummarizer(summarize_chunk, reduce_partials, chunk_token_budget=chunk_budget,
+                                     reduce_token_budget=reduce_budget, max_parallel=SUMMARY_MAX_PARALLEL_CALLS,
+                                     item_tokens=summary_prompt_builder.item_tokens,
+                                     text_tokens=summary_prompt_builder.estimator.count, cache=summary_chunk_cache)
+    run = await summarizer.summarize(chronological)
+    metrics.counter("openai_tokens_total", "Tokens Azure OpenAI consommés", call="summary").inc(run.tokens_used)
+    notes = f" ({'; '.join(run.notes)})" if run.notes else ""
+    await send_bot_log_message(
+        f"Utilisation des tokens (Synthèse map-reduce): Total={run.tokens_used} pour {len(messages_to_summarize)} messages en {run.chunks} lots "
+        f"({run.cached_chunks} depuis le cache, {run.reduce_calls} fusion(s)), {run.elapsed_seconds:.1f}s{notes}. Demandé par: {requesting_user_name_with_id}",
+        source="AI-TOKEN-USAGE"
+    )
+    return run.summary
+
+
+async def get_ai_summary(messages_list: list[dict], requesting_user_name_with_id: str, on_delta=None) -> str | None:
+    log_source_prefix = "AI-SUMMARY"
+    if not IS_AZURE_OPENAI_CONFIGURED or not azure_openai_client:
+        await send_bot_log_message(f"Tentative d'appel à l'IA (Synthèse) alors que la configuration Azure OpenAI est manquante ou a échoué. Demandé par: {requesting_user_name_with_id}", source=log_source_prefix, send_to_discord_channel=True, is_openai_filter_log=True)
+        return None
+    if not messages_list:
+        return "Aucun message à résumer."
+
+    messages_to_summarize = messages_list[:MAX_MESSAGES_FOR_SUMMARY_CONFIG]
+    system_prompt = build_summary_system_prompt(
+        f"Tu recevras une liste d'environ {len(messages_to_summarize)} messages Discord dans un format [NomAuteur] (AAAA-MM-JJ HH:MM): Contenu du message.\n"
+        "Chaque message est séparé par une ligne \"---\".",
+        "Voici les messages à résumer :", messages_to_summarize[0])
+    user_message_frame = "Voici les messages à résumer :\n\n---\n\n\nRésumé de la discussion :"
+    budget = min(SUMMARY_CHUNK_TOKENS, summary_prompt_builder.budget_for(system_prompt, user_message_frame))
+    packed = summary_prompt_builder.pack(messages_to_summarize, budget_tokens=budget)
+    if not packed.complete:
+        with metrics.histogram("summary_seconds", "Durée de get_ai_summary", mode="map_reduce").time():
+            return await _map_reduce_summary(messages_to_summarize, requesting_user_name_with_id, on_delta=on_delta)
+
+    user_message = f"Voici les messages à résumer :\n\n---\n{packed.text}\n\nRésumé de la discussion :"
+    with metrics.histogram("summary_seconds", "Durée de get_ai_summary", mode="single").time():
+        summary, tokens_used = await _summary_completion(system_prompt, user_message, requesting_user_name_with_id, max_tokens=SUMMARY_MAX_OUTPUT_TOKENS, on_delta=on_delta)
+    metrics.counter("openai_tokens_total", "Tokens Azure OpenAI consommés", call="summary").inc(tokens_used)
+    if tokens_used:
+        await send_bot_log_message(
+            f"Utilisation des tokens (Synthèse): Total={tokens_used} (prompt estimé à {packed.tokens} tokens de messages)\n"
+            f"Pour {len(packed.included)} messages ({packed.collapsed} répétitions regroupées, {packed.skipped_empty} vides ignorés). Demandé par: {requesting_user_name_with_id}",
+            source="AI-TOKEN-USAGE"
+        )
+    return summary
 
 # ----- LE RESTE DU CODE EST IDENTIQUE À LA VERSION PRÉCÉDENTE -----
 # (Initialisation du bot, variables, CosmosDB, format_message_to_json, main_message_fetch_logic, scheduled_message_fetch, on_ready, ping, ask_command, caca_command)
@@ -353,14 +560,21 @@ Essaie de maintenir le résumé relativement court (quelques phrases, idéalemen
 print("DEBUG: AI functions defined.")
 
 intents = discord.Intents.default()
-intents.messages, intents.message_content, intents.guilds = True, True, True
+intents.messages, intents.message_content, intents.guilds, intents.reactions = True, True, True, True
 bot = commands.Bot(command_prefix="!", intents=intents)
 print("DEBUG: Discord Bot object created.")
 
 TARGET_CHANNEL_ID, LOG_CHANNEL_ID_VAR, ALLOWED_USER_IDS_LIST = None, None, []
+SYNC_CHANNEL_IDS, SYNC_GUILD_IDS, SYNC_CHANNEL_DENYLIST = set(), set(), set()
+
+def parse_id_list(value: str | None) -> set[int]:
+    return {int(part.strip()) for part in (value or "").split(',') if part.strip()}
 
 try:
     if TARGET_CHANNEL_ID_STR: TARGET_CHANNEL_ID = int(TARGET_CHANNEL_ID_STR)
+    SYNC_CHANNEL_IDS = parse_id_list(TARGET_CHANNEL_IDS_STR) | ({TARGET_CHANNEL_ID} if TARGET_CHANNEL_ID else set())
+    SYNC_GUILD_IDS = parse_id_list(SYNC_GUILD_IDS_STR)
+    SYNC_CHANNEL_DENYLIST = parse_id_list(SYNC_CHANNEL_DENYLIST_STR)
     if LOG_CHANNEL_ID_STR: 
         LOG_CHANNEL_ID_VAR = int(LOG_CHANNEL_ID_STR)
         LOG_CHANNEL_ID_VAR_FOR_SEND = LOG_CHANNEL_ID_VAR # Assigner à la variable globale
@@ -372,7 +586,7 @@ try:
                 try: ALLOWED_USER_IDS_LIST.append(int(user_id_str))
                 except ValueError: print(f"AVERTISSEMENT: ID utilisateur '{user_id_str}' invalide.")
 except ValueError:
-    print("ERREUR CRITIQUE: ID de canal (TARGET ou LOG) invalide.")
+    print("ERREUR CRITIQUE: ID de canal ou de serveur (TARGET, SYNC ou LOG) invalide.")
     sys.exit(1)
 
 if ALLOWED_USER_IDS_LIST: print(f"DEBUG: Allowed user IDs: {ALLOWED_USER_IDS_LIST}")
@@ -382,94 +596,506 @@ else: print("DEBUG: LOG_CHANNEL_ID non configuré, les erreurs OpenAI spécifiqu
 
 print("DEBUG: ID conversion complete.")
 
-cosmos_client_instance_global, container_client = None, None
+cosmos_repo = None
+semantic_search = None
 if all([COSMOS_DB_ENDPOINT, COSMOS_DB_KEY, DATABASE_NAME, CONTAINER_NAME]):
-    try:
-        cosmos_client_instance_global = CosmosClient(COSMOS_DB_ENDPOINT, credential=COSMOS_DB_KEY)
-        database_client = cosmos_client_instance_global.create_database_if_not_exists(id=DATABASE_NAME)
-        container_client = database_client.create_container_if_not_exists(
-            id=CONTAINER_NAME, partition_key=PartitionKey(path="/id"), offer_throughput=400
+    cosmos_timeouts = dict(
+        call_timeout=float(os.getenv("COSMOS_CALL_TIMEOUT_SECONDS", "30")),
+        query_timeout=float(os.getenv("COSMOS_QUERY_TIMEOUT_SECONDS", "60")),
+        verified_schemas=VerifiedSchemaStore(LOCAL_STATE_PATH, max_age_seconds=SCHEMA_VERIFIED_TTL_HOURS * 3600) if SCHEMA_VERIFIED_TTL_HOURS > 0 else None,
+    )
+    cosmos_repo = CosmosRepository(
+        COSMOS_DB_ENDPOINT, COSMOS_DB_KEY, DATABASE_NAME, CONTAINER_NAME,
+        layout=LAYOUTS.get(CONTAINER_LAYOUT, LAYOUTS["v1"]), offer_throughput=400, **cosmos_timeouts,
+    )
+    if CONTAINER_NAME_V2:
+        cosmos_repo = DualWriteRepository(
+            cosmos_repo,
+            CosmosRepository(COSMOS_DB_ENDPOINT, COSMOS_DB_KEY, DATABASE_NAME, CONTAINER_NAME_V2, layout=LAYOUT_V2, offer_throughput=400, **cosmos_timeouts),
+            read_from_secondary=COSMOS_READ_FROM == "v2",
         )
-        print(f"Conteneur '{CONTAINER_NAME}' prêt.")
-    except Exception as e:
-        print(f"ERREUR CRITIQUE Cosmos DB: {e}\n{traceback.format_exc()}")
+        print(f"DEBUG: Bascule Cosmos DB active : écritures dans '{CONTAINER_NAME}' et '{CONTAINER_NAME_V2}', lectures en {COSMOS_READ_FROM}.")
+    if MESSAGE_SCHEMA == "v2":
+        try:
+            cosmos_repo = CompactRepository(cosmos_repo, DocumentHashStore(LOCAL_STATE_PATH, namespace=CONTAINER_NAME),
+                                            mixed=not MESSAGE_SCHEMA_UPGRADED)
+            print(f"DEBUG: Schéma de message compact (v2) actif{'' if MESSAGE_SCHEMA_UPGRADED else ', documents v1 encore lus'}.")
+        except Exception as e:
+            print(f"AVERTISSEMENT: Schéma compact indisponible ({e}). Documents écrits en v1.")
+    if LOCAL_REPLICA_ENABLED:
+        try:
+            cosmos_repo = ReplicatedRepository(cosmos_repo, LocalReplica(LOCAL_REPLICA_PATH),
+                                               on_error=lambda message: send_bot_log_message(message, source="LOCAL-REPLICA"))
+            print(f"DEBUG: Réplique locale '{LOCAL_REPLICA_PATH}' active ({'prête' if cosmos_repo.replica.ready else 'copie initiale au démarrage'}).")
+        except Exception as e:
+            print(f"AVERTISSEMENT: Réplique locale indisponible ({e}). Requêtes servies par Cosmos.")
+    if ARCHIVE_ENABLED:
+        try:
+            cosmos_repo = ArchiveRepository(cosmos_repo, ParquetArchive(ARCHIVE_PATH),
+                                            on_error=lambda message: send_bot_log_message(message, source="ARCHIVE"))
+            complete_until = cosmos_repo.archive.complete_until
+            coverage = f"complète jusqu'au {complete_until[:10]}" if complete_until else "vide, lancer export_archive.py"
+            print(f"DEBUG: Archive Parquet '{ARCHIVE_PATH}' active ({coverage}).")
+        except Exception as e:
+            print(f"AVERTISSEMENT: Archive Parquet indisponible ({e}). Agrégats historiques servis par Cosmos.")
+    if ROLLUPS_ENABLED:
+        try:
+            cosmos_repo = RollupRepository(cosmos_repo, RollupStore(ROLLUPS_PATH),
+                                           on_error=lambda message: send_bot_log_message(message, source="ROLLUPS"))
+            print(f"DEBUG: Rollups '{ROLLUPS_PATH}' actifs ({'prêts' if cosmos_repo.store.ready else 'calcul initial au démarrage'}).")
+        except Exception as e:
+            print(f"AVERTISSEMENT: Rollups indisponibles ({e}). Comptages servis par Cosmos.")
+    if SEMANTIC_SEARCH_ENABLED:
+        semantic_provider = None
+        if SEMANTIC_EMBEDDING_PROVIDER == "local":
+            semantic_provider = HashingEmbeddingProvider(dim=SEMANTIC_EMBEDDING_DIMENSIONS or 256)
+        elif IS_AZURE_OPENAI_CONFIGURED and SEMANTIC_EMBEDDING_DEPLOYMENT:
+            # Client affecté par init_azure_openai() au démarrage.
+            semantic_provider = AzureOpenAIEmbeddingProvider(None, SEMANTIC_EMBEDDING_DEPLOYMENT, dimensions=SEMANTIC_EMBEDDING_DIMENSIONS)
+        if semantic_provider is None:
+            print("AVERTISSEMENT: Recherche sémantique désactivée (SEMANTIC_EMBEDDING_DEPLOYMENT ou Azure OpenAI manquant).")
+        else:
+            try:
+                semantic_index = VectorIndex.load(SEMANTIC_INDEX_PATH) if os.path.exists(os.path.join(SEMANTIC_INDEX_PATH, "meta.json")) else VectorIndex()
+            except Exception as e:
+                print(f"AVERTISSEMENT: Index vectoriel '{SEMANTIC_INDEX_PATH}' illisible ({e}). Reconstruction complète.")
+                semantic_index = VectorIndex()
+
+            async def log_embedding_error(message):
+                await send_bot_log_message(message, source="SEMANTIC-INDEX")
+
+            cosmos_repo = IndexedRepository(cosmos_repo, MessageEmbedder(semantic_provider, semantic_index, batch_size=SEMANTIC_EMBED_BATCH,
+                                                                         on_error=log_embedding_error))
+            semantic_search = SemanticSearch(semantic_provider, semantic_index)
+            print(f"DEBUG: Recherche sémantique active ({SEMANTIC_EMBEDDING_PROVIDER}, {len(semantic_index)} message(s) déjà indexés dans '{SEMANTIC_INDEX_PATH}').")
+    if RESULT_CACHE_ENABLED:
+        # Toujours en dernier : le filigrane avance une fois l'écriture passée dans toutes les enveloppes.
+        cosmos_repo = WatermarkedRepository(cosmos_repo, ingestion_watermarks)
+    startup.expect("cosmos")
 else:
     print("AVERTISSEMENT: Config Cosmos DB incomplète. Fonctions DB désactivées.")
+
+checkpoint_store = None
+try:
+    if CHECKPOINT_BACKEND == "cosmos" and cosmos_repo: checkpoint_store = CosmosCheckpointStore(cosmos_repo)
+    else: checkpoint_store = SqliteCheckpointStore(LOCAL_STATE_PATH)
+except Exception as e:
+    print(f"AVERTISSEMENT: Stockage des points de reprise indisponible ({e}). Reprise par MAX(timestamp).")
+
+def is_cosmos_ready() -> bool:
+    return cosmos_repo is not None and cosmos_repo.is_connected
+
+async def init_cosmos_repository():
+    if not cosmos_repo: return
+    try:
+        await cosmos_repo.connect()
+        skipped = " (existence déjà vérifiée, sans appel réseau)" if find_repository(CosmosRepository).schema_check_skipped else ""
+        print(f"Conteneur '{CONTAINER_NAME}' prêt{skipped}." + (f" Conteneur v2 '{CONTAINER_NAME_V2}' prêt." if CONTAINER_NAME_V2 else ""))
+    except Exception as e:
+        print(f"ERREUR CRITIQUE Cosmos DB: {e}\n{traceback.format_exc()}")
+        raise
+
+async def init_azure_openai():
+    """Client Azure OpenAI construit hors de la boucle (chargement TLS/httpx), partagé avec les plongements."""
+    global azure_openai_client, IS_AZURE_OPENAI_CONFIGURED
+    try:
+        azure_openai_client = await asyncio.to_thread(
+            AsyncAzureOpenAI,
+            api_version="2023-07-01-preview", # Assurez-vous que cette version est compatible avec les détails de content_filter_result
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,
+            api_key=AZURE_OPENAI_KEY,
+        )
+    except Exception as e:
+        IS_AZURE_OPENAI_CONFIGURED = False
+        print(f"ERREUR CRITIQUE lors de l'initialisation du client AsyncAzureOpenAI: {e}\n{traceback.format_exc()}")
+        raise
+    indexed = find_repository(IndexedRepository)
+    if indexed and isinstance(indexed.embedder.provider, AzureOpenAIEmbeddingProvider):
+        indexed.embedder.provider.client = azure_openai_client  # Même objet que semantic_search.provider.
+    print("Client AsyncAzureOpenAI initialisé avec succès.")
+
+async def report_startup_time(orchestrator):
+    await send_bot_log_message(f"Démarrage terminé en {orchestrator.time_to_ready:.1f}s : {orchestrator.report()}.", source="STARTUP")
+
+async def reply_if_warming_up(ctx, *steps) -> bool:
+    """Répond « démarrage en cours » si une étape dont la commande dépend n'est pas terminée."""
+    waiting = startup.pending(*steps)
+    if not waiting: return False
+    await ctx.send(f"⏳ Démarrage en cours ({', '.join(waiting)}), réessaie dans quelques secondes.")
+    return True
+
+async def bootstrap_local_replica(repository):
+    started = datetime.datetime.now()
+    try:
+        copied = await repository.bootstrap()
+        await send_bot_log_message(f"Réplique locale prête : {copied} message(s) copiés depuis Cosmos en {(datetime.datetime.now() - started).total_seconds():.0f}s.", source="LOCAL-REPLICA")
+    except Exception as e:
+        await send_bot_log_message(f"Copie initiale de la réplique locale interrompue (reprise au prochain démarrage) : {e}", source="LOCAL-REPLICA")
+
+async def bootstrap_rollups(repository):
+    started = datetime.datetime.now()
+    replicated = find_repository(ReplicatedRepository)
+    try:
+        # Lecture depuis Cosmos même si la réplique est prête : le jeton de reprise doit rester un jeton Cosmos.
+        counted = await repository.bootstrap(source=replicated.primary if replicated else None)
+        await send_bot_log_message(f"Rollups prêts : {counted} message(s) comptés depuis Cosmos en {(datetime.datetime.now() - started).total_seconds():.0f}s.", source="ROLLUPS")
+    except Exception as e:
+        await send_bot_log_message(f"Calcul initial des rollups interrompu (reprise au prochain démarrage) : {e}", source="ROLLUPS")
+
+async def bootstrap_semantic_index():
+    started = datetime.datetime.now()
+    try:
+        indexed = find_repository(IndexedRepository)
+        submitted = await indexed.bootstrap()
+        if submitted:
+            stats = indexed.embedder.stats
+            await send_bot_log_message(f"Index sémantique prêt : {submitted} message(s) relus, {stats.embedded} plongé(s) en {stats.batches} lot(s), "
+                                       f"{(datetime.datetime.now() - started).total_seconds():.0f}s.", source="SEMANTIC-INDEX")
+    except Exception as e:
+        await send_bot_log_message(f"Indexation initiale interrompue (reprise au prochain démarrage) : {e}", source="SEMANTIC-INDEX")
+
+async def save_semantic_index_periodically():
+    embedder = find_repository(IndexedRepository).embedder
+    while True:
+        await asyncio.sleep(SEMANTIC_INDEX_SAVE_SECONDS)
+        if not embedder.dirty: continue
+        embedder.dirty = False
+        try:
+            embedder.index.compact()
+            await asyncio.to_thread(VectorIndex.write_snapshot, embedder.index.snapshot(), SEMANTIC_INDEX_PATH)
+        except Exception as e:
+            embedder.dirty = True
+            await send_bot_log_message(f"Sauvegarde de l'index sémantique échouée : {e}", source="SEMANTIC-INDEX")
+
+async def reload_semantic_index_periodically():
+    """Relit l'index sauvegardé par le processus d'ingestion quand il a changé."""
+    indexed = find_repository(IndexedRepository)
+    meta_path = os.path.join(SEMANTIC_INDEX_PATH, "meta.json")
+    loaded_mtime = os.path.getmtime(meta_path) if os.path.exists(meta_path) else None
+    while True:
+        await asyncio.sleep(SEMANTIC_INDEX_SAVE_SECONDS)
+        mtime = os.path.getmtime(meta_path) if os.path.exists(meta_path) else None
+        if mtime is None or mtime == loaded_mtime: continue
+        try:
+            index = await asyncio.to_thread(VectorIndex.load, SEMANTIC_INDEX_PATH)
+        except Exception:
+            continue  # Sauvegarde en cours d'écriture : nouvel essai au prochain tour.
+        indexed.embedder.index = semantic_search.index = index
+        loaded_mtime = mtime
+
+def find_repository(kind):
+    """Enveloppe `kind` dans la chaîne cosmos_repo -> .primary (réplique, index sémantique...), ou None."""
+    repository = cosmos_repo
+    while repository is not None and not isinstance(repository, kind):
+        repository = getattr(repository, "primary", None)
+    return repository
+
+def register_metric_gauges():
+    for step in startup.steps:
+        metrics.gauge("startup_step_seconds", lambda step=step: startup.steps[step].ready_after or 0.0, "Délai de chaque étape de démarrage depuis le lancement (0 tant qu'elle tourne)", step=step)
+    cosmos_direct = find_repository(CosmosRepository)
+    if cosmos_direct:
+        metrics.gauge("cosmos_container_reconnects", lambda: cosmos_direct.container_reconnects, "Reconnexions après un conteneur Cosmos introuvable (404)")
+    metrics.gauge("ask_queue_active", lambda: ask_queue.active, "!ask en cours de traitement")
+    metrics.gauge("ask_queue_waiting", lambda: ask_queue.waiting, "!ask en attente dans la file")
+    metrics.gauge("ask_coalesced", lambda: ask_coalescer.stats["shared"], "Étapes de !ask partagées avec une demande identique")
+    metrics.gauge("log_records_dropped", lambda: log_sink.stats["dropped"], "Logs Discord abandonnés sous surcharge")
+    metrics.gauge("summary_chunk_cache_hit_ratio", lambda: summary_chunk_cache.hits / max(1, summary_chunk_cache.hits + summary_chunk_cache.misses), "Taux de succès du cache des lots résumés")
+    if sql_generation_cache:
+        metrics.gauge("sql_cache_hit_ratio", lambda: sql_generation_cache.hit_rate, "Taux de succès du cache de génération SQL")
+    if result_cache:
+        for outcome in ("hits", "misses", "invalidated", "evicted"):
+            metrics.gauge("result_cache_lookups", lambda outcome=outcome: result_cache.stats[outcome], "Consultations du cache des résultats !ask", outcome=outcome)
+        metrics.gauge("result_cache_bytes", lambda: result_cache.bytes, "Taille estimée du cache des résultats !ask")
+    if ask_sessions:
+        metrics.gauge("ask_sessions_active", lambda: ask_sessions.active, "Sessions !ask gardées pour les questions de suivi")
+        metrics.gauge("ask_sessions_bytes", lambda: ask_sessions.bytes, "Taille estimée des sessions !ask")
+    if cosmos_repo:
+        metrics.gauge("cosmos_client_request_units", lambda: cosmos_repo.total_request_charge, "RU relevées par le client Cosmos depuis le démarrage")
+    replicated = find_repository(ReplicatedRepository)
+    if replicated:
+        for route in ("local", "fallback", "unsupported", "errors"):
+            metrics.gauge("local_replica_queries", lambda route=route: replicated.stats[route], "Requêtes !ask par chemin de la réplique locale", route=route)
+    rollup_repo = find_repository(RollupRepository)
+    if rollup_repo:
+        for route in ("answered", "unsupported", "not_ready", "errors"):
+            metrics.gauge("rollup_queries", lambda route=route: rollup_repo.stats[route], "Requêtes d'agrégat par chemin des rollups", route=route)
+    indexed = find_repository(IndexedRepository)
+    if indexed:
+        metrics.gauge("semantic_index_vectors", lambda: len(indexed.embedder.index), "Messages dans l'index sémantique")
+        metrics.gauge("semantic_embedded_messages", lambda: indexed.embedder.stats.embedded, "Messages plongés depuis le démarrage")
+
+register_metric_gauges()
+
+async def start_metrics_http_server():
+    try:
+        await metrics.start_http_server(METRICS_HTTP_HOST, METRICS_HTTP_PORT)
+        await send_bot_log_message(f"Métriques exposées sur http://{METRICS_HTTP_HOST}:{METRICS_HTTP_PORT}/metrics", source="METRICS")
+    except OSError as e:
+        await send_bot_log_message(f"AVERTISSEMENT: Serveur /metrics indisponible sur le port {METRICS_HTTP_PORT} : {e}", source="METRICS")
+
+async def bot_setup_hook():
+    log_sink.start()
+    if METRICS_HTTP_PORT: await start_metrics_http_server()
+    # Connexions Cosmos et Azure OpenAI en tâche de fond : la connexion à Discord ne les attend pas.
+    if cosmos_repo: startup.start("cosmos", init_cosmos_repository)
+    if IS_AZURE_OPENAI_CONFIGURED: startup.start("openai", init_azure_openai)
+    if not INGEST_ENABLED:
+        # Processus des commandes : réplique, rollups et index sont écrits par le processus d'ingestion.
+        if find_repository(IndexedRepository): bot.loop.create_task(reload_semantic_index_periodically())
+        return
+    bot.loop.create_task(start_local_indexes())
+
+async def start_local_indexes():
+    """Index locaux (sémantique, réplique, rollups) : copies initiales lancées une fois Cosmos connecté."""
+    await startup.wait("cosmos")
+    indexed = find_repository(IndexedRepository)
+    if indexed:
+        if isinstance(indexed.embedder.provider, AzureOpenAIEmbeddingProvider): await startup.wait("openai")
+        indexed.embedder.start()
+        bot.loop.create_task(save_semantic_index_periodically())
+        if SEMANTIC_INDEX_BOOTSTRAP and is_cosmos_ready():
+            bot.loop.create_task(bootstrap_semantic_index())
+    local_replica_repo = find_repository(ReplicatedRepository)
+    if local_replica_repo and local_replica_repo.is_connected and not local_replica_repo.replica.ready:
+        bot.loop.create_task(bootstrap_local_replica(local_replica_repo))
+    rollup_repo = find_repository(RollupRepository)
+    if rollup_repo and rollup_repo.is_connected and not rollup_repo.store.ready:
+        bot.loop.create_task(bootstrap_rollups(rollup_repo))
+
+bot.setup_hook = bot_setup_hook
 print("DEBUG: Cosmos DB init complete.")
 
-def format_message_to_json(message: discord.Message):
-    return {
-        "id": str(message.id), "message_id_int": message.id,
-        "channel_id": str(message.channel.id),
-        "guild_id": str(message.guild.id) if message.guild else None,
-        "author_id": str(message.author.id), "author_name": message.author.name, 
-        "author_discriminator": message.author.discriminator,
-        "author_display_name": message.author.display_name, "author_bot": message.author.bot,
-        "content": message.content, "timestamp_iso": message.created_at.isoformat() + "Z",
-        "timestamp_unix": int(message.created_at.timestamp()),
-        "attachments": [{"id": str(att.id), "filename": att.filename, "url": att.url, "content_type": att.content_type, "size": att.size} for att in message.attachments],
-        "attachments_count": len(message.attachments),
-        "embeds": [embed.to_dict() for embed in message.embeds],
-        "reactions": [{"emoji": str(reaction.emoji), "count": reaction.count} for reaction in message.reactions],
-        "reactions_count": sum(reaction.count for reaction in message.reactions),
-        "edited_timestamp_iso": message.edited_at.isoformat() + "Z" if message.edited_at else None,
-    }
-
-async def main_message_fetch_logic():
+live_ingestion_buffer = None
+live_ingested_channel_ids = set() # Canaux dont le point de départ du rattrapage est fixé
+sync_channel_ids = set() # Canaux résolus lors de la dernière passe (IDs explicites + serveurs - exclusions)
+
+def resolve_sync_channel_ids() -> set[int]:
+    channel_ids = set(SYNC_CHANNEL_IDS)
+    for guild_id in SYNC_GUILD_IDS:
+        guild = bot.get_guild(guild_id)
+        if not guild: continue
+        for channel in guild.text_channels:
+            if channel.permissions_for(guild.me).read_message_history: channel_ids.add(channel.id)
+    return channel_ids - SYNC_CHANNEL_DENYLIST
+
+async def resolve_reaction_update(channel_id, message_id):
+    message = discord.utils.get(bot.cached_messages, id=int(message_id))
+    if message is None:
+        channel = bot.get_channel(int(channel_id))
+        if channel is None: return None
+        try: message = await channel.fetch_message(int(message_id))
+        except (discord.NotFound, discord.Forbidden): return None
+    return format_message_to_json(message)
+
+# Canaux dont le flux temps réel prolonge sans trou la dernière passe de rattrapage : leurs écritures
+# peuvent alors avancer le point de reprise. Un RESUME de la gateway rejoue les événements manqués,
+# une nouvelle session (on_ready) non.
+live_checkpoint_channel_ids = set()
+live_checkpoint_channel_ids_before_disconnect = set()
+
+@bot.listen('on_disconnect')
+async def pause_live_checkpoint():
+    global live_checkpoint_channel_ids, live_checkpoint_channel_ids_before_disconnect
+    live_checkpoint_channel_ids_before_disconnect |= live_checkpoint_channel_ids
+    live_checkpoint_channel_ids = set()
+
+@bot.listen('on_resumed')
+async def resume_live_checkpoint():
+    global live_checkpoint_channel_ids, live_checkpoint_channel_ids_before_disconnect
+    live_checkpoint_channel_ids, live_checkpoint_channel_ids_before_disconnect = live_checkpoint_channel_ids_before_disconnect, set()
+
+@bot.listen('on_ready')
+async def reset_live_checkpoint():
+    global live_checkpoint_channel_ids, live_checkpoint_channel_ids_before_disconnect
+    live_checkpoint_channel_ids, live_checkpoint_channel_ids_before_disconnect = set(), set()
+
+async def save_ingestion_checkpoint(doc, log_source):
+    channel_scheduler.record_synced(int(doc["channel_id"]), doc["timestamp_unix"])
+    if not checkpoint_store: return
+    try: await checkpoint_store.save(doc["channel_id"], doc["id"], doc["timestamp_unix"])
+    except Exception as e:
+        await send_bot_log_message(f"AVERTISSEMENT: Sauvegarde du point de reprise échouée (msg {doc['id']}): {e}", source=log_source)
+
+async def log_live_flush(written_docs, operations_count, failed_count):
+    metrics.counter("ingested_messages_total", "Messages écrits dans Cosmos", path="live").inc(len(written_docs))
+    metrics.counter("ingest_failures_total", "Messages dont l'écriture a échoué", path="live").inc(failed_count)
+    await send_bot_log_message(f"Vidage tampon temps réel: {operations_count} opérations, {len(written_docs)} messages écrits, {failed_count} échecs.", source="LIVE-INGEST")
+    # Une opération en échec sera rejouée : le point de reprise de son canal attend qu'elle aboutisse.
+    blocked_channels = live_ingestion_buffer.blocked_channels() if live_ingestion_buffer else set()
+    newest_by_channel = {}
+    for doc in written_docs:
+        current = newest_by_channel.get(doc["channel_id"])
+        if current is None or int(doc["id"]) > int(current["id"]): newest_by_channel[doc["channel_id"]] = doc
+    for channel_id_str, doc in newest_by_channel.items():
+        if int(channel_id_str) in live_checkpoint_channel_ids and str(channel_id_str) not in blocked_channels:
+            await save_ingestion_checkpoint(doc, "LIVE-INGEST")
+
+async def log_live_error(message_id, e):
+    await send_bot_log_message(f"ERREUR écriture temps réel (msg {message_id}): {e}", source="LIVE-INGEST")
+
+def start_live_ingestion():
+    global live_ingestion_buffer
+    if not LIVE_INGESTION_ENABLED or not is_cosmos_ready(): return False
+    if live_ingestion_buffer is None:
+        live_ingestion_buffer = LiveIngestionBuffer(
+            cosmos_repo, flush_interval=LIVE_FLUSH_SECONDS, max_pending=LIVE_FLUSH_MAX_MESSAGES,
+            resolve_dirty=resolve_reaction_update, on_flush=log_live_flush, on_error=log_live_error,
+        )
+    live_ingestion_buffer.start()
+    return True
+
+def is_live_ingested_channel(channel_id) -> bool:
+    return live_ingestion_buffer is not None and channel_id in live_ingested_channel_ids
+
+@bot.listen('on_message')
+async def live_ingest_message(message):
+    if message.channel.id not in sync_channel_ids: return
+    live = is_live_ingested_channel(message.channel.id)
+    if live: live_ingestion_buffer.stage_upsert(format_message_to_json(message))
+    channel_scheduler.record_activity(message.channel.id, message.id, synced=live)
+
+@bot.listen('on_raw_message_edit')
+async def live_ingest_edit(payload):
+    if is_live_ingested_channel(payload.channel_id):
+        live_ingestion_buffer.stage_upsert(format_message_to_json(payload.message))
+
+@bot.listen('on_raw_message_delete')
+async def live_ingest_delete(payload):
+    if is_live_ingested_channel(payload.channel_id):
+        live_ingestion_buffer.stage_delete(payload.channel_id, payload.message_id)
+
+@bot.listen('on_raw_reaction_add')
+async def live_ingest_reaction_add(payload):
+    if is_live_ingested_channel(payload.channel_id):
+        live_ingestion_buffer.mark_dirty(payload.channel_id, payload.message_id)
+
+@bot.listen('on_raw_reaction_remove')
+async def live_ingest_reaction_remove(payload):
+    if is_live_ingested_channel(payload.channel_id):
+        live_ingestion_buffer.mark_dirty(payload.channel_id, payload.message_id)
+
+async def main_message_fetch_logic(channel_id: int):
     log_source = "AUTO-FETCH"
-    if not container_client: await send_bot_log_message("ERREUR: Client Cosmos DB non initialisé.", source=log_source); return
-    if not TARGET_CHANNEL_ID: await send_bot_log_message("ERREUR: TARGET_CHANNEL_ID non configuré.", source=log_source); return
+    if not is_cosmos_ready(): await send_bot_log_message("ERREUR: Client Cosmos DB non initialisé.", source=log_source); return
 
-    await send_bot_log_message(f"Démarrage tâche pour canal ID: {TARGET_CHANNEL_ID}.", source=log_source)
+    await send_bot_log_message(f"Démarrage tâche pour canal ID: {channel_id}.", source=log_source)
     try:
-        channel_to_fetch = bot.get_channel(TARGET_CHANNEL_ID) or await bot.fetch_channel(TARGET_CHANNEL_ID)
+        channel_to_fetch = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
     except (discord.NotFound, discord.Forbidden) as e:
-        await send_bot_log_message(f"ERREUR canal {TARGET_CHANNEL_ID}: {e}", source=log_source); return
+        await send_bot_log_message(f"ERREUR canal {channel_id}: {e}", source=log_source); raise
     except Exception as e:
-        await send_bot_log_message(f"ERREUR récup canal {TARGET_CHANNEL_ID}:\n{traceback.format_exc()}", source=log_source); return
+        await send_bot_log_message(f"ERREUR récup canal {channel_id}:\n{traceback.format_exc()}", source=log_source); raise
 
-    after_date = None
-    try:
-        query = f"SELECT VALUE MAX(c.timestamp_unix) FROM c WHERE c.channel_id = '{str(TARGET_CHANNEL_ID)}'"
-        results = list(container_client.query_items(query=query, enable_cross_partition_query=True))
-        if results and results[0] is not None:
-            after_date = datetime.datetime.fromtimestamp(results[0] + 0.001, tz=datetime.timezone.utc)
-    except Exception as e:
-        await send_bot_log_message(f"AVERTISSEMENT: Récup MAX timestamp échouée: {e}. Utilisation période défaut.", source=log_source)
-    
-    if not after_date: 
-        after_date = discord.utils.utcnow() - datetime.timedelta(days=14)
-        await send_bot_log_message(f"Récupération depuis {after_date.isoformat()} (défaut).", source=log_source)
+    history_after = None
+    checkpoint = None
+    if checkpoint_store:
+        try: checkpoint = await checkpoint_store.load(channel_id)
+        except Exception as e:
+            await send_bot_log_message(f"AVERTISSEMENT: Lecture du point de reprise échouée: {e}.", source=log_source)
+
+    if checkpoint:
+        history_after = discord.Object(id=int(checkpoint.last_message_id))
+        checkpoint_date = datetime.datetime.fromtimestamp(checkpoint.last_timestamp_unix, tz=datetime.timezone.utc)
+        await send_bot_log_message(f"Point de reprise '{channel_to_fetch.name}': msg {checkpoint.last_message_id} ({checkpoint_date.isoformat()}). Récupération après.", source=log_source)
     else:
-        await send_bot_log_message(f"Dernier msg stocké: {after_date.isoformat()}. Récupération après.", source=log_source)
+        # Pas encore de point de reprise (premier démarrage ou fichier d'état perdu) : calcul MAX() une seule fois.
+        try:
+            # L'id Discord croît avec la date : il sert de repère dans les deux schémas de message.
+            query = f"SELECT VALUE MAX(c.message_id_int) FROM c WHERE c.channel_id = '{str(channel_id)}'"
+            max_message_id = await cosmos_repo.query_value(query)
+            if max_message_id is not None:
+                history_after = discord.Object(id=int(max_message_id))
+        except Exception as e:
+            await send_bot_log_message(f"AVERTISSEMENT: Récup MAX message échouée: {e}. Utilisation période défaut.", source=log_source)
+
+        if not history_after:
+            history_after = discord.utils.utcnow() - datetime.timedelta(days=14)
+            await send_bot_log_message(f"Récupération '{channel_to_fetch.name}' depuis {history_after.isoformat()} (défaut).", source=log_source)
+        else:
+            await send_bot_log_message(f"Dernier msg stocké '{channel_to_fetch.name}': {history_after.id} ({history_after.created_at.isoformat()}). Récupération après.", source=log_source)
+
+    # Le point de départ du rattrapage est fixé : l'ingestion temps réel peut démarrer sans masquer le trou.
+    if start_live_ingestion() and channel_id not in live_ingested_channel_ids:
+        live_ingested_channel_ids.add(channel_id)
+        await send_bot_log_message(f"Ingestion temps réel active pour '{channel_to_fetch.name}' (vidage toutes les {LIVE_FLUSH_SECONDS}s ou {LIVE_FLUSH_MAX_MESSAGES} messages).", source="LIVE-INGEST")
 
-    fetched_in_pass = 0
+    async def log_progress(stats):
+        await send_bot_log_message(f"Progression '{channel_to_fetch.name}': {stats.written} messages traités ({stats.messages_per_second:.1f} msg/s)...", source=log_source)
+
+    async def log_write_error(doc, e_upsert):
+        await send_bot_log_message(f"ERREUR upsert msg {doc['id']}: {e_upsert}", source=log_source)
+
+    async def on_checkpoint(doc):
+        await save_ingestion_checkpoint(doc, log_source)
+
+    pipeline = BackfillPipeline(
+        cosmos_repo, format_message_to_json,
+        format_workers=INGEST_FORMAT_WORKERS, max_in_flight=INGEST_MAX_IN_FLIGHT,
+        ru_per_second=INGEST_RU_PER_SECOND, on_progress=log_progress, on_write_error=log_write_error,
+        on_checkpoint=on_checkpoint,
+    )
     try:
-        async for message in channel_to_fetch.history(limit=None, after=after_date, oldest_first=True):
-            fetched_in_pass +=1
-            message_json = format_message_to_json(message)
-            try: container_client.upsert_item(body=message_json)
-            except Exception as e_upsert:
-                 await send_bot_log_message(f"ERREUR upsert msg {message_json['id']}: {e_upsert}", source=log_source) 
-            if fetched_in_pass > 0 and fetched_in_pass % 500 == 0: 
-                await send_bot_log_message(f"Progression: {fetched_in_pass} messages traités...", source=log_source)
-        await send_bot_log_message(f"Récupération terminée pour '{channel_to_fetch.name}'. {fetched_in_pass} messages traités.", source=log_source)
+        stats = await pipeline.run(channel_to_fetch.history(limit=None, after=history_after, oldest_first=True))
+        metrics.histogram("channel_sync_seconds", "Durée d'une passe de rattrapage d'un canal").observe(stats.elapsed_seconds)
+        metrics.counter("ingested_messages_total", "Messages écrits dans Cosmos", path="backfill").inc(stats.written)
+        metrics.counter("ingest_failures_total", "Messages dont l'écriture a échoué", path="backfill").inc(stats.failed)
+        metrics.counter("cosmos_request_units_total", "RU Cosmos consommées", operation="ingest").inc(stats.request_charge)
+        # Écriture en échec : le temps réel ne doit pas avancer le point de reprise au-delà du message manquant.
+        if is_live_ingested_channel(channel_id) and not stats.checkpoint_blocked: live_checkpoint_channel_ids.add(channel_id)
+        elif stats.checkpoint_blocked: live_checkpoint_channel_ids.discard(channel_id)
+        await send_bot_log_message(
+            f"Récupération terminée pour '{channel_to_fetch.name}'. {stats.fetched} messages traités "
+            f"({stats.written} écrits, {stats.failed} en échec) en {stats.elapsed_seconds:.1f}s "
+            f"({stats.messages_per_second:.1f} msg/s, {stats.request_charge:.0f} RU).",
+            source=log_source)
+        return stats
     except Exception as e:
-        await send_bot_log_message(f"ERREUR MAJEURE fetch history:\n{traceback.format_exc()}", source=log_source)
-
+        await send_bot_log_message(f"ERREUR MAJEURE fetch history '{channel_to_fetch.name}':\n{traceback.format_exc()}", source=log_source)
+        raise
+
+channel_scheduler = ChannelSyncScheduler(main_message_fetch_logic, max_concurrent=SYNC_MAX_CONCURRENT_CHANNELS)
+
+async def run_channel_sync_pass():
+    global sync_channel_ids
+    sync_channel_ids = resolve_sync_channel_ids()
+    await refresh_channel_states(sync_channel_ids)
+    return await channel_scheduler.run_pass(sync_channel_ids)
+
+async def refresh_channel_states(channel_ids):
+    """Noms, dernier message connu et point de reprise de chaque canal dans le planificateur."""
+    checkpoints = {}
+    if checkpoint_store:
+        try: checkpoints = await checkpoint_store.load_all()
+        except Exception as e:
+            await send_bot_log_message(f"AVERTISSEMENT: Lecture des points de reprise échouée: {e}.", source="SCHEDULER")
+    for channel_id in channel_ids:
+        state = channel_scheduler.state_for(channel_id)
+        channel = bot.get_channel(channel_id)
+        if channel:
+            state.name, state.guild_name = channel.name, channel.guild.name if channel.guild else "?"
+            channel_scheduler.observe_latest_message(channel_id, getattr(channel, "last_message_id", None))
+        checkpoint = checkpoints.get(str(channel_id))
+        if checkpoint: channel_scheduler.record_synced(channel_id, checkpoint.last_timestamp_unix)
+
+# Avec l'ingestion temps réel, cette boucle ne sert plus qu'à combler les trous (redémarrage, panne).
 @tasks.loop(hours=12)
 async def scheduled_message_fetch():
     await send_bot_log_message("Démarrage tâche récupération planifiée.", source="SCHEDULER")
-    try: await main_message_fetch_logic()
+    try:
+        states = await run_channel_sync_pass()
+        failed = [s for s in states if s.last_error]
+        await send_bot_log_message(f"{len(states)} canal(aux) synchronisé(s), {len(failed)} en erreur.", source="SCHEDULER")
     except Exception as e: await send_bot_log_message(f"ERREUR non gérée scheduled_fetch:\n{traceback.format_exc()}", source="SCHEDULER")
     await send_bot_log_message("Tâche récupération planifiée terminée.", source="SCHEDULER")
 
 @scheduled_message_fetch.before_loop
 async def before_scheduled_fetch():
     await bot.wait_until_ready() 
+    await startup.wait("cosmos")
     valid_config = True
-    if not TARGET_CHANNEL_ID: await send_bot_log_message("ERREUR: TARGET_CHANNEL_ID non configuré.", source="SCHEDULER"); valid_config = False
-    if not container_client: await send_bot_log_message("ERREUR: Conteneur Cosmos DB non initialisé.", source="SCHEDULER"); valid_config = False
+    if not SYNC_CHANNEL_IDS and not SYNC_GUILD_IDS: await send_bot_log_message("ERREUR: Aucun canal à synchroniser (TARGET_CHANNEL_ID, TARGET_CHANNEL_IDS ou SYNC_GUILD_IDS).", source="SCHEDULER"); valid_config = False
+    if not is_cosmos_ready(): await send_bot_log_message("ERREUR: Conteneur Cosmos DB non initialisé.", source="SCHEDULER"); valid_config = False
     if not LOG_CHANNEL_ID_VAR: print("AVERTISSEMENT SCHEDULER: LOG_CHANNEL_ID non configuré (pour les messages stdout de cette tâche).") 
     
     if not valid_config: scheduled_message_fetch.cancel(); await send_bot_log_message("Tâche récupération annulée.", source="SCHEDULER")
@@ -477,14 +1103,280 @@ async def before_scheduled_fetch():
 
 @bot.event
 async def on_ready():
-    await send_bot_log_message(f"Bot {bot.user.name} (ID: {bot.user.id}) connecté et prêt.", source="CORE-BOT")
-    if not scheduled_message_fetch.is_running():
+    await startup.mark_ready("discord")
+    await send_bot_log_message(f"Bot {bot.user.name} (ID: {bot.user.id}) connecté et prêt (rôle {BOT_ROLE}).", source="CORE-BOT")
+    if INGEST_ENABLED and not scheduled_message_fetch.is_running():
          scheduled_message_fetch.start() 
          await send_bot_log_message("Tâche récupération planifiée initiée via on_ready.", source="SCHEDULER")
 
 @bot.command(name='ping')
 async def ping(ctx): await ctx.send(f'Pong! Latence: {round(bot.latency * 1000)}ms')
 
+def format_duration(seconds: float | None) -> str:
+    if seconds is None: return "inconnu"
+    if seconds < 60: return f"{seconds:.0f}s"
+    if seconds < 3600: return f"{seconds / 60:.0f}min"
+    if seconds < 86400: return f"{seconds / 3600:.1f}h"
+    return f"{seconds / 86400:.1f}j"
+
+@bot.command(name='synclag', help="Affiche le retard de synchronisation de chaque canal archivé.")
+async def synclag_command(ctx):
+    user_name_for_log = f"{ctx.author.name} (ID: {ctx.author.id})"
+    if ALLOWED_USER_IDS_LIST and ctx.author.id not in ALLOWED_USER_IDS_LIST:
+        await send_bot_log_message(f"Accès refusé à !synclag pour {user_name_for_log}.", source="SYNCLAG-CMD")
+        await ctx.send("Désolé, cette commande est actuellement restreinte."); return
+
+    if CHECKPOINT_BACKEND == "cosmos" and await reply_if_warming_up(ctx, "cosmos"): return
+    # Ingestion dans un autre processus : retard estimé depuis les points de reprise partagés.
+    if not INGEST_ENABLED: await refresh_channel_states(resolve_sync_channel_ids())
+    states = channel_scheduler.lag_report()
+    if not states:
+        await ctx.send("Aucune synchronisation n'a encore été planifiée."); return
+
+    lines = []
+    for state in states:
+        status = "⏳ en cours" if state.running else ("⚠️ erreur" if state.last_error else "✅")
+        live = " · temps réel" if is_live_ingested_channel(state.channel_id) else ""
+        last_pass = f"dernière passe {state.last_pass_messages} msgs en {format_duration(state.last_pass_duration)}" if state.last_pass_duration is not None else "jamais synchronisé"
+        lines.append(f"{status} **#{state.name}** ({state.guild_name}) — retard {format_duration(state.lag_seconds)}, {state.unsynced_events} msg(s) non synchronisé(s){live}\n  {last_pass}")
+    description = "\n".join(lines)
+    if len(description) > 4000: description = description[:3980] + "\n... (tronqué)"
+    embed = discord.Embed(title="🔄 Retard de synchronisation par canal", description=description, color=discord.Color.teal(), timestamp=discord.utils.utcnow())
+    embed.set_footer(text=f"{len(states)} canal(aux), {SYNC_MAX_CONCURRENT_CHANNELS} synchronisation(s) simultanée(s) max.")
+    await ctx.send(embed=embed)
+
+def format_latency(summary: dict) -> str:
+    if not summary["count"]: return "—"
+    return f"p50 {summary[0.5]:.2f}s · p95 {summary[0.95]:.2f}s ({summary['count']})"
+
+@bot.command(name='stats', help="Affiche les latences, coûts et taux de cache récents.")
+async def stats_command(ctx):
+    user_name_for_log = f"{ctx.author.name} (ID: {ctx.author.id})"
+    if ALLOWED_USER_IDS_LIST and ctx.author.id not in ALLOWED_USER_IDS_LIST:
+        await send_bot_log_message(f"Accès refusé à !stats pour {user_name_for_log}.", source="STATS-CMD")
+        await ctx.send("Désolé, cette commande est actuellement restreinte."); return
+
+    window = STATS_WINDOW_SECONDS
+    def latency(name, **labels):
+        return format_latency(metrics.histogram(name, **labels).summary(since_seconds=window))
+
+    embed = discord.Embed(title="📊 Statistiques du bot", color=discord.Color.purple(), timestamp=discord.utils.utcnow())
+    embed.add_field(name=f"⏱️ !ask (sur {format_duration(window)})", inline=False, value="\n".join([
+        f"Total : {latency('ask_seconds')}",
+        f"Attente en file : {latency('ask_queue_wait_seconds')}",
+        f"Génération SQL : {latency('ask_stage_seconds', stage='sql_generation')}",
+        f"Requête : {latency('ask_stage_seconds', stage='query')}",
+        f"Résumé : {latency('ask_stage_seconds', stage='summary')}",
+        f"Appels OpenAI SQL / résumé : {latency('openai_call_seconds', call='sql')} / {latency('openai_call_seconds', call='summary')}",
+    ]))
+    ready = f"prêt en {startup.time_to_ready:.1f}s" if startup.time_to_ready is not None else "en cours"
+    embed.add_field(name="🚀 Démarrage", inline=False, value=f"{ready} ({startup.report()})")
+    embed.add_field(name="💸 Coûts depuis le démarrage", inline=False, value="\n".join([
+        f"RU Cosmos : {metrics.total('cosmos_request_units_total', operation='ask'):,.0f} pour !ask, {metrics.total('cosmos_request_units_total', operation='ingest'):,.0f} pour l'ingestion",
+        f"Tokens OpenAI : {metrics.total('openai_tokens_total', call='sql'):,.0f} (SQL), {metrics.total('openai_tokens_total', call='summary'):,.0f} (résumés)",
+    ]))
+    sql_sources = {source: metrics.total('sql_generation_total', source=source) for source in ("local", "cache", "openai")}
+    cache_lines = [f"Requêtes SQL : {sql_sources['local']:.0f} locales, {sql_sources['cache']:.0f} en cache, {sql_sources['openai']:.0f} via l'IA",
+                   f"Lots de résumé en cache : {metrics.gauge('summary_chunk_cache_hit_ratio').read():.0%}",
+                   f"Étapes partagées entre demandes identiques : {ask_coalescer.stats['shared']}"]
+    if result_cache:
+        cache_lines.append(f"Résultats !ask en cache : {result_cache.stats['hits']}/{result_cache.stats['hits'] + result_cache.stats['misses']} "
+                           f"({result_cache.stats['summary_hits']} avec résumé), {result_cache.stats['saved_request_charge']:,.0f} RU évitées, "
+                           f"{result_cache.stats['invalidated']} invalidés par l'ingestion")
+    if ask_sessions:
+        cache_lines.append(f"Sessions !ask : {ask_sessions.active} active(s), {ask_sessions.stats['refinements']} affinage(s) sans Cosmos, "
+                           f"{ask_sessions.stats['saved_request_charge']:,.0f} RU et ~{ask_sessions.stats['tokens_avoided']:,} tokens évités")
+    replicated = find_repository(ReplicatedRepository)
+    if replicated:
+        served = replicated.stats["local"] + replicated.stats["fallback"] + replicated.stats["unsupported"]
+        cache_lines.append(f"Réplique locale : {replicated.stats['local']}/{served} requêtes servies sans Cosmos")
+    rollup_repo = find_repository(RollupRepository)
+    if rollup_repo:
+        asked = rollup_repo.stats["answered"] + rollup_repo.stats["unsupported"] + rollup_repo.stats["not_ready"]
+        cache_lines.append(f"Rollups : {rollup_repo.stats['answered']}/{asked} agrégats servis sans parcours des messages")
+    archive_repo = find_repository(ArchiveRepository)
+    if archive_repo:
+        asked = archive_repo.stats["answered"] + archive_repo.stats["unsupported"] + archive_repo.stats["too_recent"]
+        complete_until = archive_repo.archive.complete_until
+        cache_lines.append(f"Archive Parquet : {archive_repo.stats['answered']}/{asked} agrégats historiques servis sans RU"
+                           + (f" (complète jusqu'au {complete_until[:10]})" if complete_until else ""))
+    compact_repo = find_repository(CompactRepository)
+    if compact_repo:
+        cache_lines.append(f"Schéma compact : {compact_repo.stats['skipped']:,} réécritures évitées, {compact_repo.stats['bytes_saved'] / 1e6:,.1f} Mo économisés")
+    embed.add_field(name="🗄️ Caches", inline=False, value="\n".join(cache_lines))
+    embed.add_field(name="📥 Ingestion depuis le démarrage", inline=False, value="\n".join([
+        f"Messages écrits : {metrics.total('ingested_messages_total', path='backfill'):,.0f} en rattrapage, {metrics.total('ingested_messages_total', path='live'):,.0f} en temps réel",
+        f"Échecs : {metrics.total('ingest_failures_total'):,.0f}",
+        f"Passes de rattrapage : {latency('channel_sync_seconds')}",
+    ]))
+    embed.set_footer(text=f"Fenêtres de {METRICS_WINDOW} mesures par série{f' · /metrics sur le port {METRICS_HTTP_PORT}' if METRICS_HTTP_PORT else ''}")
+    await ctx.send(embed=embed)
+
+def ask_question_key(question: str, user_name: str) -> tuple:
+    """Deux !ask de même clé sont regroupés : même question normalisée, et même auteur si elle parle de lui."""
+    plain = normalize_question(question)
+    return (plain, user_name if SELF_REFERENCE_RE.search(plain) else None)
+
+def summary_key(items: list) -> tuple:
+    ids = ",".join(str(item.get("id")) if isinstance(item, dict) else repr(item) for item in items)
+    return ("summary", len(items), zlib.crc32(ids.encode("utf-8")))
+
+def remember_ask_session(ctx, question: str, items: list[dict], fetch: FetchResult, ai_summary: str | None):
+    """Résultat résumé gardé pour les questions de suivi de l'utilisateur dans ce canal (ask_sessions)."""
+    if ask_sessions and ai_summary:
+        ask_sessions.start((ctx.author.id, ctx.channel.id), question, items, fetch.request_charge,
+                           summary_key=summary_key(items), summary=ai_summary)
+
+async def fetch_for_ask(sql: str, user_name_for_log: str) -> FetchResult:
+    """fetch_results sous le plafond global de requêtes Cosmos, avec nouvel essai sur 429."""
+    async def attempt():
+        async with cosmos_query_limiter:
+            return await fetch_results(cosmos_repo, sql, max_items=MAX_MESSAGES_FOR_SUMMARY_CONFIG,
+                                       token_budget=ASK_RESULT_TOKEN_BUDGET, item_tokens=summary_prompt_builder.item_tokens,
+                                       page_size=ASK_RESULT_PAGE_SIZE)
+    return await call_with_backoff(attempt, max_attempts=RATE_LIMIT_MAX_ATTEMPTS, max_delay=RATE_LIMIT_MAX_DELAY_SECONDS,
+                                   on_retry=rate_limit_retry_logger("Cosmos DB (!ask)", user_name_for_log))
+
+async def retrieve_semantic_items(question: str, user_name_for_log: str):
+    """Messages les plus proches de la question par le sens, relus dans Cosmos et remis dans l'ordre chronologique."""
+    since, until = question_time_bounds(question, datetime.datetime.now(pytz.timezone('Europe/Paris')))
+    hits = await semantic_search.search(question, k=SEMANTIC_TOP_K, min_score=SEMANTIC_MIN_SCORE, since=since, until=until)
+    if not hits:
+        await send_bot_log_message(f"Recherche sémantique sans résultat au-dessus de {SEMANTIC_MIN_SCORE} pour '{question}'. Demandé par: {user_name_for_log}", source="ASK-CMD")
+        return FetchResult()
+    id_list = ", ".join(f'"{message_id}"' for message_id, _ in hits)
+    fetch = await fetch_for_ask(f"SELECT * FROM c WHERE c.id IN ({id_list})", user_name_for_log)
+    fetch.items.sort(key=lambda item: item.get("timestamp_iso", ""))
+    await send_bot_log_message(
+        f"Recherche sémantique : {len(hits)} voisin(s) (scores {hits[0][1]:.2f} à {hits[-1][1]:.2f}"
+        f"{', période filtrée' if since is not None else ''}), {len(fetch.items)} message(s) relus, {fetch.request_charge:.1f} RU, "
+        f"{fetch.elapsed_seconds:.2f}s. Demandé par: {user_name_for_log}", source="ASK-CMD")
+    return fetch
+
+async def stream_summary_to_channel(ctx, items: list[dict], question: str, user_name_for_log: str, cached_summary: str | None = None) -> str | None:
+    """Synthèse affichée au fil de l'eau dans un embed, prolongé sur plusieurs messages si besoin ; renvoie le résumé affiché."""
+    log_source = "ASK-CMD"
+
+    async def log_edit_error(e):
+        await send_bot_log_message(f"Erreur Discord pendant l'affichage progressif du résumé: {e}. Demandé par {user_name_for_log} Q: '{question}'", source=log_source)
+
+    writer = StreamingEmbedWriter(ctx.send, title=f"Résumé des messages trouvés ({len(items)} messages)",
+                                  footer=f"Requête : \"{question}\"", min_edit_interval=SUMMARY_STREAM_EDIT_INTERVAL,
+                                  on_error=log_edit_error)
+    if cached_summary:
+        ai_summary = cached_summary
+    else:
+        ai_summary, _ = await ask_coalescer.run(summary_key(items), lambda emit: get_ai_summary(items, user_name_for_log, on_delta=emit),
+                                                on_delta=writer.append)
+    if ai_summary:
+        shown = await writer.finish(final_text=ai_summary)
+    else:
+        shown = await writer.finish(suffix="\n\n*(Résumé interrompu.)*") if writer.text.strip() else False
+    if not shown:
+        await ctx.send("Désolé, je n'ai pas réussi à générer de résumé pour ces messages."); return None
+    first_visible = f"{writer.first_visible_seconds:.2f}s" if writer.first_visible_seconds is not None else "?"
+    await send_bot_log_message(
+        f"Synthèse diffusée pour {len(items)} messages : premier texte visible après {first_visible}, "
+        f"{len(writer.messages)} message(s), {writer.edits} édition(s){', résumé en cache' if cached_summary else ''}. Demandé par: {user_name_for_log} Q: '{question}'",
+        source=log_source)
+    return ai_summary
+
+
+async def send_summary_embed(ctx, items: list[dict], question: str, ai_summary: str | None, user_name_for_log: str):
+    """Résumé complet dans un embed (SUMMARY_STREAMING_ENABLED=0), en texte brut si Discord le refuse."""
+    log_source = "ASK-CMD"
+    if ai_summary:
+        MAX_EMBED_DESC_LENGTH = 4000 
+        MAX_FALLBACK_MSG_LENGTH = 1900 
+        TRUNCATION_SUFFIX = "\n... (Résumé tronqué)"
+        TRUNCATION_MARGIN = len(TRUNCATION_SUFFIX) + 5 
+
+        truncated_summary_for_embed = ai_summary
+        if len(ai_summary) > MAX_EMBED_DESC_LENGTH:
+            truncated_summary_for_embed = ai_summary[:MAX_EMBED_DESC_LENGTH - TRUNCATION_MARGIN] + TRUNCATION_SUFFIX
+            await send_bot_log_message(f"Résumé IA tronqué pour l'embed (original: {len(ai_summary)}, tronqué: {len(truncated_summary_for_embed)}). Demandé par {user_name_for_log} Q: '{question}'", source=log_source)
+
+        embed = discord.Embed(
+            title=f"Résumé des messages trouvés ({len(items)} messages)",
+            description=truncated_summary_for_embed, 
+            color=discord.Color.blue(), 
+            timestamp=discord.utils.utcnow()
+        )
+        embed.set_footer(text=f"Requête : \"{question}\"")
+        
+        try:
+            await ctx.send(embed=embed)
+        except discord.HTTPException as e_embed_send: 
+            await send_bot_log_message(f"Erreur lors de l'envoi de l'embed (sera tenté en message normal): {e_embed_send}. Demandé par {user_name_for_log} Q: '{question}'", source=log_source)
+            
+            fallback_message_header = f"**Résumé ({len(items)} msgs):**\n"
+            fallback_message_footer = f"\n*(Le résumé était trop long pour un embed. Version texte ci-dessus.)*" 
+            
+            remaining_space_for_summary = MAX_FALLBACK_MSG_LENGTH - len(fallback_message_header) - len(fallback_message_footer)
+            
+            truncated_summary_for_fallback = ai_summary
+            if len(ai_summary) > remaining_space_for_summary:
+                truncated_summary_for_fallback = ai_summary[:remaining_space_for_summary - TRUNCATION_MARGIN] + TRUNCATION_SUFFIX
+                await send_bot_log_message(f"Résumé IA tronqué pour le message de fallback (original: {len(ai_summary)}, tronqué: {len(truncated_summary_for_fallback)}). Demandé par {user_name_for_log} Q: '{question}'", source=log_source)
+            else:
+                truncated_summary_for_fallback = ai_summary
+
+            try:
+                await ctx.send(f"{fallback_message_header}{truncated_summary_for_fallback}{fallback_message_footer}")
+            except discord.HTTPException as e_fallback_send:
+                await send_bot_log_message(f"Erreur lors de l'envoi du message de fallback: {e_fallback_send}. Demandé par {user_name_for_log} Q: '{question}'. Le résumé était trop long.", source=log_source)
+                await ctx.send("Désolé, le résumé généré est trop long pour être affiché, même après avoir essayé de le raccourcir.")
+        
+        log_msg_succ = (f"Synthèse réussie pour {len(items)} messages. Demandé par: {user_name_for_log} Q: '{question}'. "
+                        f"Résumé basé sur {min(len(items), MAX_MESSAGES_FOR_SUMMARY_CONFIG)} messages.")
+        await send_bot_log_message(log_msg_succ, source=log_source)
+    else: 
+        await ctx.send("Désolé, je n'ai pas réussi à générer de résumé pour ces messages.")
+        # Le log d'erreur de get_ai_summary (si OpenAI a échoué) aura déjà été envoyé avec send_to_discord_channel=True
+
+
+async def answer_refinement(ctx, session, refinement, question: str, user_name_for_log: str):
+    """Question de suivi servie depuis la session : filtre local, synthèse du seul sous-ensemble retenu."""
+    log_source = "ASK-CMD-SESSION"
+    base = session.items if refinement.instead else session.current
+    try:
+        started = time.perf_counter()
+        items = apply_refinement(base, refinement, datetime.datetime.now(pytz.timezone('Europe/Paris')))
+        filter_ms = (time.perf_counter() - started) * 1000
+        if not items:
+            await ctx.send(f"Aucun des {len(base)} messages du résultat précédent ne correspond ({refinement.describe()}). Pose une nouvelle question pour chercher ailleurs.")
+            await send_bot_log_message(f"Affinage sans résultat ({refinement.describe()}) sur {len(base)} messages. Demandé par: {user_name_for_log} Q: '{question}'", source=log_source); return
+
+        key = summary_key(items)
+        cached_summary = session.summary_for(key)
+        base_tokens = sum(summary_prompt_builder.item_tokens(item) for item in base)
+        sent_tokens = 0 if cached_summary else sum(summary_prompt_builder.item_tokens(item) for item in items)
+        await ctx.send(f"J'ai retenu {len(items)} message(s) sur {len(base)} du résultat précédent ({refinement.describe()}), sans nouvelle recherche. Génération du résumé...")
+        with metrics.histogram("ask_stage_seconds", "Durée des étapes de !ask", stage="summary").time():
+            if SUMMARY_STREAMING_ENABLED:
+                ai_summary = await stream_summary_to_channel(ctx, items, question, user_name_for_log, cached_summary=cached_summary)
+            elif cached_summary:
+                ai_summary = cached_summary
+            else:
+                ai_summary, _ = await ask_coalescer.run(key, lambda emit: get_ai_summary(items, user_name_for_log))
+        if not SUMMARY_STREAMING_ENABLED:
+            await send_summary_embed(ctx, items, question, ai_summary, user_name_for_log)
+        if not ai_summary: return
+
+        session.remember_summary(key, ai_summary)
+        session.current = items
+        ask_sessions.record_refinement(session, sent_tokens, base_tokens, reused=cached_summary is not None)
+        metrics.counter("ask_answers_total", "Réponses de !ask, par chemin", path="refinement").inc()
+        summary_cost = "résumé déjà calculé" if cached_summary else f"~{sent_tokens} tokens de messages à la synthèse"
+        await send_bot_log_message(
+            f"Affinage local ({refinement.describe()}) : {len(items)}/{len(base)} messages en {filter_ms:.0f} ms, SQL et Cosmos évités "
+            f"(~{session.request_charge:.1f} RU), {summary_cost} au lieu de ~{base_tokens}. Session : {session.report()}. "
+            f"Demandé par: {user_name_for_log} Q: '{question}'", source=log_source)
+    except Exception as e:
+        await ctx.send("Une erreur inattendue s'est produite.")
+        await send_bot_log_message(f"Erreur inattendue pendant l'affinage ({refinement.describe()}): {e}\nDemandé par: {user_name_for_log} Q: '{question}'\n{traceback.format_exc()}", source=log_source, send_to_discord_channel=True)
+
+
 @bot.command(name='ask', help="Pose une question sur l'historique des messages.")
 async def ask_command(ctx, *, question: str):
     log_source = "ASK-CMD" 
@@ -495,89 +1387,158 @@ async def ask_command(ctx, *, question: str):
     if ALLOWED_USER_IDS_LIST and ctx.author.id not in ALLOWED_USER_IDS_LIST:
         await send_bot_log_message(f"Accès refusé à !ask pour {user_name_for_log}. Question: '{question}'", source=log_source)
         await ctx.send("Désolé, cette commande est actuellement restreinte."); return
+    # Question de suivi ("et seulement ceux de Fly ?") : servie depuis le résultat précédent, sans Cosmos.
+    session_key = (ctx.author.id, ctx.channel.id)
+    session = ask_sessions.get(session_key) if ask_sessions else None
+    refinement = parse_refinement(question) if session else None
+    if await reply_if_warming_up(ctx, *(("openai",) if refinement else ("cosmos", "openai"))): return
+
+    wait_seconds = ask_rate_limiter.check(ctx.author.id)
+    if wait_seconds:
+        metrics.counter("ask_requests_total", "Commandes !ask reçues, par décision d'admission", admission="rate_limited").inc()
+        await ctx.send(f"Doucement ! Tu pourras reposer une question dans {int(wait_seconds) + 1}s.")
+        await send_bot_log_message(f"!ask de {user_name_for_log} refusé par la limite par utilisateur ({ASK_USER_RATE_PER_MINUTE:g}/min). Q: '{question}'", source=log_source); return
     
-    await ctx.send(f"Recherche en cours pour : \"{question}\" ... Veuillez patienter.")
+    if not refinement: await ctx.send(f"Recherche en cours pour : \"{question}\" ... Veuillez patienter.")
 
     if not IS_AZURE_OPENAI_CONFIGURED or not azure_openai_client:
         await ctx.send("Désolé, le module d'intelligence artificielle n'est pas correctement configuré.")
         await send_bot_log_message(f"Cmd !ask par {user_name_for_log} échouée : Azure OpenAI non configuré. Q: '{question}'", source=log_source, send_to_discord_channel=True, is_openai_filter_log=True); return
-    if not container_client:
+    if refinement:
+        metrics.counter("ask_requests_total", "Commandes !ask reçues, par décision d'admission", admission="refinement").inc()
+        with metrics.histogram("ask_seconds", "Durée d'un !ask hors file d'attente").time():
+            await answer_refinement(ctx, session, refinement, question, user_name_for_log)
+        return
+    if ask_sessions: ask_sessions.forget(session_key)  # Nouvelle question : le résultat précédent ne sera plus affiné.
+    if not is_cosmos_ready():
         await ctx.send("Désolé, la connexion à la base de données n'est pas active.")
         # Note: is_openai_filter_log=False car ce n'est pas un filtre OpenAI
         await send_bot_log_message(f"Cmd !ask par {user_name_for_log} échouée : Client Cosmos DB non initialisé. Q: '{question}'", source=log_source, send_to_discord_channel=True, is_openai_filter_log=False); return 
 
-    generated_sql_query = await get_ai_analysis(question, user_name_for_log) 
+    question_key = ask_question_key(question, ctx.author.name)
+    position_message = None
+
+    async def show_queue_position(position):
+        nonlocal position_message
+        text = f"File d'attente : {position} demande(s) avant la tienne." if position > 1 else "File d'attente : tu es le prochain."
+        try:
+            if position_message is None: position_message = await ctx.send(text)
+            else: await position_message.edit(content=text)
+        except discord.HTTPException: pass
+
+    # Une question identique déjà en cours ne reprend pas de place dans la file : elle partage ses résultats.
+    duplicate = asks_in_flight[question_key] > 0
+    asks_in_flight[question_key] += 1
+    metrics.counter("ask_requests_total", "Commandes !ask reçues, par décision d'admission", admission="duplicate" if duplicate else "queued").inc()
+    try:
+        if duplicate:
+            await send_bot_log_message(f"Question identique déjà en cours : résultats partagés. Demandé par: {user_name_for_log} Q: '{question}'", source=log_source)
+            with metrics.histogram("ask_seconds", "Durée d'un !ask hors file d'attente").time():
+                await answer_question(ctx, question, question_key, user_name_for_log)
+        else:
+            queued_at = datetime.datetime.now()
+            async with ask_queue.slot(show_queue_position) as slot:
+                queue_wait_seconds = (datetime.datetime.now() - queued_at).total_seconds()
+                metrics.histogram("ask_queue_wait_seconds", "Attente dans la file de !ask").observe(queue_wait_seconds)
+                if slot.entry_position:
+                    await send_bot_log_message(f"!ask de {user_name_for_log} entré en file en position {slot.entry_position}, servi après {queue_wait_seconds:.1f}s.", source=log_source)
+                with metrics.histogram("ask_seconds", "Durée d'un !ask hors file d'attente").time():
+                    await answer_question(ctx, question, question_key, user_name_for_log)
+    finally:
+        asks_in_flight[question_key] -= 1
+        if not asks_in_flight[question_key]: del asks_in_flight[question_key]
+
+async def answer_question(ctx, question: str, question_key: tuple, user_name_for_log: str):
+    log_source = "ASK-CMD"
+
+    # "~question" : recherche par le sens, sans génération SQL.
+    semantic_mode = question.startswith("~")
+    if semantic_mode:
+        question = question[1:].strip()
+        if not semantic_search:
+            semantic_mode = False
+            await ctx.send("La recherche sémantique n'est pas activée : recherche classique.")
+
+    generated_sql_query = None
+    if not semantic_mode:
+        with metrics.histogram("ask_stage_seconds", "Durée des étapes de !ask", stage="sql_generation").time():
+            generated_sql_query, _ = await ask_coalescer.run(("sql", question_key), lambda emit: get_ai_analysis(question, user_name_for_log))
     
-    if not generated_sql_query: await ctx.send("Je n'ai pas réussi à interpréter votre question."); return 
-    if generated_sql_query == "NO_QUERY_POSSIBLE": await ctx.send("Je ne peux pas formuler de requête. Essayez de reformuler."); return 
-    if generated_sql_query == "INVALID_QUERY_FORMAT": await ctx.send("L'IA a retourné une réponse inattendue."); return 
+        if not generated_sql_query: await ctx.send("Je n'ai pas réussi à interpréter votre question."); return 
+        if generated_sql_query == "NO_QUERY_POSSIBLE": await ctx.send("Je ne peux pas formuler de requête. Essayez de reformuler."); return 
+        if generated_sql_query == "INVALID_QUERY_FORMAT": await ctx.send("L'IA a retourné une réponse inattendue."); return 
     
-    await send_bot_log_message(f"Génération SQL pour '{question}' par {user_name_for_log} terminée. Requête : {generated_sql_query}", source="ASK-CMD-SQL-READY") 
+        await send_bot_log_message(f"Génération SQL pour '{question}' par {user_name_for_log} terminée. Requête : {generated_sql_query}", source="ASK-CMD-SQL-READY") 
+    query_label = generated_sql_query or f"recherche sémantique '{question}'"
+    cached = None
 
     try:
-        items = list(container_client.query_items(query=generated_sql_query, enable_cross_partition_query=True))
+        query_started = time.perf_counter()
+        if semantic_mode:
+            fetch, shared = await ask_coalescer.run(("semantic", question_key), lambda emit: retrieve_semantic_items(question, user_name_for_log))
+        else:
+            cached = result_cache.lookup(generated_sql_query) if result_cache else None
+            if cached:
+                fetch, shared = cached.fetch, True  # RU déjà comptées lors de la lecture d'origine.
+                await send_bot_log_message(
+                    f"Résultat en cache : {len(fetch.items)} résultat(s), {fetch.request_charge:.1f} RU évitées"
+                    f"{', résumé compris' if cached.summary else ''} (canaux inchangés depuis {format_duration(time.time() - cached.created_at)}). "
+                    f"Demandé par: {user_name_for_log}", source=log_source)
+            else:
+                watermark = result_cache.watermark_for(generated_sql_query) if result_cache else None
+                fetch, shared = await ask_coalescer.run(("fetch", generated_sql_query), lambda emit: fetch_for_ask(generated_sql_query, user_name_for_log))
+                if result_cache and not shared: result_cache.store(generated_sql_query, fetch, watermark)
+                await send_bot_log_message(
+                    f"Requête Cosmos exécutée : {len(fetch.items)} résultat(s) en {fetch.pages} page(s), {fetch.request_charge:.1f} RU, {fetch.elapsed_seconds:.2f}s"
+                    f"{', projection réduite' if fetch.projected else ''}{', lecture arrêtée au budget de synthèse' if fetch.truncated else ''}"
+                    f"{', résultat partagé avec une demande identique' if shared else ''}. Demandé par: {user_name_for_log}",
+                    source=log_source)
+            aggregate = aggregate_query(generated_sql_query)
+            # Mots exacts introuvables : on retente par le sens avant de répondre "aucun message".
+            if not fetch.items and semantic_search and aggregate is None and "CONTAINS(C.CONTENT" in generated_sql_query.upper():
+                if not shared: metrics.counter("cosmos_request_units_total", "RU Cosmos consommées", operation="ask").inc(fetch.request_charge)
+                fetch, shared = await ask_coalescer.run(("semantic", question_key), lambda emit: retrieve_semantic_items(question, user_name_for_log))
+                if fetch.items:
+                    semantic_mode = True
+                    await ctx.send("Aucun message ne contient ces mots exacts : je me base sur les messages les plus proches par le sens.")
+        items = fetch.items
+        metrics.histogram("ask_stage_seconds", "Durée des étapes de !ask", stage="query").observe(time.perf_counter() - query_started)
+        if not shared: metrics.counter("cosmos_request_units_total", "RU Cosmos consommées", operation="ask").inc(fetch.request_charge)
+        metrics.counter("ask_answers_total", "Réponses de !ask, par chemin", path="semantic" if semantic_mode else "sql").inc()
 
         if not items:
             await ctx.send("Aucun message ne correspond à votre demande.")
-            await send_bot_log_message(f"Aucun résultat Cosmos DB pour '{generated_sql_query}'. Demandé par: {user_name_for_log}", source=log_source); return
-
-        if generated_sql_query.upper().startswith("SELECT VALUE COUNT(1)"):
-            count = items[0] if items else 0
-            await ctx.send(f"J'ai trouvé {count} message(s) correspondant à votre demande.")
-            await send_bot_log_message(f"Résultat COUNT pour '{generated_sql_query}': {count}. Demandé par: {user_name_for_log}", source=log_source); return
-
-        await ctx.send(f"J'ai trouvé {len(items)} message(s). Génération du résumé...") 
-        ai_summary = await get_ai_summary(items, user_name_for_log) 
-
-        if ai_summary:
-            MAX_EMBED_DESC_LENGTH = 4000 
-            MAX_FALLBACK_MSG_LENGTH = 1900 
-            TRUNCATION_SUFFIX = "\n... (Résumé tronqué)"
-            TRUNCATION_MARGIN = len(TRUNCATION_SUFFIX) + 5 
-
-            truncated_summary_for_embed = ai_summary
-            if len(ai_summary) > MAX_EMBED_DESC_LENGTH:
-                truncated_summary_for_embed = ai_summary[:MAX_EMBED_DESC_LENGTH - TRUNCATION_MARGIN] + TRUNCATION_SUFFIX
-                await send_bot_log_message(f"Résumé IA tronqué pour l'embed (original: {len(ai_summary)}, tronqué: {len(truncated_summary_for_embed)}). Demandé par {user_name_for_log} Q: '{question}'", source=log_source)
-
-            embed = discord.Embed(
-                title=f"Résumé des messages trouvés ({len(items)} messages)",
-                description=truncated_summary_for_embed, 
-                color=discord.Color.blue(), 
-                timestamp=discord.utils.utcnow()
-            )
-            embed.set_footer(text=f"Requête : \"{question}\"")
-            
-            try:
-                await ctx.send(embed=embed)
-            except discord.HTTPException as e_embed_send: 
-                await send_bot_log_message(f"Erreur lors de l'envoi de l'embed (sera tenté en message normal): {e_embed_send}. Demandé par {user_name_for_log} Q: '{question}'", source=log_source)
-                
-                fallback_message_header = f"**Résumé ({len(items)} msgs):**\n"
-                fallback_message_footer = f"\n*(Le résumé était trop long pour un embed. Version texte ci-dessus.)*" 
-                
-                remaining_space_for_summary = MAX_FALLBACK_MSG_LENGTH - len(fallback_message_header) - len(fallback_message_footer)
-                
-                truncated_summary_for_fallback = ai_summary
-                if len(ai_summary) > remaining_space_for_summary:
-                    truncated_summary_for_fallback = ai_summary[:remaining_space_for_summary - TRUNCATION_MARGIN] + TRUNCATION_SUFFIX
-                    await send_bot_log_message(f"Résumé IA tronqué pour le message de fallback (original: {len(ai_summary)}, tronqué: {len(truncated_summary_for_fallback)}). Demandé par {user_name_for_log} Q: '{question}'", source=log_source)
-                else:
-                    truncated_summary_for_fallback = ai_summary
-
-                try:
-                    await ctx.send(f"{fallback_message_header}{truncated_summary_for_fallback}{fallback_message_footer}")
-                except discord.HTTPException as e_fallback_send:
-                    await send_bot_log_message(f"Erreur lors de l'envoi du message de fallback: {e_fallback_send}. Demandé par {user_name_for_log} Q: '{question}'. Le résumé était trop long.", source=log_source)
-                    await ctx.send("Désolé, le résumé généré est trop long pour être affiché, même après avoir essayé de le raccourcir.")
-            
-            log_msg_succ = (f"Synthèse réussie pour {len(items)} messages. Demandé par: {user_name_for_log} Q: '{question}'. "
-                            f"Résumé basé sur {min(len(items), MAX_MESSAGES_FOR_SUMMARY_CONFIG)} premiers.")
-            await send_bot_log_message(log_msg_succ, source=log_source)
-        else: 
-            await ctx.send("Désolé, je n'ai pas réussi à générer de résumé pour ces messages.")
-            # Le log d'erreur de get_ai_summary (si OpenAI a échoué) aura déjà été envoyé avec send_to_discord_channel=True
+            await send_bot_log_message(f"Aucun résultat Cosmos DB pour '{query_label}'. Demandé par: {user_name_for_log}", source=log_source); return
+
+        if not semantic_mode and aggregate is not None:
+            # Comptages, sommes, classements : des chiffres, pas des messages à résumer.
+            await ctx.send(render_aggregate(aggregate, items))
+            await send_bot_log_message(f"Résultat d'agrégat pour '{generated_sql_query}': {len(items)} ligne(s). Demandé par: {user_name_for_log}", source=log_source); return
 
+        if semantic_mode and not fetch.truncated:
+            await ctx.send(f"J'ai retenu {len(items)} message(s) proches de votre question (recherche sémantique). Génération du résumé...")
+        elif fetch.truncated:
+            await ctx.send(f"J'ai trouvé plus de {len(items)} messages : je résume les {len(items)} premiers selon l'ordre de la requête. Génération du résumé...")
+        else:
+            await ctx.send(f"J'ai trouvé {len(items)} message(s). Génération du résumé...") 
+        cached_summary = cached.summary if cached and not semantic_mode else None
+        if SUMMARY_STREAMING_ENABLED:
+            with metrics.histogram("ask_stage_seconds", "Durée des étapes de !ask", stage="summary").time():
+                ai_summary = await stream_summary_to_channel(ctx, items, question, user_name_for_log, cached_summary=cached_summary)
+            if ai_summary and result_cache and not semantic_mode and not cached_summary: result_cache.store_summary(generated_sql_query, ai_summary)
+            remember_ask_session(ctx, question, items, fetch, ai_summary)
+            return
+        with metrics.histogram("ask_stage_seconds", "Durée des étapes de !ask", stage="summary").time():
+            if cached_summary: ai_summary = cached_summary
+            else: ai_summary, _ = await ask_coalescer.run(summary_key(items), lambda emit: get_ai_summary(items, user_name_for_log))
+        if ai_summary and result_cache and not semantic_mode and not cached_summary: result_cache.store_summary(generated_sql_query, ai_summary)
+        remember_ask_session(ctx, question, items, fetch, ai_summary)
+
+        await send_summary_embed(ctx, items, question, ai_summary, user_name_for_log)
+
+    except RepositoryTimeoutError as e:
+        await ctx.send("La base de données met trop de temps à répondre. Soyez plus spécifique ou réessayez plus tard.")
+        await send_bot_log_message(f"Timeout Cosmos DB pour '{query_label}': {e}\nDemandé par: {user_name_for_log} Q: '{question}'", source=log_source, send_to_discord_channel=True, is_openai_filter_log=False)
     except exceptions.CosmosHttpResponseError as e:
         error_msg_user = "Erreur lors de la recherche dans la base de données."
         if "Query exceeded memory limit" in str(e) or "Query exceeded maximum time limit" in str(e):
@@ -585,10 +1546,10 @@ async def ask_command(ctx, *, question: str):
         elif "Request rate is large" in str(e):
              error_msg_user = "Base de données temporairement surchargée. Réessayez plus tard."
         await ctx.send(error_msg_user)
-        await send_bot_log_message(f"Erreur Cosmos DB pour '{generated_sql_query}': {e}\nDemandé par: {user_name_for_log} Q: '{question}'\n{traceback.format_exc()}", source=log_source, send_to_discord_channel=True, is_openai_filter_log=False) # is_openai_filter_log=False
+        await send_bot_log_message(f"Erreur Cosmos DB pour '{query_label}': {e}\nDemandé par: {user_name_for_log} Q: '{question}'\n{traceback.format_exc()}", source=log_source, send_to_discord_channel=True, is_openai_filter_log=False) # is_openai_filter_log=False
     except Exception as e:
         await ctx.send("Une erreur inattendue s'est produite.")
-        await send_bot_log_message(f"Erreur inattendue ask_cmd pour '{generated_sql_query}': {e}\nDemandé par: {user_name_for_log} Q: '{question}'\n{traceback.format_exc()}", source=log_source, send_to_discord_channel=True, is_openai_filter_log=False) # is_openai_filter_log=False
+        await send_bot_log_message(f"Erreur inattendue ask_cmd pour '{query_label}': {e}\nDemandé par: {user_name_for_log} Q: '{question}'\n{traceback.format_exc()}", source=log_source, send_to_discord_channel=True, is_openai_filter_log=False) # is_openai_filter_log=False
 
 @bot.command(name='caca', help="Affiche les 50 derniers logs pertinents des commandes !ask.")
 async def caca_command(ctx):
@@ -641,6 +1602,10 @@ async def caca_command(ctx):
         await ctx.send("Erreur lors de la création de l'embed des logs. Les logs sont peut-être trop volumineux.")
 
 
+if not COMMANDS_ENABLED:
+    # Processus d'ingestion : le processus des commandes, connecté au même bot, répond seul.
+    for command in list(bot.commands): bot.remove_command(command.name)
+
 if __name__ == "__main__":
     if DISCORD_BOT_TOKEN:
         try: bot.run(DISCORD_BOT_TOKEN)
@@ -0,0 +1,117 @@
+"""Planification de la synchronisation de plusieurs canaux (et serveurs entiers).
+
+Chaque passe synchronise les canaux en parallèle sous un plafond global de concurrence, les plus en
+retard d'abord. Un canal n'est jamais synchronisé deux fois en même temps : son bucket de rate-limit
+Discord (GET /channels/{id}/messages) n'est utilisé que par une seule lecture d'historique à la fois,
+et le plafond global garde la somme des lectures sous la limite globale de l'API.
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+
+DISCORD_EPOCH_MS = 1420070400000
+
+
+def snowflake_to_unix(snowflake) -> float | None:
+    if not snowflake:
+        return None
+    return ((int(snowflake) >> 22) + DISCORD_EPOCH_MS) / 1000
+
+
+@dataclass
+class ChannelSyncState:
+    channel_id: int
+    name: str = "?"
+    guild_name: str = "?"
+    synced_until_unix: float | None = None  # timestamp du dernier message ingéré
+    latest_activity_unix: float | None = None  # timestamp du dernier message connu côté Discord
+    unsynced_events: int = 0
+    running: bool = False
+    last_pass_started_at: float | None = None
+    last_pass_duration: float | None = None
+    last_pass_messages: int = 0
+    last_error: str | None = None
+
+    @property
+    def lag_seconds(self) -> float | None:
+        """Retard de synchronisation : activité Discord la plus récente moins dernier message ingéré."""
+        if self.latest_activity_unix is None:
+            return 0.0 if self.synced_until_unix is not None else None
+        if self.synced_until_unix is None:
+            return None
+        return max(0.0, self.latest_activity_unix - self.synced_until_unix)
+
+    @property
+    def priority(self) -> tuple:
+        # Jamais synchronisé d'abord, puis le plus d'activité non synchronisée, puis le plus grand retard.
+        never_synced = self.synced_until_unix is None
+        return (not never_synced, -self.unsynced_events, -(self.lag_seconds or 0.0))
+
+
+class ChannelSyncScheduler:
+    """Lance `sync_channel(channel_id)` sur un ensemble de canaux, `max_concurrent` à la fois.
+
+    `sync_channel` renvoie les statistiques de la passe (objet avec `fetched`) ou None.
+    """
+
+    def __init__(self, sync_channel, max_concurrent: int = 3):
+        self.sync_channel = sync_channel
+        self.max_concurrent = max(1, max_concurrent)
+        self.states: dict[int, ChannelSyncState] = {}
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._channel_locks: dict[int, asyncio.Lock] = {}
+
+    def state_for(self, channel_id: int) -> ChannelSyncState:
+        state = self.states.get(channel_id)
+        if state is None:
+            state = self.states[channel_id] = ChannelSyncState(channel_id)
+        return state
+
+    def observe_latest_message(self, channel_id: int, message_id):
+        """Met à jour l'activité Discord connue d'un canal (ex: channel.last_message_id), sans appel API."""
+        state = self.state_for(channel_id)
+        timestamp = snowflake_to_unix(message_id)
+        if timestamp and (state.latest_activity_unix is None or timestamp > state.latest_activity_unix):
+            state.latest_activity_unix = timestamp
+        return state
+
+    def record_activity(self, channel_id: int, message_id, synced: bool = False):
+        """Note un message vu en temps réel ; `synced` s'il est déjà parti dans l'ingestion temps réel."""
+        state = self.observe_latest_message(channel_id, message_id)
+        if synced:
+            self.record_synced(channel_id, snowflake_to_unix(message_id))
+        else:
+            state.unsynced_events += 1
+
+    def record_synced(self, channel_id: int, timestamp_unix: float | None):
+        state = self.state_for(channel_id)
+        if timestamp_unix and (state.synced_until_unix is None or timestamp_unix > state.synced_until_unix):
+            state.synced_until_unix = timestamp_unix
+
+    async def _sync_one(self, state: ChannelSyncState):
+        lock = self._channel_locks.setdefault(state.channel_id, asyncio.Lock())
+        if lock.locked():
+            return  # Passe déjà en cours pour ce canal.
+        async with lock, self._semaphore:
+            state.running = True
+            state.last_pass_started_at = time.time()
+            events_before = state.unsynced_events
+            try:
+                stats = await self.sync_channel(state.channel_id)
+                state.last_pass_messages = getattr(stats, "fetched", 0) if stats else 0
+                state.last_error = None
+                state.unsynced_events = max(0, state.unsynced_events - events_before)
+            except Exception as e:
+                state.last_error = str(e)
+            finally:
+                state.running = False
+                state.last_pass_duration = time.time() - state.last_pass_started_at
+
+    async def run_pass(self, channel_ids) -> list[ChannelSyncState]:
+        """Synchronise les canaux donnés, par ordre de priorité, et renvoie leurs états."""
+        states = sorted((self.state_for(cid) for cid in channel_ids), key=lambda s: s.priority)
+        await asyncio.gather(*(self._sync_one(state) for state in states))
+        return states
+
+    def lag_report(self) -> list[ChannelSyncState]:
+        return sorted(self.states.values(), key=lambda s: s.priority)
@@ -0,0 +1,112 @@
+"""Points de reprise de l'ingestion, par canal.
+
+Un point de reprise mémorise le dernier message ingéré de façon contiguë (id + timestamp) : la passe
+suivante reprend avec `after=<id>` au lieu de recalculer un MAX() cross-partition sur tout le conteneur.
+Deux implémentations : un fichier SQLite local (défaut) ou un petit document Cosmos par canal, lu et
+écrit par point-read (O(1), quelle que soit la taille de l'archive).
+"""
+import sqlite3
+import time
+from dataclasses import dataclass
+
+DEFAULT_STATE_PATH = "bebzia_state.sqlite3"
+
+
+@dataclass
+class Checkpoint:
+    channel_id: str
+    last_message_id: str
+    last_timestamp_unix: float
+    updated_at: float
+
+
+def open_state_db(path: str = DEFAULT_STATE_PATH) -> sqlite3.Connection:
+    """Connexion SQLite partagée pour l'état local du bot (mode WAL, autocommit)."""
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SqliteCheckpointStore:
+    """Points de reprise dans le fichier d'état local. Les mises à jour ne reculent jamais."""
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH):
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingestion_checkpoints ("
+            " channel_id TEXT PRIMARY KEY, last_message_id TEXT NOT NULL,"
+            " last_timestamp_unix REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    async def load(self, channel_id) -> Checkpoint | None:
+        row = self.conn.execute(
+            "SELECT channel_id, last_message_id, last_timestamp_unix, updated_at"
+            " FROM ingestion_checkpoints WHERE channel_id = ?", (str(channel_id),)
+        ).fetchone()
+        return Checkpoint(*row) if row else None
+
+    async def load_all(self) -> dict[str, Checkpoint]:
+        rows = self.conn.execute(
+            "SELECT channel_id, last_message_id, last_timestamp_unix, updated_at FROM ingestion_checkpoints"
+        ).fetchall()
+        return {row[0]: Checkpoint(*row) for row in rows}
+
+    async def save(self, channel_id, last_message_id, last_timestamp_unix: float) -> bool:
+        """Avance le point de reprise (transaction unique). Renvoie False si l'existant est plus récent."""
+        cursor = self.conn.execute(
+            "INSERT INTO ingestion_checkpoints (channel_id, last_message_id, last_timestamp_unix, updated_at)"
+            " VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(channel_id) DO UPDATE SET last_message_id = excluded.last_message_id,"
+            " last_timestamp_unix = excluded.last_timestamp_unix, updated_at = excluded.updated_at"
+            " WHERE CAST(excluded.last_message_id AS INTEGER) >= CAST(ingestion_checkpoints.last_message_id AS INTEGER)",
+            (str(channel_id), str(last_message_id), float(last_timestamp_unix), time.time()),
+        )
+        return cursor.rowcount > 0
+
+
+class CosmosCheckpointStore:
+    """Points de reprise stockés comme documents `ingestion_checkpoint` dans le conteneur des messages.
+
+    Les champs sont préfixés (`cursor_*`) pour ne jamais correspondre aux filtres des requêtes !ask
+    sur `channel_id`, `timestamp_iso` ou `content`.
+    """
+
+    DOC_TYPE = "ingestion_checkpoint"
+
+    def __init__(self, repository):
+        self.repository = repository
+        self._known: dict[str, Checkpoint] = {}
+
+    @staticmethod
+    def _doc_id(channel_id) -> str:
+        return f"checkpoint-{channel_id}"
+
+    async def load(self, channel_id) -> Checkpoint | None:
+        doc_id = self._doc_id(channel_id)
+        doc = await self.repository.read_item(doc_id, partition_key=doc_id)
+        if not doc:
+            return None
+        checkpoint = Checkpoint(str(channel_id), doc["cursor_message_id"], doc["cursor_timestamp_unix"], doc["updated_at"])
+        self._known[str(channel_id)] = checkpoint
+        return checkpoint
+
+    async def load_all(self) -> dict[str, Checkpoint]:
+        docs = await self.repository.query_items(
+            "SELECT * FROM c WHERE c.doc_type = @doc_type", parameters=[{"name": "@doc_type", "value": self.DOC_TYPE}])
+        return {d["cursor_channel_id"]: Checkpoint(d["cursor_channel_id"], d["cursor_message_id"],
+                                                   d["cursor_timestamp_unix"], d["updated_at"]) for d in docs}
+
+    async def save(self, channel_id, last_message_id, last_timestamp_unix: float) -> bool:
+        known = self._known.get(str(channel_id))
+        if known and int(known.last_message_id) > int(last_message_id):
+            return False
+        doc_id = self._doc_id(channel_id)
+        now = time.time()
+        await self.repository.upsert_item({
+            "id": doc_id, "doc_type": self.DOC_TYPE, "cursor_channel_id": str(channel_id),
+            "cursor_message_id": str(last_message_id), "cursor_timestamp_unix": float(last_timestamp_unix),
+            "updated_at": now,
+        })
+        self._known[str(channel_id)] = Checkpoint(str(channel_id), str(last_message_id), float(last_timestamp_unix), now)
+        return True
@@ -0,0 +1,318 @@
+"""Schéma compact (v2) des documents de message, avec écritures évitées quand rien n'a changé.
+
+Le document v1 (message_schema) réécrit à chaque upsert les embeds complets, les URLs des pièces
+jointes et deux horodatages. En v2 :
+- les champs ont des noms courts (FIELD_NAMES). timestamp_iso garde son nom, pour le tri et les
+  filtres de période sur les deux schémas. timestamp_unix n'est plus écrit : il est recalculé à la lecture ;
+- les valeurs par défaut (jamais édité, discriminant "0") ne sont pas écrites ; les requêtes les
+  retrouvent par `?? défaut` ;
+- pièces jointes et embeds vont dans un document annexe "<id>:x", écrit seulement s'il y en a.
+  Sa clé de partition est son id, dans les deux dispositions ;
+- chaque document porte une empreinte (`h`) de ce qui peut changer : texte, édition, réactions,
+  pièces jointes (URL sans la signature du CDN, qui change à chaque lecture) et embeds. Un message
+  réingéré à l'identique n'est pas réécrit. Les empreintes écrites sont gardées dans le fichier d'état local.
+
+CompactRepository se place juste au-dessus de Cosmos. Les couches supérieures (réplique, rollups,
+index sémantique) et les requêtes !ask voient toujours le schéma v1 : les requêtes sont réécrites vers
+les noms courts, en excluant les annexes, et les documents lus sont remis au format v1.
+Mise à niveau paresseuse : chaque réécriture d'un message le convertit, et upgrade_schema.py convertit
+le reste. Tant que des documents v1 restent (`mixed`), chaque champ est lu en `(c.court ?? c.long)`.
+Ces expressions n'utilisent pas l'index, c'est le prix de la transition.
+"""
+import datetime
+import hashlib
+import json
+
+import cosmos_sql
+from checkpoints import DEFAULT_STATE_PATH, open_state_db
+
+SCHEMA_VERSION = 2
+FIELD_NAMES = {
+    "message_id_int": "m", "channel_id": "ch", "guild_id": "g", "author_id": "a", "author_name": "an",
+    "author_discriminator": "ad", "author_display_name": "dn", "author_bot": "b", "content": "t",
+    "attachments_count": "na", "reactions": "r", "reactions_count": "nr", "edited_timestamp_iso": "e",
+}
+LONG_NAMES = {short: long for long, short in FIELD_NAMES.items()}
+OMITTED_DEFAULTS = {"author_discriminator": ("0", '"0"'), "edited_timestamp_iso": (None, "null")}  # (valeur, littéral SQL)
+SIDE_FIELDS = {"attachments": "at", "embeds": "em"}
+DROPPED_FIELDS = ("timestamp_unix", "pk")
+SIDE_SUFFIX = ":x"
+SIDE_MARKER = "x"  # Id du message dans son annexe ; les requêtes réécrites excluent les documents qui l'ont.
+V1_MESSAGES_QUERY = "SELECT * FROM c WHERE IS_DEFINED(c.message_id_int)"
+
+_CLAUSE_KEYWORDS = {"SELECT", "FROM", "WHERE", "GROUP", "ORDER", "OFFSET"}
+
+
+def is_message(doc: dict) -> bool:
+    return "message_id_int" in doc
+
+
+def side_id(message_id) -> str:
+    return f"{message_id}{SIDE_SUFFIX}"
+
+
+def _stable_attachment(attachment: dict) -> dict:
+    url = attachment.get("url")
+    return {**attachment, "url": url.split("?", 1)[0]} if isinstance(url, str) else attachment
+
+
+def content_hash(doc: dict) -> str:
+    """Empreinte des parties d'un message v1 qui changent après sa création."""
+    state = [doc.get("content"), doc.get("edited_timestamp_iso"), doc.get("reactions"), doc.get("author_name"),
+             doc.get("author_display_name"), [_stable_attachment(a) for a in doc.get("attachments") or []],
+             doc.get("embeds")]
+    payload = json.dumps(state, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=8).hexdigest()
+
+
+def compact_document(doc: dict) -> tuple[dict, dict | None]:
+    """(document principal v2, annexe ou None) à partir d'un document de message v1."""
+    main = {"id": str(doc["id"]), "v": SCHEMA_VERSION}
+    for key, value in doc.items():
+        if key.startswith("_") or key in DROPPED_FIELDS or key in SIDE_FIELDS or key == "id":
+            continue
+        if key in OMITTED_DEFAULTS and value == OMITTED_DEFAULTS[key][0]:
+            continue
+        main[FIELD_NAMES.get(key, key)] = value
+    side = {short: doc[key] for key, short in SIDE_FIELDS.items() if doc.get(key)}
+    if side:
+        side = {"id": side_id(main["id"]), SIDE_MARKER: main["id"], **side}
+        main["hx"] = 1
+    main["h"] = content_hash(doc)
+    return main, side or None
+
+
+def _timestamp_unix(timestamp_iso) -> int | None:
+    if not isinstance(timestamp_iso, str):
+        return None
+    try:
+        created = datetime.datetime.fromisoformat(timestamp_iso.removesuffix("Z"))
+    except ValueError:
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=datetime.timezone.utc)
+    return int(created.timestamp())
+
+
+def expand_document(doc: dict) -> dict:
+    """Document v2 remis au format v1 (sans pièces jointes ni embeds, voir read_extras) ; les autres inchangés."""
+    if not isinstance(doc, dict) or doc.get("v") != SCHEMA_VERSION:
+        return doc
+    expanded = {}
+    for key, value in doc.items():
+        if key in ("v", "h", "hx"):
+            continue
+        expanded[LONG_NAMES.get(key, key)] = value
+    for key, (default, _) in OMITTED_DEFAULTS.items():
+        expanded.setdefault(key, default)
+    if "timestamp_iso" in expanded:
+        expanded["timestamp_unix"] = _timestamp_unix(expanded["timestamp_iso"])
+    return expanded
+
+
+def _scan(sql: str) -> list[tuple[str, str, int, int]]:
+    """Jetons (type, texte, début, fin) de `sql`, espaces exclus ; les mots-clés restent des ident."""
+    tokens, pos = [], 0
+    while pos < len(sql):
+        m = cosmos_sql._TOKEN_RE.match(sql, pos)
+        if not m:
+            raise cosmos_sql.CosmosSqlError(f"Caractère inattendu à la position {pos}: {sql[pos:pos + 20]!r}")
+        if m.lastgroup != "ws":
+            tokens.append((m.lastgroup, m.group(), m.start(), m.end()))
+        pos = m.end()
+    return tokens
+
+
+def rewrite_query(sql: str, mixed: bool = True) -> str:
+    """Requête v1 réécrite pour un conteneur au schéma compact.
+
+    Champs renommés (`(c.court ?? c.long)` si `mixed`, `?? défaut` pour les valeurs omises), sauf dans
+    ORDER BY et devant un accès `.x`/`[..]`, où Cosmos veut un chemin : les documents v1 n'y sont
+    alors plus vus. Projections simples renommées en retour (`AS long`), annexes exclues du WHERE.
+    """
+    sql = sql.strip().rstrip(";").rstrip()
+    tokens = _scan(sql)
+    clauses, depth, clause = [], 0, None
+    for kind, text, _, _ in tokens:
+        if kind == "op" and text in "([":
+            depth += 1
+        elif kind == "op" and text in ")]":
+            depth -= 1
+        elif kind == "ident" and depth == 0 and text.upper() in _CLAUSE_KEYWORDS:
+            clause = text.upper()
+        clauses.append((clause, depth))
+    from_index = next((i for i, (kind, text, _, _) in enumerate(tokens)
+                       if kind == "ident" and text.upper() == "FROM" and clauses[i][1] == 0), None)
+    if from_index is None or from_index + 1 >= len(tokens) or tokens[from_index + 1][0] != "ident":
+        raise cosmos_sql.CosmosSqlError("FROM <alias> attendu")
+    alias = tokens[from_index + 1][1]
+    value_query = any(kind == "ident" and text.upper() == "VALUE" for kind, text, _, _ in tokens[:from_index])
+
+    edits = []  # (début, fin, texte) appliqués de la fin vers le début.
+    for i in range(len(tokens) - 2):
+        (kind, text, start, _), (_, dot, _, _), (name_kind, name, _, end) = tokens[i:i + 3]
+        if kind != "ident" or text != alias or dot != "." or name_kind != "ident" or name not in FIELD_NAMES:
+            continue
+        if i and tokens[i - 1][1] == ".":
+            continue
+        following = tokens[i + 3][1] if i + 3 < len(tokens) else None
+        short = FIELD_NAMES[name]
+        if clauses[i][0] == "ORDER" or following in (".", "["):
+            replacement = f"{alias}.{short}"
+        else:
+            chain = [f"{alias}.{short}"] + ([f"{alias}.{name}"] if mixed else [])
+            chain += [OMITTED_DEFAULTS[name][1]] if name in OMITTED_DEFAULTS else []
+            replacement = f"({' ?? '.join(chain)})" if len(chain) > 1 else chain[0]
+        previous = tokens[i - 1][1].upper() if i else ""
+        item_start = previous in ("SELECT", ",", "VALUE", "DISTINCT") or (i >= 2 and tokens[i - 2][1].upper() == "TOP")
+        if (clauses[i] == ("SELECT", 0) and not value_query and item_start
+                and (following == "," or (following or "").upper() == "FROM")):
+            replacement += f" AS {name}"
+        edits.append((start, end, replacement))
+
+    guard = f"NOT IS_DEFINED({alias}.{SIDE_MARKER})"
+    where_index = next((i for i, (kind, text, _, _) in enumerate(tokens)
+                        if kind == "ident" and text.upper() == "WHERE" and clauses[i][1] == 0), None)
+    tail_index = next((i for i in range(from_index + 2, len(tokens))
+                       if clauses[i][1] == 0 and tokens[i][0] == "ident" and tokens[i][1].upper() in ("GROUP", "ORDER", "OFFSET")), None)
+    tail = tokens[tail_index][2] if tail_index is not None else len(sql)
+    if where_index is not None:
+        edits.append((tokens[where_index][3], tokens[where_index][3], f" {guard} AND ("))
+        edits.append((tail, tail, ") " if tail_index is not None else ")"))
+    else:
+        edits.append((tail, tail, f"WHERE {guard} " if tail_index is not None else f" WHERE {guard}"))
+    for start, end, replacement in sorted(edits, key=lambda edit: (edit[0], edit[1]), reverse=True):
+        sql = sql[:start] + replacement + sql[end:]
+    return sql
+
+
+class DocumentHashStore:
+    """Empreinte de la dernière version écrite de chaque message, par conteneur (fichier d'état local)."""
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH, namespace: str = ""):
+        self.namespace = namespace
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS document_hashes ("
+            " namespace TEXT NOT NULL, id TEXT NOT NULL, hash TEXT NOT NULL, has_side INTEGER NOT NULL,"
+            " PRIMARY KEY (namespace, id)) WITHOUT ROWID"
+        )
+
+    def get(self, doc_id) -> tuple[str, bool] | None:
+        row = self.conn.execute("SELECT hash, has_side FROM document_hashes WHERE namespace = ? AND id = ?",
+                                (self.namespace, str(doc_id))).fetchone()
+        return (row[0], bool(row[1])) if row else None
+
+    def put(self, doc_id, digest: str, has_side: bool):
+        self.conn.execute(
+            "INSERT INTO document_hashes (namespace, id, hash, has_side) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(namespace, id) DO UPDATE SET hash = excluded.hash, has_side = excluded.has_side",
+            (self.namespace, str(doc_id), digest, int(has_side)))
+
+    def forget(self, doc_id):
+        self.conn.execute("DELETE FROM document_hashes WHERE namespace = ? AND id = ?", (self.namespace, str(doc_id)))
+
+
+class CompactRepository:
+    """Enveloppe d'un dépôt Cosmos : écrit au schéma compact, lit et interroge au schéma v1."""
+
+    def __init__(self, primary, hashes: DocumentHashStore, mixed: bool = True):
+        self.primary = primary
+        self.hashes = hashes
+        self.mixed = mixed
+        self.stats = {"written": 0, "skipped": 0, "side_written": 0, "side_deleted": 0, "bytes_saved": 0}
+
+    @property
+    def layout(self):
+        return self.primary.layout
+
+    @property
+    def is_connected(self) -> bool:
+        return self.primary.is_connected
+
+    @property
+    def total_request_charge(self) -> float:
+        return self.primary.total_request_charge
+
+    async def connect(self):
+        await self.primary.connect()
+
+    async def close(self):
+        await self.primary.close()
+
+    def rewrite(self, query: str) -> str:
+        try:
+            return rewrite_query(query, mixed=self.mixed)
+        except cosmos_sql.CosmosSqlError:
+            return query  # Syntaxe inconnue : envoyée telle quelle, Cosmos tranchera.
+
+    async def upsert_item(self, body: dict, timeout: float | None = None, force: bool = False) -> dict:
+        """Écrit le message au schéma compact, sauf s'il est identique à la dernière version écrite."""
+        if not is_message(body):
+            return await self.primary.upsert_item(body, timeout=timeout)
+        main, side = compact_document(body)
+        known = self.hashes.get(main["id"])
+        if known and known[0] == main["h"] and not force:
+            self.stats["skipped"] += 1
+            return body
+        await self.primary.upsert_item(main, timeout=timeout)
+        if side:
+            await self.primary.upsert_item(side, timeout=timeout)
+            self.stats["side_written"] += 1
+        elif known and known[1]:
+            await self._delete_side(main["id"], timeout)
+        self.hashes.put(main["id"], main["h"], side is not None)
+        self.stats["written"] += 1
+        self.stats["bytes_saved"] += len(json.dumps(body, default=str)) - len(json.dumps(main)) - (len(json.dumps(side)) if side else 0)
+        return body
+
+    async def _delete_side(self, message_id, timeout: float | None):
+        if await self.primary.delete_item(side_id(message_id), side_id(message_id), timeout=timeout):
+            self.stats["side_deleted"] += 1
+
+    async def delete_message(self, channel_id, message_id, timeout: float | None = None) -> bool:
+        deleted = await self.primary.delete_message(channel_id, message_id, timeout=timeout)
+        await self._forget_message(message_id, timeout)
+        return deleted
+
+    async def delete_item(self, item_id: str, partition_key, timeout: float | None = None) -> bool:
+        deleted = await self.primary.delete_item(item_id, partition_key, timeout=timeout)
+        if str(item_id).isdigit():
+            await self._forget_message(item_id, timeout)
+        return deleted
+
+    async def _forget_message(self, message_id, timeout: float | None):
+        known = self.hashes.get(message_id)
+        if known is None or known[1]:  # Inconnu : l'annexe a pu être écrite par une autre instance.
+            await self._delete_side(message_id, timeout)
+        self.hashes.forget(message_id)
+
+    async def read_item(self, item_id: str, partition_key, timeout: float | None = None) -> dict | None:
+        return expand_document(await self.primary.read_item(item_id, partition_key, timeout=timeout))
+
+    async def read_extras(self, message_id, timeout: float | None = None) -> dict:
+        """Pièces jointes et embeds d'un message (lecture ponctuelle de son annexe)."""
+        side = await self.primary.read_item(side_id(message_id), side_id(message_id), timeout=timeout)
+        side = side or {}
+        return {long: side.get(short, []) for long, short in SIDE_FIELDS.items()}
+
+    async def query_items(self, query: str, parameters: list[dict] | None = None,
+                          timeout: float | None = None) -> list:
+        results = await self.primary.query_items(self.rewrite(query), parameters=parameters, timeout=timeout)
+        return [expand_document(item) for item in results]
+
+    async def query_value(self, query: str, parameters: list[dict] | None = None,
+                          timeout: float | None = None):
+        return expand_document(await self.primary.query_value(self.rewrite(query), parameters=parameters, timeout=timeout))
+
+    async def query_pages(self, query: str, parameters: list[dict] | None = None, page_size: int = 100,
+                          continuation_token: str | None = None, timeout: float | None = None,
+                          on_request_charge=None):
+        pages = self.primary.query_pages(self.rewrite(query), parameters=parameters, page_size=page_size,
+                                         continuation_token=continuation_token, timeout=timeout,
+                                         on_request_charge=on_request_charge)
+        try:
+            async for page, token in pages:
+                yield [expand_document(item) for item in page], token
+        finally:
+            await pages.aclose()
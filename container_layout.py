@@ -0,0 +1,83 @@
+"""Dispositions (clé de partition + politique d'indexation) du conteneur des messages.
+
+v1 : clé de partition /id et indexation par défaut (disposition historique).
+v2 : clé synthétique /pk = "<channel_id>:<AAAA-MM>", index composites (channel_id, timestamp_iso) et
+     (author_name, timestamp_iso), et sans indexer les gros champs embeds/attachments/reactions
+     (moins de RU à chaque écriture), sous leurs noms longs comme courts (schéma compact). Les
+     documents qui ne sont pas des messages (points de reprise, annexes du schéma compact...) ont
+     pk = id, ce qui garde leurs lectures ponctuelles en O(1).
+"""
+import datetime
+from dataclasses import dataclass
+
+DISCORD_EPOCH_MS = 1420070400000
+
+V2_INDEXING_POLICY = {
+    "indexingMode": "consistent",
+    "automatic": True,
+    "includedPaths": [{"path": "/*"}],
+    "excludedPaths": [
+        {"path": "/embeds/*"},
+        {"path": "/attachments/*"},
+        {"path": "/reactions/*"},
+        {"path": "/r/*"},
+        {"path": "/at/*"},
+        {"path": "/em/*"},
+        {"path": '/"_etag"/?'},
+    ],
+    "compositeIndexes": [
+        [{"path": "/channel_id", "order": "ascending"}, {"path": "/timestamp_iso", "order": "ascending"}],
+        [{"path": "/channel_id", "order": "ascending"}, {"path": "/timestamp_iso", "order": "descending"}],
+        [{"path": "/author_name", "order": "ascending"}, {"path": "/timestamp_iso", "order": "descending"}],
+        [{"path": "/ch", "order": "ascending"}, {"path": "/timestamp_iso", "order": "ascending"}],
+        [{"path": "/ch", "order": "ascending"}, {"path": "/timestamp_iso", "order": "descending"}],
+        [{"path": "/an", "order": "ascending"}, {"path": "/timestamp_iso", "order": "descending"}],
+    ],
+}
+
+
+def month_of_snowflake(message_id) -> str:
+    created = datetime.datetime.fromtimestamp(((int(message_id) >> 22) + DISCORD_EPOCH_MS) / 1000, tz=datetime.timezone.utc)
+    return created.strftime("%Y-%m")
+
+
+@dataclass(frozen=True)
+class ContainerLayout:
+    name: str
+    partition_key_path: str
+    indexing_policy: dict | None = None
+
+    @property
+    def uses_synthetic_key(self) -> bool:
+        return self.partition_key_path == "/pk"
+
+    def message_partition_key(self, channel_id, message_id) -> str:
+        """Clé de partition d'un message à partir de son id seul (suppressions, lectures ponctuelles)."""
+        if not self.uses_synthetic_key:
+            return str(message_id)
+        return f"{channel_id}:{month_of_snowflake(message_id)}"
+
+    def document_partition_key(self, doc: dict) -> str:
+        if not self.uses_synthetic_key:
+            return str(doc["id"])
+        if doc.get("pk"):
+            return doc["pk"]
+        # Noms longs (schéma v1) ou courts (schéma compact, voir compact_schema).
+        channel_id, message_id = doc.get("channel_id") or doc.get("ch"), doc.get("message_id_int") or doc.get("m")
+        if channel_id and message_id:
+            return self.message_partition_key(channel_id, message_id)
+        if channel_id and doc.get("timestamp_iso"):
+            return f"{channel_id}:{doc['timestamp_iso'][:7]}"
+        return str(doc["id"])
+
+    def prepare(self, doc: dict) -> dict:
+        """Document prêt à écrire dans ce conteneur (ajoute pk en v2, retire les propriétés système)."""
+        body = {k: v for k, v in doc.items() if not k.startswith("_")}
+        if self.uses_synthetic_key:
+            body["pk"] = self.document_partition_key(body)
+        return body
+
+
+LAYOUT_V1 = ContainerLayout("v1", "/id")
+LAYOUT_V2 = ContainerLayout("v2", "/pk", V2_INDEXING_POLICY)
+LAYOUTS = {"v1": LAYOUT_V1, "v2": LAYOUT_V2}
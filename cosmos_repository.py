@@ -0,0 +1,387 @@
+"""Couche d'accès asynchrone au conteneur Cosmos DB des messages.
+
+Tous les appels Cosmos du bot passent par ici : le client `azure.cosmos.aio` est créé une seule fois
+(session HTTP réutilisée) et chaque appel est borné par un timeout pour ne jamais bloquer la boucle
+discord.py. `InMemoryCosmosRepository` expose la même interface sur un dict local, pour les benchmarks.
+"""
+import asyncio
+import copy
+import json
+import time
+
+from azure.cosmos import PartitionKey, exceptions
+from azure.cosmos.aio import CosmosClient
+
+import cosmos_sql
+from container_layout import LAYOUT_V1, ContainerLayout
+
+DEFAULT_CALL_TIMEOUT_SECONDS = 30.0
+DEFAULT_QUERY_TIMEOUT_SECONDS = 60.0
+OWNER_RESOURCE_NOT_FOUND = 1003  # Sous-statut d'un 404 Cosmos : la base ou le conteneur manque, pas le document.
+
+
+class RepositoryTimeoutError(TimeoutError):
+    """Un appel Cosmos a dépassé son timeout."""
+
+
+class RepositoryNotConnectedError(RuntimeError):
+    """Le dépôt est utilisé avant connect()."""
+
+
+class CosmosRepository:
+    """Dépôt Cosmos DB asynchrone partagé par le bot (une connexion, timeouts par appel)."""
+
+    def __init__(self, endpoint: str, key: str, database_name: str, container_name: str,
+                 layout: ContainerLayout = LAYOUT_V1, offer_throughput: int | None = 400,
+                 call_timeout: float = DEFAULT_CALL_TIMEOUT_SECONDS,
+                 query_timeout: float = DEFAULT_QUERY_TIMEOUT_SECONDS, verified_schemas=None):
+        self.endpoint = endpoint
+        self.key = key
+        self.database_name = database_name
+        self.container_name = container_name
+        self.layout = layout
+        self.offer_throughput = offer_throughput
+        self.call_timeout = call_timeout
+        self.query_timeout = query_timeout
+        self.verified_schemas = verified_schemas  # startup.VerifiedSchemaStore, optionnel.
+        self.schema_check_skipped = False
+        self.container_reconnects = 0
+        self.total_request_charge = 0.0
+        self._client = None
+        self._container = None
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def is_connected(self) -> bool:
+        return self._container is not None
+
+    @property
+    def schema_key(self) -> str:
+        """Identité du conteneur attendu : une disposition différente impose une nouvelle vérification."""
+        policy = json.dumps(self.layout.indexing_policy, sort_keys=True)
+        return f"{self.endpoint}|{self.database_name}|{self.container_name}|{self.layout.partition_key_path}|{policy}"
+
+    async def connect(self):
+        """Ouvre le client (une seule fois) et s'assure que la base et le conteneur existent.
+
+        Si `verified_schemas` connaît déjà le conteneur, aucun appel réseau : le client est ouvert
+        directement sur le conteneur et la première requête établit la connexion.
+        """
+        async with self._connect_lock:
+            if self._container is not None:
+                return
+            client = CosmosClient(self.endpoint, credential=self.key)
+            if self.verified_schemas is not None and self.verified_schemas.is_verified(self.schema_key):
+                self._container = client.get_database_client(self.database_name).get_container_client(self.container_name)
+                self._client, self.schema_check_skipped = client, True
+                return
+            try:
+                database = await asyncio.wait_for(
+                    client.create_database_if_not_exists(id=self.database_name), self.call_timeout)
+                container_options = {"indexing_policy": self.layout.indexing_policy} if self.layout.indexing_policy else {}
+                self._container = await asyncio.wait_for(
+                    database.create_container_if_not_exists(
+                        id=self.container_name, partition_key=PartitionKey(path=self.layout.partition_key_path),
+                        offer_throughput=self.offer_throughput, **container_options),
+                    self.call_timeout)
+            except BaseException:
+                await client.close()
+                raise
+            self._client = client
+            if self.verified_schemas is not None:
+                self.verified_schemas.mark_verified(self.schema_key)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+        self._client, self._container = None, None
+
+    def _record_charge(self, headers, *_):
+        try:
+            self.total_request_charge += float(headers.get("x-ms-request-charge") or 0)
+        except (AttributeError, TypeError, ValueError):
+            pass
+
+    def _require_container(self):
+        if self._container is None:
+            raise RepositoryNotConnectedError("Dépôt Cosmos DB non connecté.")
+        return self._container
+
+    async def _bounded(self, coro, timeout: float | None, what: str):
+        try:
+            return await asyncio.wait_for(coro, timeout if timeout is not None else self.call_timeout)
+        except asyncio.TimeoutError:
+            raise RepositoryTimeoutError(f"Timeout Cosmos DB ({what})") from None
+
+    @staticmethod
+    def _container_missing(error: exceptions.CosmosResourceNotFoundError, item_level: bool) -> bool:
+        """Un 404 sur un document (lecture, suppression) ne veut pas dire que le conteneur a disparu."""
+        return not item_level or getattr(error, "sub_status", None) == OWNER_RESOURCE_NOT_FOUND
+
+    async def _reconnect(self, failed_container):
+        """Conteneur supprimé ou recréé : oublie la vérification mémorisée et reconnecte (une fois pour tous)."""
+        async with self._connect_lock:
+            if self._container is failed_container:
+                if self.verified_schemas is not None:
+                    self.verified_schemas.forget(self.schema_key)
+                if self._client is not None:
+                    await self._client.close()
+                self._client, self._container, self.schema_check_skipped = None, None, False
+                self.container_reconnects += 1
+        await self.connect()
+
+    async def _call(self, operation, timeout: float | None, what: str, item_level: bool = False):
+        """`operation(container)` borné par un timeout, rejoué une fois après reconnexion si le conteneur manque."""
+        container = self._require_container()
+        try:
+            return await self._bounded(operation(container), timeout, what)
+        except exceptions.CosmosResourceNotFoundError as e:
+            if not self._container_missing(e, item_level):
+                raise
+            await self._reconnect(container)
+        return await self._bounded(operation(self._require_container()), timeout, what)
+
+    async def upsert_item(self, body: dict, timeout: float | None = None) -> dict:
+        body = self.layout.prepare(body)
+        return await self._call(lambda container: container.upsert_item(body=body, response_hook=self._record_charge),
+                                timeout, "upsert")
+
+    async def read_item(self, item_id: str, partition_key, timeout: float | None = None) -> dict | None:
+        try:
+            return await self._call(lambda container: container.read_item(item=item_id, partition_key=partition_key,
+                                                                          response_hook=self._record_charge),
+                                    timeout, "read", item_level=True)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+
+    async def delete_item(self, item_id: str, partition_key, timeout: float | None = None) -> bool:
+        try:
+            await self._call(lambda container: container.delete_item(item=item_id, partition_key=partition_key,
+                                                                     response_hook=self._record_charge),
+                             timeout, "delete", item_level=True)
+            return True
+        except exceptions.CosmosResourceNotFoundError:
+            return False
+
+    async def query_items(self, query: str, parameters: list[dict] | None = None,
+                          timeout: float | None = None) -> list:
+        """Exécute une requête (cross-partition) et draine tous les résultats sous un seul timeout."""
+
+        async def drain(container):
+            return [item async for item in container.query_items(
+                query=query, parameters=parameters, response_hook=self._record_charge)]
+
+        return await self._call(drain, timeout if timeout is not None else self.query_timeout, "query")
+
+    async def query_value(self, query: str, parameters: list[dict] | None = None,
+                          timeout: float | None = None):
+        """Premier résultat d'une requête SELECT VALUE (ou None)."""
+        results = await self.query_items(query, parameters=parameters, timeout=timeout)
+        return results[0] if results else None
+
+    async def query_pages(self, query: str, parameters: list[dict] | None = None, page_size: int = 100,
+                          continuation_token: str | None = None, timeout: float | None = None,
+                          on_request_charge=None):
+        """Itère les pages d'une requête : (documents, jeton de continuation). Timeout par page.
+
+        `on_request_charge(ru)` reçoit le coût de chaque réponse de cette requête seulement. Si le
+        conteneur manque dès la première page, reconnexion puis nouvel essai (au-delà, l'erreur remonte).
+        """
+
+        def record_charge(headers, *args):
+            before = self.total_request_charge
+            self._record_charge(headers, *args)
+            if on_request_charge:
+                on_request_charge(self.total_request_charge - before)
+
+        first_page = True
+        while True:
+            container = self._require_container()
+            pager = container.query_items(query=query, parameters=parameters, max_item_count=page_size,
+                                          response_hook=record_charge).by_page(continuation_token)
+            pages = pager.__aiter__()
+            try:
+                while True:
+                    try:
+                        page = await self._bounded(pages.__anext__(),
+                                                   timeout if timeout is not None else self.query_timeout, "query page")
+                    except StopAsyncIteration:
+                        return
+                    first_page = False
+                    yield [item async for item in page], pager.continuation_token
+            except exceptions.CosmosResourceNotFoundError:
+                if not first_page:
+                    raise
+                first_page = False
+                await self._reconnect(container)
+
+    async def delete_message(self, channel_id, message_id, timeout: float | None = None) -> bool:
+        return await self.delete_item(str(message_id), self.layout.message_partition_key(channel_id, message_id),
+                                      timeout=timeout)
+
+
+def estimate_request_charge(operation: str, payload_bytes: int = 0, scanned_documents: int = 0) -> float:
+    """Coût RU approximatif d'une opération (ordres de grandeur documentés pour Cosmos DB)."""
+    kilobytes = max(1.0, payload_bytes / 1024)
+    if operation == "upsert":
+        return 5.7 * kilobytes
+    if operation == "read":
+        return 1.0 * kilobytes
+    if operation == "delete":
+        return 5.7
+    # Requête cross-partition : coût fixe par partition plus lecture des documents parcourus.
+    return 2.8 + 0.05 * scanned_documents + kilobytes
+
+
+class InMemoryCosmosRepository:
+    """Double de test du dépôt : documents en mémoire, requêtes évaluées par cosmos_sql.
+
+    Simule une latence par appel et un coût RU estimé (`total_request_charge`), pour comparer des
+    stratégies d'accès sans Azure.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, layout: ContainerLayout = LAYOUT_V1):
+        self.latency_seconds = latency_seconds
+        self.layout = layout
+        self.documents: dict[str, dict] = {}
+        self.call_counts = {"upsert": 0, "read": 0, "delete": 0, "query": 0}
+        self.total_request_charge = 0.0
+
+    @property
+    def is_connected(self) -> bool:
+        return True
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def _simulate_latency(self):
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        else:
+            await asyncio.sleep(0)
+
+    async def upsert_item(self, body: dict, timeout: float | None = None) -> dict:
+        await self._simulate_latency()
+        self.call_counts["upsert"] += 1
+        self.total_request_charge += estimate_request_charge("upsert", len(json.dumps(body, default=str)))
+        stored = copy.deepcopy(self.layout.prepare(body))
+        stored["_ts"] = int(time.time())  # Horodatage serveur de la dernière écriture, comme Cosmos.
+        self.documents[str(stored["id"])] = stored
+        return copy.deepcopy(stored)
+
+    async def read_item(self, item_id: str, partition_key, timeout: float | None = None) -> dict | None:
+        await self._simulate_latency()
+        self.call_counts["read"] += 1
+        self.total_request_charge += estimate_request_charge("read")
+        doc = self.documents.get(str(item_id))
+        return copy.deepcopy(doc) if doc is not None else None
+
+    async def delete_item(self, item_id: str, partition_key, timeout: float | None = None) -> bool:
+        await self._simulate_latency()
+        self.call_counts["delete"] += 1
+        self.total_request_charge += estimate_request_charge("delete")
+        return self.documents.pop(str(item_id), None) is not None
+
+    async def query_items(self, query: str, parameters: list[dict] | None = None,
+                          timeout: float | None = None) -> list:
+        await self._simulate_latency()
+        self.call_counts["query"] += 1
+        results = cosmos_sql.execute(query, self.documents.values(), parameters)
+        self.total_request_charge += estimate_request_charge(
+            "query", len(json.dumps(results, default=str)), scanned_documents=len(self.documents))
+        return copy.deepcopy(results)
+
+    async def query_value(self, query: str, parameters: list[dict] | None = None,
+                          timeout: float | None = None):
+        results = await self.query_items(query, parameters=parameters, timeout=timeout)
+        return results[0] if results else None
+
+    async def query_pages(self, query: str, parameters: list[dict] | None = None, page_size: int = 100,
+                          continuation_token: str | None = None, timeout: float | None = None,
+                          on_request_charge=None):
+        # Coût facturé page par page, comme Cosmos : arrêter l'itération tôt économise des RU.
+        self.call_counts["query"] += 1
+        results = cosmos_sql.execute(query, self.documents.values(), parameters)
+        offset = int(continuation_token or 0)
+        while offset < len(results):
+            page = copy.deepcopy(results[offset:offset + page_size])
+            offset += len(page)
+            await self._simulate_latency()
+            charge = estimate_request_charge("query", len(json.dumps(page, default=str)),
+                                             scanned_documents=len(self.documents) * len(page) // max(len(results), 1))
+            self.total_request_charge += charge
+            if on_request_charge:
+                on_request_charge(charge)
+            yield page, (str(offset) if offset < len(results) else None)
+
+    async def delete_message(self, channel_id, message_id, timeout: float | None = None) -> bool:
+        return await self.delete_item(str(message_id), self.layout.message_partition_key(channel_id, message_id))
+
+
+class DualWriteRepository:
+    """Dépôt de bascule entre deux conteneurs : écrit dans les deux, lit dans celui choisi.
+
+    Pendant la migration v1 -> v2, les écritures du bot (backfill, temps réel) arrivent dans les deux
+    dispositions ; `read_from_secondary` bascule les lectures sans redémarrer l'ingestion.
+    """
+
+    def __init__(self, primary, secondary, read_from_secondary: bool = False):
+        self.primary = primary
+        self.secondary = secondary
+        self.read_from_secondary = read_from_secondary
+
+    @property
+    def reader(self):
+        return self.secondary if self.read_from_secondary else self.primary
+
+    @property
+    def layout(self):
+        return self.reader.layout
+
+    @property
+    def is_connected(self) -> bool:
+        return self.primary.is_connected and self.secondary.is_connected
+
+    @property
+    def total_request_charge(self) -> float:
+        return self.primary.total_request_charge + self.secondary.total_request_charge
+
+    async def connect(self):
+        await asyncio.gather(self.primary.connect(), self.secondary.connect())
+
+    async def close(self):
+        await asyncio.gather(self.primary.close(), self.secondary.close())
+
+    async def upsert_item(self, body: dict, timeout: float | None = None) -> dict:
+        results = await asyncio.gather(self.primary.upsert_item(body, timeout=timeout),
+                                       self.secondary.upsert_item(body, timeout=timeout))
+        return results[1] if self.read_from_secondary else results[0]
+
+    async def delete_message(self, channel_id, message_id, timeout: float | None = None) -> bool:
+        results = await asyncio.gather(self.primary.delete_message(channel_id, message_id, timeout=timeout),
+                                       self.secondary.delete_message(channel_id, message_id, timeout=timeout))
+        return any(results)
+
+    async def delete_item(self, item_id: str, partition_key, timeout: float | None = None) -> bool:
+        # Documents hors messages (pk = id dans les deux dispositions).
+        results = await asyncio.gather(self.primary.delete_item(item_id, partition_key, timeout=timeout),
+                                       self.secondary.delete_item(item_id, partition_key, timeout=timeout))
+        return any(results)
+
+    async def read_item(self, item_id: str, partition_key, timeout: float | None = None) -> dict | None:
+        return await self.reader.read_item(item_id, partition_key, timeout=timeout)
+
+    async def query_items(self, query: str, parameters: list[dict] | None = None, timeout: float | None = None) -> list:
+        return await self.reader.query_items(query, parameters=parameters, timeout=timeout)
+
+    async def query_value(self, query: str, parameters: list[dict] | None = None, timeout: float | None = None):
+        return await self.reader.query_value(query, parameters=parameters, timeout=timeout)
+
+    def query_pages(self, query: str, parameters: list[dict] | None = None, page_size: int = 100,
+                    continuation_token: str | None = None, timeout: float | None = None, on_request_charge=None):
+        return self.reader.query_pages(query, parameters=parameters, page_size=page_size,
+                                       continuation_token=continuation_token, timeout=timeout,
+                                       on_request_charge=on_request_charge)
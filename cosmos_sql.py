@@ -0,0 +1,711 @@
+"""Analyseur et évaluateur local du sous-ensemble SQL Cosmos DB produit par get_ai_analysis.
+
+Couvre ce que le prompt de génération SQL demande au modèle : SELECT [TOP N] (*, VALUE ..., liste
+de champs), WHERE avec AND/OR/NOT, comparaisons, coalescence `??`, IN, BETWEEN, CONTAINS/STARTSWITH/ENDSWITH,
+agrégats (COUNT, MAX, MIN, SUM, AVG), GROUP BY, ORDER BY et OFFSET/LIMIT.
+Sert de moteur pour le double en mémoire du dépôt Cosmos et pour les réécritures de requêtes.
+"""
+import re
+from dataclasses import dataclass, field
+
+
+class CosmosSqlError(ValueError):
+    """Requête hors du sous-ensemble SQL supporté localement."""
+
+
+class _Undefined:
+    """Valeur 'undefined' de Cosmos (champ absent) : se propage dans les expressions."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __repr__(self):
+        return "UNDEFINED"
+
+    def __bool__(self):
+        return False
+
+
+UNDEFINED = _Undefined()
+
+AGGREGATE_FUNCTIONS = {"COUNT", "MAX", "MIN", "SUM", "AVG"}
+
+
+@dataclass
+class Literal:
+    value: object
+
+
+@dataclass
+class Parameter:
+    name: str
+
+
+@dataclass
+class Path:
+    parts: tuple
+
+    @property
+    def field_name(self) -> str:
+        """Nom de propriété de premier niveau (ex: 'author_name' pour c.author_name)."""
+        return self.parts[0] if self.parts else ""
+
+
+@dataclass
+class Call:
+    name: str
+    args: list
+
+
+@dataclass
+class Unary:
+    op: str
+    operand: object
+
+
+@dataclass
+class Binary:
+    op: str
+    left: object
+    right: object
+
+
+@dataclass
+class InList:
+    operand: object
+    values: list
+    negated: bool = False
+
+
+@dataclass
+class Between:
+    operand: object
+    low: object
+    high: object
+    negated: bool = False
+
+
+@dataclass
+class Projection:
+    expr: object
+    alias: str | None = None
+
+
+@dataclass
+class Query:
+    projections: list | None = None  # None = SELECT *
+    value: bool = False
+    top: int | None = None
+    where: object = None
+    group_by: list = field(default_factory=list)
+    order_by: list = field(default_factory=list)  # [(expr, descending)]
+    offset: int | None = None
+    limit: int | None = None
+    alias: str = "c"
+
+    @property
+    def is_aggregate(self) -> bool:
+        if self.group_by:
+            return True
+        return any(contains_aggregate(p.expr) for p in (self.projections or []))
+
+    @property
+    def is_count(self) -> bool:
+        return (self.value and len(self.projections or []) == 1
+                and isinstance(self.projections[0].expr, Call) and self.projections[0].expr.name == "COUNT"
+                and not self.group_by)
+
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<param>@[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op><=|>=|!=|<>|\|\||\?\?|[=<>(),.*\[\]+\-/%])
+""", re.VERBOSE)
+
+_KEYWORDS = {"SELECT", "TOP", "VALUE", "FROM", "WHERE", "AND", "OR", "NOT", "IN", "BETWEEN", "ORDER",
+             "BY", "ASC", "DESC", "GROUP", "OFFSET", "LIMIT", "AS", "TRUE", "FALSE", "NULL", "DISTINCT",
+             "JOIN", "EXISTS", "UNDEFINED"}
+
+_STRING_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", '"': '"', "'": "'", "/": "/", "b": "\b", "f": "\f"}
+
+
+def _unescape_string(raw: str) -> str:
+    body = raw[1:-1]
+    return re.sub(r"\\(.)", lambda m: _STRING_ESCAPES.get(m.group(1), m.group(1)), body)
+
+
+def _tokenize(sql: str) -> list[tuple[str, object]]:
+    tokens, pos = [], 0
+    while pos < len(sql):
+        m = _TOKEN_RE.match(sql, pos)
+        if not m:
+            raise CosmosSqlError(f"Caractère inattendu à la position {pos}: {sql[pos:pos + 20]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        text = m.group(kind)
+        if kind == "ws":
+            continue
+        if kind == "number":
+            tokens.append(("literal", float(text) if any(ch in text for ch in ".eE") else int(text)))
+        elif kind == "string":
+            tokens.append(("literal", _unescape_string(text)))
+        elif kind == "param":
+            tokens.append(("param", text))
+        elif kind == "ident":
+            upper = text.upper()
+            if upper in _KEYWORDS:
+                tokens.append(("kw", upper))
+            else:
+                tokens.append(("ident", text))
+        else:
+            tokens.append(("op", text))
+    tokens.append(("eof", None))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, sql: str):
+        self.tokens = _tokenize(sql)
+        self.pos = 0
+        self.alias = "c"
+
+    def peek(self, offset: int = 0):
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)]
+
+    def advance(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def accept(self, kind: str, value=None) -> bool:
+        tok_kind, tok_value = self.peek()
+        if tok_kind == kind and (value is None or tok_value == value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, kind: str, value=None):
+        tok_kind, tok_value = self.peek()
+        if tok_kind != kind or (value is not None and tok_value != value):
+            raise CosmosSqlError(f"Attendu {value or kind}, trouvé {tok_value!r}")
+        return self.advance()
+
+    def parse_query(self) -> Query:
+        query = Query()
+        self.expect("kw", "SELECT")
+        if self.accept("kw", "DISTINCT"):
+            raise CosmosSqlError("SELECT DISTINCT non supporté localement")
+        if self.accept("kw", "TOP"):
+            query.top = int(self._expect_number())
+        if self.accept("kw", "VALUE"):
+            query.value = True
+            query.projections = [Projection(self.parse_expr())]
+        elif self.accept("op", "*"):
+            query.projections = None
+        else:
+            query.projections = [self._parse_projection()]
+            while self.accept("op", ","):
+                query.projections.append(self._parse_projection())
+        self.expect("kw", "FROM")
+        _, self.alias = self.expect("ident")
+        query.alias = self.alias
+        if self.peek() == ("kw", "JOIN"):
+            raise CosmosSqlError("JOIN non supporté localement")
+        if self.accept("kw", "WHERE"):
+            query.where = self.parse_expr()
+        if self.accept("kw", "GROUP"):
+            self.expect("kw", "BY")
+            query.group_by.append(self.parse_expr())
+            while self.accept("op", ","):
+                query.group_by.append(self.parse_expr())
+        if self.accept("kw", "ORDER"):
+            self.expect("kw", "BY")
+            query.order_by.append(self._parse_order_item())
+            while self.accept("op", ","):
+                query.order_by.append(self._parse_order_item())
+        if self.accept("kw", "OFFSET"):
+            query.offset = int(self._expect_number())
+            self.expect("kw", "LIMIT")
+            query.limit = int(self._expect_number())
+        if self.peek()[0] != "eof":
+            raise CosmosSqlError(f"Jeton inattendu après la requête: {self.peek()[1]!r}")
+        return query
+
+    def _expect_number(self):
+        kind, value = self.advance()
+        if kind != "literal" or not isinstance(value, (int, float)):
+            raise CosmosSqlError(f"Nombre attendu, trouvé {value!r}")
+        return value
+
+    def _parse_projection(self) -> Projection:
+        expr = self.parse_expr()
+        alias = None
+        if self.accept("kw", "AS"):
+            _, alias = self.expect("ident")
+        return Projection(expr, alias)
+
+    def _parse_order_item(self):
+        expr = self.parse_expr()
+        descending = False
+        if self.accept("kw", "DESC"):
+            descending = True
+        else:
+            self.accept("kw", "ASC")
+        return (expr, descending)
+
+    def parse_expr(self):
+        return self._parse_or()
+
+    def _parse_or(self):
+        node = self._parse_and()
+        while self.accept("kw", "OR"):
+            node = Binary("OR", node, self._parse_and())
+        return node
+
+    def _parse_and(self):
+        node = self._parse_not()
+        while self.accept("kw", "AND"):
+            node = Binary("AND", node, self._parse_not())
+        return node
+
+    def _parse_not(self):
+        if self.accept("kw", "NOT"):
+            return Unary("NOT", self._parse_not())
+        return self._parse_comparison()
+
+    def _parse_comparison(self):
+        left = self._parse_coalesce()
+        negated = False
+        if self.peek() == ("kw", "NOT") and self.peek(1)[1] in ("IN", "BETWEEN"):
+            self.advance()
+            negated = True
+        if self.accept("kw", "IN"):
+            self.expect("op", "(")
+            values = [self.parse_expr()]
+            while self.accept("op", ","):
+                values.append(self.parse_expr())
+            self.expect("op", ")")
+            return InList(left, values, negated)
+        if self.accept("kw", "BETWEEN"):
+            low = self._parse_additive()
+            self.expect("kw", "AND")
+            high = self._parse_additive()
+            return Between(left, low, high, negated)
+        kind, value = self.peek()
+        if kind == "op" and value in ("=", "!=", "<>", "<", "<=", ">", ">="):
+            self.advance()
+            return Binary("!=" if value == "<>" else value, left, self._parse_coalesce())
+        return left
+
+    def _parse_coalesce(self):
+        node = self._parse_additive()
+        while self.accept("op", "??"):
+            node = Binary("??", node, self._parse_additive())
+        return node
+
+    def _parse_additive(self):
+        node = self._parse_multiplicative()
+        while self.peek()[0] == "op" and self.peek()[1] in ("+", "-", "||"):
+            _, op = self.advance()
+            node = Binary(op, node, self._parse_multiplicative())
+        return node
+
+    def _parse_multiplicative(self):
+        node = self._parse_primary()
+        while self.peek()[0] == "op" and self.peek()[1] in ("*", "/", "%"):
+            _, op = self.advance()
+            node = Binary(op, node, self._parse_primary())
+        return node
+
+    def _parse_primary(self):
+        kind, value = self.advance()
+        if kind == "literal":
+            return Literal(value)
+        if kind == "param":
+            return Parameter(value)
+        if kind == "kw" and value in ("TRUE", "FALSE"):
+            return Literal(value == "TRUE")
+        if kind == "kw" and value == "NULL":
+            return Literal(None)
+        if kind == "kw" and value == "UNDEFINED":
+            return Literal(UNDEFINED)
+        if kind == "op" and value == "(":
+            node = self.parse_expr()
+            self.expect("op", ")")
+            return node
+        if kind == "op" and value == "-":
+            return Binary("-", Literal(0), self._parse_primary())
+        if kind == "ident":
+            if self.peek() == ("op", "("):
+                self.advance()
+                args = []
+                if not self.accept("op", ")"):
+                    args.append(self.parse_expr())
+                    while self.accept("op", ","):
+                        args.append(self.parse_expr())
+                    self.expect("op", ")")
+                return Call(value.upper(), args)
+            return self._parse_path(value)
+        raise CosmosSqlError(f"Expression inattendue: {value!r}")
+
+    def _parse_path(self, root: str):
+        parts = []
+        while True:
+            if self.accept("op", "."):
+                _, name = self.expect("ident") if self.peek()[0] == "ident" else self.advance()
+                parts.append(str(name))
+            elif self.accept("op", "["):
+                _, key = self.expect("literal")
+                self.expect("op", "]")
+                parts.append(key)
+            else:
+                break
+        return Path((root,) + tuple(parts))
+
+
+def _strip_alias(node, alias: str):
+    """Retire l'alias du conteneur (c) en tête des chemins, une fois l'alias connu."""
+    if isinstance(node, Path):
+        if node.parts and node.parts[0] == alias:
+            return Path(tuple(node.parts[1:]))
+        raise CosmosSqlError(f"Référence inconnue: {'.'.join(map(str, node.parts))}")
+    if isinstance(node, Call):
+        return Call(node.name, [_strip_alias(a, alias) for a in node.args])
+    if isinstance(node, Unary):
+        return Unary(node.op, _strip_alias(node.operand, alias))
+    if isinstance(node, Binary):
+        return Binary(node.op, _strip_alias(node.left, alias), _strip_alias(node.right, alias))
+    if isinstance(node, InList):
+        return InList(_strip_alias(node.operand, alias), [_strip_alias(v, alias) for v in node.values], node.negated)
+    if isinstance(node, Between):
+        return Between(_strip_alias(node.operand, alias), _strip_alias(node.low, alias),
+                       _strip_alias(node.high, alias), node.negated)
+    return node
+
+
+def parse(sql: str) -> Query:
+    """Analyse une requête Cosmos SQL. Lève CosmosSqlError si elle sort du sous-ensemble supporté."""
+    parser = _Parser(sql.strip().rstrip(";"))
+    query = parser.parse_query()
+    alias = query.alias
+    if query.projections is not None:
+        query.projections = [Projection(_strip_alias(p.expr, alias), p.alias) for p in query.projections]
+    query.where = _strip_alias(query.where, alias) if query.where is not None else None
+    query.group_by = [_strip_alias(g, alias) for g in query.group_by]
+    query.order_by = [(_strip_alias(e, alias), d) for e, d in query.order_by]
+    return query
+
+
+def contains_aggregate(node) -> bool:
+    if isinstance(node, Call):
+        return node.name in AGGREGATE_FUNCTIONS or any(contains_aggregate(a) for a in node.args)
+    if isinstance(node, Unary):
+        return contains_aggregate(node.operand)
+    if isinstance(node, Binary):
+        return contains_aggregate(node.left) or contains_aggregate(node.right)
+    return False
+
+
+def referenced_fields(query: Query) -> set[str]:
+    """Propriétés de premier niveau lues par la requête (hors SELECT *)."""
+    found = set()
+
+    def visit(node):
+        if isinstance(node, Path):
+            if node.parts:
+                found.add(str(node.parts[0]))
+        elif isinstance(node, Call):
+            for a in node.args:
+                visit(a)
+        elif isinstance(node, Unary):
+            visit(node.operand)
+        elif isinstance(node, Binary):
+            visit(node.left)
+            visit(node.right)
+        elif isinstance(node, InList):
+            visit(node.operand)
+            for v in node.values:
+                visit(v)
+        elif isinstance(node, Between):
+            visit(node.operand)
+            visit(node.low)
+            visit(node.high)
+
+    for p in query.projections or []:
+        visit(p.expr)
+    visit(query.where)
+    for g in query.group_by:
+        visit(g)
+    for e, _ in query.order_by:
+        visit(e)
+    return found
+
+
+# ----- Évaluation -----
+
+def _type_rank(value) -> int:
+    if value is UNDEFINED:
+        return 0
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 2
+    if isinstance(value, (int, float)):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, list):
+        return 5
+    return 6
+
+
+def _sort_key(value):
+    rank = _type_rank(value)
+    if rank in (2, 3, 4):
+        return (rank, value)
+    return (rank, 0)
+
+
+def _comparable(a, b) -> bool:
+    if a is UNDEFINED or b is UNDEFINED:
+        return False
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool)
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return True
+    return type(a) is type(b) and isinstance(a, str)
+
+
+def _string_call(name: str, args: list):
+    if any(a is UNDEFINED for a in args[:2]) or not all(isinstance(a, str) for a in args[:2]):
+        return UNDEFINED
+    text, needle = args[0], args[1]
+    if len(args) > 2 and args[2] is True:
+        text, needle = text.lower(), needle.lower()
+    if name == "CONTAINS":
+        return needle in text
+    if name == "STARTSWITH":
+        return text.startswith(needle)
+    return text.endswith(needle)
+
+
+def _scalar_call(name: str, args: list):
+    if name in ("CONTAINS", "STARTSWITH", "ENDSWITH"):
+        return _string_call(name, args)
+    if name == "LOWER":
+        return args[0].lower() if isinstance(args[0], str) else UNDEFINED
+    if name == "UPPER":
+        return args[0].upper() if isinstance(args[0], str) else UNDEFINED
+    if name == "LENGTH":
+        return len(args[0]) if isinstance(args[0], str) else UNDEFINED
+    if name == "ARRAY_LENGTH":
+        return len(args[0]) if isinstance(args[0], list) else UNDEFINED
+    if name == "IS_DEFINED":
+        return args[0] is not UNDEFINED
+    if name == "IS_NULL":
+        return args[0] is None
+    if name == "SUBSTRING":
+        if not isinstance(args[0], str):
+            return UNDEFINED
+        return args[0][int(args[1]):int(args[1]) + int(args[2])]
+    if name == "LEFT":
+        return args[0][:int(args[1])] if isinstance(args[0], str) else UNDEFINED
+    if name == "ARRAY_CONTAINS":
+        return isinstance(args[0], list) and args[1] in args[0]
+    raise CosmosSqlError(f"Fonction non supportée localement: {name}")
+
+
+def _lookup(doc, parts):
+    current = doc
+    for part in parts:
+        if isinstance(current, dict) and part in current:
+            current = current[part]
+        elif isinstance(current, list) and isinstance(part, int) and 0 <= part < len(current):
+            current = current[part]
+        else:
+            return UNDEFINED
+    return current
+
+
+def evaluate(node, doc: dict, params: dict | None = None):
+    """Évalue une expression (sans agrégat) sur un document."""
+    if isinstance(node, Literal):
+        return node.value
+    if isinstance(node, Parameter):
+        if not params or node.name not in params:
+            raise CosmosSqlError(f"Paramètre non fourni: {node.name}")
+        return params[node.name]
+    if isinstance(node, Path):
+        return _lookup(doc, node.parts) if node.parts else doc
+    if isinstance(node, Unary):
+        value = evaluate(node.operand, doc, params)
+        return (not value) if isinstance(value, bool) else UNDEFINED
+    if isinstance(node, Binary):
+        if node.op in ("AND", "OR"):
+            left = evaluate(node.left, doc, params)
+            if node.op == "AND" and left is False:
+                return False
+            if node.op == "OR" and left is True:
+                return True
+            right = evaluate(node.right, doc, params)
+            if node.op == "AND":
+                if right is False:
+                    return False
+                return True if (left is True and right is True) else UNDEFINED
+            if right is True:
+                return True
+            return False if (left is False and right is False) else UNDEFINED
+        if node.op == "??":
+            left = evaluate(node.left, doc, params)
+            return left if left is not UNDEFINED else evaluate(node.right, doc, params)
+        left, right = evaluate(node.left, doc, params), evaluate(node.right, doc, params)
+        if node.op in ("=", "!="):
+            if left is UNDEFINED or right is UNDEFINED:
+                return UNDEFINED
+            equal = _type_rank(left) == _type_rank(right) and left == right
+            return equal if node.op == "=" else not equal
+        if node.op in ("<", "<=", ">", ">="):
+            if not _comparable(left, right):
+                return UNDEFINED
+            return {"<": left < right, "<=": left <= right, ">": left > right, ">=": left >= right}[node.op]
+        if node.op == "||":
+            return left + right if isinstance(left, str) and isinstance(right, str) else UNDEFINED
+        if not (isinstance(left, (int, float)) and isinstance(right, (int, float))):
+            return UNDEFINED
+        if node.op == "+":
+            return left + right
+        if node.op == "-":
+            return left - right
+        if node.op == "*":
+            return left * right
+        if node.op == "/":
+            return left / right if right else UNDEFINED
+        return left % right if right else UNDEFINED
+    if isinstance(node, InList):
+        value = evaluate(node.operand, doc, params)
+        if value is UNDEFINED:
+            return UNDEFINED
+        found = any(_type_rank(value) == _type_rank(v) and value == v
+                    for v in (evaluate(x, doc, params) for x in node.values))
+        return (not found) if node.negated else found
+    if isinstance(node, Between):
+        value = evaluate(node.operand, doc, params)
+        low, high = evaluate(node.low, doc, params), evaluate(node.high, doc, params)
+        if not (_comparable(value, low) and _comparable(value, high)):
+            return UNDEFINED
+        inside = low <= value <= high
+        return (not inside) if node.negated else inside
+    if isinstance(node, Call):
+        if node.name in AGGREGATE_FUNCTIONS:
+            raise CosmosSqlError(f"Agrégat {node.name} hors d'un contexte d'agrégation")
+        return _scalar_call(node.name, [evaluate(a, doc, params) for a in node.args])
+    raise CosmosSqlError(f"Noeud non évaluable: {node!r}")
+
+
+def _aggregate(node, group: list, params: dict | None):
+    if isinstance(node, Call) and node.name in AGGREGATE_FUNCTIONS:
+        if node.name == "COUNT":
+            if not node.args or isinstance(node.args[0], Literal):
+                return len(group)
+            return sum(1 for d in group if evaluate(node.args[0], d, params) is not UNDEFINED)
+        values = [evaluate(node.args[0], d, params) for d in group]
+        values = [v for v in values if v is not UNDEFINED]
+        if node.name in ("SUM", "AVG"):
+            numbers = [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+            if not numbers:
+                return UNDEFINED if node.name == "AVG" or values else 0
+            return sum(numbers) if node.name == "SUM" else sum(numbers) / len(numbers)
+        if not values:
+            return UNDEFINED
+        pick = max if node.name == "MAX" else min
+        return pick(values, key=_sort_key)
+    if isinstance(node, Binary):
+        return evaluate(Binary(node.op, Literal(_aggregate(node.left, group, params)),
+                               Literal(_aggregate(node.right, group, params))), {}, params)
+    return evaluate(node, group[0] if group else {}, params)
+
+
+def _projection_name(projection: Projection, index: int) -> str:
+    if projection.alias:
+        return projection.alias
+    if isinstance(projection.expr, Path) and projection.expr.parts:
+        return str(projection.expr.parts[-1])
+    return f"${index + 1}"
+
+
+def _project(query: Query, doc_or_group, params, aggregate: bool):
+    def value_of(expr):
+        if aggregate:
+            return _aggregate(expr, doc_or_group, params)
+        return evaluate(expr, doc_or_group, params)
+
+    if query.projections is None:
+        return doc_or_group
+    if query.value:
+        return value_of(query.projections[0].expr)
+    row = {}
+    for index, projection in enumerate(query.projections):
+        value = value_of(projection.expr)
+        if value is not UNDEFINED:
+            row[_projection_name(projection, index)] = value
+    return row
+
+
+def execute(query: Query | str, documents, parameters: list[dict] | dict | None = None) -> list:
+    """Exécute la requête sur un itérable de documents et renvoie la liste des résultats."""
+    if isinstance(query, str):
+        query = parse(query)
+    if isinstance(parameters, list):
+        params = {p["name"]: p["value"] for p in parameters}
+    else:
+        params = parameters or {}
+
+    if query.where is not None:
+        matched = [d for d in documents if evaluate(query.where, d, params) is True]
+    else:
+        matched = list(documents)
+
+    if query.is_aggregate:
+        if query.group_by:
+            groups: dict = {}
+            for doc in matched:
+                key = tuple(repr(evaluate(g, doc, params)) for g in query.group_by)
+                groups.setdefault(key, []).append(doc)
+            rows = [_project(query, group, params, aggregate=True) for group in groups.values()]
+        else:
+            rows = [_project(query, matched, params, aggregate=True)]
+        rows = [r for r in rows if r is not UNDEFINED]
+        # Cosmos refuse ORDER BY avec GROUP BY ; localement on trie sur la projection correspondante.
+        for expr, descending in reversed(query.order_by):
+            rows.sort(key=lambda r: _sort_key(_lookup_projected(query, r, expr) if isinstance(r, dict) else r),
+                      reverse=descending)
+    else:
+        for expr, descending in reversed(query.order_by):
+            matched.sort(key=lambda d: _sort_key(evaluate(expr, d, params)), reverse=descending)
+        if query.order_by:
+            # Cosmos exclut des résultats triés les documents sans la propriété de tri.
+            first_expr = query.order_by[0][0]
+            matched = [d for d in matched if evaluate(first_expr, d, params) is not UNDEFINED]
+        rows = [_project(query, d, params, aggregate=False) for d in matched]
+        if query.value:
+            rows = [r for r in rows if r is not UNDEFINED]
+
+    if query.offset is not None:
+        rows = rows[query.offset:query.offset + (query.limit or 0)]
+    if query.top is not None:
+        rows = rows[:query.top]
+    return rows
+
+
+def _lookup_projected(query: Query, row: dict, expr):
+    for index, projection in enumerate(query.projections or []):
+        if projection.expr == expr or (isinstance(expr, Path) and expr.parts
+                                       and _projection_name(projection, index) == expr.parts[-1]):
+            return row.get(_projection_name(projection, index), UNDEFINED)
+    return UNDEFINED
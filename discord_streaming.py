@@ -0,0 +1,144 @@
+"""Affichage progressif d'un texte généré dans un embed Discord.
+
+Le texte reçu par morceaux est affiché dès le premier morceau (envoi d'un message), puis le même
+message est édité au plus une fois par `min_edit_interval` secondes : Discord limite les éditions à
+environ 5 toutes les 5 secondes par salon, et les morceaux arrivés entre deux éditions sont regroupés.
+Au-delà de `max_chars` (4096 max pour une description d'embed), le texte continue dans un nouveau
+message au lieu d'être tronqué, coupé de préférence entre deux paragraphes ou deux phrases.
+"""
+import asyncio
+import time
+
+import discord
+
+EMBED_DESCRIPTION_LIMIT = 4000
+CURSOR = " ▌"
+
+
+def split_for_embed(text: str, limit: int) -> tuple[str, str]:
+    """Coupe `text` en (tête <= limit, reste), sur un paragraphe, une phrase ou un espace si possible."""
+    if len(text) <= limit:
+        return text, ""
+    window = text[:limit]
+    for separator in ("\n\n", "\n", ". ", " "):
+        cut = window.rfind(separator)
+        if cut >= limit // 2:
+            cut += len(separator)
+            return text[:cut].rstrip(), text[cut:].lstrip()
+    return window, text[limit:]
+
+
+class StreamingEmbedWriter:
+    """`send(embed=...)` envoie un nouveau message (ex: ctx.send) et renvoie le discord.Message."""
+
+    def __init__(self, send, title: str, continued_title: str = "Résumé (suite {page})", footer: str | None = None,
+                 color: discord.Color | None = None, max_chars: int = EMBED_DESCRIPTION_LIMIT,
+                 min_edit_interval: float = 1.0, on_error=None):
+        self.send = send
+        self.title = title
+        self.continued_title = continued_title
+        self.footer = footer
+        self.color = color or discord.Color.blue()
+        self.max_chars = max_chars
+        self.min_edit_interval = min_edit_interval
+        self.on_error = on_error
+        self.pages: list[str] = [""]
+        self.messages: list[discord.Message] = []
+        self._rendered: list[str] = []
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.started_at = time.monotonic()
+        self.first_visible_seconds: float | None = None
+        self.edits = 0
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.pages)
+
+    def _embed(self, index: int, description: str, final: bool) -> discord.Embed:
+        title = self.title if index == 0 else self.continued_title.format(page=index + 1)
+        embed = discord.Embed(title=title, description=description, color=self.color, timestamp=discord.utils.utcnow())
+        if final and self.footer and index == len(self.pages) - 1:
+            embed.set_footer(text=self.footer)
+        return embed
+
+    def _reflow(self):
+        limit = self.max_chars - len(CURSOR)
+        while len(self.pages[-1]) > limit:
+            head, tail = split_for_embed(self.pages[-1], limit)
+            self.pages[-1] = head
+            self.pages.append(tail)
+
+    async def append(self, delta: str):
+        """Ajoute un morceau ; ne bloque pas sur Discord (l'affichage se fait en tâche de fond)."""
+        if not delta:
+            return
+        self.pages[-1] += delta
+        self._reflow()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._changed.set()
+
+    async def _sync(self, final: bool):
+        for index, page in enumerate(self.pages):
+            if not page.strip():
+                continue
+            last = index == len(self.pages) - 1
+            rendered = page if final or not last else page + CURSOR
+            if index < len(self._rendered) and self._rendered[index] == rendered:
+                continue
+            embed = self._embed(index, rendered, final)
+            try:
+                if index < len(self.messages):
+                    await self.messages[index].edit(embed=embed)
+                    self.edits += 1
+                else:
+                    self.messages.append(await self.send(embed=embed))
+                    if self.first_visible_seconds is None:
+                        self.first_visible_seconds = time.monotonic() - self.started_at
+            except discord.HTTPException as e:
+                if self.on_error:
+                    await self.on_error(e)
+                if index >= len(self.messages):
+                    raise
+                continue
+            if index < len(self._rendered):
+                self._rendered[index] = rendered
+            else:
+                self._rendered.append(rendered)
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            await self._sync(final=False)
+            await asyncio.sleep(self.min_edit_interval)
+
+    async def finish(self, final_text: str | None = None, suffix: str = "") -> bool:
+        """Dernier affichage (sans curseur, avec le pied de page). Renvoie False si rien n'a été affiché.
+
+        `final_text` remplace le texte reçu par morceaux (ex: le résumé complet renvoyé par l'API).
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except discord.HTTPException:
+                pass
+        if final_text is not None:
+            self.pages = [final_text]
+        if suffix:
+            self.pages[-1] += suffix
+        self._reflow()
+        if not self.text.strip():
+            return False
+        await self._sync(final=True)
+        for extra in self.messages[len(self.pages):]:  # Texte final plus court que le texte diffusé.
+            try:
+                await extra.delete()
+            except discord.HTTPException:
+                pass
+        del self.messages[len(self.pages):]
+        return bool(self.messages)
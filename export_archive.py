@@ -0,0 +1,82 @@
+"""Export incrémental du conteneur des messages vers l'archive Parquet (parquet_archive).
+
+Chaque passe relit les messages écrits depuis la précédente, page par page, et les range par canal
+et par mois dans ARCHIVE_PATH. Le jeton de continuation est enregistré dans le fichier d'état local
+après chaque lot écrit : relancer la commande reprend une passe interrompue.
+
+Mise en place conseillée :
+  1. pip install pyarrow
+  2. python export_archive.py --ru-per-second 200   (première passe, relançable)
+  3. ARCHIVE_ENABLED=1 : le bot sert les agrégats historiques de !ask depuis l'archive.
+  4. Relancer l'export régulièrement (planificateur, une fois par jour) : seuls les documents écrits
+     depuis la dernière passe sont relus, y compris les anciens messages rattrapés entre-temps.
+     --full reconstruit tout (reprend les suppressions).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from checkpoints import DEFAULT_STATE_PATH
+from compact_schema import CompactRepository, DocumentHashStore
+from container_layout import LAYOUTS
+from cosmos_repository import CosmosRepository
+from ingestion import RequestUnitThrottle
+from parquet_archive import DEFAULT_ARCHIVE_PATH, ArchiveExporter, ArchiveProgressStore
+
+
+async def main_async(args):
+    load_dotenv()
+    endpoint, key = os.getenv("COSMOS_DB_ENDPOINT"), os.getenv("COSMOS_DB_KEY")
+    database_name, container_name = os.getenv("DATABASE_NAME"), os.getenv("CONTAINER_NAME")
+    if not all([endpoint, key, database_name, container_name]):
+        print("ERREUR: COSMOS_DB_ENDPOINT, COSMOS_DB_KEY, DATABASE_NAME et CONTAINER_NAME sont requis.")
+        return 1
+
+    state_path = os.getenv("LOCAL_STATE_PATH", DEFAULT_STATE_PATH)
+    raw = CosmosRepository(endpoint, key, database_name, container_name,
+                           layout=LAYOUTS[os.getenv("CONTAINER_LAYOUT", "v1")], query_timeout=args.page_timeout)
+    source = raw
+    if os.getenv("MESSAGE_SCHEMA", "v1").lower() == "v2":
+        source = CompactRepository(raw, DocumentHashStore(state_path, namespace=container_name),
+                                   mixed=os.getenv("MESSAGE_SCHEMA_UPGRADED", "0") != "1")
+    exporter = ArchiveExporter(args.path or os.getenv("ARCHIVE_PATH", DEFAULT_ARCHIVE_PATH), ArchiveProgressStore(state_path),
+                               flush_rows=args.flush_rows)
+    throttle = RequestUnitThrottle(args.ru_per_second) if args.ru_per_second else None
+    started = time.monotonic()
+
+    async def report(exported: int):
+        if throttle:
+            await throttle.wait(raw.total_request_charge)
+        elapsed = time.monotonic() - started
+        print(f"{exported} messages lus ({exported / max(elapsed, 1e-9):.0f}/s, {raw.total_request_charge:.0f} RU, "
+              f"{exporter.stats['bytes_written'] / 1e6:.1f} Mo écrits)")
+
+    try:
+        await raw.connect()
+        exported = await exporter.export(source, page_size=args.page_size, full=args.full, on_progress=report)
+        print(f"Export terminé : {exported} messages en {time.monotonic() - started:.0f}s, "
+              f"{exporter.stats['files_written']} fichiers écrits, {exporter.stats['partitions_rewritten']} partitions réécrites, "
+              f"{raw.total_request_charge:.0f} RU. Archive : {exporter.manifest['messages']} messages, "
+              f"{exporter.manifest['bytes'] / 1e6:.1f} Mo, complète jusqu'au {exporter.manifest['complete_until']}.")
+        return 0
+    finally:
+        await raw.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporte les messages du conteneur vers l'archive Parquet.")
+    parser.add_argument("--path", help=f"défaut: ARCHIVE_PATH ou {DEFAULT_ARCHIVE_PATH}")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--page-timeout", type=float, default=120.0)
+    parser.add_argument("--flush-rows", type=int, default=200_000, help="lignes gardées en mémoire avant écriture")
+    parser.add_argument("--ru-per-second", type=float, default=0, help="budget RU/s de lecture (0 = illimité)")
+    parser.add_argument("--full", action="store_true", help="vide l'archive et réexporte tout le conteneur")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
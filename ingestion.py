@@ -0,0 +1,344 @@
+"""Pipeline d'ingestion de l'historique d'un canal vers Cosmos DB.
+
+lecteur d'historique -> file bornée -> workers de formatage -> file bornée -> écrivain concurrent.
+Les files bornées donnent la contre-pression (le lecteur Discord attend si Cosmos ne suit pas) et
+l'écrivain garde au plus `max_in_flight` upserts en vol, freinés par un budget de RU/s.
+Le conteneur est partitionné sur /id : chaque message est sa propre partition, les batchs
+transactionnels Cosmos ne s'appliquent donc pas et le "batch" est une fenêtre d'upserts concurrents.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+_END = object()
+_FAILED = object()  # Écriture abandonnée après tous les essais : bloque le point de reprise.
+
+
+@dataclass
+class IngestionStats:
+    fetched: int = 0
+    formatted: int = 0
+    written: int = 0
+    failed: int = 0
+    checkpoint_blocked: bool = False  # Un message n'a pas pu être écrit : la passe suivante le reprendra.
+    request_charge: float = 0.0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float | None = None
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def messages_per_second(self) -> float:
+        elapsed = self.elapsed_seconds
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+
+class RequestUnitThrottle:
+    """Limite la consommation de RU/s en se basant sur le total de RU rapporté par le dépôt."""
+
+    def __init__(self, ru_per_second: float, burst_seconds: float = 1.0):
+        self.ru_per_second = ru_per_second
+        self.burst = ru_per_second * burst_seconds
+        self._started_at = None
+        self._start_charge = 0.0
+
+    async def wait(self, total_request_charge: float):
+        if not self.ru_per_second:
+            return
+        now = time.monotonic()
+        if self._started_at is None:
+            self._started_at, self._start_charge = now, total_request_charge
+            return
+        consumed = total_request_charge - self._start_charge
+        allowed = (now - self._started_at) * self.ru_per_second + self.burst
+        if consumed > allowed:
+            await asyncio.sleep((consumed - allowed) / self.ru_per_second)
+
+
+class BackfillPipeline:
+    """Ingestion concurrente d'un flux de messages Discord avec suivi d'un point de reprise ordonné.
+
+    `on_checkpoint(doc)` reçoit le document le plus récent tel que tous les messages précédents du flux
+    ont été écrits (ou ignorés faute de pouvoir être formatés) ; il est appelé au plus tous les
+    `checkpoint_every` messages et en fin de passe. Le point de reprise s'arrête avant le premier
+    upsert en échec après tous les essais : la passe suivante reprend à partir de ce message.
+    """
+
+    def __init__(self, repository, formatter, format_workers: int = 2, max_in_flight: int = 16,
+                 queue_size: int = 1000, ru_per_second: float | None = None, max_retries: int = 3,
+                 checkpoint_every: int = 100, progress_every: int = 500,
+                 on_progress=None, on_write_error=None, on_checkpoint=None):
+        self.repository = repository
+        self.formatter = formatter
+        self.format_workers = max(1, format_workers)
+        self.max_in_flight = max(1, max_in_flight)
+        self.queue_size = queue_size
+        self.throttle = RequestUnitThrottle(ru_per_second) if ru_per_second else None
+        self.max_retries = max_retries
+        self.checkpoint_every = checkpoint_every
+        self.progress_every = progress_every
+        self.on_progress = on_progress
+        self.on_write_error = on_write_error
+        self.on_checkpoint = on_checkpoint
+
+    async def run(self, history) -> IngestionStats:
+        stats = IngestionStats()
+        raw_queue = asyncio.Queue(maxsize=self.queue_size)
+        doc_queue = asyncio.Queue(maxsize=self.queue_size)
+        start_charge = getattr(self.repository, "total_request_charge", 0.0)
+
+        reader = asyncio.create_task(self._read(history, raw_queue, stats))
+        formatters = [asyncio.create_task(self._format(raw_queue, doc_queue, stats))
+                      for _ in range(self.format_workers)]
+        writer = asyncio.create_task(self._write(doc_queue, stats))
+        tasks = [reader, *formatters, writer]
+        try:
+            await self._await_stage([reader], tasks)
+            for _ in formatters:
+                await raw_queue.put(_END)
+            await self._await_stage(formatters, tasks)
+            await doc_queue.put(_END)
+            await self._await_stage([writer], tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            stats.finished_at = time.monotonic()
+            stats.request_charge = getattr(self.repository, "total_request_charge", 0.0) - start_charge
+        return stats
+
+    @staticmethod
+    async def _await_stage(stage: list[asyncio.Task], tasks: list[asyncio.Task]):
+        """Attend la fin d'une étape en remontant immédiatement l'erreur de n'importe quelle autre étape."""
+        while not all(task.done() for task in stage):
+            running = [task for task in tasks if not task.done()]
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception():
+                    raise task.exception()
+
+    async def _read(self, history, raw_queue: asyncio.Queue, stats: IngestionStats):
+        sequence = 0
+        async for message in history:
+            await raw_queue.put((sequence, message))
+            sequence += 1
+            stats.fetched = sequence
+
+    async def _format(self, raw_queue: asyncio.Queue, doc_queue: asyncio.Queue, stats: IngestionStats):
+        while True:
+            entry = await raw_queue.get()
+            if entry is _END:
+                return
+            sequence, message = entry
+            try:
+                doc = self.formatter(message)
+                stats.formatted += 1
+            except Exception as e:
+                doc = None
+                stats.failed += 1
+                if self.on_write_error:
+                    await self.on_write_error({"id": str(getattr(message, "id", "?"))}, e)
+            await doc_queue.put((sequence, doc))
+
+    async def _write(self, doc_queue: asyncio.Queue, stats: IngestionStats):
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        pending: set[asyncio.Task] = set()
+        completed: dict[int, object] = {}
+        first_failure = None
+        next_sequence = 0
+        last_checkpoint_sequence = -1
+        last_contiguous_doc = None
+        last_progress = 0
+
+        async def upsert(sequence: int, doc: dict):
+            nonlocal first_failure
+            written = False
+            try:
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        await self.repository.upsert_item(doc)
+                        stats.written += 1
+                        written = True
+                        break
+                    except Exception as e:
+                        if attempt >= self.max_retries:
+                            stats.failed += 1
+                            if self.on_write_error:
+                                await self.on_write_error(doc, e)
+                        else:
+                            await asyncio.sleep(0.5 * (2 ** attempt))
+            finally:
+                if not written and (first_failure is None or sequence < first_failure):
+                    first_failure = sequence
+                    stats.checkpoint_blocked = True
+                    for later in [key for key in completed if key > sequence]:
+                        del completed[later]  # Le point de reprise n'ira plus au-delà.
+                if first_failure is None or sequence <= first_failure:
+                    completed[sequence] = doc if written else _FAILED
+                in_flight.release()
+
+        async def advance_checkpoint(force: bool = False):
+            nonlocal next_sequence, last_checkpoint_sequence, last_contiguous_doc, last_progress
+            while next_sequence in completed and completed[next_sequence] is not _FAILED:
+                last_contiguous_doc = completed.pop(next_sequence) or last_contiguous_doc
+                next_sequence += 1
+            contiguous = next_sequence - 1
+            if self.on_checkpoint and last_contiguous_doc and contiguous > last_checkpoint_sequence and \
+                    (force or contiguous - last_checkpoint_sequence >= self.checkpoint_every):
+                await self.on_checkpoint(last_contiguous_doc)
+                last_checkpoint_sequence = contiguous
+            if self.on_progress and stats.written - last_progress >= self.progress_every:
+                last_progress = stats.written - stats.written % self.progress_every
+                await self.on_progress(stats)
+
+        while True:
+            entry = await doc_queue.get()
+            if entry is _END:
+                break
+            sequence, doc = entry
+            if doc is None:
+                if first_failure is None:
+                    completed[sequence] = None
+                await advance_checkpoint()
+                continue
+            if self.throttle:
+                await self.throttle.wait(getattr(self.repository, "total_request_charge", 0.0))
+            await in_flight.acquire()
+            task = asyncio.create_task(upsert(sequence, doc))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            await advance_checkpoint()
+        if pending:
+            await asyncio.gather(*pending)
+        await advance_checkpoint(force=True)
+
+
+class LiveIngestionBuffer:
+    """Tampon d'écriture alimenté par les événements Discord (création, édition, réactions, suppression).
+
+    Les opérations sont fusionnées par id de message : seule la dernière version d'un message est écrite
+    et une suppression annule un upsert en attente. Le tampon est vidé toutes les `flush_interval`
+    secondes ou dès que `max_pending` messages sont en attente.
+    `resolve_dirty(channel_id, message_id)` doit renvoyer le document à jour d'un message dont seules
+    les réactions ont changé (ou None) ; il n'est appelé qu'une fois par message et par vidage.
+    Une opération en échec est remise en attente pour le vidage suivant, sauf si une opération plus récente
+    sur le même message est arrivée entre-temps ; tant qu'elle n'a pas abouti, son canal figure dans
+    `blocked_channels()` et le point de reprise temps réel de ce canal ne doit pas avancer.
+    """
+
+    def __init__(self, repository, flush_interval: float = 5.0, max_pending: int = 50, max_in_flight: int = 8,
+                 resolve_dirty=None, on_flush=None, on_error=None):
+        self.repository = repository
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_in_flight = max(1, max_in_flight)
+        self.resolve_dirty = resolve_dirty
+        self.on_flush = on_flush
+        self.on_error = on_error
+        self.stats = {"events": 0, "coalesced": 0, "upserts": 0, "deletes": 0, "failed": 0, "requeued": 0, "flushes": 0}
+        self._pending: dict[str, tuple[str, object]] = {}
+        self._failures: dict[str, str] = {}  # id de message -> id de canal des opérations pas encore écrites.
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _stage(self, message_id: str, operation: str, payload):
+        self.stats["events"] += 1
+        previous = self._pending.get(message_id)
+        if previous is not None:
+            self.stats["coalesced"] += 1
+            # Une réaction sur un message déjà en attente d'upsert ne change rien : il sera relu entier.
+            if operation == "dirty" and previous[0] in ("upsert", "delete"):
+                return
+        self._pending[message_id] = (operation, payload)
+        if len(self._pending) >= self.max_pending:
+            self._wake.set()
+
+    def blocked_channels(self) -> set[str]:
+        """Canaux ayant au moins une opération en échec pas encore rejouée avec succès."""
+        return set(self._failures.values())
+
+    def stage_upsert(self, doc: dict):
+        self._stage(str(doc["id"]), "upsert", doc)
+
+    def stage_delete(self, channel_id, message_id):
+        self._stage(str(message_id), "delete", channel_id)
+
+    def mark_dirty(self, channel_id, message_id):
+        self._stage(str(message_id), "dirty", channel_id)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                if self.on_error:
+                    await self.on_error(None, e)
+
+    async def flush(self) -> list[dict]:
+        """Écrit les opérations en attente ; renvoie les documents effectivement upsertés."""
+        async with self._flush_lock:
+            if not self._pending:
+                return []
+            batch, self._pending = self._pending, {}
+            failed_before = self.stats["failed"]
+            in_flight = asyncio.Semaphore(self.max_in_flight)
+            written: list[dict] = []
+
+            async def apply(message_id: str, staged_operation: str, staged_payload):
+                operation, payload = staged_operation, staged_payload
+                async with in_flight:
+                    try:
+                        if operation == "dirty":
+                            payload = await self.resolve_dirty(payload, message_id) if self.resolve_dirty else None
+                            operation = "upsert"
+                        if payload is None:
+                            pass
+                        elif operation == "upsert":
+                            await self.repository.upsert_item(payload)
+                            self.stats["upserts"] += 1
+                            written.append(payload)
+                        else:
+                            await self.repository.delete_message(payload, message_id)
+                            self.stats["deletes"] += 1
+                    except Exception as e:
+                        self.stats["failed"] += 1
+                        channel_id = staged_payload["channel_id"] if staged_operation == "upsert" else staged_payload
+                        self._failures[message_id] = str(channel_id)
+                        # Une opération arrivée pendant le vidage est plus récente : elle remplace celle-ci.
+                        if message_id not in self._pending:
+                            self._pending[message_id] = (staged_operation, staged_payload)
+                            self.stats["requeued"] += 1
+                        if self.on_error:
+                            await self.on_error(message_id, e)
+                    else:
+                        self._failures.pop(message_id, None)
+
+            await asyncio.gather(*(apply(mid, op, payload) for mid, (op, payload) in batch.items()))
+            self.stats["flushes"] += 1
+            if self.on_flush:
+                await self.on_flush(written, len(batch), self.stats["failed"] - failed_before)
+            return written
@@ -0,0 +1,209 @@
+"""Analyse locale des questions !ask les plus fréquentes, sans appel à l'IA.
+
+Reconnaît quelques formes simples (comptages, "dernier message de X", "les N derniers messages",
+"les messages d'hier de X", "qui a le plus parlé cette semaine", "combien de réactions (en moyenne)")
+et produit la même requête Cosmos SQL que le prompt de get_ai_analysis demande au modèle. Tout mot
+non reconnu fait échouer l'analyse : la question part alors à l'IA. On préfère rater une question
+simple que mal en interpréter une.
+"""
+import re
+import unicodedata
+from dataclasses import dataclass
+
+from sql_cache import resolve_time_window
+
+DEFAULT_FIELDS = "c.id, c.channel_id, c.guild_id, c.author_name, c.author_display_name, c.content, c.timestamp_iso"
+MAX_LIMIT = 100
+
+TIME_PATTERNS = [
+    ("day_before_yesterday", r"\b(?:d')?avant[- ]hier\b"),
+    ("today", r"\b(?:d')?aujourd'?hui\b"),
+    ("yesterday", r"\b(?:d')?hier\b"),
+    ("last_week", r"\b(?:de |pour |durant )?la semaine (?:derniere|passee)\b"),
+    ("week", r"\b(?:de |pour |durant )?cette semaine\b"),
+    ("last_month", r"\b(?:du |le |pour le )?mois (?:dernier|passe)\b"),
+    ("month", r"\b(?:de |pour )?ce mois(?:[- ]ci)?\b"),
+    ("last_year", r"\b(?:de |pour )?l'annee (?:derniere|passee)\b"),
+    ("year", r"\b(?:de |pour )?cette annee\b"),
+]
+
+NUMBER_WORDS = {"deux": 2, "trois": 3, "quatre": 4, "cinq": 5, "six": 6, "sept": 7, "huit": 8, "neuf": 9,
+                "dix": 10, "quinze": 15, "vingt": 20, "trente": 30, "cinquante": 50, "cent": 100}
+NUMBER_RE = r"(?P<n>\d{1,3}|" + "|".join(NUMBER_WORDS) + ")"
+
+SUM_RE = re.compile(r"\bcombien (?:de |d')?(?P<what>reactions|pieces jointes)\b")
+SUMMED_FIELDS = {"reactions": "reactions_count", "pieces jointes": "attachments_count"}
+AVERAGE_RE = re.compile(r"\b(?:en moyenne|par message)\b")
+TOP_CHANNELS_RE = re.compile(r"\bquels? (?:salons?|canal|canaux|chans?) (?:est|sont) (?:le|les) plus actifs?\b")
+TOP_AUTHORS_RE = re.compile(r"\bqui (?:a|ont) le plus (?:parle|poste|ecrit|envoye|spamme)\b|\bqui est le plus actif\b|"
+                            r"\b(?:les )?(?:membres |gens |personnes )?les plus actifs\b")
+COUNT_RE = re.compile(r"\bcombien\b(?: (?:de |d')?(?:messages?|msgs?)\b)?")
+LAST_N_RE = re.compile(rf"\b(?:les |mes )?{NUMBER_RE} (?P<dir>derniers|premiers) (?:messages|msgs)\b")
+SINGLE_RE = re.compile(r"\b(?:le |mon |son )?(?P<dir>dernier|premier) (?:message|msg)\b|"
+                       r"\b(?:le |mon )?message le plus (?P<dir2>recent|ancien)\b")
+LIST_RE = re.compile(r"\b(?:les |mes )?(?:messages|msgs)\b")
+SELF_RE = re.compile(r"(?:\b(?:de|par) moi\b|\bmes\b|\bmon\b|\bj'ai\b|\bai-je\b|\bje\b)")
+AUTHOR_RE = re.compile(r"(?:\b(?:de|par) |\bd')(?P<name>[\w.\-]+)")
+
+FILLER_WORDS = {
+    "", "le", "la", "les", "de", "des", "du", "un", "une", "a", "ont", "ete", "il", "y", "en", "au", "total",
+    "ici", "dans", "ce", "cet", "canal", "salon", "chan", "serveur", "quel", "quels", "quelle", "est", "sont",
+    "c'est", "qui", "montre", "affiche", "donne", "trouve", "resume", "resumes", "liste", "moi", "stp", "svp",
+    "s'il", "te", "plait", "on", "envoye", "envoyes", "ecrit", "ecrits", "poste", "postes", "message",
+    "messages", "msg", "msgs", "dit", "dits", "eu", "ask", "par", "ai", "ai-je", "envoyee", "envoyees",
+}
+
+# Mots qui suivent souvent "de"/"d'"/"par" sans être un pseudo : la question part alors à l'IA.
+NOT_AUTHOR_WORDS = {
+    "janvier", "fevrier", "mars", "avril", "mai", "juin", "juillet", "aout", "septembre", "octobre", "novembre",
+    "decembre", "lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche", "noel", "paques",
+    "nouvel", "an", "vacances", "weekend", "week-end", "matin", "midi", "soir", "soiree", "nuit", "minuit",
+    "jour", "jours", "semaine", "semaines", "mois", "annee", "annees", "heure", "heures", "minute", "minutes",
+    "debut", "fin", "image", "images", "photo", "photos", "video", "videos", "lien", "liens", "fichier",
+    "fichiers", "piece", "pieces", "gif", "gifs", "emoji", "emojis", "sticker", "stickers", "reaction",
+    "reactions", "vocal", "vocaux", "audio", "texte", "textes", "jeu", "jeux", "film", "films", "musique",
+    "serie", "series", "quoi", "tout", "tous", "toutes", "personne", "gens", "monde", "autres", "chacun",
+    "salon", "salons", "canal", "canaux", "serveur", "general", "discussion", "conversation", "bot", "bots",
+}
+
+
+@dataclass
+class IntentMatch:
+    intent: str  # "count", "sum", "average", "top_authors", "top_channels", "latest", "last_n", "list"
+    sql: str
+    author: str | None = None
+    time_range: str | None = None
+    limit: int | None = None
+
+
+def _plain(text: str) -> str:
+    """Minuscules sans accents, caractère pour caractère (les positions restent alignées sur `text`)."""
+    return "".join(unicodedata.normalize("NFKD", ch)[0].lower()[:1] or " " for ch in text)
+
+
+def is_author_name(name: str) -> bool:
+    """Vrai si `name` peut être un pseudo : ni date (mois, jour, année, nombre) ni nom commun connu."""
+    plain = _plain(name).strip(".-")
+    return bool(plain) and not plain.isdigit() and plain not in NOT_AUTHOR_WORDS and plain not in FILLER_WORDS
+
+
+def _time_filter(time_range: str, window: dict[str, str]) -> str:
+    if time_range == "week":
+        return (f'c.timestamp_iso >= "{window["week_start"]}T00:00:00.000Z" AND '
+                f'c.timestamp_iso <= "{window["week_end"]}T23:59:59.999Z"')
+    if time_range == "last_week":
+        return (f'c.timestamp_iso >= "{window["last_week_start"]}T00:00:00.000Z" AND '
+                f'c.timestamp_iso <= "{window["last_week_end"]}T23:59:59.999Z"')
+    return f'STARTSWITH(c.timestamp_iso, "{window[time_range]}")'
+
+
+def _is_filler(residual: str) -> bool:
+    residual = re.sub(r"\b[ldjmst]'", " ", residual)
+    residual = re.sub(r"-(?:moi|nous|les)\b", " ", residual)
+    return all(word in FILLER_WORDS for word in residual.split())
+
+
+def parse_question(question: str, user_name: str, now) -> IntentMatch | None:
+    """IntentMatch si la question a une forme connue, sinon None (la question doit partir à l'IA)."""
+    text = unicodedata.normalize("NFC", question.replace("’", "'")).strip()
+    if "#" in text or "<" in text or '"' in text:
+        return None  # Mentions de salon/utilisateur ou recherche de texte : laissées à l'IA.
+    text = re.sub(r"^!ask\s+", "", text, flags=re.IGNORECASE)
+    text = re.sub(r"[?!.,;:]+", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    plain = _plain(text)
+
+    def cut(match):
+        nonlocal text, plain
+        start, end = match.span()
+        text = text[:start] + " " + text[end:]
+        plain = plain[:start] + " " + plain[end:]
+
+    time_range = None
+    for name, pattern in TIME_PATTERNS:
+        match = re.search(pattern, plain)
+        if match:
+            if time_range:
+                return None  # Deux périodes dans la même question.
+            time_range = name
+            cut(match)
+
+    averaged = False
+    while (average := AVERAGE_RE.search(plain)):
+        averaged = True
+        cut(average)
+
+    limit, order, summed = None, "DESC", None
+    if (match := SUM_RE.search(plain)):
+        intent, summed = "average" if averaged else "sum", SUMMED_FIELDS[match.group("what")]
+    elif (match := COUNT_RE.search(plain)):
+        intent = "count"
+    elif (match := TOP_CHANNELS_RE.search(plain)):
+        intent = "top_channels"
+    elif (match := TOP_AUTHORS_RE.search(plain)):
+        intent = "top_authors"
+    elif (match := LAST_N_RE.search(plain)):
+        intent = "last_n"
+        raw_n = match.group("n")
+        limit = int(raw_n) if raw_n.isdigit() else NUMBER_WORDS[raw_n]
+        if match.group("dir") == "premiers":
+            order = "ASC"
+        if not 1 <= limit <= MAX_LIMIT:
+            return None
+    elif (match := SINGLE_RE.search(plain)):
+        intent, limit = "latest", 1
+        if match.group("dir") == "premier" or match.group("dir2") == "ancien":
+            order = "ASC"
+    elif (match := LIST_RE.search(plain)):
+        intent = "list"
+    else:
+        return None
+    if averaged and intent != "average":
+        return None  # "combien de messages en moyenne par jour" : laissé à l'IA.
+    self_reference = match.group(0).startswith("mes ") or match.group(0).startswith("mon ")
+    cut(match)
+
+    author = None
+    if SELF_RE.search(plain):
+        self_reference = True
+    if self_reference:
+        author = user_name
+    for match in AUTHOR_RE.finditer(plain):
+        name = text[match.start("name"):match.end("name")]
+        if _plain(name) in FILLER_WORDS:
+            continue
+        if not is_author_name(name):
+            return None  # "de janvier", "de 2023", "d'images" : pas un pseudo, laissé à l'IA.
+        if author and author.lower() != name.lower():
+            return None  # Plusieurs auteurs : laissé à l'IA.
+        author = name
+        cut(match)
+        break
+    plain = re.sub(r"\b(?:de|par) moi\b", " ", plain)
+
+    if not _is_filler(plain):
+        return None
+    if intent == "list" and not (author or time_range):
+        return None  # "les messages" tout court : trop vague pour deviner une limite.
+    if intent == "top_authors" and author:
+        return None  # "qui a le plus parlé de Valorant" : un sujet, pas un auteur.
+
+    conditions = []
+    if time_range:
+        conditions.append(_time_filter(time_range, resolve_time_window(now)))
+    if author:
+        conditions.append(f'CONTAINS(c.author_name, "{author}", true)')
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    if intent == "count":
+        sql = f"SELECT VALUE COUNT(1) FROM c{where}"
+    elif intent in ("sum", "average"):
+        sql = f"SELECT VALUE {'SUM' if intent == 'sum' else 'AVG'}(c.{summed}) FROM c{where}"
+    elif intent in ("top_authors", "top_channels"):
+        # Sans ORDER BY (refusé par Cosmos avec GROUP BY) : classement trié à l'affichage.
+        key = "author_name" if intent == "top_authors" else "channel_id"
+        sql = f"SELECT c.{key}, COUNT(1) AS messages FROM c{where} GROUP BY c.{key}"
+    else:
+        top = f"TOP {limit} " if limit else ""
+        sql = f"SELECT {top}{DEFAULT_FIELDS} FROM c{where} ORDER BY c.timestamp_iso {order}"
+    return IntentMatch(intent, sql, author=author, time_range=time_range, limit=limit)
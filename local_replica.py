@@ -0,0 +1,721 @@
+"""Réplique locale des messages (SQLite + FTS5) pour servir les requêtes !ask sans Cosmos.
+
+La réplique est alimentée par le chemin d'ingestion (chaque écriture de message réussie dans Cosmos
+est recopiée ici) et, au premier démarrage, par une copie initiale paginée depuis Cosmos. Elle garde
+les champs scalaires du schéma (pas les embeds, pièces jointes ni réactions détaillées), avec :
+- un index (channel_id, timestamp_unix), un index timestamp_iso et un index (author_name, timestamp_iso) ;
+- un index plein texte FTS5 à trigrammes sur content, qui sert les CONTAINS(c.content, ...) sans
+  parcourir toute l'archive.
+
+Les requêtes du sous-ensemble produit par get_ai_analysis sont traduites de l'AST cosmos_sql vers du
+SQL SQLite paramétré, en gardant la sémantique Cosmos (undefined, comparaisons entre types différents,
+null). Tout ce qui sort de ce sous-ensemble (SELECT *, champs imbriqués ou absents de la réplique,
+fonctions ARRAY_*...) lève UnsupportedQuery et la requête part vers Cosmos.
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+
+import cosmos_sql
+from checkpoints import open_state_db
+
+DEFAULT_REPLICA_PATH = "bebzia_replica.sqlite3"
+
+# Champ du document -> (type Cosmos, nullable). Les colonnes portent le nom des champs du schéma.
+COLUMNS = {
+    "message_id_int": ("number", False),
+    "id": ("string", False),
+    "channel_id": ("string", False),
+    "guild_id": ("string", True),
+    "author_id": ("string", False),
+    "author_name": ("string", False),
+    "author_discriminator": ("string", True),
+    "author_display_name": ("string", False),
+    "author_bot": ("boolean", False),
+    "content": ("string", False),
+    "timestamp_iso": ("string", False),
+    "timestamp_unix": ("number", False),
+    "attachments_count": ("number", False),
+    "reactions_count": ("number", False),
+    "edited_timestamp_iso": ("string", True),
+}
+FULL_TEXT_COLUMNS = ("content",)  # Les noms d'auteurs, courts et peu variés, se filtrent mieux par balayage d'index.
+_COLUMN_NAMES = tuple(COLUMNS)
+_SQL_TYPES = {"number": "INTEGER", "string": "TEXT", "boolean": "INTEGER"}
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS messages (
+    message_id_int INTEGER PRIMARY KEY,
+    {", ".join(f"{name} {_SQL_TYPES[kind]}" for name, (kind, _) in COLUMNS.items() if name != "message_id_int")}
+);
+CREATE INDEX IF NOT EXISTS messages_channel_time ON messages(channel_id, timestamp_unix);
+CREATE INDEX IF NOT EXISTS messages_time ON messages(timestamp_iso);
+CREATE INDEX IF NOT EXISTS messages_author_time ON messages(author_name, timestamp_iso);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    {", ".join(FULL_TEXT_COLUMNS)}, content='messages', content_rowid='message_id_int',
+    tokenize='trigram case_sensitive 0'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, {", ".join(FULL_TEXT_COLUMNS)})
+    VALUES (new.message_id_int, {", ".join(f"new.{c}" for c in FULL_TEXT_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, {", ".join(FULL_TEXT_COLUMNS)})
+    VALUES ('delete', old.message_id_int, {", ".join(f"old.{c}" for c in FULL_TEXT_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF {", ".join(FULL_TEXT_COLUMNS)} ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, {", ".join(FULL_TEXT_COLUMNS)})
+    VALUES ('delete', old.message_id_int, {", ".join(f"old.{c}" for c in FULL_TEXT_COLUMNS)});
+    INSERT INTO messages_fts(rowid, {", ".join(FULL_TEXT_COLUMNS)})
+    VALUES (new.message_id_int, {", ".join(f"new.{c}" for c in FULL_TEXT_COLUMNS)});
+END;
+CREATE TABLE IF NOT EXISTS replica_meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS deleted_messages (message_id_int INTEGER PRIMARY KEY);
+"""
+
+_UPSERT_SQL = (
+    f"INSERT INTO messages ({', '.join(_COLUMN_NAMES)}) VALUES ({', '.join('?' * len(_COLUMN_NAMES))})"
+    f" ON CONFLICT(message_id_int) DO UPDATE SET "
+    + ", ".join(f"{name} = excluded.{name}" for name in _COLUMN_NAMES if name != "message_id_int")
+)
+_INSERT_MISSING_SQL = (
+    f"INSERT INTO messages ({', '.join(_COLUMN_NAMES)}) VALUES ({', '.join('?' * len(_COLUMN_NAMES))})"
+    " ON CONFLICT(message_id_int) DO NOTHING"
+)
+
+BOOTSTRAP_QUERY = (f"SELECT {', '.join(f'c.{name}' for name in _COLUMN_NAMES)} FROM c"
+                   " WHERE IS_DEFINED(c.message_id_int)")
+
+
+class UnsupportedQuery(cosmos_sql.CosmosSqlError):
+    """Requête hors de ce que la réplique locale sait servir : elle part vers Cosmos."""
+
+
+# ----- Fonctions Python enregistrées dans SQLite (sémantique Python/Cosmos, pas celle de SQLite) -----
+
+def _cosmos_string(name, text, needle, ignore_case):
+    if not isinstance(text, str) or not isinstance(needle, str):
+        return None
+    if ignore_case:
+        text, needle = text.lower(), needle.lower()
+    if name == "CONTAINS":
+        return needle in text
+    if name == "STARTSWITH":
+        return text.startswith(needle)
+    return text.endswith(needle)
+
+
+def _register_functions(conn: sqlite3.Connection):
+    conn.create_function("cosmos_string", 4, _cosmos_string, deterministic=True)
+    conn.create_function("cosmos_lower", 1, lambda s: s.lower() if isinstance(s, str) else None, deterministic=True)
+    conn.create_function("cosmos_upper", 1, lambda s: s.upper() if isinstance(s, str) else None, deterministic=True)
+
+
+def _row_from_doc(doc: dict) -> tuple | None:
+    message_id = doc.get("message_id_int")
+    if message_id is None:
+        if not str(doc.get("id", "")).isdigit():
+            return None
+        message_id = int(doc["id"])
+    row = [int(message_id)]
+    for name in _COLUMN_NAMES[1:]:
+        value = doc.get(name)
+        row.append(int(value) if isinstance(value, bool) else value)
+    return tuple(row)
+
+
+# ----- Traduction cosmos_sql -> SQLite -----
+
+@dataclass
+class _Expr:
+    sql: str
+    kind: str | None  # "string", "number", "boolean", "null" ; None = inconnu
+    nullable: bool = False  # Peut valoir null (colonne nullable) : null est une valeur définie en Cosmos.
+    maybe_undefined: bool = False  # Peut être undefined en Cosmos (NULL côté SQLite).
+
+
+_UNDEFINED_EXPR = _Expr("NULL", None, maybe_undefined=True)
+_UNDEFINED_BOOL = _Expr("NULL", "boolean", maybe_undefined=True)  # Test impossible (types différents) : undefined.
+
+
+def _kind_of(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    raise UnsupportedQuery(f"Valeur non gérée par la réplique: {value!r}")
+
+
+@dataclass
+class TranslatedQuery:
+    sql: str
+    args: dict
+    columns: list = field(default_factory=list)  # [(nom, kind, drop_null)] ; un seul élément si VALUE
+    value: bool = False
+
+
+class _Translator:
+    def __init__(self, query: cosmos_sql.Query, params: dict):
+        self.query = query
+        self.params = params
+        self.args: dict = {}
+
+    def _bind(self, value) -> str:
+        # Paramètres nommés : une expression peut être recopiée deux fois ou assemblée dans le désordre.
+        name = f"p{len(self.args)}"
+        self.args[name] = int(value) if isinstance(value, bool) else value
+        return f":{name}"
+
+    def _constant(self, value) -> _Expr:
+        kind = _kind_of(value)
+        if kind == "null":
+            return _Expr("NULL", "null", nullable=True)
+        return _Expr(self._bind(value), kind)
+
+    def constant_value(self, node):
+        if isinstance(node, cosmos_sql.Literal):
+            return node.value
+        if isinstance(node, cosmos_sql.Parameter):
+            if node.name not in self.params:
+                raise cosmos_sql.CosmosSqlError(f"Paramètre non fourni: {node.name}")
+            return self.params[node.name]
+        raise UnsupportedQuery("Constante attendue")
+
+    def expr(self, node, aggregate: bool = False) -> _Expr:
+        if isinstance(node, (cosmos_sql.Literal, cosmos_sql.Parameter)):
+            return self._constant(self.constant_value(node))
+        if isinstance(node, cosmos_sql.Path):
+            if len(node.parts) != 1 or node.parts[0] not in COLUMNS:
+                raise UnsupportedQuery(f"Champ absent de la réplique: {node.parts!r}")
+            kind, nullable = COLUMNS[node.parts[0]]
+            return _Expr(node.parts[0], kind, nullable=nullable)
+        if isinstance(node, cosmos_sql.Unary):
+            operand = self.expr(node.operand, aggregate)
+            if operand.kind != "boolean":
+                return _UNDEFINED_BOOL
+            return _Expr(f"(NOT {operand.sql})", "boolean", maybe_undefined=operand.maybe_undefined or operand.nullable)
+        if isinstance(node, cosmos_sql.Binary):
+            return self._binary(node, aggregate)
+        if isinstance(node, cosmos_sql.InList):
+            return self._in_list(node, aggregate)
+        if isinstance(node, cosmos_sql.Between):
+            operand, low, high = (self.expr(n, aggregate) for n in (node.operand, node.low, node.high))
+            if not (self._ordered(operand, low) and self._ordered(operand, high)):
+                return _UNDEFINED_BOOL
+            negation = "NOT " if node.negated else ""
+            return _Expr(f"({operand.sql} {negation}BETWEEN {low.sql} AND {high.sql})", "boolean", maybe_undefined=True)
+        if isinstance(node, cosmos_sql.Call):
+            if node.name in cosmos_sql.AGGREGATE_FUNCTIONS:
+                if not aggregate:
+                    raise UnsupportedQuery(f"Agrégat {node.name} hors projection")
+                return self._aggregate(node)
+            return self._call(node, aggregate)
+        raise UnsupportedQuery(f"Noeud non traduisible: {node!r}")
+
+    @staticmethod
+    def _ordered(a: _Expr, b: _Expr) -> bool:
+        """Comparaison d'ordre possible en Cosmos (mêmes types, null exclu)."""
+        return a.kind is not None and a.kind == b.kind and a.kind != "null"
+
+    def _binary(self, node: cosmos_sql.Binary, aggregate: bool) -> _Expr:
+        if node.op == "??":
+            raise UnsupportedQuery("Coalescence ?? non traduite")
+        left, right = self.expr(node.left, aggregate), self.expr(node.right, aggregate)
+        if node.op in ("AND", "OR"):
+            if left.kind != "boolean" or right.kind != "boolean":
+                raise UnsupportedQuery(f"{node.op} sur une expression non booléenne")
+            undefined = left.maybe_undefined or right.maybe_undefined or left.nullable or right.nullable
+            return _Expr(f"({left.sql} {node.op} {right.sql})", "boolean", maybe_undefined=undefined)
+        if node.op in ("=", "!="):
+            if left.maybe_undefined or right.maybe_undefined:
+                # undefined = x est undefined en Cosmos, comme NULL = x en SQLite.
+                if left.kind and right.kind and left.kind != right.kind:
+                    return _UNDEFINED_BOOL
+                op = "=" if node.op == "=" else "!="
+                return _Expr(f"({left.sql} {op} {right.sql})", "boolean", maybe_undefined=True)
+            if left.kind != right.kind and "null" not in (left.kind, right.kind):
+                return _Expr("0" if node.op == "=" else "1", "boolean")
+            # Valeurs toujours définies : égalité stricte (types différents ou null -> faux), jamais NULL.
+            op = "IS" if node.op == "=" else "IS NOT"
+            return _Expr(f"({left.sql} {op} {right.sql})", "boolean")
+        if node.op in ("<", "<=", ">", ">="):
+            if not self._ordered(left, right):
+                return _UNDEFINED_BOOL
+            return _Expr(f"({left.sql} {node.op} {right.sql})", "boolean",
+                         maybe_undefined=left.nullable or right.nullable or left.maybe_undefined or right.maybe_undefined)
+        if node.op == "||":
+            if left.kind != "string" or right.kind != "string":
+                return _UNDEFINED_EXPR
+            return _Expr(f"({left.sql} || {right.sql})", "string", maybe_undefined=True)
+        if left.kind != "number" or right.kind != "number":
+            return _UNDEFINED_EXPR
+        if node.op == "/":
+            return _Expr(f"({left.sql} * 1.0 / NULLIF({right.sql}, 0))", "number", maybe_undefined=True)
+        if node.op == "%":
+            return _Expr(f"({left.sql} % NULLIF({right.sql}, 0))", "number", maybe_undefined=True)
+        return _Expr(f"({left.sql} {node.op} {right.sql})", "number",
+                     maybe_undefined=left.maybe_undefined or right.maybe_undefined)
+
+    def _in_list(self, node: cosmos_sql.InList, aggregate: bool) -> _Expr:
+        operand = self.expr(node.operand, aggregate)
+        if operand.kind is None:
+            raise UnsupportedQuery("IN sur une expression de type inconnu")
+        values = [self.expr(v, aggregate) for v in node.values]
+        same_kind = [v.sql for v in values if v.kind == operand.kind and v.kind != "null"]
+        with_null = any(v.kind == "null" for v in values)
+        if any(v.kind is None or v.maybe_undefined for v in values):
+            raise UnsupportedQuery("IN sur des valeurs calculées")
+        parts = []
+        if same_kind:
+            test = f"{operand.sql} IN ({', '.join(same_kind)})"
+            parts.append(f"COALESCE({test}, 0)" if operand.nullable and not operand.maybe_undefined else test)
+        if with_null and (operand.nullable or operand.kind == "null"):
+            parts.append(f"{operand.sql} IS NULL")
+        sql = f"({' OR '.join(parts)})" if parts else "0"
+        if operand.maybe_undefined and parts:
+            sql = f"(CASE WHEN {operand.sql} IS NULL THEN NULL ELSE {sql} END)"
+        if node.negated:
+            sql = f"(NOT {sql})"
+        return _Expr(sql, "boolean", maybe_undefined=operand.maybe_undefined)
+
+    def _call(self, node: cosmos_sql.Call, aggregate: bool) -> _Expr:
+        name = node.name
+        if name in ("CONTAINS", "STARTSWITH", "ENDSWITH"):
+            return self._string_test(node, aggregate)
+        if name in ("LOWER", "UPPER", "LENGTH", "LEFT", "SUBSTRING"):
+            text = self.expr(node.args[0], aggregate) if node.args else _UNDEFINED_EXPR
+            if text.kind != "string":
+                return _UNDEFINED_EXPR
+            if name == "LOWER":
+                return _Expr(f"cosmos_lower({text.sql})", "string", maybe_undefined=True)
+            if name == "UPPER":
+                return _Expr(f"cosmos_upper({text.sql})", "string", maybe_undefined=True)
+            if name == "LENGTH":
+                return _Expr(f"length({text.sql})", "number", maybe_undefined=text.nullable or text.maybe_undefined)
+            bounds = [self.constant_value(a) for a in node.args[1:]]
+            if not all(isinstance(b, int) and not isinstance(b, bool) and b >= 0 for b in bounds):
+                raise UnsupportedQuery(f"{name} avec des bornes non constantes")
+            start, length = (0, bounds[0]) if name == "LEFT" else (bounds[0], bounds[1])
+            return _Expr(f"substr({text.sql}, {start + 1}, {length})", "string", maybe_undefined=True)
+        args = [self.expr(a, aggregate) for a in node.args]
+        if name == "IS_DEFINED":
+            return _Expr("1", "boolean") if not args[0].maybe_undefined else _Expr(f"({args[0].sql} IS NOT NULL)", "boolean")
+        if name == "IS_NULL":
+            if args[0].maybe_undefined:
+                raise UnsupportedQuery("IS_NULL sur une expression calculée")
+            return _Expr(f"({args[0].sql} IS NULL)", "boolean")
+        raise UnsupportedQuery(f"Fonction non servie par la réplique: {name}")
+
+    def _string_test(self, node: cosmos_sql.Call, aggregate: bool) -> _Expr:
+        text = self.expr(node.args[0], aggregate)
+        ignore_case = self.constant_value(node.args[2]) is True if len(node.args) > 2 else False
+        needle_node = node.args[1]
+        if not isinstance(needle_node, (cosmos_sql.Literal, cosmos_sql.Parameter)):
+            needle = self.expr(needle_node, aggregate)
+            if text.kind != "string" or needle.kind != "string":
+                return _UNDEFINED_BOOL
+            return _Expr(f"cosmos_string('{node.name}', {text.sql}, {needle.sql}, {int(ignore_case)})", "boolean",
+                         maybe_undefined=True)
+        needle_value = self.constant_value(needle_node)
+        if text.kind != "string" or not isinstance(needle_value, str):
+            return _UNDEFINED_BOOL
+        undefined = text.nullable or text.maybe_undefined
+        column = text.sql if isinstance(node.args[0], cosmos_sql.Path) else None
+        if node.name == "STARTSWITH" and not ignore_case and column:
+            # Préfixe sensible à la casse : intervalle sur la colonne (index utilisable).
+            low, high = self._bind(needle_value), self._bind(needle_value + "\U0010ffff")
+            return _Expr(f"({column} >= {low} AND {column} < {high})", "boolean", maybe_undefined=undefined)
+        if node.name == "CONTAINS" and not ignore_case:
+            check = f"(instr({text.sql}, {self._bind(needle_value)}) > 0)"
+        elif node.name == "CONTAINS" and needle_value.isascii():
+            # lower() de SQLite ne replie que l'ASCII : suffisant pour une aiguille ASCII.
+            check = f"(instr(lower({text.sql}), {self._bind(needle_value.lower())}) > 0)"
+        else:
+            check = f"cosmos_string('{node.name}', {text.sql}, {self._bind(needle_value)}, {int(ignore_case)})"
+        if node.name == "CONTAINS" and column in FULL_TEXT_COLUMNS and len(needle_value) >= 3:
+            # Une phrase de trigrammes est une recherche de sous-chaîne insensible à la casse : exacte
+            # pour une aiguille ASCII sans casse, sinon elle réduit les candidats avant la vérification.
+            phrase = '"' + needle_value.replace('"', '""') + '"'
+            match = f"message_id_int IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH {self._bind(f'{column} : {phrase}')})"
+            if ignore_case and needle_value.isascii():
+                return _Expr(f"({match})", "boolean", maybe_undefined=undefined)
+            return _Expr(f"({match} AND {check})", "boolean", maybe_undefined=undefined)
+        return _Expr(check, "boolean", maybe_undefined=undefined)
+
+    def _aggregate(self, node: cosmos_sql.Call) -> _Expr:
+        if node.name == "COUNT":
+            if not node.args or isinstance(node.args[0], cosmos_sql.Literal):
+                return _Expr("COUNT(*)", "number")
+            argument = self.expr(node.args[0])
+            if argument.maybe_undefined:
+                return _Expr(f"COUNT({argument.sql})", "number")
+            return _Expr("COUNT(*)", "number")  # Champ toujours défini (null compris).
+        argument = self.expr(node.args[0])
+        if node.name in ("SUM", "AVG"):
+            if argument.kind != "number":
+                raise UnsupportedQuery(f"{node.name} sur une valeur non numérique")
+            if node.name == "SUM":
+                return _Expr(f"COALESCE(SUM({argument.sql}), 0)", "number")
+            return _Expr(f"AVG({argument.sql})", "number", maybe_undefined=True)
+        if argument.nullable or argument.kind is None:
+            raise UnsupportedQuery(f"{node.name} sur un champ nullable")  # null compte comme valeur en Cosmos.
+        return _Expr(f"{node.name}({argument.sql})", argument.kind, maybe_undefined=True)
+
+    def condition(self, node) -> str:
+        where = self.expr(node)
+        if where.kind != "boolean":
+            raise UnsupportedQuery("WHERE non booléen")
+        return where.sql
+
+    def translate(self) -> TranslatedQuery:
+        query = self.query
+        if query.projections is None or any(isinstance(p.expr, cosmos_sql.Path) and not p.expr.parts
+                                            for p in query.projections):
+            raise UnsupportedQuery("Documents entiers demandés (SELECT * / VALUE c)")
+        aggregate = query.is_aggregate
+        select, columns = [], []
+        for index, projection in enumerate(query.projections):
+            expr = self.expr(projection.expr, aggregate=aggregate)
+            select.append(expr.sql)
+            columns.append((cosmos_sql._projection_name(projection, index), expr.kind, expr.maybe_undefined))
+        sql = f"SELECT {', '.join(select)} FROM messages"
+        where = [self.condition(query.where)] if query.where is not None else []
+        if query.order_by and not aggregate:
+            first = self.expr(query.order_by[0][0])
+            if first.maybe_undefined:
+                where.append(f"{first.sql} IS NOT NULL")  # Cosmos exclut les documents sans la propriété de tri.
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if query.group_by:
+            sql += " GROUP BY " + ", ".join(self.expr(g).sql for g in query.group_by)
+        if query.order_by:
+            sql += " ORDER BY " + ", ".join(f"{self.expr(e, aggregate=aggregate).sql}{' DESC' if desc else ''}"
+                                            for e, desc in query.order_by)
+        limit, offset = query.top, None
+        if query.offset is not None:
+            offset = query.offset
+            limit = min(query.limit or 0, query.top) if query.top is not None else (query.limit or 0)
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+            if offset:
+                sql += f" OFFSET {int(offset)}"
+        return TranslatedQuery(sql, self.args, columns[:1] if query.value else columns, query.value)
+
+
+def translate(query, parameters: list[dict] | dict | None = None) -> TranslatedQuery:
+    """Traduit une requête Cosmos (texte ou AST) ; lève UnsupportedQuery si la réplique ne peut pas la servir."""
+    if isinstance(query, str):
+        query = cosmos_sql.parse(query)
+    if isinstance(parameters, list):
+        params = {p["name"]: p["value"] for p in parameters}
+    else:
+        params = parameters or {}
+    return _Translator(query, params).translate()
+
+
+def _convert_rows(translated: TranslatedQuery, rows) -> list:
+    results = []
+    for row in rows:
+        if translated.value:
+            name, kind, drop_null = translated.columns[0]
+            value = row[0]
+            if value is None and drop_null:
+                continue
+            results.append(bool(value) if kind == "boolean" and value is not None else value)
+            continue
+        item = {}
+        for (name, kind, drop_null), value in zip(translated.columns, row):
+            if value is None and drop_null:
+                continue
+            item[name] = bool(value) if kind == "boolean" and value is not None else value
+        results.append(item)
+    return results
+
+
+class LocalReplica:
+    """Fichier SQLite de la réplique. Écritures sérialisées, lectures sur une connexion par thread."""
+
+    def __init__(self, path: str = DEFAULT_REPLICA_PATH):
+        self.path = path
+        self.conn = open_state_db(path)
+        _register_functions(self.conn)
+        self.conn.executescript(_SCHEMA)
+        self._write_lock = threading.Lock()
+        self._readers = threading.local()
+
+    def get_meta(self, key: str) -> str | None:
+        row = self.conn.execute("SELECT value FROM replica_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str | None):
+        with self._write_lock:
+            if value is None:
+                self.conn.execute("DELETE FROM replica_meta WHERE key = ?", (key,))
+            else:
+                self.conn.execute("INSERT INTO replica_meta (key, value) VALUES (?, ?)"
+                                  " ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    @property
+    def ready(self) -> bool:
+        """Vrai une fois la copie initiale terminée (et tant qu'aucune écriture recopiée n'a échoué)."""
+        return self.get_meta("bootstrap_complete") == "1"
+
+    def mark_ready(self):
+        with self._write_lock:
+            self.conn.execute("DELETE FROM deleted_messages")  # Plus de copie initiale à protéger.
+        self.set_meta("bootstrap_complete", "1")
+
+    def mark_stale(self):
+        """La réplique a raté une écriture : plus servie, recopiée au prochain démarrage."""
+        self.set_meta("bootstrap_complete", None)
+        self.set_meta("bootstrap_token", None)
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def write_documents(self, docs, only_missing: bool = False) -> int:
+        """Insère ou met à jour des messages en une transaction.
+
+        `only_missing` (copie initiale) garde les lignes existantes et saute les messages supprimés
+        depuis le début de la copie, qu'une page lue avant la suppression ferait sinon revivre.
+        """
+        rows = [row for row in map(_row_from_doc, docs) if row is not None]
+        if not rows:
+            return 0
+        with self._write_lock:
+            if only_missing:
+                deleted = {message_id for (message_id,) in self.conn.execute(
+                    f"SELECT message_id_int FROM deleted_messages WHERE message_id_int IN ({', '.join('?' * len(rows))})",
+                    [row[0] for row in rows])}
+                rows = [row for row in rows if row[0] not in deleted]
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(_INSERT_MISSING_SQL if only_missing else _UPSERT_SQL, rows)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def remove_messages(self, message_ids) -> int:
+        """Supprime des messages ; pendant la copie initiale, garde aussi leur id (voir write_documents)."""
+        ids = [(int(m),) for m in message_ids]
+        recording = not self.ready
+        with self._write_lock:
+            self.conn.execute("BEGIN")
+            try:
+                cursor = self.conn.executemany("DELETE FROM messages WHERE message_id_int = ?", ids)
+                removed = cursor.rowcount
+                if recording:
+                    self.conn.executemany("INSERT OR IGNORE INTO deleted_messages (message_id_int) VALUES (?)", ids)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return removed
+
+    async def upsert_documents(self, docs, only_missing: bool = False) -> int:
+        return await asyncio.to_thread(self.write_documents, list(docs), only_missing)
+
+    async def delete_messages(self, message_ids) -> int:
+        return await asyncio.to_thread(self.remove_messages, list(message_ids))
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            _register_functions(conn)
+            self._readers.conn = conn
+        return conn
+
+    def run_query(self, translated: TranslatedQuery) -> list:
+        return _convert_rows(translated, self._reader().execute(translated.sql, translated.args).fetchall())
+
+    async def query(self, translated: TranslatedQuery) -> list:
+        return await asyncio.to_thread(self.run_query, translated)
+
+    async def query_pages(self, translated: TranslatedQuery, page_size: int = 100):
+        """Pages lues au fil de l'itération (le curseur SQLite n'est pas vidé d'avance)."""
+        conn = await asyncio.to_thread(sqlite3.connect, self.path, isolation_level=None, check_same_thread=False)
+        _register_functions(conn)
+        try:
+            cursor = await asyncio.to_thread(conn.execute, translated.sql, translated.args)
+            offset = 0
+            while True:
+                rows = await asyncio.to_thread(cursor.fetchmany, page_size)
+                if not rows:
+                    return
+                offset += len(rows)
+                yield _convert_rows(translated, rows), (str(offset) if len(rows) == page_size else None)
+                if len(rows) < page_size:
+                    return
+        finally:
+            conn.close()
+
+
+class ReplicatedRepository:
+    """Dépôt Cosmos doublé d'une réplique locale : écrit dans les deux, lit localement quand c'est possible.
+
+    Les écritures de messages sont recopiées après leur succès dans Cosmos. Les requêtes sont servies
+    par la réplique une fois la copie initiale terminée et si elles se traduisent ; sinon (ou en cas
+    d'erreur SQLite) elles partent vers Cosmos. Les documents hors messages (doc_type) restent dans Cosmos.
+    """
+
+    def __init__(self, primary, replica: LocalReplica, on_error=None):
+        self.primary = primary
+        self.replica = replica
+        self.on_error = on_error
+        self.stats = {"local": 0, "fallback": 0, "unsupported": 0, "errors": 0, "local_seconds": 0.0}
+
+    @property
+    def layout(self):
+        return self.primary.layout
+
+    @property
+    def is_connected(self) -> bool:
+        return self.primary.is_connected
+
+    @property
+    def total_request_charge(self) -> float:
+        return self.primary.total_request_charge
+
+    async def connect(self):
+        await self.primary.connect()
+
+    async def close(self):
+        await self.primary.close()
+
+    async def _report(self, what: str, error: Exception):
+        self.stats["errors"] += 1
+        if self.on_error:
+            await self.on_error(f"Réplique locale ({what}): {error}")
+
+    async def _mirror(self, docs: list[dict]):
+        docs = [d for d in docs if "doc_type" not in d]
+        if not docs:
+            return
+        try:
+            await self.replica.upsert_documents(docs)
+        except sqlite3.Error as e:
+            self.replica.mark_stale()
+            await self._report("écriture", e)
+
+    async def upsert_item(self, body: dict, timeout: float | None = None) -> dict:
+        result = await self.primary.upsert_item(body, timeout=timeout)
+        await self._mirror([body])
+        return result
+
+    async def delete_message(self, channel_id, message_id, timeout: float | None = None) -> bool:
+        deleted = await self.primary.delete_message(channel_id, message_id, timeout=timeout)
+        try:
+            await self.replica.delete_messages([message_id])
+        except sqlite3.Error as e:
+            self.replica.mark_stale()
+            await self._report("suppression", e)
+        return deleted
+
+    async def delete_item(self, item_id: str, partition_key, timeout: float | None = None) -> bool:
+        deleted = await self.primary.delete_item(item_id, partition_key, timeout=timeout)
+        if str(item_id).isdigit():
+            try:
+                await self.replica.delete_messages([item_id])
+            except sqlite3.Error as e:
+                self.replica.mark_stale()
+                await self._report("suppression", e)
+        return deleted
+
+    async def read_item(self, item_id: str, partition_key, timeout: float | None = None) -> dict | None:
+        return await self.primary.read_item(item_id, partition_key, timeout=timeout)
+
+    def _route(self, query: str, parameters) -> TranslatedQuery | None:
+        if not self.replica.ready:
+            self.stats["fallback"] += 1
+            return None
+        try:
+            return translate(query, parameters)
+        except cosmos_sql.CosmosSqlError:
+            self.stats["unsupported"] += 1
+            self.stats["fallback"] += 1
+            return None
+
+    async def query_items(self, query: str, parameters: list[dict] | None = None, timeout: float | None = None) -> list:
+        translated = self._route(query, parameters)
+        if translated is not None:
+            started = time.perf_counter()
+            try:
+                results = await self.replica.query(translated)
+            except sqlite3.Error as e:
+                await self._report("lecture", e)
+            else:
+                self.stats["local"] += 1
+                self.stats["local_seconds"] += time.perf_counter() - started
+                return results
+            self.stats["fallback"] += 1
+        return await self.primary.query_items(query, parameters=parameters, timeout=timeout)
+
+    async def query_value(self, query: str, parameters: list[dict] | None = None, timeout: float | None = None):
+        results = await self.query_items(query, parameters=parameters, timeout=timeout)
+        return results[0] if results else None
+
+    async def query_pages(self, query: str, parameters: list[dict] | None = None, page_size: int = 100,
+                          continuation_token: str | None = None, timeout: float | None = None, on_request_charge=None):
+        translated = self._route(query, parameters) if continuation_token is None else None
+        if translated is not None:
+            started = time.perf_counter()
+            pages = self.replica.query_pages(translated, page_size=page_size)
+            served = False
+            try:
+                async for page, token in pages:
+                    if not served:
+                        served = True
+                        self.stats["local"] += 1
+                        self.stats["local_seconds"] += time.perf_counter() - started  # Jusqu'à la première page.
+                    if on_request_charge:
+                        on_request_charge(0.0)
+                    yield page, token
+            except sqlite3.Error as e:
+                if served:
+                    raise
+                await self._report("lecture", e)
+            else:
+                if not served:
+                    self.stats["local"] += 1
+                return
+            finally:
+                await pages.aclose()
+            self.stats["fallback"] += 1
+        async for page, token in self.primary.query_pages(query, parameters=parameters, page_size=page_size,
+                                                          continuation_token=continuation_token, timeout=timeout,
+                                                          on_request_charge=on_request_charge):
+            yield page, token
+
+    async def bootstrap(self, page_size: int = 1000, on_progress=None) -> int:
+        """Copie initiale paginée depuis Cosmos, reprenable (jeton de continuation gardé dans la réplique).
+
+        Les lignes déjà présentes (recopiées par l'ingestion pendant la copie, donc plus récentes) sont gardées,
+        et les messages supprimés pendant la copie ne sont pas réinsérés (table deleted_messages).
+        """
+        if self.replica.ready:
+            return 0
+        copied = 0
+        token = self.replica.get_meta("bootstrap_token")
+        pages = self.primary.query_pages(BOOTSTRAP_QUERY, page_size=page_size, continuation_token=token)
+        try:
+            async for page, token in pages:
+                copied += await self.replica.upsert_documents(page, only_missing=True)
+                self.replica.set_meta("bootstrap_token", token)
+                if on_progress:
+                    await on_progress(copied)
+                if token is None:
+                    break
+        finally:
+            await pages.aclose()
+        self.replica.set_meta("bootstrap_token", None)
+        self.replica.mark_ready()
+        return copied
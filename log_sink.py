@@ -0,0 +1,180 @@
+"""Journalisation sans attente : console via `logging`, canal Discord de logs par lots.
+
+`LogSink.emit` ne bloque jamais l'appelant :
+- la ligne console part dans une `QueueHandler`, écrite sur stdout par un thread ;
+- les entrées destinées au canal Discord sont mises en file. Une tâche de fond les regroupe
+  en blocs de code de 1900 caractères au plus et fusionne les doublons ("×N").
+- Sous surcharge (file pleine), les entrées les plus anciennes sont abandonnées. Leur nombre
+  par source est résumé dans l'envoi suivant.
+"""
+import asyncio
+import collections
+import datetime
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from dataclasses import dataclass, field
+
+LOGGER_NAME = "bebzia"
+DISCORD_MAX_CHARS = 1900
+_BLOCK_OVERHEAD = len("```\n\n```")
+
+
+@dataclass
+class LogRecord:
+    source: str
+    message: str
+    level: int = logging.INFO
+    to_discord: bool = False
+    is_openai_filter_log: bool = False
+    created_at: datetime.datetime = field(default_factory=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+    @property
+    def timestamp(self) -> str:
+        return self.created_at.strftime('%Y-%m-%d %H:%M:%S UTC')
+
+    def discord_text(self) -> str:
+        content = f"❌ {self.message}" if self.is_openai_filter_log else self.message
+        return f"{self.timestamp} [{self.source}]\n{content}"
+
+
+def setup_console_logging(level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """Logger `bebzia` : l'écriture sur stdout se fait dans un thread, jamais dans la boucle asyncio."""
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.propagate = False
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("[%(asctime)s UTC] %(levelname)s %(message)s", "%Y-%m-%d %H:%M:%S"))
+    stream.formatter.converter = time.gmtime
+    listener = logging.handlers.QueueListener(records, stream)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    listener.start()
+    return listener
+
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:max(0, limit - 13)] + "... (Tronqué)"
+
+
+class LogSink:
+    """File des entrées de log à envoyer sur Discord, vidée par `send(texte)` en tâche de fond.
+
+    Au plus `max_messages_per_flush` messages Discord toutes les `flush_interval` secondes (la limite
+    d'un canal est de 5 messages / 5 s) ; au-delà de `max_pending` entrées en attente, les plus
+    anciennes sont abandonnées.
+    """
+
+    def __init__(self, send, flush_interval: float = 2.0, max_pending: int = 200, max_messages_per_flush: int = 3,
+                 max_chars: int = DISCORD_MAX_CHARS, logger: logging.Logger | None = None):
+        self.send = send
+        self.flush_interval = flush_interval
+        self.max_pending = max(1, max_pending)
+        self.max_messages_per_flush = max(1, max_messages_per_flush)
+        self.max_chars = max_chars
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self._pending: collections.deque[list] = collections.deque()  # [LogRecord, répétitions]
+        self._pending_by_key: dict[tuple, list] = {}
+        self._dropped: collections.Counter = collections.Counter()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.stats = {"records": 0, "sent_messages": 0, "coalesced": 0, "dropped": 0, "send_errors": 0}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def emit(self, record: LogRecord):
+        """Console tout de suite (sans attendre l'écriture), Discord plus tard si `record.to_discord`."""
+        self.stats["records"] += 1
+        self.logger.log(record.level, "[%s] %s", record.source, record.message)
+        if not record.to_discord:
+            return
+        key = (record.source, record.message, record.is_openai_filter_log)
+        entry = self._pending_by_key.get(key)
+        if entry is not None:  # Doublon encore en attente : un compteur, pas une place dans la file.
+            entry[1] += 1
+            self.stats["coalesced"] += 1
+            return
+        if len(self._pending) >= self.max_pending:
+            dropped, repeated = self._pop()
+            self._dropped[dropped.source] += repeated
+            self.stats["dropped"] += repeated
+        entry = self._pending_by_key[key] = [record, 1]
+        self._pending.append(entry)
+        self._wake.set()
+
+    def _pop(self) -> list:
+        entry = self._pending.popleft()
+        record = entry[0]
+        del self._pending_by_key[(record.source, record.message, record.is_openai_filter_log)]
+        return entry
+
+    def _take_batches(self) -> list[str]:
+        """Blocs de code prêts à envoyer, au plus `max_messages_per_flush`, en consommant la file."""
+        block_limit = self.max_chars - _BLOCK_OVERHEAD
+        batches: list[str] = []
+        current = ""
+
+        def add(line: str) -> bool:
+            nonlocal current
+            if current and len(current) + 1 + len(line) > block_limit:
+                if len(batches) + 1 >= self.max_messages_per_flush:
+                    return False  # Le bloc suivant dépasserait le nombre de messages permis par vidage.
+                batches.append(current)
+                current = ""
+            current = f"{current}\n{line}" if current else line
+            return True
+
+        # Les entrées abandonnées sont plus anciennes que toute la file : leur résumé passe en premier.
+        if self._dropped:
+            summary = ", ".join(f"{source}×{count}" for source, count in self._dropped.most_common())
+            add(_truncate(f"… {sum(self._dropped.values())} entrée(s) de log abandonnée(s) (surcharge) : {summary}", block_limit))
+            self._dropped.clear()
+        while self._pending:
+            record, repeated = self._pending[0]
+            text = _truncate(record.discord_text(), block_limit - 8)
+            if not add(text if repeated == 1 else f"{text} (×{repeated})"):
+                break
+            self._pop()
+        if current:
+            batches.append(current)
+        return [f"```\n{batch}\n```" for batch in batches]
+
+    async def flush(self) -> int:
+        sent = 0
+        for text in self._take_batches():
+            try:
+                await self.send(text)
+                sent += 1
+            except Exception as e:
+                self.stats["send_errors"] += 1
+                self.logger.error("[SEND_LOG_ERROR] Erreur envoi log Discord: %s", e)
+        self.stats["sent_messages"] += sent
+        return sent
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._pending:
+                await self.flush()
+                await asyncio.sleep(self.flush_interval)  # Laisse aussi le temps aux doublons de s'accumuler.
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            await self.flush()
@@ -0,0 +1,21 @@
+"""Format des documents Cosmos DB représentant un message Discord."""
+import discord
+
+
+def format_message_to_json(message: discord.Message):
+    return {
+        "id": str(message.id), "message_id_int": message.id,
+        "channel_id": str(message.channel.id),
+        "guild_id": str(message.guild.id) if message.guild else None,
+        "author_id": str(message.author.id), "author_name": message.author.name,
+        "author_discriminator": message.author.discriminator,
+        "author_display_name": message.author.display_name, "author_bot": message.author.bot,
+        "content": message.content, "timestamp_iso": message.created_at.isoformat() + "Z",
+        "timestamp_unix": int(message.created_at.timestamp()),
+        "attachments": [{"id": str(att.id), "filename": att.filename, "url": att.url, "content_type": att.content_type, "size": att.size} for att in message.attachments],
+        "attachments_count": len(message.attachments),
+        "embeds": [embed.to_dict() for embed in message.embeds],
+        "reactions": [{"emoji": str(reaction.emoji), "count": reaction.count} for reaction in message.reactions],
+        "reactions_count": sum(reaction.count for reaction in message.reactions),
+        "edited_timestamp_iso": message.edited_at.isoformat() + "Z" if message.edited_at else None,
+    }
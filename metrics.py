@@ -0,0 +1,199 @@
+"""Métriques en mémoire constante : compteurs, jauges et histogrammes à fenêtre glissante.
+
+Un histogramme garde ses `window` dernières observations dans deux `array` de taille fixe
+(valeur, horodatage). Les quantiles de !stats sont calculés sur cette fenêtre, éventuellement
+limitée aux `since_seconds` dernières secondes. Le nombre et la somme depuis le démarrage sont
+tenus à part, pour l'export texte au format Prometheus (type summary).
+"""
+import array
+import time
+
+DEFAULT_WINDOW = 1024
+EXPORT_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def quantile(sorted_values: list[float], q: float) -> float | None:
+    """Quantile par interpolation linéaire entre les rangs voisins."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Gauge:
+    """Valeur lue à la demande (`read` appelle `fn`), ou fixée avec `set`."""
+
+    def __init__(self, fn=None):
+        self.fn = fn
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def read(self) -> float | None:
+        if self.fn is None:
+            return self.value
+        try:
+            value = self.fn()
+        except Exception:
+            return None
+        return None if value is None else float(value)
+
+
+class Histogram:
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self.window = max(1, window)
+        self._values = array.array("d", bytes(8 * self.window))
+        self._times = array.array("d", bytes(8 * self.window))
+        self._next = 0
+        self._filled = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float, now: float | None = None):
+        self._values[self._next] = value
+        self._times[self._next] = time.monotonic() if now is None else now
+        self._next = (self._next + 1) % self.window
+        self._filled = min(self._filled + 1, self.window)
+        self.count += 1
+        self.sum += value
+
+    def time(self) -> "_Timer":
+        """Durée du bloc observée à la sortie ; utilisable avec `with` comme avec `async with`."""
+        return _Timer(self)
+
+    def values(self, since_seconds: float | None = None, now: float | None = None) -> list[float]:
+        values = self._values[:self._filled]
+        if since_seconds is None:
+            return list(values)
+        cutoff = (time.monotonic() if now is None else now) - since_seconds
+        times = self._times
+        return [value for i, value in enumerate(values) if times[i] >= cutoff]
+
+    def summary(self, since_seconds: float | None = None, quantiles=(0.5, 0.95)) -> dict:
+        values = sorted(self.values(since_seconds))
+        result = {"count": len(values), "sum": sum(values)}
+        for q in quantiles:
+            result[q] = quantile(values, q)
+        return result
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        return self.__exit__(*exc)
+
+
+class MetricsRegistry:
+    """Familles de métriques nommées `<prefix>_<nom>`, une série par jeu d'étiquettes."""
+
+    def __init__(self, prefix: str = "bebzia", window: int = DEFAULT_WINDOW):
+        self.prefix = prefix
+        self.window = window
+        self._families: dict[str, dict] = {}  # nom -> {"kind", "help", "series": {labels: métrique}}
+
+    def _series(self, kind: str, name: str, help: str, labels: dict, factory):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = {"kind": kind, "help": help, "series": {}}
+        elif family["kind"] != kind:
+            raise ValueError(f"Métrique {name} déjà déclarée comme {family['kind']}")
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        metric = family["series"].get(key)
+        if metric is None:
+            metric = family["series"][key] = factory()
+        return metric
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._series("counter", name, help, labels, Counter)
+
+    def histogram(self, name: str, help: str = "", **labels) -> Histogram:
+        return self._series("summary", name, help, labels, lambda: Histogram(self.window))
+
+    def gauge(self, name: str, fn=None, help: str = "", **labels) -> Gauge:
+        gauge = self._series("gauge", name, help, labels, lambda: Gauge(fn))
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def series(self, name: str) -> dict:
+        """{étiquettes: métrique} d'une famille (vide si elle n'existe pas encore)."""
+        family = self._families.get(name)
+        return dict(family["series"]) if family else {}
+
+    def total(self, name: str, **labels) -> float:
+        """Somme des compteurs `name` dont les étiquettes contiennent `labels`."""
+        wanted = {(k, str(v)) for k, v in labels.items()}
+        return sum(metric.value for key, metric in self.series(name).items() if wanted <= set(key))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name, family in sorted(self._families.items()):
+            full_name = f"{self.prefix}_{name}"
+            if family["help"]:
+                lines.append(f"# HELP {full_name} {family['help']}")
+            lines.append(f"# TYPE {full_name} {family['kind']}")
+            for labels, metric in sorted(family["series"].items()):
+                if family["kind"] == "summary":
+                    values = sorted(metric.values())
+                    for q in EXPORT_QUANTILES:
+                        value = quantile(values, q)
+                        if value is not None:
+                            lines.append(f"{full_name}{_format_labels(labels, (('quantile', str(q)),))} {value:.6g}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {metric.sum:.6g}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {metric.count}")
+                else:
+                    value = metric.read() if family["kind"] == "gauge" else metric.value
+                    if value is not None:
+                        lines.append(f"{full_name}{_format_labels(labels)} {value:.6g}")
+        return "\n".join(lines) + "\n"
+
+    async def start_http_server(self, host: str = "127.0.0.1", port: int = 9108):
+        """Sert GET /metrics (aiohttp, déjà installé avec discord.py). Renvoie le runner à fermer avec cleanup()."""
+        from aiohttp import web
+
+        async def handle_metrics(request):
+            return web.Response(text=self.render_prometheus(), content_type="text/plain", charset="utf-8",
+                                headers={"X-Content-Type-Options": "nosniff"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
@@ -0,0 +1,173 @@
+"""Migration du conteneur des messages vers la disposition v2 (clé /pk canal:mois, indexation ciblée).
+
+Copie en continu le conteneur source vers un nouveau conteneur, page par page. Le jeton de
+continuation est enregistré après chaque page dans le fichier d'état local : relancer la commande
+reprend là où elle s'était arrêtée (au pire une page est recopiée, les upserts sont idempotents).
+
+Le bot écrit déjà dans la cible pendant la copie (double écriture) : une page lue en v1 peut donc être
+plus ancienne que ce qui est en v2. Avant chaque écriture, la cible est relue et le document est
+ignoré si elle en a une version au moins aussi récente (`_ts` serveur, puis `edited_timestamp_iso`) ;
+absent de la cible, il est relu dans la source et ignoré s'il y a été supprimé entre-temps. Reste une
+fenêtre de quelques millisecondes entre la relecture et l'écriture : --verify puis une seconde passe
+(--restart) la referment si des suppressions ont eu lieu pendant la copie.
+
+Bascule conseillée :
+  1. CONTAINER_NAME_V2=<nouveau> : le bot écrit dans les deux conteneurs, lit toujours en v1. À activer
+     avant la copie, sinon les messages écrits pendant celle-ci manqueraient en v2.
+  2. python migrate_container.py --target-container <nouveau>   (relançable)
+  3. python migrate_container.py --target-container <nouveau> --verify
+  4. COSMOS_READ_FROM=v2 : les lectures passent en v2, les écritures restent doublées.
+  5. CONTAINER_NAME=<nouveau>, CONTAINER_LAYOUT=v2, sans CONTAINER_NAME_V2 : fin de la bascule.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from checkpoints import DEFAULT_STATE_PATH, open_state_db
+from container_layout import LAYOUT_V2, LAYOUTS
+from cosmos_repository import CosmosRepository
+from ingestion import RequestUnitThrottle
+
+
+def _edited_at(doc: dict) -> str:
+    return doc.get("edited_timestamp_iso") or doc.get("e") or ""  # Noms longs ou schéma compact.
+
+
+def is_stale_copy(source_doc: dict, target_doc: dict | None) -> bool:
+    """Vrai si la cible a déjà une version au moins aussi récente que celle lue dans la source."""
+    if target_doc is None:
+        return False
+    if target_doc.get("_ts", 0) >= source_doc.get("_ts", 0):
+        return True
+    return _edited_at(target_doc) > _edited_at(source_doc)
+
+
+class MigrationProgressStore:
+    def __init__(self, path: str = DEFAULT_STATE_PATH):
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS container_migrations ("
+            " source TEXT NOT NULL, target TEXT NOT NULL, continuation_token TEXT, copied INTEGER NOT NULL,"
+            " finished INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL, PRIMARY KEY (source, target))"
+        )
+
+    def load(self, source: str, target: str):
+        return self.conn.execute(
+            "SELECT continuation_token, copied, finished FROM container_migrations WHERE source = ? AND target = ?",
+            (source, target)).fetchone()
+
+    def save(self, source: str, target: str, token: str | None, copied: int, finished: bool = False):
+        self.conn.execute(
+            "INSERT INTO container_migrations (source, target, continuation_token, copied, finished, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(source, target) DO UPDATE SET"
+            " continuation_token = excluded.continuation_token, copied = excluded.copied,"
+            " finished = excluded.finished, updated_at = excluded.updated_at",
+            (source, target, token, copied, int(finished), time.time()))
+
+    def reset(self, source: str, target: str):
+        self.conn.execute("DELETE FROM container_migrations WHERE source = ? AND target = ?", (source, target))
+
+
+async def copy_container(source, target, progress: MigrationProgressStore, source_name: str, target_name: str,
+                         page_size: int = 200, concurrency: int = 16, ru_per_second: float | None = None):
+    saved = progress.load(source_name, target_name)
+    token, copied = (saved[0], saved[1]) if saved else (None, 0)
+    if saved and saved[2]:
+        print(f"Migration {source_name} -> {target_name} déjà terminée ({copied} documents). --restart pour recommencer.")
+        return copied
+    if token:
+        print(f"Reprise de la migration après {copied} documents.")
+
+    throttle = RequestUnitThrottle(ru_per_second) if ru_per_second else None
+    in_flight = asyncio.Semaphore(max(1, concurrency))
+    started = time.monotonic()
+
+    skipped = 0
+
+    async def copy_one(doc) -> bool:
+        async with in_flight:
+            if throttle:
+                await throttle.wait(target.total_request_charge)
+            existing = await target.read_item(str(doc["id"]), target.layout.document_partition_key(doc))
+            if is_stale_copy(doc, existing):
+                return False  # Déjà à jour en v2 (double écriture ou page recopiée après une reprise).
+            if existing is None:
+                current = await source.read_item(str(doc["id"]), source.layout.document_partition_key(doc))
+                if current is None:
+                    return False  # Supprimé depuis la lecture de la page : ne pas le faire revivre en v2.
+                doc = current
+            await target.upsert_item(doc)
+            return True
+
+    async for page, next_token in source.query_pages("SELECT * FROM c", page_size=page_size, continuation_token=token):
+        written = await asyncio.gather(*(copy_one(doc) for doc in page))
+        copied += len(page)
+        skipped += written.count(False)
+        progress.save(source_name, target_name, next_token, copied, finished=next_token is None)
+        elapsed = time.monotonic() - started
+        print(f"{copied} documents copiés ({len(page) / max(elapsed, 1e-9):.0f} docs/s sur la dernière page, "
+              f"{skipped} déjà à jour ou supprimés, {target.total_request_charge:.0f} RU)")
+        started = time.monotonic()
+    progress.save(source_name, target_name, None, copied, finished=True)
+    return copied
+
+
+async def verify(source, target):
+    source_count, target_count = await asyncio.gather(
+        source.query_value("SELECT VALUE COUNT(1) FROM c"), target.query_value("SELECT VALUE COUNT(1) FROM c"))
+    print(f"Source: {source_count} documents, cible: {target_count} documents.")
+    return source_count == target_count
+
+
+async def main_async(args):
+    load_dotenv()
+    endpoint, key = os.getenv("COSMOS_DB_ENDPOINT"), os.getenv("COSMOS_DB_KEY")
+    database_name = os.getenv("DATABASE_NAME")
+    source_name = args.source_container or os.getenv("CONTAINER_NAME")
+    if not all([endpoint, key, database_name, source_name, args.target_container]):
+        print("ERREUR: COSMOS_DB_ENDPOINT, COSMOS_DB_KEY, DATABASE_NAME et les conteneurs source/cible sont requis.")
+        return 1
+
+    source_layout = LAYOUTS[args.source_layout or os.getenv("CONTAINER_LAYOUT", "v1")]
+    source = CosmosRepository(endpoint, key, database_name, source_name, layout=source_layout,
+                              query_timeout=args.page_timeout)
+    target = CosmosRepository(endpoint, key, database_name, args.target_container, layout=LAYOUT_V2,
+                              offer_throughput=args.target_throughput)
+    progress = MigrationProgressStore(os.getenv("LOCAL_STATE_PATH", DEFAULT_STATE_PATH))
+    try:
+        await asyncio.gather(source.connect(), target.connect())
+        if args.verify:
+            return 0 if await verify(source, target) else 2
+        if args.restart:
+            progress.reset(source_name, args.target_container)
+        copied = await copy_container(source, target, progress, source_name, args.target_container,
+                                      page_size=args.page_size, concurrency=args.concurrency,
+                                      ru_per_second=args.ru_per_second or None)
+        print(f"Migration terminée : {copied} documents. RU lecture {source.total_request_charge:.0f}, "
+              f"écriture {target.total_request_charge:.0f}.")
+        return 0
+    finally:
+        await asyncio.gather(source.close(), target.close())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migre le conteneur des messages vers la disposition v2.")
+    parser.add_argument("--target-container", required=True)
+    parser.add_argument("--source-container", help="défaut: CONTAINER_NAME")
+    parser.add_argument("--source-layout", choices=sorted(LAYOUTS), help="défaut: CONTAINER_LAYOUT ou v1")
+    parser.add_argument("--target-throughput", type=int, default=400)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--page-timeout", type=float, default=120.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ru-per-second", type=float, default=0, help="budget RU/s d'écriture (0 = illimité)")
+    parser.add_argument("--restart", action="store_true", help="ignore la progression enregistrée")
+    parser.add_argument("--verify", action="store_true", help="compare seulement le nombre de documents")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
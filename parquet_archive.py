@@ -0,0 +1,611 @@
+"""Archive Parquet des messages, pour servir les agrégats historiques de !ask sans RU.
+
+export_archive.py lit le conteneur page par page (jetons de continuation, reprise après coupure) et
+écrit les champs scalaires des messages en Parquet compressé (zstd), partitionné par canal et par mois :
+
+    <ARCHIVE_PATH>/channel_id=<canal>/month=<AAAA-MM>/part-<n>.parquet
+
+L'export est incrémental : chaque passe relit les documents écrits depuis le début de la précédente
+(c._ts, horodatage serveur de la dernière écriture), donc aussi les éditions et les messages rattrapés
+tardivement. Un message déjà archivé qui revient remplace son ancienne ligne : sa partition est
+réécrite. Les suppressions ne sont reprises que par un export complet (--full).
+
+Le manifeste `_archive.json` note jusqu'où l'archive est complète : le début de la dernière passe
+terminée. Les anciens messages rattrapés après cette passe n'y entrent qu'à la suivante.
+
+ArchiveRepository sert localement les agrégats (COUNT, SUM, MIN, MAX, AVG, GROUP BY sur des champs)
+dont le WHERE borne timestamp_iso avant cette date : fichiers lus en mémoire mappée, partitions
+élaguées d'après le filtre (canal, mois), filtre et regroupement vectorisés (pyarrow.compute). Le
+reste lève UnsupportedArchiveQuery et la requête passe au dépôt suivant.
+"""
+import asyncio
+import datetime
+import glob
+import json
+import os
+import re
+import time
+
+import cosmos_sql
+from checkpoints import DEFAULT_STATE_PATH, open_state_db
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:  # Dépendance optionnelle : sans pyarrow, l'archive est désactivée.
+    pa = None
+
+DEFAULT_ARCHIVE_PATH = "bebzia_archive"
+MANIFEST_NAME = "_archive.json"
+COMPRESSION = "zstd"
+MAX_PARTS_PER_PARTITION = 8  # Au-delà, la partition est fusionnée en un seul fichier.
+
+# Champ du document -> (type Arrow, nullable). channel_id et le mois sont portés par les dossiers.
+FIELDS = {
+    "id": ("string", False),
+    "message_id_int": ("int64", False),
+    "guild_id": ("string", True),
+    "author_id": ("string", False),
+    "author_name": ("string", False),
+    "author_discriminator": ("string", True),
+    "author_display_name": ("string", False),
+    "author_bot": ("bool", False),
+    "content": ("string", False),
+    "timestamp_iso": ("string", False),
+    "edited_timestamp_iso": ("string", True),
+    "attachments_count": ("int32", False),
+    "reactions_count": ("int32", False),
+}
+PARTITION_FIELDS = ("channel_id", "month")
+QUERY_FIELDS = {**FIELDS, "channel_id": ("string", False)}
+TIMESTAMP_FIELD = "timestamp_iso"
+EXPORT_QUERY = (f"SELECT c.channel_id, {', '.join(f'c.{name}' for name in FIELDS)}, c._ts"
+                " FROM c WHERE IS_DEFINED(c.message_id_int) AND c._ts >= @since")
+
+_KINDS = {"string": str, "int64": (int, float), "int32": (int, float), "bool": bool}
+_COMPARISONS = {"=", "!=", "<>", "<", "<=", ">", ">="}
+_MIRRORED = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}
+_AGGREGATES = {"COUNT": "count_all", "SUM": "sum", "MIN": "min", "MAX": "max", "AVG": "mean"}
+_STRING_TESTS = {"STARTSWITH": "starts_with", "ENDSWITH": "ends_with", "CONTAINS": "match_substring"}
+_RANGE_END = "~"  # Après tous les caractères d'un horodatage ISO.
+
+
+class UnsupportedArchiveQuery(cosmos_sql.CosmosSqlError):
+    """Requête que l'archive ne sait pas servir : elle part vers le dépôt suivant."""
+
+
+def file_schema():
+    return pa.schema([(name, pa.type_for_alias(kind), nullable) for name, (kind, nullable) in FIELDS.items()]
+                     + [("_ts", pa.int64())])
+
+
+def dataset_schema():
+    return file_schema().append(pa.field("channel_id", pa.string())).append(pa.field("month", pa.string()))
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITION_FIELDS]), flavor="hive")
+
+
+def _iso(timestamp: float) -> str:
+    """Même forme que timestamp_iso (format_message_to_json), pour comparer les chaînes."""
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).isoformat() + "Z"
+
+
+def _row_from_doc(doc: dict) -> dict | None:
+    if not isinstance(doc, dict) or not isinstance(doc.get("timestamp_iso"), str) or doc.get("channel_id") is None:
+        return None
+    row = {}
+    for name, (kind, nullable) in FIELDS.items():
+        value = doc.get(name)
+        if value is None and not nullable:
+            return None
+        row[name] = str(value) if kind == "string" and value is not None else value
+    row["channel_id"] = str(doc["channel_id"])
+    row["_ts"] = int(doc.get("_ts") or 0)
+    return row
+
+
+# ----- Export -----
+
+class ArchiveProgressStore:
+    """Avancement de l'export par archive, dans le fichier d'état local."""
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH):
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS archive_exports ("
+            " archive TEXT PRIMARY KEY, since INTEGER NOT NULL, pass_started REAL, continuation_token TEXT,"
+            " exported INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def load(self, archive: str) -> tuple:
+        """(since, pass_started, continuation_token, exported) ; pass_started est None entre deux passes."""
+        row = self.conn.execute(
+            "SELECT since, pass_started, continuation_token, exported FROM archive_exports WHERE archive = ?",
+            (archive,)).fetchone()
+        return row or (0, None, None, 0)
+
+    def save(self, archive: str, since: int, pass_started: float | None, token: str | None, exported: int):
+        self.conn.execute(
+            "INSERT INTO archive_exports (archive, since, pass_started, continuation_token, exported, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(archive) DO UPDATE SET since = excluded.since,"
+            " pass_started = excluded.pass_started, continuation_token = excluded.continuation_token,"
+            " exported = excluded.exported, updated_at = excluded.updated_at",
+            (archive, since, pass_started, token, exported, time.time()))
+
+    def reset(self, archive: str):
+        self.conn.execute("DELETE FROM archive_exports WHERE archive = ?", (archive,))
+
+
+class ArchiveExporter:
+    """Écrit les pages lues dans Cosmos en partitions Parquet, par lots de `flush_rows` lignes.
+
+    L'avancement (jeton de continuation) n'est enregistré qu'après l'écriture d'un lot : une passe
+    interrompue reprend au dernier lot écrit, et les lignes relues remplacent les mêmes messages.
+    """
+
+    def __init__(self, path: str = DEFAULT_ARCHIVE_PATH, progress: ArchiveProgressStore | None = None,
+                 flush_rows: int = 200_000):
+        if pa is None:
+            raise RuntimeError("pyarrow n'est pas installé (pip install pyarrow).")
+        self.path = os.path.abspath(path)
+        self.progress = progress or ArchiveProgressStore()
+        self.flush_rows = flush_rows
+        self.stats = {"rows": 0, "files_written": 0, "partitions_rewritten": 0, "bytes_written": 0}
+        self.manifest: dict = {}
+
+    def _write_file(self, directory: str, table) -> str:
+        name = f"part-{time.time_ns():x}.parquet"
+        temporary = os.path.join(directory, f".{name}.tmp")  # Ignoré par la lecture (préfixe '.').
+        pq.write_table(table, temporary, compression=COMPRESSION)
+        target = os.path.join(directory, name)
+        os.replace(temporary, target)
+        self.stats["files_written"] += 1
+        self.stats["bytes_written"] += os.path.getsize(target)
+        return target
+
+    def _write_partition(self, directory: str, table):
+        os.makedirs(directory, exist_ok=True)
+        parts = sorted(glob.glob(os.path.join(directory, "part-*.parquet")))
+        if parts:
+            existing = ds.dataset(parts, schema=file_schema(), format="parquet")
+            replaced = pc.is_in(existing.to_table(columns=["id"]).column("id"), value_set=table.column("id"))
+            if len(parts) >= MAX_PARTS_PER_PARTITION or pc.any(replaced).as_py():
+                kept = existing.to_table(filter=~pc.field("id").isin(table.column("id")))
+                table = pa.concat_tables([kept, table]).sort_by("message_id_int")
+                self._write_file(directory, table)
+                for part in parts:
+                    os.remove(part)
+                self.stats["partitions_rewritten"] += 1
+                return
+        self._write_file(directory, table.sort_by("message_id_int"))
+
+    def write_rows(self, rows: dict) -> int:
+        """Écrit un lot de lignes (id -> ligne), regroupées par partition."""
+        partitions: dict[tuple, list] = {}
+        for row in rows.values():
+            partitions.setdefault((row.pop("channel_id"), row["timestamp_iso"][:7]), []).append(row)
+        schema = file_schema()
+        for (channel_id, month), partition_rows in partitions.items():
+            directory = os.path.join(self.path, f"channel_id={channel_id}", f"month={month}")
+            self._write_partition(directory, pa.Table.from_pylist(partition_rows, schema=schema))
+        self.stats["rows"] += len(rows)
+        return len(rows)
+
+    def write_manifest(self, complete_until: str):
+        dataset = open_dataset(self.path)
+        manifest = {"complete_until": complete_until, "exported_at": _iso(time.time()),
+                    "messages": dataset.count_rows() if dataset is not None else 0,
+                    "bytes": sum(os.path.getsize(f) for f in (dataset.files if dataset is not None else ()))}
+        temporary = os.path.join(self.path, f".{MANIFEST_NAME}.tmp")
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(temporary, os.path.join(self.path, MANIFEST_NAME))
+        return manifest
+
+    def clear(self):
+        """Vide l'archive (export complet) : partitions et manifeste."""
+        for directory in glob.glob(os.path.join(self.path, "channel_id=*")):
+            for root, dirs, files in os.walk(directory, topdown=False):
+                for name in files:
+                    os.remove(os.path.join(root, name))
+                os.rmdir(root)
+        manifest = os.path.join(self.path, MANIFEST_NAME)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+        self.progress.reset(self.path)
+
+    async def export(self, source, page_size: int = 1000, full: bool = False, on_progress=None) -> int:
+        """Une passe d'export depuis `source` (dépôt de messages), reprise si la précédente a été coupée."""
+        if full:
+            self.clear()
+        os.makedirs(self.path, exist_ok=True)
+        since, pass_started, token, exported = self.progress.load(self.path)
+        if pass_started is None:
+            pass_started, token, exported = time.time(), None, 0
+        buffered: dict[str, dict] = {}
+        pages = source.query_pages(EXPORT_QUERY, parameters=[{"name": "@since", "value": since}],
+                                   page_size=page_size, continuation_token=token)
+        try:
+            async for page, token in pages:
+                for doc in page:
+                    row = _row_from_doc(doc)
+                    if row is not None and row["_ts"] >= buffered.get(row["id"], row)["_ts"]:
+                        buffered[row["id"]] = row
+                if len(buffered) >= self.flush_rows or token is None:
+                    exported += await asyncio.to_thread(self.write_rows, buffered)
+                    buffered = {}
+                    self.progress.save(self.path, since, pass_started, token, exported)
+                if on_progress:
+                    await on_progress(exported + len(buffered))
+                if token is None:
+                    break
+        finally:
+            await pages.aclose()
+        if buffered:
+            exported += await asyncio.to_thread(self.write_rows, buffered)
+        # Passe suivante : tout ce qui a été écrit depuis le début de celle-ci (1s de marge sur _ts).
+        self.progress.save(self.path, int(pass_started) - 1, None, None, exported)
+        self.manifest = await asyncio.to_thread(self.write_manifest, _iso(pass_started))
+        return exported
+
+
+# ----- Lecture -----
+
+def open_dataset(path: str):
+    """Jeu de données des partitions, fichiers ouverts en mémoire mappée ; None si l'archive est vide."""
+    if not glob.glob(os.path.join(path, "channel_id=*", "month=*", "part-*.parquet")):
+        return None
+    return ds.dataset(os.path.abspath(path), schema=dataset_schema(), format="parquet", partitioning=_partitioning(),
+                      filesystem=pafs.LocalFileSystem(use_mmap=True))
+
+
+class ArchiveQuery:
+    """Agrégat validé et traduit en expressions pyarrow : filtre, colonnes lues, agrégations."""
+
+    def __init__(self, query: cosmos_sql.Query, params: dict):
+        self.query = query
+        self.params = params
+        self.low: str | None = None
+        self.high: str | None = None
+        self.columns: set[str] = set()
+        self.keys: list[str] = []
+        self.aggregates: dict[str, tuple] = {}  # Nom de colonne du résultat -> (colonne, fonction pyarrow).
+        if query.projections is None or not query.is_aggregate:
+            raise UnsupportedArchiveQuery("Pas un agrégat")
+        for expr in query.group_by:
+            self.keys.append(self._field(expr))
+        self.outputs = [self._output(projection.expr) for projection in query.projections]
+        self.filter = self._condition(query.where, top_level=True) if query.where is not None else None
+
+    def _constant(self, node):
+        if isinstance(node, cosmos_sql.Literal):
+            return node.value
+        if isinstance(node, cosmos_sql.Parameter):
+            if node.name not in self.params:
+                raise cosmos_sql.CosmosSqlError(f"Paramètre non fourni: {node.name}")
+            return self.params[node.name]
+        raise UnsupportedArchiveQuery("Constante attendue")
+
+    @staticmethod
+    def _is_constant(node) -> bool:
+        return isinstance(node, (cosmos_sql.Literal, cosmos_sql.Parameter))
+
+    def _field(self, node, projected: bool = True) -> str:
+        if not isinstance(node, cosmos_sql.Path) or len(node.parts) != 1 or node.parts[0] not in QUERY_FIELDS:
+            raise UnsupportedArchiveQuery(f"Champ absent de l'archive: {node!r}")
+        if projected:
+            self.columns.add(node.parts[0])  # Les champs du seul filtre ne sont pas matérialisés.
+        return node.parts[0]
+
+    def _output(self, expr) -> str:
+        if isinstance(expr, cosmos_sql.Call) and expr.name in _AGGREGATES:
+            function = _AGGREGATES[expr.name]
+            if expr.name == "COUNT":
+                if expr.args and not isinstance(expr.args[0], cosmos_sql.Literal):
+                    self._field(expr.args[0], projected=False)  # Champs tous définis dans l'archive : COUNT(c.x) = COUNT(1).
+                self.aggregates["count_all"] = ([], "count_all")
+                return "count_all"
+            if len(expr.args) != 1:
+                raise UnsupportedArchiveQuery(f"{expr.name} attend un champ")
+            column = self._field(expr.args[0])
+            kind, nullable = QUERY_FIELDS[column]
+            if function in ("sum", "mean") and kind not in ("int64", "int32"):
+                raise UnsupportedArchiveQuery(f"{expr.name} sur un champ non numérique")
+            if nullable:
+                raise UnsupportedArchiveQuery(f"{expr.name} sur un champ qui peut être null")
+            self.aggregates[f"{column}_{function}"] = (column, function)
+            return f"{column}_{function}"
+        if isinstance(expr, cosmos_sql.Path) and self._field(expr) in self.keys:
+            return expr.parts[0]
+        raise UnsupportedArchiveQuery("Projection hors agrégat et hors GROUP BY")
+
+    def _operand(self, node) -> tuple:
+        """(expression, champ) d'un champ, éventuellement sous LOWER/UPPER."""
+        if isinstance(node, cosmos_sql.Call) and node.name in ("LOWER", "UPPER") and len(node.args) == 1:
+            expression, column = self._operand(node.args[0])
+            if QUERY_FIELDS[column][0] != "string":
+                raise UnsupportedArchiveQuery(f"{node.name} sur un champ non textuel")
+            return (pc.utf8_lower if node.name == "LOWER" else pc.utf8_upper)(expression), column
+        column = self._field(node, projected=False)
+        return pc.field(column), column
+
+    def _typed(self, column: str, node):
+        value = self._constant(node)
+        expected = _KINDS[QUERY_FIELDS[column][0]]
+        if value is None or (isinstance(value, bool) and expected is not bool) or not isinstance(value, expected):
+            raise UnsupportedArchiveQuery(f"Constante {value!r} d'un autre type que {column}")
+        return value
+
+    def _narrow(self, low: str | None = None, high: str | None = None):
+        if low is not None and (self.low is None or low > self.low):
+            self.low = low
+        if high is not None and (self.high is None or high < self.high):
+            self.high = high
+
+    def _condition(self, node, top_level: bool):
+        """Expression pyarrow équivalente ; relève les bornes de timestamp_iso des conditions en AND."""
+        if isinstance(node, cosmos_sql.Binary) and node.op in ("AND", "OR"):
+            nested = top_level and node.op == "AND"
+            left, right = self._condition(node.left, nested), self._condition(node.right, nested)
+            return left & right if node.op == "AND" else left | right
+        if isinstance(node, cosmos_sql.Unary) and node.op == "NOT":
+            return ~self._condition(node.operand, top_level=False)
+        if isinstance(node, cosmos_sql.Binary) and node.op in _COMPARISONS:
+            op, left, right = node.op, node.left, node.right
+            if self._is_constant(left) and not self._is_constant(right):
+                op, left, right = _MIRRORED.get(op, op), right, left
+            expression, column = self._operand(left)
+            value = self._typed(column, right)
+            if top_level and left == cosmos_sql.Path((TIMESTAMP_FIELD,)):
+                self._narrow(low=value if op in (">", ">=", "=") else None, high=value if op in ("<", "<=", "=") else None)
+            if op == "=":
+                return expression == value
+            if op in ("!=", "<>"):
+                return expression != value
+            return {"<": expression < value, "<=": expression <= value,
+                    ">": expression > value, ">=": expression >= value}[op]
+        if isinstance(node, cosmos_sql.InList):
+            expression, column = self._operand(node.operand)
+            condition = expression.isin([self._typed(column, value) for value in node.values])
+            return ~condition if node.negated else condition
+        if isinstance(node, cosmos_sql.Between):
+            expression, column = self._operand(node.operand)
+            low, high = self._typed(column, node.low), self._typed(column, node.high)
+            if top_level and not node.negated and node.operand == cosmos_sql.Path((TIMESTAMP_FIELD,)):
+                self._narrow(low=low, high=high)
+            condition = (expression >= low) & (expression <= high)
+            return ~condition if node.negated else condition
+        if isinstance(node, cosmos_sql.Call) and node.name in _STRING_TESTS and len(node.args) in (2, 3):
+            expression, column = self._operand(node.args[0])
+            needle = self._typed(column, node.args[1])
+            ignore_case = len(node.args) == 3 and self._constant(node.args[2]) is not False
+            if top_level and node.name == "STARTSWITH" and not ignore_case \
+                    and node.args[0] == cosmos_sql.Path((TIMESTAMP_FIELD,)):
+                self._narrow(low=needle, high=needle + _RANGE_END)
+            return getattr(pc, _STRING_TESTS[node.name])(expression, pattern=needle, ignore_case=ignore_case)
+        raise UnsupportedArchiveQuery(f"Condition non gérée: {node!r}")
+
+    def scan_filter(self):
+        """Filtre complété des bornes de mois, pour n'ouvrir que les partitions concernées."""
+        conditions = [self.filter] if self.filter is not None else []
+        if self.low is not None:
+            conditions.append(pc.field("month") >= self.low[:7])
+        if self.high is not None:
+            conditions.append(pc.field("month") <= self.high[:7])
+        condition = conditions[0] if conditions else None
+        for other in conditions[1:]:
+            condition = condition & other
+        return condition
+
+    def _value(self, output: str, values: dict):
+        value = values.get(output)
+        if value is None and output in self.aggregates:
+            function = self.aggregates[output][1]
+            return 0 if function == "sum" else cosmos_sql.UNDEFINED  # Cosmos : SUM vide = 0, MIN/MAX/AVG absents.
+        return value
+
+    def _project(self, values: dict):
+        if self.query.value:
+            return self._value(self.outputs[0], values)
+        row = {}
+        for index, (projection, output) in enumerate(zip(self.query.projections, self.outputs)):
+            value = self._value(output, values)
+            if value is not cosmos_sql.UNDEFINED:
+                row[cosmos_sql._projection_name(projection, index)] = value
+        return row
+
+    def run(self, dataset) -> list:
+        condition = self.scan_filter()
+        if not self.columns:
+            groups = [{"count_all": dataset.count_rows(filter=condition)}]
+        else:
+            table = dataset.to_table(columns=sorted(self.columns), filter=condition)
+            if self.keys:
+                grouped = table.group_by(self.keys).aggregate(list(self.aggregates.values()))
+                groups = grouped.to_pylist()
+            else:
+                functions = {"count_all": lambda column: table.num_rows, "sum": pc.sum, "min": pc.min,
+                             "max": pc.max, "mean": pc.mean}
+                groups = [{output: (table.num_rows if function == "count_all"
+                                    else functions[function](table.column(column)).as_py())
+                           for output, (column, function) in self.aggregates.items()}]
+        rows = [self._project(values) for values in groups]
+        rows = [row for row in rows if row is not cosmos_sql.UNDEFINED]
+        query = self.query
+        for expr, descending in reversed(query.order_by):
+            rows.sort(key=lambda r: cosmos_sql._sort_key(cosmos_sql._lookup_projected(query, r, expr) if isinstance(r, dict) else r),
+                      reverse=descending)
+        if query.offset is not None:
+            rows = rows[query.offset:query.offset + (query.limit or 0)]
+        if query.top is not None:
+            rows = rows[:query.top]
+        return rows
+
+
+def plan(query: str, parameters: list[dict] | dict | None = None) -> ArchiveQuery | None:
+    """ArchiveQuery pour un agrégat servi par l'archive, None si ce n'est pas un agrégat.
+
+    Lève UnsupportedArchiveQuery pour un agrégat hors de ce que l'archive sait calculer.
+    """
+    parsed = cosmos_sql.parse(query)
+    if not parsed.is_aggregate:
+        return None
+    if isinstance(parameters, list):
+        params = {p["name"]: p["value"] for p in parameters}
+    else:
+        params = dict(parameters or {})
+    return ArchiveQuery(parsed, params)
+
+
+class ParquetArchive:
+    """Archive en lecture : rechargée quand l'export réécrit le manifeste."""
+
+    def __init__(self, path: str = DEFAULT_ARCHIVE_PATH):
+        if pa is None:
+            raise RuntimeError("pyarrow n'est pas installé (pip install pyarrow).")
+        self.path = path
+        self.manifest: dict = {}
+        self._dataset = None
+        self._manifest_mtime = None
+        self.refresh()
+
+    def refresh(self):
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            self.manifest, self._dataset, self._manifest_mtime = {}, None, None
+            return
+        if mtime == self._manifest_mtime:
+            return
+        with open(manifest_path, encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self._dataset = open_dataset(self.path)
+        self._manifest_mtime = mtime
+
+    @property
+    def complete_until(self) -> str | None:
+        return self.manifest.get("complete_until") if self._dataset is not None else None
+
+    def covers(self, planned: ArchiveQuery) -> bool:
+        """Vrai si la requête ne lit que des messages antérieurs à la fin de la partie complète."""
+        complete_until = self.complete_until
+        return complete_until is not None and planned.high is not None and planned.high <= complete_until
+
+    def run_query(self, planned: ArchiveQuery) -> list:
+        return planned.run(self._dataset)
+
+    async def query(self, planned: ArchiveQuery) -> list:
+        return await asyncio.to_thread(self.run_query, planned)
+
+
+class ArchiveRepository:
+    """Dépôt Cosmos dont les agrégats historiques sont servis par l'archive Parquet.
+
+    Les écritures passent sans changement : l'archive est mise à jour par export_archive.py. Une
+    requête n'est servie que si sa borne haute sur timestamp_iso précède la fin de la partie complète
+    de l'archive ; les autres, et les agrégats non gérés, passent au dépôt suivant.
+    """
+
+    def __init__(self, primary, archive: ParquetArchive, on_error=None):
+        self.primary = primary
+        self.archive = archive
+        self.on_error = on_error
+        self.stats = {"answered": 0, "unsupported": 0, "too_recent": 0, "errors": 0, "seconds": 0.0}
+
+    @property
+    def layout(self):
+        return self.primary.layout
+
+    @property
+    def is_connected(self) -> bool:
+        return self.primary.is_connected
+
+    @property
+    def total_request_charge(self) -> float:
+        return self.primary.total_request_charge
+
+    async def connect(self):
+        await self.primary.connect()
+
+    async def close(self):
+        await self.primary.close()
+
+    async def upsert_item(self, body: dict, timeout: float | None = None) -> dict:
+        return await self.primary.upsert_item(body, timeout=timeout)
+
+    async def delete_message(self, channel_id, message_id, timeout: float | None = None) -> bool:
+        return await self.primary.delete_message(channel_id, message_id, timeout=timeout)
+
+    async def delete_item(self, item_id: str, partition_key, timeout: float | None = None) -> bool:
+        return await self.primary.delete_item(item_id, partition_key, timeout=timeout)
+
+    async def read_item(self, item_id: str, partition_key, timeout: float | None = None) -> dict | None:
+        return await self.primary.read_item(item_id, partition_key, timeout=timeout)
+
+    async def _report(self, what: str, error: Exception):
+        self.stats["errors"] += 1
+        if self.on_error:
+            await self.on_error(f"Archive Parquet ({what}): {error}")
+
+    async def _route(self, query: str, parameters) -> ArchiveQuery | None:
+        try:
+            planned = plan(query, parameters)
+        except cosmos_sql.CosmosSqlError:
+            if re.search(r"\b(?:COUNT|SUM|MIN|MAX|AVG|GROUP\s+BY)\b", query, re.IGNORECASE):
+                self.stats["unsupported"] += 1
+            return None
+        if planned is None:
+            return None
+        try:
+            self.archive.refresh()
+        except (OSError, ValueError, pa.ArrowException) as e:
+            await self._report("manifeste illisible", e)
+            return None
+        if not self.archive.covers(planned):
+            self.stats["too_recent"] += 1
+            return None
+        return planned
+
+    async def _answer(self, planned: ArchiveQuery) -> list | None:
+        started = time.perf_counter()
+        try:
+            results = await self.archive.query(planned)
+        except (OSError, pa.ArrowException) as e:
+            await self._report("lecture", e)
+            return None
+        self.stats["answered"] += 1
+        self.stats["seconds"] += time.perf_counter() - started
+        return results
+
+    async def query_items(self, query: str, parameters: list[dict] | None = None, timeout: float | None = None) -> list:
+        planned = await self._route(query, parameters)
+        if planned is not None:
+            results = await self._answer(planned)
+            if results is not None:
+                return results
+        return await self.primary.query_items(query, parameters=parameters, timeout=timeout)
+
+    async def query_value(self, query: str, parameters: list[dict] | None = None, timeout: float | None = None):
+        results = await self.query_items(query, parameters=parameters, timeout=timeout)
+        return results[0] if results else None
+
+    async def query_pages(self, query: str, parameters: list[dict] | None = None, page_size: int = 100,
+                          continuation_token: str | None = None, timeout: float | None = None, on_request_charge=None):
+        planned = await self._route(query, parameters) if continuation_token is None else None
+        if planned is not None:
+            results = await self._answer(planned)
+            if results is not None:
+                if on_request_charge:
+                    on_request_charge(0.0)
+                yield results, None
+                return
+        async for page, token in self.primary.query_pages(query, parameters=parameters, page_size=page_size,
+                                                          continuation_token=continuation_token, timeout=timeout,
+                                                          on_request_charge=on_request_charge):
+            yield page, token
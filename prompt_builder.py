@@ -0,0 +1,167 @@
+"""Assemblage des prompts de synthèse sous un budget de tokens.
+
+- Estimation des tokens message par message (mise en cache dans le builder, par id et contenu), avec
+  tiktoken s'il est installé, sinon une approximation locale de l'encodage cl100k pour du français de chat.
+- Les messages sont formatés une seule fois, puis assemblés par join (pas de concaténation répétée).
+- Les messages répétés à la suite par le même auteur sont regroupés ("(x3)"), les messages vides ou
+  réduits à de la ponctuation sont écartés (sauf s'ils portent une pièce jointe).
+- Le budget réserve la place du prompt système et de la réponse (`max_tokens`).
+"""
+import datetime
+import re
+from dataclasses import dataclass, field
+
+import pytz
+
+try:
+    import tiktoken
+except ImportError:  # Dépendance optionnelle : l'estimateur local suffit pour borner le budget.
+    tiktoken = None
+
+MESSAGE_SEPARATOR = "\n---\n"
+PARIS_TZ = pytz.timezone("Europe/Paris")
+_PUNCTUATION = "!\"'()*,-./:;?@[]_"
+_MEANINGFUL_RE = re.compile(r"\w")
+
+
+def _estimate_tokens_locally(text: str) -> int:
+    """Approximation de cl100k, volontairement un peu pessimiste (le budget reste un plafond).
+
+    Un token par mot, ou par ~3,5 lettres pour les mots longs, plus un par signe de ponctuation ;
+    accents et emojis comptent en plus. Uniquement des opérations en C (split, count, encode) :
+    le comptage ne coûte pas plus que le formatage de la ligne.
+    """
+    punctuation = sum(map(text.count, _PUNCTUATION))
+    words = text.split()
+    letters = len(text) - punctuation - (len(text) - sum(map(len, words)))
+    wide = len(text.encode("utf-8")) - len(text)  # Octets en plus : accents (1) et emojis (3).
+    return max(len(words), (letters * 2) // 7) + punctuation + wide // 2
+
+
+class TokenEstimator:
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        self._encoding = tiktoken.get_encoding(encoding_name) if tiktoken else None
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return _estimate_tokens_locally(text)
+
+
+_hour_cache: dict[str, str] = {}
+
+
+def format_paris_minute(timestamp_iso: str | None) -> str:
+    """"AAAA-MM-JJ HH:MM" à Paris pour un timestamp UTC du schéma, sans dateutil.
+
+    Le décalage de Paris étant d'un nombre entier d'heures, seule l'heure est convertie (et mise en
+    cache) ; les minutes sont recopiées telles quelles.
+    """
+    if not timestamp_iso:
+        return "Date inconnue"
+    hour_key = timestamp_iso[:13]
+    paris_hour = _hour_cache.get(hour_key)
+    if paris_hour is None:
+        try:
+            dt = datetime.datetime.fromisoformat(hour_key).replace(tzinfo=datetime.timezone.utc)
+        except ValueError:
+            return timestamp_iso
+        paris_hour = dt.astimezone(PARIS_TZ).strftime("%Y-%m-%d %H")
+        if len(_hour_cache) > 100_000:
+            _hour_cache.clear()
+        _hour_cache[hour_key] = paris_hour
+    return f"{paris_hour}:{timestamp_iso[14:16]}"
+
+
+@dataclass
+class PackedPrompt:
+    text: str
+    tokens: int
+    included: list[dict] = field(default_factory=list)
+    collapsed: int = 0  # Répétitions regroupées.
+    skipped_empty: int = 0
+    dropped_for_budget: int = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.dropped_for_budget == 0
+
+
+class PromptBuilder:
+    """Formate et empaquette des documents messages dans un budget de tokens."""
+
+    def __init__(self, estimator: TokenEstimator | None = None, context_tokens: int = 16000,
+                 max_output_tokens: int = 1500, safety_margin: int = 200, line_cache_size: int = 50_000):
+        self.estimator = estimator or TokenEstimator()
+        self.context_tokens = context_tokens
+        self.max_output_tokens = max_output_tokens
+        self.safety_margin = safety_margin
+        self._separator_tokens = self.estimator.count(MESSAGE_SEPARATOR)
+        # Cache des lignes formatées, gardé ici plutôt que sur les documents (partagés avec les caches de
+        # requêtes et le réplica) : une édition change la clé, donc jamais de ligne périmée.
+        self.line_cache_size = line_cache_size
+        self._line_cache: dict[tuple, tuple[str, int]] = {}
+
+    def budget_for(self, system_prompt: str, extra_text: str = "", max_output_tokens: int | None = None) -> int:
+        """Tokens disponibles pour les messages une fois le prompt système et la réponse réservés."""
+        reserved = self.estimator.count(system_prompt) + self.estimator.count(extra_text)
+        reserved += self.max_output_tokens if max_output_tokens is None else max_output_tokens
+        return max(0, self.context_tokens - reserved - self.safety_margin)
+
+    def message_line(self, item: dict) -> tuple[str, int]:
+        """Ligne formatée du message et son coût en tokens, calculés une fois par version du message."""
+        author = item.get("author_display_name", item.get("author_name", "Auteur inconnu"))
+        content = item.get("content") or ""
+        message_id = item.get("id")
+        key = None
+        if message_id is not None:
+            key = (message_id, item.get("edited_timestamp_iso"), hash(content), author, bool(item.get("attachments_count")))
+            cached = self._line_cache.get(key)
+            if cached is not None:
+                return cached
+        if not _MEANINGFUL_RE.search(content) and item.get("attachments_count"):
+            content = (content + " [pièce jointe]").strip()
+        line = f"[{author}] ({format_paris_minute(item.get('timestamp_iso'))}): {content}"
+        result = (line, self.estimator.count(line) + self._separator_tokens)
+        if key is not None:
+            if len(self._line_cache) >= self.line_cache_size:
+                self._line_cache.clear()
+            self._line_cache[key] = result
+        return result
+
+    def item_tokens(self, item: dict) -> int:
+        return self.message_line(item)[1]
+
+    @staticmethod
+    def is_empty(item: dict) -> bool:
+        return not _MEANINGFUL_RE.search(item.get("content") or "") and not item.get("attachments_count")
+
+    def pack(self, items: list[dict], budget_tokens: int) -> PackedPrompt:
+        """Ajoute les messages dans l'ordre donné tant que le budget le permet."""
+        lines, included = [], []
+        tokens = collapsed = skipped = dropped = 0
+        previous_key, previous_line, repeat_count = None, "", 0
+        for position, item in enumerate(items):
+            if self.is_empty(item):
+                skipped += 1
+                continue
+            key = (item.get("author_name"), (item.get("content") or "").strip().lower())
+            if key == previous_key:
+                repeat_count += 1
+                collapsed += 1
+                lines[-1] = f"{previous_line} (x{repeat_count})"
+                continue
+            line, line_tokens = self.message_line(item)
+            if tokens + line_tokens > budget_tokens:
+                dropped = sum(1 for rest in items[position:] if not self.is_empty(rest))
+                break
+            lines.append(line)
+            included.append(item)
+            tokens += line_tokens
+            previous_key, previous_line, repeat_count = key, line, 1
+        text = MESSAGE_SEPARATOR.join(lines) + MESSAGE_SEPARATOR if lines else ""
+        return PackedPrompt(text, tokens, included, collapsed, skipped, dropped)
@@ -0,0 +1,263 @@
+"""Cache des résultats de !ask (messages lus, valeurs COUNT, résumé final), invalidé par les écritures.
+
+Entre deux passes d'ingestion, une question populaire ("résume aujourd'hui") relance la même requête
+générée, avec les mêmes RU et les mêmes tokens de synthèse. Les entrées sont indexées par la requête
+SQL normalisée. Elles sont marquées par le filigrane (watermark) des canaux que la requête lit :
+un numéro de version par canal, avancé par toute écriture de message (rattrapage, temps réel,
+éditions, suppressions) via WatermarkedRepository. Une entrée reste valable tant qu'aucun de ses
+canaux n'a bougé. Une requête sans filtre sur c.channel_id dépend de tous les canaux.
+Quand l'ingestion tourne dans un autre processus (BOT_ROLE), les filigranes sont lus et avancés dans
+le fichier d'état local (SharedWatermarks).
+
+Pas de TTL : les dates relatives sont déjà concrètes dans la requête générée, donc une même
+question posée le lendemain donne une autre clé. LRU borné en nombre d'entrées et en octets (estimés).
+"""
+import collections
+import json
+import time
+from dataclasses import dataclass
+
+import cosmos_sql
+from checkpoints import DEFAULT_STATE_PATH, open_state_db
+from result_fetcher import FetchResult
+
+
+class IngestionWatermarks:
+    """Version des données de chaque canal ; `epoch` avance quand le canal touché est inconnu."""
+
+    def __init__(self):
+        self.epoch = 0
+        self.total = 0
+        self._channels: collections.Counter[str] = collections.Counter()
+
+    def advance(self, channel_id=None):
+        if channel_id is None:
+            self.epoch += 1
+        else:
+            self._channels[str(channel_id)] += 1
+        self.total += 1
+
+    def snapshot(self, channels: frozenset | None) -> tuple:
+        if channels is None:
+            return (self.epoch, self.total)
+        return (self.epoch,) + tuple(self._channels[channel] for channel in sorted(channels))
+
+
+class SharedWatermarks:
+    """IngestionWatermarks dans le fichier d'état local, partagé entre le processus d'ingestion et celui des commandes."""
+
+    _EPOCH, _TOTAL = "*", "+"
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH):
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingestion_watermarks ("
+            " channel_id TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID"
+        )
+
+    def advance(self, channel_id=None):
+        key = self._EPOCH if channel_id is None else str(channel_id)
+        self.conn.execute(
+            "INSERT INTO ingestion_watermarks (channel_id, version) VALUES (?, 1), (?, 1)"
+            " ON CONFLICT(channel_id) DO UPDATE SET version = version + 1", (key, self._TOTAL))
+
+    def snapshot(self, channels: frozenset | None) -> tuple:
+        keys = [self._EPOCH, self._TOTAL] + sorted(channels or ())
+        rows = dict(self.conn.execute(
+            f"SELECT channel_id, version FROM ingestion_watermarks WHERE channel_id IN ({','.join('?' * len(keys))})", keys))
+        if channels is None:
+            return (rows.get(self._EPOCH, 0), rows.get(self._TOTAL, 0))
+        return (rows.get(self._EPOCH, 0),) + tuple(rows.get(channel, 0) for channel in sorted(channels))
+
+
+def normalize_sql(sql: str) -> str:
+    """Jetons séparés par un espace : la mise en forme de l'IA ne change pas la clé, les chaînes si."""
+    tokens, pos = [], 0
+    sql = sql.strip().rstrip(";")
+    while pos < len(sql):
+        m = cosmos_sql._TOKEN_RE.match(sql, pos)
+        if not m:
+            return " ".join(sql.split())
+        if m.lastgroup != "ws":
+            tokens.append(m.group())
+        pos = m.end()
+    return " ".join(tokens)
+
+
+def _channels_of(node) -> frozenset | None:
+    """Canaux auxquels le filtre limite la requête, ou None s'il peut en lire d'autres."""
+    if isinstance(node, cosmos_sql.Binary) and node.op in ("AND", "OR"):
+        left, right = _channels_of(node.left), _channels_of(node.right)
+        if node.op == "OR":
+            return left | right if left is not None and right is not None else None
+        if left is not None and right is not None:
+            return left & right
+        return left if left is not None else right
+    channel_path = cosmos_sql.Path(("channel_id",))
+    if isinstance(node, cosmos_sql.Binary) and node.op == "=":
+        for path, value in ((node.left, node.right), (node.right, node.left)):
+            if path == channel_path and isinstance(value, cosmos_sql.Literal):
+                return frozenset({str(value.value)})
+    if (isinstance(node, cosmos_sql.InList) and not node.negated and node.operand == channel_path
+            and all(isinstance(value, cosmos_sql.Literal) for value in node.values)):
+        return frozenset(str(value.value) for value in node.values)
+    return None
+
+
+def query_channels(sql: str) -> frozenset | None:
+    try:
+        query = cosmos_sql.parse(sql)
+    except cosmos_sql.CosmosSqlError:
+        return None
+    return _channels_of(query.where) if query.where is not None else None
+
+
+@dataclass
+class CachedResult:
+    fetch: FetchResult
+    channels: frozenset | None
+    watermark: tuple
+    size_bytes: int
+    created_at: float
+    summary: str | None = None
+    hits: int = 0
+
+
+class ResultCache:
+    def __init__(self, watermarks: IngestionWatermarks, max_entries: int = 200, max_bytes: int = 64 * 1024 * 1024):
+        self.watermarks = watermarks
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: collections.OrderedDict[str, CachedResult] = collections.OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "invalidated": 0, "evicted": 0, "summary_hits": 0,
+                      "saved_request_charge": 0.0}
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def watermark_for(self, sql: str) -> tuple:
+        """Filigrane à relever AVANT la requête : une écriture pendant la lecture empêche la mise en cache."""
+        return self.watermarks.snapshot(query_channels(sql))
+
+    def _valid(self, key: str) -> CachedResult | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.watermark != self.watermarks.snapshot(entry.channels):
+            self._remove(key)
+            self.stats["invalidated"] += 1
+            return None
+        return entry
+
+    def lookup(self, sql: str) -> CachedResult | None:
+        key = normalize_sql(sql)
+        entry = self._valid(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        self.stats["hits"] += 1
+        self.stats["saved_request_charge"] += entry.fetch.request_charge
+        if entry.summary:
+            self.stats["summary_hits"] += 1
+        return entry
+
+    def store(self, sql: str, fetch: FetchResult, watermark: tuple):
+        channels = query_channels(sql)
+        if watermark != self.watermarks.snapshot(channels):
+            return  # Données écrites pendant la lecture : résultat peut-être déjà périmé.
+        size = len(json.dumps(fetch.items, default=str))
+        if size > self.max_bytes // 4:
+            return
+        key = normalize_sql(sql)
+        self._remove(key)
+        self._entries[key] = CachedResult(fetch, channels, watermark, size, time.time())
+        self.bytes += size
+        self._evict()
+
+    def store_summary(self, sql: str, summary: str):
+        """Attache le résumé final à l'entrée, si ses données n'ont pas changé entre-temps."""
+        entry = self._valid(normalize_sql(sql))
+        if entry is not None and entry.summary is None:
+            entry.summary = summary
+            entry.size_bytes += len(summary)
+            self.bytes += len(summary)
+            self._evict()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size_bytes
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self.bytes -= entry.size_bytes
+            self.stats["evicted"] += 1
+
+
+class WatermarkedRepository:
+    """Enveloppe du dépôt : avance le filigrane du canal une fois chaque écriture de message terminée."""
+
+    def __init__(self, primary, watermarks: IngestionWatermarks):
+        self.primary = primary
+        self.watermarks = watermarks
+
+    @property
+    def layout(self):
+        return self.primary.layout
+
+    @property
+    def is_connected(self) -> bool:
+        return self.primary.is_connected
+
+    @property
+    def total_request_charge(self) -> float:
+        return self.primary.total_request_charge
+
+    async def connect(self):
+        await self.primary.connect()
+
+    async def close(self):
+        await self.primary.close()
+
+    async def upsert_item(self, body: dict, timeout: float | None = None) -> dict:
+        result = await self.primary.upsert_item(body, timeout=timeout)
+        if "message_id_int" in body:
+            self.watermarks.advance(body.get("channel_id"))
+        return result
+
+    async def delete_message(self, channel_id, message_id, timeout: float | None = None) -> bool:
+        try:
+            return await self.primary.delete_message(channel_id, message_id, timeout=timeout)
+        finally:
+            self.watermarks.advance(channel_id)
+
+    async def delete_item(self, item_id: str, partition_key, timeout: float | None = None) -> bool:
+        try:
+            return await self.primary.delete_item(item_id, partition_key, timeout=timeout)
+        finally:
+            if str(item_id).isdigit():
+                self.watermarks.advance()  # Message dont le canal n'est pas connu ici.
+
+    async def read_item(self, item_id: str, partition_key, timeout: float | None = None) -> dict | None:
+        return await self.primary.read_item(item_id, partition_key, timeout=timeout)
+
+    async def query_items(self, query: str, parameters: list[dict] | None = None,
+                          timeout: float | None = None) -> list:
+        return await self.primary.query_items(query, parameters=parameters, timeout=timeout)
+
+    async def query_value(self, query: str, parameters: list[dict] | None = None,
+                          timeout: float | None = None):
+        return await self.primary.query_value(query, parameters=parameters, timeout=timeout)
+
+    def query_pages(self, query: str, parameters: list[dict] | None = None, page_size: int = 100,
+                    continuation_token: str | None = None, timeout: float | None = None,
+                    on_request_charge=None):
+        return self.primary.query_pages(query, parameters=parameters, page_size=page_size,
+                                        continuation_token=continuation_token, timeout=timeout,
+                                        on_request_charge=on_request_charge)
@@ -0,0 +1,114 @@
+"""Lecture bornée des résultats d'une requête !ask.
+
+La requête générée par l'IA peut sélectionner des documents entiers (embeds, pièces jointes,
+réactions) et ramener des milliers de résultats. Ici :
+- la projection est remplacée par les seuls champs utiles à la synthèse (pour les requêtes qui
+  renvoient des messages ; COUNT, VALUE et GROUP BY sont laissés tels quels) ;
+- les pages sont lues une à une via le jeton de continuation, et la lecture s'arrête dès que le
+  budget de la synthèse (tokens ou nombre de messages) est plein ; les lignes d'agrégat (une par
+  groupe) ne sont pas résumées et sont toutes lues ;
+- le coût RU de la requête est mesuré page par page.
+"""
+import re
+import time
+from dataclasses import dataclass, field
+
+import cosmos_sql
+from aggregate_answers import aggregate_query
+
+SUMMARY_FIELDS = ("id", "channel_id", "guild_id", "author_name", "author_display_name", "content",
+                  "timestamp_iso", "attachments_count")
+
+_SELECT_HEAD_RE = re.compile(r"\s*SELECT\s+(?:TOP\s+\d+\s+)?(?:VALUE\s+)?", re.IGNORECASE)
+_FROM_RE = re.compile(r"\bFROM\b", re.IGNORECASE)
+
+
+def _top_level_from(sql: str, start: int) -> int | None:
+    """Position du FROM principal (hors chaînes et parenthèses) à partir de `start`."""
+    depth, quote, i = 0, None, start
+    while i < len(sql):
+        ch = sql[i]
+        if quote:
+            if ch == "\\":
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in "\"'":
+            quote = ch
+        elif ch in "([":
+            depth += 1
+        elif ch in ")]":
+            depth -= 1
+        elif depth == 0 and _FROM_RE.match(sql, i) and (i == 0 or not (sql[i - 1].isalnum() or sql[i - 1] == "_")):
+            return i
+        i += 1
+    return None
+
+
+def enforce_projection(sql: str, fields=SUMMARY_FIELDS) -> tuple[str, bool]:
+    """(requête, projetée ?) : remplace la liste SELECT par `fields` quand la requête renvoie des messages."""
+    try:
+        query = cosmos_sql.parse(sql)
+    except cosmos_sql.CosmosSqlError:
+        return sql, False  # Syntaxe non gérée localement : requête gardée, lecture bornée quand même.
+    whole_documents = query.value and len(query.projections) == 1 and query.projections[0].expr == cosmos_sql.Path(())
+    if (query.value and not whole_documents) or query.is_aggregate or query.group_by:
+        return sql, False
+    head = _SELECT_HEAD_RE.match(sql)
+    from_position = _top_level_from(sql, head.end()) if head else None
+    if from_position is None:
+        return sql, False
+    alias = query.alias or "c"
+    top = f"TOP {query.top} " if query.top is not None else ""
+    projection = ", ".join(f"{alias}.{name}" for name in fields)
+    return f"SELECT {top}{projection} {sql[from_position:]}", True
+
+
+@dataclass
+class FetchResult:
+    items: list = field(default_factory=list)
+    sql: str = ""
+    projected: bool = False
+    pages: int = 0
+    request_charge: float = 0.0
+    estimated_tokens: int = 0
+    truncated: bool = False  # Arrêt sur budget : d'autres résultats existent.
+    elapsed_seconds: float = 0.0
+
+
+async def fetch_results(repository, sql: str, max_items: int, token_budget: int | None = None,
+                        item_tokens=None, page_size: int = 100, timeout: float | None = None) -> FetchResult:
+    """Lit les pages de `sql` jusqu'à épuisement ou jusqu'à remplir `max_items` / `token_budget`."""
+    started = time.monotonic()
+    projected_sql, projected = enforce_projection(sql)
+    result = FetchResult(sql=projected_sql, projected=projected)
+    if not projected and aggregate_query(sql) is not None:
+        max_items, item_tokens = float("inf"), None  # Classement complet : trié avant affichage.
+
+    def add_charge(charge: float):
+        result.request_charge += charge
+
+    pages = repository.query_pages(projected_sql, page_size=page_size, timeout=timeout, on_request_charge=add_charge)
+    try:
+        async for page, continuation_token in pages:
+            result.pages += 1
+            for item in page:
+                if len(result.items) >= max_items:
+                    result.truncated = True
+                    break
+                if item_tokens and isinstance(item, dict):
+                    tokens = item_tokens(item)
+                    if token_budget is not None and result.estimated_tokens + tokens > token_budget and result.items:
+                        result.truncated = True
+                        break
+                    result.estimated_tokens += tokens
+                result.items.append(item)
+            if result.truncated or continuation_token is None:
+                break
+            if len(result.items) >= max_items:
+                result.truncated = True  # Budget plein pile en fin de page : inutile de lire la suivante.
+                break
+    finally:
+        await pages.aclose()
+    result.elapsed_seconds = time.monotonic() - started
+    return result
@@ -0,0 +1,711 @@
+"""Agrégats précalculés des messages (rollups), pour répondre aux comptages !ask sans parcourir Cosmos.
+
+Chaque message écrit par l'ingestion alimente, dans un fichier SQLite local :
+- des seaux par période (année, mois, jour, heure : préfixes de 4, 7, 10 et 13 caractères de
+  timestamp_iso) et par dimensions (canal, serveur, auteur, noms de l'auteur, bot ou non), avec le
+  nombre de messages, de pièces jointes et de réactions ;
+- un registre de la contribution de chaque message (période, dimensions, horodatage exact), qui
+  permet de retirer l'ancienne contribution lors d'une mise à jour (édition, réactions) ou d'une
+  suppression.
+
+Les requêtes d'agrégat dont le WHERE ne lit que ces dimensions et timestamp_iso (STARTSWITH,
+comparaisons, BETWEEN, IN sur des constantes) sont servies en sommant les seaux. Seaux lus du plus
+grossier au plus fin : un seau dont toute la période vérifie (ou non) les conditions de temps est
+évalué en une fois ; seules les périodes coupées par une borne sont détaillées au niveau inférieur,
+et les heures coupées sont relues message par message dans le registre. Le résultat est exact, et
+le travail dépend du nombre de seaux lus, pas du nombre de messages.
+
+Les documents hors messages (doc_type) ne sont pas comptés. Tout le reste (ORDER BY, champs hors
+dimensions, MAX/MIN/AVG...) lève UnsupportedRollupQuery et la requête part vers Cosmos.
+"""
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import cosmos_sql
+from checkpoints import open_state_db
+
+DEFAULT_ROLLUP_PATH = "bebzia_rollups.sqlite3"
+
+PERIOD_LENGTHS = (4, 7, 10, 13)  # Année, mois, jour, heure.
+DIMENSIONS = ("channel_id", "guild_id", "author_id", "author_name", "author_display_name", "author_bot")
+TIMESTAMP_FIELD = "timestamp_iso"
+SUMMED_FIELDS = ("attachments_count", "reactions_count")
+SOURCE_QUERY = (f"SELECT {', '.join(f'c.{name}' for name in ('id',) + DIMENSIONS + (TIMESTAMP_FIELD,) + SUMMED_FIELDS)}"
+                " FROM c WHERE IS_DEFINED(c.message_id_int)")
+
+_HOUR_RE = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:")
+_TIMESTAMP_TEMPLATE = "0000-01-01T00:00:00.000Z"
+_COMPARISONS = {"=", "!=", "<>", "<", "<=", ">", ">="}
+_MIRRORED = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}
+_RANGE_END = "~"  # Après tous les caractères d'un horodatage ISO.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_dimensions (dims_id INTEGER PRIMARY KEY, dims TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS rollup_buckets (
+    level INTEGER NOT NULL, period TEXT NOT NULL, dims_id INTEGER NOT NULL,
+    messages INTEGER NOT NULL, attachments INTEGER NOT NULL, reactions INTEGER NOT NULL,
+    PRIMARY KEY (level, period, dims_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_messages (
+    message_id INTEGER PRIMARY KEY, hour TEXT, dims_id INTEGER NOT NULL, timestamp_iso TEXT,
+    attachments INTEGER NOT NULL, reactions INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rollup_messages_hour ON rollup_messages(hour);
+CREATE TABLE IF NOT EXISTS rollup_meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS deleted_messages (message_id INTEGER PRIMARY KEY);
+"""
+
+_BUCKET_DELTA_SQL = (
+    "INSERT INTO rollup_buckets (level, period, dims_id, messages, attachments, reactions) VALUES (?, ?, ?, ?, ?, ?)"
+    " ON CONFLICT(level, period, dims_id) DO UPDATE SET messages = messages + excluded.messages,"
+    " attachments = attachments + excluded.attachments, reactions = reactions + excluded.reactions"
+)
+_LEDGER_UPSERT_SQL = (
+    "INSERT INTO rollup_messages (message_id, hour, dims_id, timestamp_iso, attachments, reactions)"
+    " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(message_id) DO UPDATE SET hour = excluded.hour,"
+    " dims_id = excluded.dims_id, timestamp_iso = excluded.timestamp_iso,"
+    " attachments = excluded.attachments, reactions = excluded.reactions"
+)
+
+
+class UnsupportedRollupQuery(cosmos_sql.CosmosSqlError):
+    """Agrégat que les rollups ne savent pas servir : la requête part vers Cosmos."""
+
+
+def _number(value) -> int | float:
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def dimensions_key(doc: dict) -> str:
+    """Dimensions présentes dans le document, en JSON canonique (une absence n'est pas un null)."""
+    return json.dumps({name: doc[name] for name in DIMENSIONS if name in doc}, sort_keys=True, ensure_ascii=False)
+
+
+def _contribution(doc: dict) -> tuple | None:
+    """(message_id, heure, dimensions, horodatage, pièces jointes, réactions), ou None hors messages."""
+    if "doc_type" in doc or not str(doc.get("id", "")).isdigit():
+        return None
+    timestamp = doc.get(TIMESTAMP_FIELD)
+    if not isinstance(timestamp, str):
+        timestamp = None
+    hour = timestamp[:PERIOD_LENGTHS[-1]] if timestamp and _HOUR_RE.match(timestamp) else None
+    return (int(doc["id"]), hour, dimensions_key(doc), timestamp,
+            _number(doc.get("attachments_count")), _number(doc.get("reactions_count")))
+
+
+def _add_deltas(deltas: dict, hour: str | None, dims, sign: int, attachments, reactions):
+    if hour is None:
+        return  # Horodatage irrégulier : message seulement dans le registre, toujours relu en détail.
+    for length in PERIOD_LENGTHS:
+        delta = deltas.setdefault((length, hour[:length], dims), [0, 0, 0])
+        delta[0] += sign
+        delta[1] += sign * attachments
+        delta[2] += sign * reactions
+
+
+def accumulate_buckets(totals: dict, docs) -> int:
+    """Ajoute `docs` à `totals` {(niveau, période, dimensions JSON): [messages, pièces jointes, réactions]}.
+
+    Même calcul que le stockage, sur des documents lus ailleurs (vérification par parcours complet).
+    """
+    counted = 0
+    for contribution in filter(None, map(_contribution, docs)):
+        _, hour, dims, _, attachments, reactions = contribution
+        _add_deltas(totals, hour, dims, 1, attachments, reactions)
+        counted += 1
+    return counted
+
+
+# ----- Préparation des requêtes -----
+
+class RollupQuery:
+    """Requête d'agrégat validée : conditions de temps relevées, bornes de parcours des seaux."""
+
+    def __init__(self, query: cosmos_sql.Query, params: dict):
+        self.query = query
+        self.params = params
+        self.boundaries: set[str] = set()  # Constantes comparées à timestamp_iso.
+        self.low: str | None = None
+        self.high: str | None = None
+        self._check_projections()
+        for expr in query.group_by:
+            self._check_dimensions(expr)
+        if query.where is not None:
+            self._check_where(query.where, top_level=True)
+
+    def _constant(self, node):
+        if isinstance(node, cosmos_sql.Literal):
+            return node.value
+        if isinstance(node, cosmos_sql.Parameter):
+            if node.name not in self.params:
+                raise cosmos_sql.CosmosSqlError(f"Paramètre non fourni: {node.name}")
+            return self.params[node.name]
+        raise UnsupportedRollupQuery("Constante attendue")
+
+    @staticmethod
+    def _is_constant(node) -> bool:
+        return isinstance(node, (cosmos_sql.Literal, cosmos_sql.Parameter))
+
+    @staticmethod
+    def _is_timestamp(node) -> bool:
+        return isinstance(node, cosmos_sql.Path) and node.parts == (TIMESTAMP_FIELD,)
+
+    def _check_projections(self):
+        query = self.query
+        if not query.is_aggregate or query.projections is None:
+            raise UnsupportedRollupQuery("Pas un agrégat")
+        if query.order_by:
+            raise UnsupportedRollupQuery("ORDER BY non servi par les rollups")
+        for projection in query.projections:
+            expr = projection.expr
+            if isinstance(expr, cosmos_sql.Call) and expr.name in cosmos_sql.AGGREGATE_FUNCTIONS:
+                self._check_aggregate(expr)
+            elif query.group_by:
+                self._check_dimensions(expr)
+            else:
+                raise UnsupportedRollupQuery("Champ hors agrégat sans GROUP BY")
+
+    @staticmethod
+    def _check_aggregate(call: cosmos_sql.Call):
+        args = call.args
+        if call.name == "COUNT" and (not args or isinstance(args[0], cosmos_sql.Literal)
+                                     or args[0] == cosmos_sql.Path(("id",))):
+            return
+        if call.name == "SUM" and len(args) == 1 and isinstance(args[0], cosmos_sql.Path) \
+                and args[0].parts in {(name,) for name in SUMMED_FIELDS}:
+            return
+        raise UnsupportedRollupQuery(f"Agrégat {call.name} non servi par les rollups")
+
+    def _check_dimensions(self, node):
+        """Expression évaluable sur les seules dimensions d'un seau."""
+        if isinstance(node, cosmos_sql.Path):
+            if len(node.parts) != 1 or node.parts[0] not in DIMENSIONS:
+                raise UnsupportedRollupQuery(f"Champ absent des rollups: {node.parts!r}")
+        elif isinstance(node, cosmos_sql.Call):
+            if node.name in cosmos_sql.AGGREGATE_FUNCTIONS:
+                raise UnsupportedRollupQuery("Agrégat imbriqué")
+            for arg in node.args:
+                self._check_dimensions(arg)
+        elif isinstance(node, cosmos_sql.Unary):
+            self._check_dimensions(node.operand)
+        elif isinstance(node, cosmos_sql.Binary):
+            self._check_dimensions(node.left)
+            self._check_dimensions(node.right)
+        elif isinstance(node, cosmos_sql.InList):
+            for child in [node.operand, *node.values]:
+                self._check_dimensions(child)
+        elif isinstance(node, cosmos_sql.Between):
+            for child in (node.operand, node.low, node.high):
+                self._check_dimensions(child)
+        elif not self._is_constant(node):
+            raise UnsupportedRollupQuery(f"Expression non gérée: {node!r}")
+
+    def _boundary(self, value) -> str | None:
+        if isinstance(value, str):
+            self.boundaries.add(value)
+            return value
+        return None
+
+    def _narrow(self, low: str | None = None, high: str | None = None):
+        if low is not None and (self.low is None or low > self.low):
+            self.low = low
+        if high is not None and (self.high is None or high < self.high):
+            self.high = high
+
+    def _check_where(self, node, top_level: bool):
+        """Les dimensions partout ; timestamp_iso seulement comparé à des constantes (bornes relevées)."""
+        if isinstance(node, cosmos_sql.Binary) and node.op == "AND":
+            self._check_where(node.left, top_level)
+            self._check_where(node.right, top_level)
+            return
+        if isinstance(node, cosmos_sql.Binary) and node.op in _COMPARISONS:
+            op, left, right = node.op, node.left, node.right
+            if self._is_timestamp(right) and self._is_constant(left):
+                op, left, right = _MIRRORED.get(op, op), right, left
+            if self._is_timestamp(left) and self._is_constant(right):
+                bound = self._boundary(self._constant(right))
+                if top_level and bound is not None:
+                    if op in (">", ">=", "="):
+                        self._narrow(low=bound)
+                    if op in ("<", "<=", "="):
+                        self._narrow(high=bound)
+                return
+        if isinstance(node, cosmos_sql.Call) and node.name == "STARTSWITH" and node.args and self._is_timestamp(node.args[0]):
+            if len(node.args) < 2 or not self._is_constant(node.args[1]):
+                raise UnsupportedRollupQuery("STARTSWITH(c.timestamp_iso, ...) sans constante")
+            prefix = self._constant(node.args[1])
+            ignore_case = len(node.args) > 2 and (not self._is_constant(node.args[2]) or self._constant(node.args[2]) is not False)
+            if ignore_case and isinstance(prefix, str) and prefix.lower() != prefix.upper():
+                raise UnsupportedRollupQuery("STARTSWITH insensible à la casse sur une date avec lettres")
+            bound = self._boundary(prefix)
+            if top_level and bound is not None:
+                self._narrow(low=bound, high=bound + _RANGE_END)
+            return
+        if isinstance(node, cosmos_sql.Between) and self._is_timestamp(node.operand):
+            if not (self._is_constant(node.low) and self._is_constant(node.high)):
+                raise UnsupportedRollupQuery("BETWEEN sur timestamp_iso sans constantes")
+            low, high = self._boundary(self._constant(node.low)), self._boundary(self._constant(node.high))
+            if top_level and not node.negated:
+                self._narrow(low=low, high=high)
+            return
+        if isinstance(node, cosmos_sql.InList) and self._is_timestamp(node.operand):
+            if not all(self._is_constant(v) for v in node.values):
+                raise UnsupportedRollupQuery("IN sur timestamp_iso sans constantes")
+            for value in node.values:
+                self._boundary(self._constant(value))
+            return
+        if isinstance(node, cosmos_sql.Call):
+            if node.name in cosmos_sql.AGGREGATE_FUNCTIONS:
+                raise UnsupportedRollupQuery("Agrégat dans WHERE")
+            for arg in node.args:
+                self._check_where(arg, top_level=False)
+        elif isinstance(node, cosmos_sql.Unary):
+            self._check_where(node.operand, top_level=False)
+        elif isinstance(node, cosmos_sql.Binary):
+            self._check_where(node.left, top_level=False)
+            self._check_where(node.right, top_level=False)
+        elif isinstance(node, (cosmos_sql.InList, cosmos_sql.Between)) or isinstance(node, cosmos_sql.Path):
+            self._check_dimensions(node)
+        elif not self._is_constant(node):
+            raise UnsupportedRollupQuery(f"Expression non gérée: {node!r}")
+
+    def ambiguous_periods(self, length: int) -> set[str]:
+        """Périodes de `length` caractères coupées par une borne : leurs messages ne vérifient pas tous
+        les conditions de temps de la même façon. Ailleurs, les `length` premiers caractères décident."""
+        return {bound[:length] for bound in self.boundaries if len(bound) > length}
+
+    def period_range(self, length: int) -> tuple[str | None, str | None]:
+        return (self.low[:length] if self.low is not None else None,
+                self.high[:length] if self.high is not None else None)
+
+
+def plan(query: str, parameters: list[dict] | dict | None = None) -> RollupQuery | None:
+    """RollupQuery si la requête est un agrégat servi par les rollups, None si ce n'est pas un agrégat.
+
+    Lève UnsupportedRollupQuery pour un agrégat hors de ce que les rollups savent calculer.
+    """
+    parsed = cosmos_sql.parse(query)
+    if not parsed.is_aggregate:
+        return None
+    if isinstance(parameters, list):
+        params = {p["name"]: p["value"] for p in parameters}
+    else:
+        params = dict(parameters or {})
+    return RollupQuery(parsed, params)
+
+
+# ----- Stockage -----
+
+class RollupStore:
+    """Fichier SQLite des rollups. Écritures sérialisées, lectures sur une connexion par thread."""
+
+    def __init__(self, path: str = DEFAULT_ROLLUP_PATH):
+        self.path = path
+        self.conn = open_state_db(path)
+        self.conn.executescript(_SCHEMA)
+        self._write_lock = threading.Lock()
+        self._readers = threading.local()
+        self._dims_ids: dict[str, int] = {}
+        self._dims_docs: dict[int, dict] = {}
+
+    def get_meta(self, key: str) -> str | None:
+        row = self.conn.execute("SELECT value FROM rollup_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str | None):
+        with self._write_lock:
+            if value is None:
+                self.conn.execute("DELETE FROM rollup_meta WHERE key = ?", (key,))
+            else:
+                self.conn.execute("INSERT INTO rollup_meta (key, value) VALUES (?, ?)"
+                                  " ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    @property
+    def ready(self) -> bool:
+        """Vrai une fois le calcul initial terminé (et tant qu'aucune mise à jour n'a échoué)."""
+        return self.get_meta("bootstrap_complete") == "1"
+
+    def mark_ready(self):
+        with self._write_lock:
+            self.conn.execute("DELETE FROM deleted_messages")  # Plus de calcul initial à protéger.
+        self.set_meta("bootstrap_complete", "1")
+
+    def mark_stale(self):
+        """Une mise à jour a échoué : rollups plus servis, recalculés au prochain démarrage."""
+        with self._write_lock:
+            self.conn.executescript("DELETE FROM rollup_buckets; DELETE FROM rollup_messages; DELETE FROM rollup_meta;")
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM rollup_messages").fetchone()[0]
+
+    def _dims_id(self, dims: str) -> int:
+        dims_id = self._dims_ids.get(dims)
+        if dims_id is None:
+            self.conn.execute("INSERT INTO rollup_dimensions (dims) VALUES (?) ON CONFLICT(dims) DO NOTHING", (dims,))
+            dims_id = self._dims_ids[dims] = self.conn.execute(
+                "SELECT dims_id FROM rollup_dimensions WHERE dims = ?", (dims,)).fetchone()[0]
+        return dims_id
+
+    def _ledger_rows(self, message_ids: list[int]) -> dict[int, tuple]:
+        rows = {}
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            rows.update((row[0], row[1:]) for row in self.conn.execute(
+                "SELECT message_id, hour, dims_id, attachments, reactions FROM rollup_messages"
+                f" WHERE message_id IN ({', '.join('?' * len(chunk))})", chunk))
+        return rows
+
+    def _apply(self, deltas: dict):
+        changes = [(level, period, dims_id, *delta) for (level, period, dims_id), delta in deltas.items() if any(delta)]
+        self.conn.executemany(_BUCKET_DELTA_SQL, changes)
+        self.conn.executemany("DELETE FROM rollup_buckets WHERE level = ? AND period = ? AND dims_id = ? AND messages <= 0",
+                              [change[:3] for change in changes if change[3] < 0])
+
+    def write_documents(self, docs, only_missing: bool = False) -> int:
+        """Ajoute des messages, ou remplace leur contribution précédente, en une transaction.
+
+        `only_missing` (calcul initial) garde les messages déjà comptés, plus récents, et saute les messages
+        supprimés depuis le début du calcul, qu'une page lue avant la suppression ferait sinon revivre.
+        """
+        contributions = {c[0]: c for c in map(_contribution, docs) if c is not None}
+        if not contributions:
+            return 0
+        with self._write_lock:
+            self.conn.execute("BEGIN")
+            try:
+                previous = self._ledger_rows(list(contributions))
+                if only_missing:
+                    skipped = set(previous) | self._deleted_ids(list(contributions))
+                    contributions = {k: c for k, c in contributions.items() if k not in skipped}
+                    previous = {}
+                deltas = {}
+                for hour, dims_id, attachments, reactions in previous.values():
+                    _add_deltas(deltas, hour, dims_id, -1, attachments, reactions)
+                ledger = []
+                for message_id, hour, dims, timestamp, attachments, reactions in contributions.values():
+                    dims_id = self._dims_id(dims)
+                    _add_deltas(deltas, hour, dims_id, 1, attachments, reactions)
+                    ledger.append((message_id, hour, dims_id, timestamp, attachments, reactions))
+                self.conn.executemany(_LEDGER_UPSERT_SQL, ledger)
+                self._apply(deltas)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                self._dims_ids.clear()  # Dimensions peut-être insérées dans la transaction annulée.
+                raise
+        return len(contributions)
+
+    def _deleted_ids(self, message_ids: list[int]) -> set[int]:
+        deleted = set()
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            deleted.update(row[0] for row in self.conn.execute(
+                f"SELECT message_id FROM deleted_messages WHERE message_id IN ({', '.join('?' * len(chunk))})", chunk))
+        return deleted
+
+    def remove_messages(self, message_ids) -> int:
+        """Retire des messages ; pendant le calcul initial, garde aussi leur id (voir write_documents)."""
+        ids = [int(m) for m in message_ids if str(m).isdigit()]
+        if not ids:
+            return 0
+        recording = not self.ready
+        with self._write_lock:
+            self.conn.execute("BEGIN")
+            try:
+                previous = self._ledger_rows(ids)
+                deltas = {}
+                for hour, dims_id, attachments, reactions in previous.values():
+                    _add_deltas(deltas, hour, dims_id, -1, attachments, reactions)
+                self.conn.executemany("DELETE FROM rollup_messages WHERE message_id = ?", [(m,) for m in previous])
+                self._apply(deltas)
+                if recording:
+                    self.conn.executemany("INSERT OR IGNORE INTO deleted_messages (message_id) VALUES (?)", [(m,) for m in ids])
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return len(previous)
+
+    async def upsert_documents(self, docs, only_missing: bool = False) -> int:
+        return await asyncio.to_thread(self.write_documents, list(docs), only_missing)
+
+    async def delete_messages(self, message_ids) -> int:
+        return await asyncio.to_thread(self.remove_messages, list(message_ids))
+
+    def bucket_totals(self) -> dict:
+        """Tous les seaux, sous la forme produite par accumulate_buckets."""
+        rows = self._reader().execute(
+            "SELECT b.level, b.period, d.dims, b.messages, b.attachments, b.reactions"
+            " FROM rollup_buckets b JOIN rollup_dimensions d ON d.dims_id = b.dims_id")
+        return {(level, period, dims): [messages, attachments, reactions]
+                for level, period, dims, messages, attachments, reactions in rows}
+
+    # ----- Lecture -----
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        return conn
+
+    def _dimensions(self, conn: sqlite3.Connection, dims_id: int) -> dict:
+        doc = self._dims_docs.get(dims_id)
+        if doc is None:
+            for row_id, dims in conn.execute("SELECT dims_id, dims FROM rollup_dimensions WHERE dims_id >= ?", (dims_id,)):
+                self._dims_docs[row_id] = json.loads(dims)
+            doc = self._dims_docs[dims_id]
+        return doc
+
+    def run_query(self, planned: RollupQuery) -> list:
+        conn = self._reader()
+        where, params = planned.query.where, planned.params
+        boundaries = sorted(planned.boundaries)
+        groups: dict = {}
+
+        def add_rows(sql: str, args: list, length: int | None):
+            """Lignes (dims_id, horodatage représentatif, messages, pièces jointes, réactions, positions...)."""
+            for dims_id, timestamp, messages, attachments, reactions, *_ in conn.execute(sql, args):
+                doc = dict(self._dimensions(conn, dims_id))
+                if timestamp is not None:
+                    # Période : tout horodatage de la période convient.
+                    doc[TIMESTAMP_FIELD] = timestamp if length is None else timestamp + _TIMESTAMP_TEMPLATE[length:]
+                if where is not None and cosmos_sql.evaluate(where, doc, params) is not True:
+                    continue
+                key = tuple(repr(cosmos_sql.evaluate(g, doc, params)) for g in planned.query.group_by)
+                group = groups.setdefault(key, [doc, 0, 0, 0])
+                group[1] += messages
+                group[2] += attachments
+                group[3] += reactions
+
+        # Les conditions de temps ne dépendent que de la position de l'horodatage (ou de la période, hors
+        # périodes coupées) par rapport à chaque borne : les lignes sont sommées par (dimensions, position)
+        # dans SQLite, et le WHERE est évalué une fois par somme.
+        parents: set[str] | None = None  # Périodes du niveau précédent à détailler (None = toutes).
+        for length in PERIOD_LENGTHS:
+            ambiguous = planned.ambiguous_periods(length)
+            low, high = planned.period_range(length)
+            columns, position_args = _position_columns("period", boundaries, length)
+            for parent in (sorted(parents) if parents is not None else [None]):
+                sql = (f"SELECT dims_id, MIN(period), SUM(messages), SUM(attachments), SUM(reactions){columns}"
+                       " FROM rollup_buckets WHERE level = ?")
+                args = position_args + [length]
+                if parent is not None:
+                    sql += " AND period >= ? AND period < ?"
+                    args += [parent, parent + _RANGE_END]
+                if low is not None:
+                    sql += " AND period >= ?"
+                    args.append(low)
+                if high is not None:
+                    sql += " AND period <= ?"
+                    args.append(high)
+                if ambiguous:
+                    sql += f" AND period NOT IN ({', '.join('?' * len(ambiguous))})"
+                    args += sorted(ambiguous)
+                add_rows(sql + " GROUP BY dims_id" + "".join(f", p{i}" for i in range(len(boundaries))), args, length)
+            parents = ambiguous
+            if not parents:
+                break
+
+        # Heures coupées par une borne, et messages sans heure lisible : lus dans le registre.
+        columns, position_args = _position_columns("timestamp_iso", boundaries)
+        group_by = " GROUP BY dims_id" + "".join(f", p{i}, l{i}" for i in range(len(boundaries)))
+        for hour in [None, *sorted(parents or ())]:
+            add_rows(f"SELECT dims_id, MIN(timestamp_iso), COUNT(*), SUM(attachments), SUM(reactions){columns}"
+                     f" FROM rollup_messages WHERE hour {'IS NULL' if hour is None else '= ?'}{group_by}",
+                     position_args + ([] if hour is None else [hour]), None)
+        return _project(planned, groups)
+
+    async def query(self, planned: RollupQuery) -> list:
+        return await asyncio.to_thread(self.run_query, planned)
+
+
+def _position_columns(column: str, boundaries: list[str], length: int | None = None) -> tuple[str, list]:
+    """Colonnes SQL p<i> (ordre du préfixe de `column` par rapport à la borne i) et, pour un horodatage
+    complet (`length` None), l<i> (plus long que la borne : utile quand le préfixe est égal)."""
+    columns, args = [], []
+    for i, bound in enumerate(boundaries):
+        size = len(bound) if length is None else min(len(bound), length)
+        columns.append(f"(substr({column}, 1, {size}) > ?) - (substr({column}, 1, {size}) < ?) AS p{i}")
+        args += [bound[:size]] * 2
+        if length is None:
+            columns.append(f"length({column}) > {len(bound)} AS l{i}")
+    return "".join(f", {c}" for c in columns), args
+
+
+def _project(planned: RollupQuery, groups: dict) -> list:
+    query = planned.query
+    if not query.group_by and not groups:
+        groups = {(): [{}, 0, 0, 0]}  # Agrégat sans GROUP BY : une ligne, même sans message.
+
+    def value_of(expr, doc, messages, attachments, reactions):
+        if isinstance(expr, cosmos_sql.Call) and expr.name in cosmos_sql.AGGREGATE_FUNCTIONS:
+            if expr.name == "COUNT":
+                return messages
+            return attachments if expr.args[0].parts == ("attachments_count",) else reactions
+        return cosmos_sql.evaluate(expr, doc, planned.params)
+
+    rows = []
+    for doc, messages, attachments, reactions in groups.values():
+        if query.value:
+            row = value_of(query.projections[0].expr, doc, messages, attachments, reactions)
+        else:
+            row = {}
+            for index, projection in enumerate(query.projections):
+                value = value_of(projection.expr, doc, messages, attachments, reactions)
+                if value is not cosmos_sql.UNDEFINED:
+                    row[cosmos_sql._projection_name(projection, index)] = value
+        if row is not cosmos_sql.UNDEFINED:
+            rows.append(row)
+    if query.offset is not None:
+        rows = rows[query.offset:query.offset + (query.limit or 0)]
+    if query.top is not None:
+        rows = rows[:query.top]
+    return rows
+
+
+class RollupRepository:
+    """Dépôt Cosmos dont les agrégats sont servis par les rollups quand c'est possible.
+
+    Les écritures de messages mettent les rollups à jour après leur succès dans Cosmos. Les requêtes
+    d'agrégat sont servies localement une fois le calcul initial terminé ; les autres requêtes, et les
+    agrégats non gérés, passent au dépôt suivant (réplique locale ou Cosmos).
+    """
+
+    def __init__(self, primary, store: RollupStore, on_error=None):
+        self.primary = primary
+        self.store = store
+        self.on_error = on_error
+        self.stats = {"answered": 0, "unsupported": 0, "not_ready": 0, "errors": 0, "seconds": 0.0}
+
+    @property
+    def layout(self):
+        return self.primary.layout
+
+    @property
+    def is_connected(self) -> bool:
+        return self.primary.is_connected
+
+    @property
+    def total_request_charge(self) -> float:
+        return self.primary.total_request_charge
+
+    async def connect(self):
+        await self.primary.connect()
+
+    async def close(self):
+        await self.primary.close()
+
+    async def _report(self, what: str, error: Exception):
+        self.stats["errors"] += 1
+        if self.on_error:
+            await self.on_error(f"Rollups ({what}): {error}")
+
+    async def _update(self, what: str, update):
+        try:
+            await update
+        except sqlite3.Error as e:
+            self.store.mark_stale()
+            await self._report(what, e)
+
+    async def upsert_item(self, body: dict, timeout: float | None = None) -> dict:
+        result = await self.primary.upsert_item(body, timeout=timeout)
+        if "doc_type" not in body:
+            await self._update("écriture", self.store.upsert_documents([body]))
+        return result
+
+    async def delete_message(self, channel_id, message_id, timeout: float | None = None) -> bool:
+        deleted = await self.primary.delete_message(channel_id, message_id, timeout=timeout)
+        await self._update("suppression", self.store.delete_messages([message_id]))
+        return deleted
+
+    async def delete_item(self, item_id: str, partition_key, timeout: float | None = None) -> bool:
+        deleted = await self.primary.delete_item(item_id, partition_key, timeout=timeout)
+        if str(item_id).isdigit():
+            await self._update("suppression", self.store.delete_messages([item_id]))
+        return deleted
+
+    async def read_item(self, item_id: str, partition_key, timeout: float | None = None) -> dict | None:
+        return await self.primary.read_item(item_id, partition_key, timeout=timeout)
+
+    def _route(self, query: str, parameters) -> RollupQuery | None:
+        try:
+            planned = plan(query, parameters)
+        except cosmos_sql.CosmosSqlError:
+            if re.search(r"\b(?:COUNT|SUM|GROUP\s+BY)\b", query, re.IGNORECASE):
+                self.stats["unsupported"] += 1
+            return None
+        if planned is not None and not self.store.ready:
+            self.stats["not_ready"] += 1
+            return None
+        return planned
+
+    async def _answer(self, planned: RollupQuery) -> list | None:
+        started = time.perf_counter()
+        try:
+            results = await self.store.query(planned)
+        except cosmos_sql.CosmosSqlError:
+            self.stats["unsupported"] += 1  # Fonction inconnue de l'évaluateur local, par exemple.
+            return None
+        except sqlite3.Error as e:
+            await self._report("lecture", e)
+            return None
+        self.stats["answered"] += 1
+        self.stats["seconds"] += time.perf_counter() - started
+        return results
+
+    async def query_items(self, query: str, parameters: list[dict] | None = None, timeout: float | None = None) -> list:
+        planned = self._route(query, parameters)
+        if planned is not None:
+            results = await self._answer(planned)
+            if results is not None:
+                return results
+        return await self.primary.query_items(query, parameters=parameters, timeout=timeout)
+
+    async def query_value(self, query: str, parameters: list[dict] | None = None, timeout: float | None = None):
+        results = await self.query_items(query, parameters=parameters, timeout=timeout)
+        return results[0] if results else None
+
+    async def query_pages(self, query: str, parameters: list[dict] | None = None, page_size: int = 100,
+                          continuation_token: str | None = None, timeout: float | None = None, on_request_charge=None):
+        planned = self._route(query, parameters) if continuation_token is None else None
+        if planned is not None:
+            results = await self._answer(planned)
+            if results is not None:
+                if on_request_charge:
+                    on_request_charge(0.0)
+                yield results, None
+                return
+        async for page, token in self.primary.query_pages(query, parameters=parameters, page_size=page_size,
+                                                          continuation_token=continuation_token, timeout=timeout,
+                                                          on_request_charge=on_request_charge):
+            yield page, token
+
+    async def bootstrap(self, source=None, page_size: int = 1000, on_progress=None) -> int:
+        """Calcul initial par lecture paginée de `source` (défaut : le dépôt suivant), reprenable.
+
+        Les messages déjà comptés (mis à jour par l'ingestion pendant le calcul) sont gardés, et les messages
+        supprimés pendant le calcul ne sont pas recomptés (table deleted_messages).
+        """
+        if self.store.ready:
+            return 0
+        source = source or self.primary
+        counted = 0
+        token = self.store.get_meta("bootstrap_token")
+        pages = source.query_pages(SOURCE_QUERY, page_size=page_size, continuation_token=token)
+        try:
+            async for page, token in pages:
+                counted += await self.store.upsert_documents(page, only_missing=True)
+                self.store.set_meta("bootstrap_token", token)
+                if on_progress:
+                    await on_progress(counted)
+                if token is None:
+                    break
+        finally:
+            await pages.aclose()
+        self.store.set_meta("bootstrap_token", None)
+        self.store.mark_ready()
+        return counted
@@ -0,0 +1,567 @@
+"""Recherche sémantique des messages (!ask ~question) par plongements vectoriels.
+
+- Les messages sont plongés par lots à l'ingestion (MessageEmbedder, branché sur le dépôt par
+  IndexedRepository) : un fournisseur interchangeable (Azure OpenAI, ou HashingEmbeddingProvider,
+  déterministe et local, pour les tests et les benchmarks).
+- Les vecteurs normalisés sont gardés dans des tableaux NumPy contigus (int8 + une échelle par ligne,
+  4 fois moins de mémoire que float32, ou float32), avec l'id, le canal et le timestamp de chaque
+  message pour filtrer sans sortir de NumPy.
+- La recherche des k plus proches est un produit matrice-vecteur par blocs suivi d'un argpartition :
+  pas de boucle Python par message.
+Un message dont le contenu n'a pas changé (édition de réactions...) n'est pas replongé.
+"""
+import asyncio
+import datetime
+import json
+import os
+import re
+import time
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+import pytz
+
+from intent_parser import TIME_PATTERNS
+from sql_cache import normalize_question, resolve_time_window
+
+PARIS_TZ = pytz.timezone("Europe/Paris")
+_MEANINGFUL_RE = re.compile(r"\w{2,}")
+_WORD_RE = re.compile(r"\w+")
+
+
+def message_text(doc: dict) -> str | None:
+    """Texte plongé pour un document message, ou None s'il n'y a rien à chercher dedans."""
+    content = (doc.get("content") or "").strip()
+    return content if _MEANINGFUL_RE.search(content) else None
+
+
+def fingerprint(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+# ----- Fournisseurs de plongements -----
+
+class HashingEmbeddingProvider:
+    """Plongement déterministe et local (hachage de mots et de trigrammes de lettres, sans accents).
+
+    Pas de sens à proprement parler, mais stable d'une exécution à l'autre, rapide, et proche pour des
+    textes qui partagent des mots ou des morceaux de mots : de quoi tester la chaîne sans Azure.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 256, latency_seconds: float = 0.0):
+        self.dim = dim
+        self.latency_seconds = latency_seconds  # Simule l'aller-retour d'une API distante, par appel.
+        self.calls = 0
+
+    def _features(self, text: str) -> list[int]:
+        features = []
+        for word in _WORD_RE.findall(normalize_question(text)):
+            features.append(zlib.crc32(word.encode()))
+            padded = f" {word} "
+            features.extend(zlib.crc32(padded[i:i + 3].encode()) for i in range(len(padded) - 2))
+        return features
+
+    def embed_sync(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.array(self._features(text) or [0], dtype=np.uint32)
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dim, signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-6)
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        self.calls += 1
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        return self.embed_sync(texts)
+
+
+class AzureOpenAIEmbeddingProvider:
+    """Plongements d'un déploiement Azure OpenAI (ex: text-embedding-3-small), un appel par lot."""
+
+    name = "azure-openai"
+
+    def __init__(self, client, deployment: str, dimensions: int | None = None):
+        self.client = client
+        self.deployment = deployment
+        self.dimensions = dimensions
+        self.dim = dimensions
+        self.calls = 0
+        self.tokens_used = 0
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        kwargs = {"dimensions": self.dimensions} if self.dimensions else {}
+        response = await self.client.embeddings.create(model=self.deployment, input=texts, **kwargs)
+        self.calls += 1
+        if getattr(response, "usage", None):
+            self.tokens_used += response.usage.total_tokens
+        vectors = np.array([item.embedding for item in sorted(response.data, key=lambda d: d.index)], dtype=np.float32)
+        self.dim = vectors.shape[1]
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-6)
+
+
+# ----- Index -----
+
+class VectorIndex:
+    """Vecteurs normalisés en tableaux contigus, recherche exacte des k plus proches (cosinus).
+
+    Les suppressions marquent la ligne morte ; `compact()` les récupère. Les ajouts modifient les
+    tableaux sur place ou les remplacent (agrandissement, compaction) : une recherche en cours dans un
+    thread garde une vue cohérente des tableaux qu'elle a pris au départ.
+    """
+
+    _ARRAYS = ("ids", "vectors", "scales", "channels", "timestamps", "fingerprints", "alive")
+
+    def __init__(self, dim: int | None = None, quantize: bool = True, capacity: int = 1024):
+        self.dim = dim
+        self.quantize = quantize
+        self.meta: dict = {}
+        self._size = 0
+        self._row_of: dict[int, int] = {}
+        self._allocate(capacity if dim else 0)
+
+    def _allocate(self, capacity: int):
+        dim = self.dim or 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.vectors = np.zeros((capacity, dim), dtype=np.int8 if self.quantize else np.float32)
+        self.scales = np.ones(capacity, dtype=np.float32)
+        self.channels = np.zeros(capacity, dtype=np.int64)
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.fingerprints = np.zeros(capacity, dtype=np.uint32)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    def _grow(self, needed: int):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 1024)
+        for name in self._ARRAYS:
+            old = getattr(self, name)
+            grown = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, name, grown)
+        self.scales[self._size:] = 1.0
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name)[:self._size].nbytes for name in self._ARRAYS)
+
+    def fingerprint_of(self, message_id: int) -> int | None:
+        row = self._row_of.get(int(message_id))
+        return int(self.fingerprints[row]) if row is not None else None
+
+    def add(self, ids, vectors: np.ndarray, channels=None, timestamps=None, fingerprints=None):
+        """Ajoute ou remplace (même id) des vecteurs déjà normalisés."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._allocate(max(1024, len(vectors)))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Dimension {vectors.shape[1]} au lieu de {self.dim}")
+        count = len(vectors)
+        channels = np.zeros(count, dtype=np.int64) if channels is None else np.asarray(channels, dtype=np.int64)
+        timestamps = np.zeros(count, dtype=np.int64) if timestamps is None else np.asarray(timestamps, dtype=np.int64)
+        fingerprints = np.zeros(count, dtype=np.uint32) if fingerprints is None else np.asarray(fingerprints, dtype=np.uint32)
+        rows = np.empty(count, dtype=np.int64)
+        self._grow(self._size + count)
+        for position, message_id in enumerate(ids):
+            message_id = int(message_id)
+            row = self._row_of.get(message_id)
+            if row is None:
+                row = self._size
+                self._size += 1
+                self._row_of[message_id] = row
+            rows[position] = row
+        if self.quantize:
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-6) / 127.0
+            self.vectors[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales[rows] = scales
+        else:
+            self.vectors[rows] = vectors
+        self.ids[rows] = np.fromiter((int(i) for i in ids), dtype=np.int64, count=count)
+        self.channels[rows] = channels
+        self.timestamps[rows] = timestamps
+        self.fingerprints[rows] = fingerprints
+        self.alive[rows] = True
+
+    def remove(self, ids) -> int:
+        removed = 0
+        for message_id in ids:
+            row = self._row_of.pop(int(message_id), None)
+            if row is not None:
+                self.alive[row] = False
+                removed += 1
+        return removed
+
+    def search(self, query: np.ndarray, k: int = 50, min_score: float | None = None, channel_id=None,
+               since: int | None = None, until: int | None = None, block_rows: int = 4096) -> list[tuple[int, float]]:
+        """[(id, score)] des k messages les plus proches, du plus au moins proche."""
+        if not self._row_of or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / max(float(np.linalg.norm(query)), 1e-6)
+        size, ids, vectors, scales = self._size, self.ids, self.vectors, self.scales
+        alive, channels, timestamps = self.alive, self.channels, self.timestamps
+        candidate_rows, candidate_scores = [], []
+        for start in range(0, size, block_rows):
+            stop = min(start + block_rows, size)
+            block = vectors[start:stop]
+            # Par blocs : la conversion int8 -> float32 reste en cache au lieu de doubler la mémoire.
+            scores = block.astype(np.float32) @ query if self.quantize else block @ query
+            if self.quantize:
+                scores *= scales[start:stop]
+            mask = alive[start:stop].copy()
+            if channel_id is not None:
+                mask &= channels[start:stop] == int(channel_id)
+            if since is not None:
+                mask &= timestamps[start:stop] >= since
+            if until is not None:
+                mask &= timestamps[start:stop] < until
+            if min_score is not None:
+                mask &= scores >= min_score
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                continue
+            scores = scores[rows]
+            if len(rows) > k:
+                best = np.argpartition(scores, -k)[-k:]
+                rows, scores = rows[best], scores[best]
+            candidate_rows.append(rows + start)
+            candidate_scores.append(scores)
+        if not candidate_rows:
+            return []
+        rows = np.concatenate(candidate_rows)
+        scores = np.concatenate(candidate_scores)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [(int(ids[rows[i]]), float(scores[i])) for i in order]
+
+    def compact(self):
+        """Retire les lignes supprimées dans de nouveaux tableaux (les rangs changent, les ids non)."""
+        keep = np.flatnonzero(self.alive[:self._size])
+        if len(keep) == self._size:
+            return
+        for name in self._ARRAYS:
+            setattr(self, name, getattr(self, name)[keep])
+        self._size = len(keep)
+        self._row_of = {int(message_id): row for row, message_id in enumerate(self.ids)}
+
+    def snapshot(self) -> dict:
+        """Copie cohérente des tableaux et des métadonnées, à prendre sur la boucle (add() agrandit les tableaux)."""
+        size = self._size
+        arrays = {name: getattr(self, name)[:size].copy() for name in self._ARRAYS}
+        return {"arrays": arrays, "meta": dict(self.meta, dim=self.dim, quantize=self.quantize, size=size)}
+
+    @staticmethod
+    def write_snapshot(snapshot: dict, directory: str):
+        """Un fichier .npy par tableau, écrit puis renommé ; ne lit que la copie, peut tourner dans un thread."""
+        os.makedirs(directory, exist_ok=True)
+        for name, array in snapshot["arrays"].items():
+            temporary = os.path.join(directory, f"{name}.tmp.npy")
+            np.save(temporary, array)
+            os.replace(temporary, os.path.join(directory, f"{name}.npy"))
+        meta = snapshot["meta"]
+        temporary = os.path.join(directory, "meta.json.tmp")
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(temporary, os.path.join(directory, "meta.json"))
+
+    def save(self, directory: str):
+        self.write_snapshot(self.snapshot(), directory)
+
+    @classmethod
+    def load(cls, directory: str) -> "VectorIndex":
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(dim=meta.pop("dim"), quantize=meta.pop("quantize"), capacity=0)
+        size = meta.pop("size")
+        index.meta = meta
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy")) for name in cls._ARRAYS}
+        if any(len(array) != size for array in arrays.values()):
+            raise ValueError(f"Index incomplet dans {directory}")
+        for name, array in arrays.items():
+            setattr(index, name, array)
+        index._size = size
+        index._row_of = {int(message_id): row for row, message_id in enumerate(index.ids) if index.alive[row]}
+        return index
+
+
+# ----- Ingestion -----
+
+@dataclass
+class EmbedderStats:
+    submitted: int = 0
+    embedded: int = 0
+    unchanged: int = 0
+    skipped_empty: int = 0
+    batches: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+
+
+class MessageEmbedder:
+    """File d'attente des messages à plonger, vidée par lots de `batch_size` en tâche de fond.
+
+    `submit` ne bloque que si plus de `max_pending` messages attendent (contre-pression sur le backfill).
+    """
+
+    def __init__(self, provider, index: VectorIndex, batch_size: int = 64, flush_interval: float = 2.0,
+                 max_pending: int = 5000, max_parallel: int = 2, on_error=None):
+        self.provider = provider
+        self.index = index
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_parallel = max(1, max_parallel)
+        self.on_error = on_error
+        self.stats = EmbedderStats()
+        self.dirty = False
+        self._pending: dict[int, tuple[str, int, int, int]] = {}
+        self._wake = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _stage(self, doc: dict) -> bool:
+        text = message_text(doc)
+        message_id = doc.get("message_id_int") or (int(doc["id"]) if str(doc.get("id", "")).isdigit() else None)
+        if message_id is None or "doc_type" in doc:
+            return False
+        if text is None:
+            self.stats.skipped_empty += 1
+            if self.index.remove([message_id]):  # Contenu effacé : le message ne doit plus sortir.
+                self.dirty = True
+            return False
+        text_fingerprint = fingerprint(text)
+        if self.index.fingerprint_of(message_id) == text_fingerprint:
+            self.stats.unchanged += 1
+            return False
+        self._pending[int(message_id)] = (text, int(doc.get("channel_id") or 0), int(doc.get("timestamp_unix") or 0),
+                                          text_fingerprint)
+        return True
+
+    async def submit(self, docs):
+        for doc in docs:
+            self.stats.submitted += 1
+            if self._stage(doc) and len(self._pending) >= self.batch_size:
+                self._wake.set()
+        if len(self._pending) >= self.max_pending:
+            self._room.clear()
+            self._wake.set()
+            await self._room.wait()
+
+    def forget(self, message_ids):
+        for message_id in message_ids:
+            self._pending.pop(int(message_id), None)
+        if self.index.remove(message_ids):
+            self.dirty = True
+
+    async def _embed_batch(self, batch: list[tuple[int, tuple[str, int, int, int]]]) -> bool:
+        started = time.perf_counter()
+        try:
+            vectors = await self.provider.embed([entry[0] for _, entry in batch])
+        except Exception as e:
+            self.stats.failed += len(batch)
+            if self.on_error:
+                await self.on_error(f"Plongement d'un lot de {len(batch)} message(s) échoué : {e}")
+            return False
+        self.index.add([message_id for message_id, _ in batch], vectors,
+                       channels=[entry[1] for _, entry in batch], timestamps=[entry[2] for _, entry in batch],
+                       fingerprints=[entry[3] for _, entry in batch])
+        self.dirty = True
+        self.stats.embedded += len(batch)
+        self.stats.batches += 1
+        self.stats.seconds += time.perf_counter() - started
+        return True
+
+    async def flush(self) -> int:
+        """Plonge tout ce qui attend, par lots (au plus `max_parallel` appels en cours).
+
+        Renvoie le nombre de messages dont le plongement a échoué. Ils sont remis en attente pour le
+        prochain vidage (sauf version plus récente déjà en attente, ou file pleine).
+        """
+        async with self._flush_lock:
+            failed = []
+            while self._pending:
+                items = list(self._pending.items())[:self.batch_size * self.max_parallel]
+                for message_id, _ in items:
+                    del self._pending[message_id]
+                batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+                embedded = await asyncio.gather(*(self._embed_batch(batch) for batch in batches))
+                for batch, ok in zip(batches, embedded):
+                    if not ok:
+                        failed.extend(batch)
+                if len(self._pending) < self.max_pending:
+                    self._room.set()
+            for message_id, entry in failed:
+                if len(self._pending) >= self.max_pending:
+                    break
+                self._pending.setdefault(message_id, entry)
+            self._room.set()
+            return len(failed)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._pending:
+                await self.flush()
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+EMBEDDING_SOURCE_QUERY = ("SELECT c.id, c.message_id_int, c.channel_id, c.content, c.timestamp_unix FROM c"
+                          " WHERE IS_DEFINED(c.message_id_int)")
+
+
+class IndexedRepository:
+    """Dépôt qui transmet les messages écrits (et supprimés) au MessageEmbedder ; le reste est délégué."""
+
+    def __init__(self, primary, embedder: MessageEmbedder):
+        self.primary = primary
+        self.embedder = embedder
+
+    @property
+    def layout(self):
+        return self.primary.layout
+
+    @property
+    def is_connected(self) -> bool:
+        return self.primary.is_connected
+
+    @property
+    def total_request_charge(self) -> float:
+        return self.primary.total_request_charge
+
+    async def connect(self):
+        await self.primary.connect()
+
+    async def close(self):
+        await self.primary.close()
+
+    async def upsert_item(self, body: dict, timeout: float | None = None) -> dict:
+        result = await self.primary.upsert_item(body, timeout=timeout)
+        await self.embedder.submit([body])
+        return result
+
+    async def delete_message(self, channel_id, message_id, timeout: float | None = None) -> bool:
+        deleted = await self.primary.delete_message(channel_id, message_id, timeout=timeout)
+        self.embedder.forget([message_id])
+        return deleted
+
+    async def delete_item(self, item_id: str, partition_key, timeout: float | None = None) -> bool:
+        deleted = await self.primary.delete_item(item_id, partition_key, timeout=timeout)
+        if str(item_id).isdigit():
+            self.embedder.forget([item_id])
+        return deleted
+
+    async def read_item(self, item_id: str, partition_key, timeout: float | None = None) -> dict | None:
+        return await self.primary.read_item(item_id, partition_key, timeout=timeout)
+
+    async def query_items(self, query: str, parameters: list[dict] | None = None, timeout: float | None = None) -> list:
+        return await self.primary.query_items(query, parameters=parameters, timeout=timeout)
+
+    async def query_value(self, query: str, parameters: list[dict] | None = None, timeout: float | None = None):
+        return await self.primary.query_value(query, parameters=parameters, timeout=timeout)
+
+    def query_pages(self, query: str, parameters: list[dict] | None = None, page_size: int = 100,
+                    continuation_token: str | None = None, timeout: float | None = None, on_request_charge=None):
+        return self.primary.query_pages(query, parameters=parameters, page_size=page_size,
+                                        continuation_token=continuation_token, timeout=timeout,
+                                        on_request_charge=on_request_charge)
+
+    async def bootstrap(self, page_size: int = 500, on_progress=None) -> int:
+        """Plonge l'archive déjà dans Cosmos (reprenable : jeton de continuation dans index.meta)."""
+        index = self.embedder.index
+        if index.meta.get("bootstrap_complete"):
+            return 0
+        submitted = 0
+        pages = self.primary.query_pages(EMBEDDING_SOURCE_QUERY, page_size=page_size,
+                                         continuation_token=index.meta.get("bootstrap_token"))
+        try:
+            async for page, token in pages:
+                await self.embedder.submit(page)
+                submitted += len(page)
+                failed = await self.embedder.flush()
+                if failed:
+                    # Jeton de la page précédente conservé : la reprise relira cette page.
+                    raise RuntimeError(f"{failed} message(s) non plongé(s), indexation initiale arrêtée avant cette page")
+                index.meta["bootstrap_token"] = token  # Gardé seulement une fois la page plongée.
+                if on_progress:
+                    await on_progress(submitted)
+                if token is None:
+                    break
+        finally:
+            await pages.aclose()
+        index.meta.pop("bootstrap_token", None)
+        index.meta["bootstrap_complete"] = True
+        self.embedder.dirty = True
+        return submitted
+
+
+# ----- Recherche -----
+
+def question_time_bounds(question: str, now: datetime.datetime) -> tuple[int | None, int | None]:
+    """Bornes unix [début, fin) de la première période relative de la question ("hier", "ce mois"...)."""
+    plain = normalize_question(question)
+    window = resolve_time_window(now)
+    for time_range, pattern in TIME_PATTERNS:
+        if not re.search(pattern, plain):
+            continue
+        if time_range in ("week", "last_week"):
+            prefix = "week" if time_range == "week" else "last_week"
+            start = datetime.date.fromisoformat(window[f"{prefix}_start"])
+            end = datetime.date.fromisoformat(window[f"{prefix}_end"]) + datetime.timedelta(days=1)
+        else:
+            value = window[time_range]
+            if len(value) == 10:
+                start = datetime.date.fromisoformat(value)
+                end = start + datetime.timedelta(days=1)
+            elif len(value) == 7:
+                start = datetime.date.fromisoformat(value + "-01")
+                end = (start + datetime.timedelta(days=32)).replace(day=1)
+            else:
+                start = datetime.date(int(value), 1, 1)
+                end = datetime.date(int(value) + 1, 1, 1)
+
+        def to_unix(day: datetime.date) -> int:
+            return int(PARIS_TZ.localize(datetime.datetime(day.year, day.month, day.day)).timestamp())
+
+        return to_unix(start), to_unix(end)
+    return None, None
+
+
+class SemanticSearch:
+    def __init__(self, provider, index: VectorIndex):
+        self.provider = provider
+        self.index = index
+
+    async def search(self, question: str, k: int = 100, min_score: float | None = None, channel_id=None,
+                     since: int | None = None, until: int | None = None) -> list[tuple[int, float]]:
+        query = await self.provider.embed([question])
+        return await asyncio.to_thread(self.index.search, query[0], k, min_score, channel_id, since, until)
@@ -0,0 +1,193 @@
+"""Cache des requêtes SQL générées par get_ai_analysis.
+
+Deux niveaux :
+- exact : (question normalisée, utilisateur si la question parle de lui, jour de référence à Paris).
+- modèle : la même question posée un autre jour. Les dates concrètes que le prompt a calculées pour
+  les expressions relatives ("hier", "cette semaine", ...) sont remplacées par des marqueurs
+  ({yesterday}, {week_start}...), puis recalculées au moment de la réutilisation. Une requête n'est
+  mise en modèle que si TOUTES ses dates littérales s'expliquent ainsi.
+Éviction LRU + TTL, persistance JSON optionnelle.
+"""
+import collections
+import datetime
+import json
+import os
+import re
+import time
+import unicodedata
+from dataclasses import asdict, dataclass
+
+# Expression relative (normalisée, sans accents) -> marqueurs de date qu'elle introduit dans la requête.
+RELATIVE_TERMS = {
+    "avant-hier": ("day_before_yesterday",),
+    "aujourd'hui": ("today",),
+    "hier": ("yesterday",),
+    "cette semaine": ("week_start", "week_end"),
+    "la semaine derniere": ("last_week_start", "last_week_end"),
+    "ce mois": ("month",),
+    "le mois dernier": ("last_month",),
+    "cette annee": ("year",),
+    "l'annee derniere": ("last_year",),
+}
+
+SELF_REFERENCE_RE = re.compile(r"\b(moi|mes|mon|ma|je|j'|m'|perso)\b")
+DATE_LITERAL_RE = re.compile(r"\d{4}-\d{2}(?:-\d{2})?")
+YEAR_LITERAL_RE = re.compile(r"[\"'](\d{4})[\"'\-]")
+
+
+def normalize_question(question: str) -> str:
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.replace("’", "'").replace("`", "'")
+    text = re.sub(r"[^\w' -]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def resolve_time_window(now: datetime.datetime) -> dict[str, str]:
+    """Valeurs concrètes des marqueurs, calculées comme dans le prompt de get_ai_analysis."""
+    today = now.date()
+    week_start = today - datetime.timedelta(days=today.weekday())
+    last_week_start = week_start - datetime.timedelta(days=7)
+    first_of_month = today.replace(day=1)
+    last_month = first_of_month - datetime.timedelta(days=1)
+    return {
+        "today": today.strftime("%Y-%m-%d"),
+        "yesterday": (today - datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+        "day_before_yesterday": (today - datetime.timedelta(days=2)).strftime("%Y-%m-%d"),
+        "week_start": week_start.strftime("%Y-%m-%d"),
+        "week_end": (week_start + datetime.timedelta(days=6)).strftime("%Y-%m-%d"),
+        "last_week_start": last_week_start.strftime("%Y-%m-%d"),
+        "last_week_end": (last_week_start + datetime.timedelta(days=6)).strftime("%Y-%m-%d"),
+        "month": today.strftime("%Y-%m"),
+        "last_month": last_month.strftime("%Y-%m"),
+        "year": today.strftime("%Y"),
+        "last_year": str(today.year - 1),
+    }
+
+
+def relative_markers(normalized_question: str) -> list[str]:
+    markers, remaining = [], normalized_question
+    # Les expressions longues d'abord ("avant-hier" ne doit pas être lu comme "hier").
+    for term in sorted(RELATIVE_TERMS, key=len, reverse=True):
+        pattern = rf"(?<![\w-]){re.escape(term)}(?![\w-])"  # "d'hier" compte, "hierarchie" non.
+        if re.search(pattern, remaining):
+            markers.extend(RELATIVE_TERMS[term])
+            remaining = re.sub(pattern, " ", remaining)
+    return markers
+
+
+def make_template(sql: str, markers: list[str], window: dict[str, str]) -> str | None:
+    """Remplace les dates du jour par des marqueurs ; None si une date reste inexpliquée."""
+    template = sql.replace("{", "{{").replace("}", "}}")
+    # Dates complètes d'abord, puis mois, puis années (une date contient son mois et son année).
+    for marker in sorted(markers, key=lambda m: len(window[m]), reverse=True):
+        value = window[marker]
+        if len(value) == 4:
+            template = re.sub(rf"(?<![\d-]){value}(?![\d])", "{" + marker + "}", template)
+        else:
+            template = template.replace(value, "{" + marker + "}")
+    if DATE_LITERAL_RE.search(template) or YEAR_LITERAL_RE.search(template):
+        return None
+    return template
+
+
+@dataclass
+class CacheEntry:
+    sql: str
+    saved_tokens: int
+    created_at: float
+    hits: int = 0
+
+
+class SqlGenerationCache:
+    def __init__(self, max_entries: int = 500, exact_ttl_seconds: float = 6 * 3600,
+                 template_ttl_seconds: float = 7 * 86400, persist_path: str | None = None):
+        self.max_entries = max_entries
+        self.exact_ttl_seconds = exact_ttl_seconds
+        self.template_ttl_seconds = template_ttl_seconds
+        self.persist_path = persist_path
+        self._exact: collections.OrderedDict[str, CacheEntry] = collections.OrderedDict()
+        self._templates: collections.OrderedDict[str, CacheEntry] = collections.OrderedDict()
+        self.stats = {"exact_hits": 0, "template_hits": 0, "misses": 0, "saved_tokens": 0}
+        if persist_path:
+            self._load()
+
+    @staticmethod
+    def _keys(question: str, user_name: str, window: dict[str, str]):
+        normalized = normalize_question(question)
+        user_part = user_name.lower() if SELF_REFERENCE_RE.search(normalized) else "*"
+        template_key = f"{user_part}|{normalized}"
+        return normalized, f"{window['today']}|{template_key}", template_key
+
+    def _get(self, store: collections.OrderedDict, key: str, ttl: float) -> CacheEntry | None:
+        entry = store.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.created_at > ttl:
+            del store[key]
+            return None
+        store.move_to_end(key)
+        return entry
+
+    @staticmethod
+    def _put(store: collections.OrderedDict, key: str, entry: CacheEntry, max_entries: int):
+        store[key] = entry
+        store.move_to_end(key)
+        while len(store) > max_entries:
+            store.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.stats["exact_hits"] + self.stats["template_hits"] + self.stats["misses"]
+        return (self.stats["exact_hits"] + self.stats["template_hits"]) / total if total else 0.0
+
+    def lookup(self, question: str, user_name: str, now: datetime.datetime) -> tuple[str, str, int] | None:
+        """Renvoie (sql, niveau "exact"/"modèle", tokens économisés) ou None."""
+        window = resolve_time_window(now)
+        _, exact_key, template_key = self._keys(question, user_name, window)
+        entry = self._get(self._exact, exact_key, self.exact_ttl_seconds)
+        if entry:
+            entry.hits += 1
+            self.stats["exact_hits"] += 1
+            self.stats["saved_tokens"] += entry.saved_tokens
+            return entry.sql, "exact", entry.saved_tokens
+        entry = self._get(self._templates, template_key, self.template_ttl_seconds)
+        if entry:
+            entry.hits += 1
+            self.stats["template_hits"] += 1
+            self.stats["saved_tokens"] += entry.saved_tokens
+            sql = entry.sql.format(**window)
+            self._put(self._exact, exact_key, CacheEntry(sql, entry.saved_tokens, time.time()), self.max_entries)
+            return sql, "modèle", entry.saved_tokens
+        self.stats["misses"] += 1
+        return None
+
+    def store(self, question: str, user_name: str, now: datetime.datetime, sql: str, tokens_used: int):
+        window = resolve_time_window(now)
+        normalized, exact_key, template_key = self._keys(question, user_name, window)
+        created = time.time()
+        self._put(self._exact, exact_key, CacheEntry(sql, tokens_used, created), self.max_entries)
+        template = make_template(sql, relative_markers(normalized), window)
+        if template is not None:
+            self._put(self._templates, template_key, CacheEntry(template, tokens_used, created), self.max_entries)
+        if self.persist_path:
+            self._save()
+
+    def _save(self):
+        payload = {"exact": {k: asdict(v) for k, v in self._exact.items()},
+                   "templates": {k: asdict(v) for k, v in self._templates.items()}}
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, self.persist_path)
+
+    def _load(self):
+        try:
+            with open(self.persist_path, encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, value in payload.get("exact", {}).items():
+            self._exact[key] = CacheEntry(**value)
+        for key, value in payload.get("templates", {}).items():
+            self._templates[key] = CacheEntry(**value)
@@ -0,0 +1,124 @@
+"""Démarrage du bot en arrière-plan : la connexion à Discord n'attend plus Cosmos.
+
+StartupOrchestrator lance les étapes d'initialisation (connexion Cosmos, client Azure OpenAI, copies
+initiales des index locaux...) en tâches de fond, en parallèle, chacune après les étapes dont elle dépend. Les commandes
+consultent `pending()` pour répondre « démarrage en cours » au lieu d'échouer, et le délai de chaque
+étape depuis le lancement du processus (time-to-ready) est relevé pour les logs, !stats et /metrics.
+
+VerifiedSchemaStore garde dans le fichier d'état local la trace des conteneurs déjà vérifiés : tant
+que la marque est récente, CosmosRepository.connect ouvre le conteneur sans appeler
+create_database_if_not_exists / create_container_if_not_exists. Si le conteneur a disparu entre-temps
+(404 Cosmos), le dépôt oublie la marque (`forget`) et se reconnecte avec la vérification complète.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from checkpoints import DEFAULT_STATE_PATH, open_state_db
+
+
+@dataclass
+class StartupStep:
+    name: str
+    ready_after: float | None = None  # Secondes depuis le lancement ; None tant que l'étape tourne.
+    error: BaseException | None = None
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class StartupOrchestrator:
+    def __init__(self, on_error=None, on_ready=None):
+        self.started = time.monotonic()
+        self.on_error = on_error
+        self.on_ready = on_ready
+        self.steps: dict[str, StartupStep] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def expect(self, name: str) -> StartupStep:
+        """Déclare une étape attendue (avant son lancement) : elle compte dans pending() dès maintenant."""
+        return self.steps.setdefault(name, StartupStep(name))
+
+    def start(self, name: str, init, after: tuple = ()) -> asyncio.Task:
+        """Lance `init()` en tâche de fond, une fois les étapes `after` terminées (réussies ou non)."""
+        step = self.expect(name)
+
+        async def run():
+            for dependency in after:
+                await self.wait(dependency)
+            try:
+                await init()
+            except Exception as e:
+                step.error = e
+                if self.on_error:
+                    await self.on_error(f"Étape de démarrage '{name}' échouée : {e}")
+            await self._finish(step)
+
+        task = asyncio.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def mark_ready(self, name: str):
+        """Étape terminée par un événement extérieur (connexion Discord, par exemple)."""
+        step = self.expect(name)
+        if not step.done.is_set():
+            await self._finish(step)
+
+    async def _finish(self, step: StartupStep):
+        step.ready_after = self.elapsed()
+        step.done.set()
+        if self.on_ready and self.time_to_ready is not None:
+            callback, self.on_ready = self.on_ready, None  # Une seule fois, quand tout est prêt.
+            await callback(self)
+
+    async def wait(self, name: str, timeout: float | None = None) -> bool:
+        step = self.expect(name)
+        try:
+            await asyncio.wait_for(step.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return step.error is None
+
+    def pending(self, *names: str) -> list[str]:
+        """Étapes parmi `names` (toutes par défaut) encore en cours."""
+        return [name for name in (names or self.steps) if name in self.steps and not self.steps[name].done.is_set()]
+
+    @property
+    def time_to_ready(self) -> float | None:
+        if not self.steps or any(not step.done.is_set() for step in self.steps.values()):
+            return None
+        return max(step.ready_after for step in self.steps.values())
+
+    def report(self) -> str:
+        parts = []
+        for step in self.steps.values():
+            if not step.done.is_set():
+                parts.append(f"{step.name} en cours ({self.elapsed():.1f}s)")
+            else:
+                parts.append(f"{step.name} {step.ready_after:.1f}s" + (" (échec)" if step.error else ""))
+        return ", ".join(parts)
+
+
+class VerifiedSchemaStore:
+    """Conteneurs Cosmos vérifiés (base et conteneur existants), marque valable `max_age_seconds`."""
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH, max_age_seconds: float = 86400.0):
+        self.max_age_seconds = max_age_seconds
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS verified_schemas (key TEXT PRIMARY KEY, verified_at REAL NOT NULL)"
+        )
+
+    def is_verified(self, key: str) -> bool:
+        row = self.conn.execute("SELECT verified_at FROM verified_schemas WHERE key = ?", (key,)).fetchone()
+        return row is not None and time.time() - row[0] < self.max_age_seconds
+
+    def mark_verified(self, key: str):
+        self.conn.execute(
+            "INSERT INTO verified_schemas (key, verified_at) VALUES (?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET verified_at = excluded.verified_at", (key, time.time()))
+
+    def forget(self, key: str):
+        self.conn.execute("DELETE FROM verified_schemas WHERE key = ?", (key,))
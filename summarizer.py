@@ -0,0 +1,183 @@
+"""Synthèse map-reduce des grands ensembles de messages.
+
+Les messages sont triés chronologiquement puis découpés en lots bornés en tokens. Chaque lot est
+résumé séparément (parallélisme borné), puis les résumés partiels sont fusionnés, par étages si
+eux-mêmes dépassent le budget. Le coût et la latence dépendent alors du parallélisme, plus de la
+taille du contexte.
+
+Les frontières de lots dépendent du contenu (un message dont le hash d'id tombe sur 0 modulo
+`boundary_modulus` ferme le lot), pas de la position dans le résultat. Deux questions qui se
+recoupent ("résume la semaine" puis "résume hier et avant-hier") produisent donc en grande partie les
+mêmes lots, et leurs résumés partiels sont relus depuis le cache au lieu d'être redemandés à l'IA.
+"""
+import asyncio
+import collections
+import hashlib
+import time
+from dataclasses import dataclass, field
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation grossière (~4 caractères par token en français)."""
+    return len(text) // 4 + 1
+
+
+def _message_digest(item: dict) -> bytes:
+    return hashlib.sha1(f"{item.get('id')}|{item.get('content', '')}".encode("utf-8")).digest()
+
+
+def chunk_key(chunk: list[dict]) -> str:
+    digest = hashlib.sha1()
+    for item in chunk:
+        digest.update(_message_digest(item))
+    return digest.hexdigest()
+
+
+def split_into_chunks(items: list[dict], token_budget: int, item_tokens, min_fill: float = 0.5,
+                      boundary_modulus: int = 24) -> list[list[dict]]:
+    """Découpe `items` (déjà triés) en lots de `token_budget` tokens au plus, frontières stables."""
+    chunks, current, current_tokens = [], [], 0
+    for item in items:
+        tokens = item_tokens(item)
+        if current and current_tokens + tokens > token_budget:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+        at_boundary = _message_digest(item)[0] % boundary_modulus == 0
+        if at_boundary and current_tokens >= token_budget * min_fill:
+            chunks.append(current)
+            current, current_tokens = [], 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ChunkSummaryCache:
+    """LRU + TTL des résumés partiels, indexés par l'empreinte (ids + contenus) du lot."""
+
+    def __init__(self, max_entries: int = 2000, ttl_seconds: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: collections.OrderedDict[str, tuple[float, str]] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl_seconds:
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, summary: str):
+        self._entries[key] = (time.time(), summary)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+@dataclass
+class SummaryRun:
+    summary: str | None = None
+    chunks: int = 0
+    cached_chunks: int = 0
+    failed_chunks: int = 0
+    reduce_calls: int = 0
+    tokens_used: int = 0
+    elapsed_seconds: float = 0.0
+    notes: list[str] = field(default_factory=list)
+
+
+class MapReduceSummarizer:
+    """Orchestration map-reduce ; les appels au modèle sont fournis par l'appelant.
+
+    `summarize_chunk(chunk, index, total)` et `reduce_partials(partials, items, final)` sont des
+    coroutines qui renvoient `(texte ou None, tokens consommés)` ; `final` est faux pour les fusions
+    intermédiaires, dont le résultat sera à nouveau fusionné.
+    """
+
+    def __init__(self, summarize_chunk, reduce_partials, chunk_token_budget: int = 6000,
+                 reduce_token_budget: int = 8000, max_parallel: int = 4, item_tokens=None,
+                 text_tokens=None, cache: ChunkSummaryCache | None = None):
+        self.summarize_chunk = summarize_chunk
+        self.reduce_partials = reduce_partials
+        self.chunk_token_budget = chunk_token_budget
+        self.reduce_token_budget = reduce_token_budget
+        self.max_parallel = max(1, max_parallel)
+        self.item_tokens = item_tokens or (lambda item: estimate_tokens(item.get("content", "")) + 12)
+        self.text_tokens = text_tokens or estimate_tokens
+        self.cache = cache
+
+    async def _map(self, chunks: list[list[dict]], run: SummaryRun) -> list[str]:
+        semaphore = asyncio.Semaphore(self.max_parallel)
+
+        async def one(index: int, chunk: list[dict]) -> str | None:
+            key = chunk_key(chunk)
+            if self.cache and (cached := self.cache.get(key)) is not None:
+                run.cached_chunks += 1
+                return cached
+            async with semaphore:
+                text, tokens = await self.summarize_chunk(chunk, index, len(chunks))
+            run.tokens_used += tokens
+            if text is None:
+                run.failed_chunks += 1
+                return None
+            if self.cache:
+                self.cache.put(key, text)
+            return text
+
+        partials = await asyncio.gather(*(one(i, chunk) for i, chunk in enumerate(chunks)))
+        return [p for p in partials if p]
+
+    async def _reduce(self, partials: list[str], items: list[dict], run: SummaryRun) -> str | None:
+        # Fusion par étages tant que l'ensemble des résumés partiels dépasse le budget du prompt final.
+        while len(partials) > 1 and sum(self.text_tokens(p) for p in partials) > self.reduce_token_budget:
+            groups, current, current_tokens = [], [], 0
+            for partial in partials:
+                tokens = self.text_tokens(partial)
+                if current and current_tokens + tokens > self.reduce_token_budget:
+                    groups.append(current)
+                    current, current_tokens = [], 0
+                current.append(partial)
+                current_tokens += tokens
+            groups.append(current)
+            if len(groups) == len(partials):
+                break  # Chaque résumé partiel remplit déjà le budget : on fusionne tel quel.
+            semaphore = asyncio.Semaphore(self.max_parallel)
+
+            async def merge(group):
+                if len(group) == 1:
+                    return group[0]
+                async with semaphore:
+                    text, tokens = await self.reduce_partials(group, items, False)
+                run.tokens_used += tokens
+                run.reduce_calls += 1
+                return text
+
+            partials = [p for p in await asyncio.gather(*(merge(g) for g in groups)) if p]
+        if not partials:
+            return None
+        text, tokens = await self.reduce_partials(partials, items, True)
+        run.tokens_used += tokens
+        run.reduce_calls += 1
+        return text
+
+    def needs_map_reduce(self, items: list[dict]) -> bool:
+        return sum(self.item_tokens(item) for item in items) > self.chunk_token_budget
+
+    async def summarize(self, items: list[dict]) -> SummaryRun:
+        """`items` doit être trié chronologiquement (les lots suivent l'ordre de la conversation)."""
+        started = time.monotonic()
+        run = SummaryRun()
+        chunks = split_into_chunks(items, self.chunk_token_budget, self.item_tokens)
+        run.chunks = len(chunks)
+        partials = await self._map(chunks, run)
+        if run.failed_chunks:
+            run.notes.append(f"{run.failed_chunks} lot(s) sur {run.chunks} n'ont pas pu être résumés")
+        run.summary = await self._reduce(partials, items, run)
+        run.elapsed_seconds = time.monotonic() - started
+        return run
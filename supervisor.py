@@ -0,0 +1,88 @@
+"""Lance les processus du bot et les relance s'ils s'arrêtent.
+
+WORKER_ROLES choisit les processus, chacun un `python bot.py` avec son BOT_ROLE :
+  all              un seul processus (défaut, petits déploiements) ;
+  commands,ingest  commandes (!ask, !stats...) d'un côté, rattrapage et ingestion temps réel de
+                   l'autre : un gros rattrapage ne ralentit plus les réponses.
+Les processus partagent le fichier d'état local (points de reprise, filigranes du cache de
+résultats), la réplique, les rollups et l'index sémantique : ils doivent tourner sur la même machine.
+
+Un processus arrêté est relancé après un délai qui double à chaque arrêt rapproché (plafonné à
+SUPERVISOR_MAX_BACKOFF_SECONDS), et revient à 1s après une minute de fonctionnement. SIGTERM/SIGINT
+sont transmis aux processus, tués s'ils ne sont pas arrêtés au bout de SUPERVISOR_STOP_TIMEOUT_SECONDS.
+
+    python supervisor.py
+"""
+import asyncio
+import os
+import signal
+import sys
+import time
+
+from dotenv import load_dotenv
+
+ROLES = ("all", "commands", "ingest")
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+HEALTHY_AFTER_SECONDS = 60.0
+
+
+def worker_environment(role: str, index: int) -> dict:
+    """Environnement d'un processus : son rôle, et un port /metrics distinct par processus."""
+    env = dict(os.environ, BOT_ROLE=role)
+    metrics_port = int(os.getenv("METRICS_HTTP_PORT", "0"))
+    if metrics_port:
+        env["METRICS_HTTP_PORT"] = str(metrics_port + index)
+    return env
+
+
+async def supervise(role: str, index: int, stopping: asyncio.Event, max_backoff: float, stop_timeout: float):
+    backoff = 1.0
+    while not stopping.is_set():
+        started = time.monotonic()
+        process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=worker_environment(role, index))
+        print(f"SUPERVISOR: processus '{role}' démarré (pid {process.pid}).", flush=True)
+        waiter = asyncio.create_task(process.wait())
+        stop_waiter = asyncio.create_task(stopping.wait())
+        await asyncio.wait([waiter, stop_waiter], return_when=asyncio.FIRST_COMPLETED)
+        stop_waiter.cancel()
+        if stopping.is_set() and not waiter.done():
+            process.terminate()
+            try:
+                await asyncio.wait_for(waiter, timeout=stop_timeout)
+            except asyncio.TimeoutError:
+                print(f"SUPERVISOR: processus '{role}' toujours actif après {stop_timeout:.0f}s, arrêt forcé.", flush=True)
+                process.kill()
+                await waiter
+            print(f"SUPERVISOR: processus '{role}' arrêté.", flush=True)
+            return
+        uptime = time.monotonic() - started
+        if uptime >= HEALTHY_AFTER_SECONDS:
+            backoff = 1.0
+        print(f"SUPERVISOR: processus '{role}' terminé (code {waiter.result()}) après {uptime:.0f}s. "
+              f"Relance dans {backoff:.0f}s.", flush=True)
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=backoff)
+        except asyncio.TimeoutError:
+            pass
+        backoff = min(backoff * 2, max_backoff)
+
+
+async def main_async() -> int:
+    load_dotenv()
+    roles = [role.strip().lower() for role in os.getenv("WORKER_ROLES", "all").split(",") if role.strip()]
+    unknown = [role for role in roles if role not in ROLES]
+    if not roles or unknown or ("all" in roles and len(roles) > 1):
+        print(f"ERREUR: WORKER_ROLES invalide ({','.join(roles)}). Valeurs : all, ou commands,ingest.")
+        return 1
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    max_backoff = float(os.getenv("SUPERVISOR_MAX_BACKOFF_SECONDS", "60"))
+    stop_timeout = float(os.getenv("SUPERVISOR_STOP_TIMEOUT_SECONDS", "20"))
+    await asyncio.gather(*(supervise(role, index, stopping, max_backoff, stop_timeout) for index, role in enumerate(roles)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main_async()))
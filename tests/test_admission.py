@@ -0,0 +1,257 @@
+"""Contrôle d'admission de !ask : file équitable, regroupement des demandes identiques et 429."""
+import asyncio
+import email.utils
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admission
+from admission import Coalescer, FairQueue, UserRateLimiter, call_with_backoff, retry_after_seconds
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_served_in_order_and_told_their_position():
+    async def scenario():
+        queue = FairQueue(max_active=1)
+        positions = {name: [] for name in "BCD"}
+        granted = []
+
+        async def request(name):
+            async def on_position(position):
+                positions[name].append(position)
+
+            entry = await queue.acquire(on_position)
+            granted.append((name, entry))
+
+        assert await queue.acquire() == 0
+        tasks = {name: asyncio.create_task(request(name)) for name in "BCD"}
+        await settle()
+        assert queue.waiting == 3 and granted == []
+        for name in "BCD":
+            queue.release()  # Libère la place tenue par la demande précédente.
+            await settle()
+            assert granted[-1][0] == name and queue.active == 1
+        await asyncio.gather(*tasks.values())
+        queue.release()
+        assert queue.active == 0
+        return queue, positions, granted
+
+    queue, positions, granted = asyncio.run(scenario())
+    assert [name for name, _ in granted] == ["B", "C", "D"]
+    assert dict(granted) == {"B": 1, "C": 2, "D": 3}
+    assert positions == {"B": [1], "C": [2, 1], "D": [3, 2, 1]}
+
+
+def test_cancelled_waiter_leaves_the_queue_and_the_others_move_up():
+    async def scenario():
+        queue = FairQueue(max_active=1)
+        positions = []
+
+        async def on_position(position):
+            positions.append(position)
+
+        await queue.acquire()
+        middle = asyncio.create_task(queue.acquire())
+        last = asyncio.create_task(queue.acquire(on_position))
+        await settle()
+        middle.cancel()
+        await settle()
+        assert queue.waiting == 1 and positions == [2, 1]
+        queue.release()
+        await last
+        queue.release()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert queue.active == 0 and queue.waiting == 0
+
+
+def test_slot_granted_during_cancellation_is_passed_on():
+    async def scenario():
+        queue = FairQueue(max_active=1)
+        await queue.acquire()
+        cancelled = asyncio.create_task(queue.acquire())
+        following = asyncio.create_task(queue.acquire())
+        await settle()
+        queue.release()  # La place passe au premier en attente...
+        cancelled.cancel()  # ... annulé avant d'avoir pu reprendre la main.
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        await asyncio.wait_for(following, timeout=1)  # La place n'est pas perdue.
+        assert queue.active == 1 and queue.waiting == 0
+        queue.release()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert queue.active == 0
+
+
+def test_slot_context_manager_releases_on_error():
+    async def scenario():
+        queue = FairQueue(max_active=1)
+        with pytest.raises(RuntimeError):
+            async with queue.slot():
+                raise RuntimeError("échec de la demande")
+        async with queue.slot() as slot:
+            assert slot.entry_position == 0
+        return queue
+
+    assert asyncio.run(scenario()).active == 0
+
+
+def test_late_joiner_receives_every_part_exactly_once():
+    async def scenario():
+        coalescer = Coalescer()
+        resume = asyncio.Event()
+        first, late = [], []
+
+        async def factory(emit):
+            await emit("a")
+            await emit("b")
+            await resume.wait()
+            await emit("c")
+            await emit("d")
+            return "résumé"
+
+        async def collect(parts):
+            async def on_delta(part):
+                parts.append(part)
+            return on_delta
+
+        leader = asyncio.create_task(coalescer.run("k", factory, await collect(first)))
+        await settle()
+        assert coalescer.in_flight("k") and first == ["a", "b"]
+        follower = asyncio.create_task(coalescer.run("k", factory, await collect(late)))
+        await settle()
+        assert late == ["a", "b"]  # Morceaux émis avant son arrivée.
+        resume.set()
+        results = await asyncio.gather(leader, follower)
+        return coalescer, results, first, late
+
+    coalescer, results, first, late = asyncio.run(scenario())
+    assert results == [("résumé", False), ("résumé", True)]
+    assert first == late == ["a", "b", "c", "d"]
+    assert coalescer.stats == {"started": 1, "shared": 1} and not coalescer.in_flight("k")
+
+
+def test_shared_computation_survives_the_leader_cancellation():
+    async def scenario():
+        coalescer = Coalescer()
+        resume = asyncio.Event()
+        calls = []
+
+        async def factory(emit):
+            calls.append(1)
+            await resume.wait()
+            return 42
+
+        leader = asyncio.create_task(coalescer.run("k", factory))
+        await settle()
+        follower = asyncio.create_task(coalescer.run("k", factory))
+        await settle()
+        leader.cancel()
+        await settle()
+        resume.set()
+        return await follower, calls
+
+    assert asyncio.run(scenario()) == ((42, True), [1])
+
+
+def test_failing_display_does_not_block_other_requests():
+    async def scenario():
+        coalescer = Coalescer()
+        received = []
+
+        async def factory(emit):
+            for part in "abc":
+                await emit(part)
+                await asyncio.sleep(0)
+            return "fin"
+
+        async def broken(part):
+            raise RuntimeError("message Discord supprimé")
+
+        async def on_delta(part):
+            received.append(part)
+
+        return await asyncio.gather(coalescer.run("k", factory, broken), coalescer.run("k", factory, on_delta)), received
+
+    results, received = asyncio.run(scenario())
+    assert results == [("fin", False), ("fin", True)] and received == ["a", "b", "c"]
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, headers=None, response_headers=None):
+        super().__init__("429")
+        self.headers = headers
+        if response_headers is not None:
+            self.response = type("Response", (), {"headers": response_headers, "status_code": 429})()
+
+
+def run_with_backoff(monkeypatch, errors, **kwargs):
+    sleeps, retries, calls = [], [], []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    async def call():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "ok"
+
+    async def on_retry(attempt, delay, error):
+        retries.append((attempt, delay))
+
+    monkeypatch.setattr(admission.asyncio, "sleep", fake_sleep)
+    result = asyncio.run(call_with_backoff(call, on_retry=on_retry, **kwargs))
+    return result, sleeps, retries
+
+
+def test_backoff_honours_retry_after_ms_and_retry_after(monkeypatch):
+    errors = [RateLimited(headers={"retry-after-ms": "250"}),
+              RateLimited(response_headers={"Retry-After": "2"}),
+              RateLimited(headers={"x-ms-retry-after-ms": "1500", "Retry-After": "9"})]
+    result, sleeps, retries = run_with_backoff(monkeypatch, errors)
+    assert result == "ok"
+    assert sleeps == [0.25, 2.0, 1.5]  # Les millisecondes priment sur Retry-After.
+    assert retries == [(1, 0.25), (2, 2.0), (3, 1.5)]
+
+
+def test_backoff_caps_the_delay_and_falls_back_to_exponential(monkeypatch):
+    result, sleeps, _ = run_with_backoff(monkeypatch, [RateLimited(headers={"Retry-After": "120"}), RateLimited()],
+                                         base_delay=1.0, max_delay=30.0)
+    assert result == "ok"
+    assert sleeps[0] == 30.0
+    assert 1.6 <= sleeps[1] <= 2.4  # Deuxième essai : 2 s, à ±20 % près.
+
+
+def test_backoff_gives_up_and_leaves_other_errors_alone(monkeypatch):
+    with pytest.raises(RateLimited):
+        run_with_backoff(monkeypatch, [RateLimited(headers={"retry-after-ms": "1"})] * 4, max_attempts=4)
+    with pytest.raises(ValueError):
+        run_with_backoff(monkeypatch, [ValueError("pas un 429")])
+
+
+def test_retry_after_http_date():
+    date = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert 55 <= retry_after_seconds(RateLimited(headers={"Retry-After": date})) <= 60
+    assert retry_after_seconds(RateLimited(headers={"Retry-After": "bientôt"})) is None
+
+
+def test_user_rate_limiter_allows_a_burst_then_waits():
+    limiter = UserRateLimiter(per_minute=6, burst=2)
+    assert limiter.check("a", now=0) == 0 and limiter.check("a", now=0) == 0
+    assert limiter.check("a", now=0) == pytest.approx(10.0)
+    assert limiter.check("b", now=0) == 0  # Seau propre à chaque utilisateur.
+    assert limiter.check("a", now=10) == 0
@@ -0,0 +1,143 @@
+"""Réponses de !ask aux agrégats : mise en forme, questions servies par les rollups et par l'archive."""
+import asyncio
+import datetime
+import os
+import sys
+
+import pytest
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregate_answers import aggregate_query, render_aggregate
+from cosmos_repository import InMemoryCosmosRepository
+from rollups import RollupRepository, RollupStore
+
+
+def test_message_queries_are_not_aggregates():
+    assert aggregate_query("SELECT c.id, c.content FROM c ORDER BY c.timestamp_iso DESC") is None
+    assert aggregate_query("pas du SQL") is None
+
+
+def test_group_by_is_ranked_by_its_first_aggregate():
+    query = aggregate_query("SELECT c.author_name, COUNT(1) AS messages FROM c GROUP BY c.author_name")
+    text = render_aggregate(query, [{"author_name": "airzya", "messages": 3}, {"author_name": "hezek112", "messages": 12},
+                                    {"author_name": "FlyXOwl", "messages": 1}], max_groups=2)
+    lines = text.splitlines()
+    assert lines[1] == "1. **hezek112** : 12 messages"
+    assert lines[2] == "2. **airzya** : 3 messages"
+    assert lines[3] == "… et 1 autre(s)."
+
+
+def test_min_ranking_starts_with_the_oldest():
+    query = aggregate_query("SELECT c.author_name, MIN(c.timestamp_iso) AS premier FROM c GROUP BY c.author_name")
+    text = render_aggregate(query, [{"author_name": "airzya", "premier": "2024-03-01T10:00:00Z"},
+                                    {"author_name": "hezek112", "premier": "2023-01-01T10:00:00Z"}])
+    assert text.splitlines()[1].startswith("1. **hezek112** : premier message le 2023-01-01")
+
+
+def test_scalar_aggregates():
+    assert render_aggregate(aggregate_query("SELECT VALUE COUNT(1) FROM c"), [4]) == \
+        "J'ai trouvé 4 message(s) correspondant à votre demande."
+    assert render_aggregate(aggregate_query("SELECT VALUE SUM(c.reactions_count) FROM c"), [7]) == "Résultat : 7 réactions."
+    assert "1.50" in render_aggregate(aggregate_query("SELECT VALUE AVG(c.reactions_count) FROM c"), [1.5])
+    assert render_aggregate(aggregate_query("SELECT c.author_name, COUNT(1) AS n FROM c GROUP BY c.author_name"), []) == \
+        "Aucun message ne correspond à votre demande."
+
+
+class Author:
+    id = 1
+    name = "FlyXOwl"
+
+
+class Context:
+    def __init__(self):
+        self.author = Author()
+        self.sent = []
+
+    async def send(self, content=None, embed=None):
+        self.sent.append(content)
+
+
+def test_activity_question_is_answered_by_the_rollups(tmp_path, monkeypatch):
+    import bot
+
+    today = datetime.datetime.now(pytz.timezone("Europe/Paris")).strftime("%Y-%m-%d")
+    primary = InMemoryCosmosRepository()
+    for index, author in enumerate(["hezek112"] * 5 + ["airzya"] * 2 + ["FlyXOwl"]):
+        primary.documents[str(1000 + index)] = {
+            "id": str(1000 + index), "message_id_int": 1000 + index, "channel_id": "1", "guild_id": "9",
+            "author_id": author, "author_name": author, "author_display_name": author, "author_bot": False,
+            "content": f"message {index}", "timestamp_iso": f"{today}T12:{index:02d}:00.000Z",
+            "attachments_count": 0, "reactions_count": 1,
+        }
+    repository = RollupRepository(primary, RollupStore(str(tmp_path / "rollups.sqlite3")))
+    asyncio.run(repository.bootstrap(source=primary))
+    queries_before = primary.call_counts["query"]
+
+    async def no_log(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(bot, "cosmos_repo", repository)
+    monkeypatch.setattr(bot, "result_cache", None)
+    monkeypatch.setattr(bot, "LOCAL_INTENT_PARSER_ENABLED", True)
+    monkeypatch.setattr(bot, "send_bot_log_message", no_log)
+
+    async def ask():
+        ctx = Context()
+        await bot.answer_question(ctx, "qui a le plus parlé aujourd'hui ?", ("test", 1), "FlyXOwl (ID: 1)")
+        return ctx
+
+    ctx = asyncio.run(ask())
+    assert repository.stats["answered"] == 1
+    assert primary.call_counts["query"] == queries_before  # Aucun parcours des messages.
+    lines = ctx.sent[-1].splitlines()
+    assert lines[0] == "Classement par auteur (3 au total) :"
+    assert lines[1:] == ["1. **hezek112** : 5 messages", "2. **airzya** : 2 messages", "3. **FlyXOwl** : 1 message"]
+
+
+def test_archive_answers_an_average_question_and_reports_errors(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    import bot
+    from parquet_archive import ArchiveExporter, ArchiveProgressStore, ArchiveRepository, MANIFEST_NAME, ParquetArchive
+
+    last_month = (datetime.datetime.now(pytz.timezone("Europe/Paris")).replace(day=1) - datetime.timedelta(days=1)).strftime("%Y-%m")
+    primary = InMemoryCosmosRepository()
+    for index in range(4):
+        asyncio.run(primary.upsert_item({
+            "id": str(2000 + index), "message_id_int": 2000 + index, "channel_id": "1", "guild_id": "9",
+            "author_id": "5", "author_name": "hezek112", "author_display_name": "Hezek", "author_bot": False,
+            "content": "salut", "timestamp_iso": f"{last_month}-10T12:0{index}:00.000Z",
+            "attachments_count": 0, "reactions_count": index,
+        }))
+    archive_path = str(tmp_path / "archive")
+    asyncio.run(ArchiveExporter(archive_path, ArchiveProgressStore(str(tmp_path / "state.sqlite3"))).export(primary))
+    errors = []
+
+    async def record_error(message):
+        errors.append(message)
+
+    async def no_log(*args, **kwargs):
+        pass
+
+    repository = ArchiveRepository(primary, ParquetArchive(archive_path), on_error=record_error)
+    monkeypatch.setattr(bot, "cosmos_repo", repository)
+    monkeypatch.setattr(bot, "result_cache", None)
+    monkeypatch.setattr(bot, "LOCAL_INTENT_PARSER_ENABLED", True)
+    monkeypatch.setattr(bot, "send_bot_log_message", no_log)
+    queries_before = primary.call_counts["query"]
+
+    async def ask():
+        ctx = Context()
+        await bot.answer_question(ctx, "combien de réactions en moyenne par message le mois dernier ?", ("test", 2), "FlyXOwl (ID: 1)")
+        return ctx
+
+    ctx = asyncio.run(ask())
+    assert repository.stats["answered"] == 1
+    assert primary.call_counts["query"] == queries_before
+    assert ctx.sent[-1] == "Résultat : moyenne de réactions : 1.50 par message."
+
+    with open(os.path.join(archive_path, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        f.write("{illisible")
+    asyncio.run(repository.query_items("SELECT VALUE COUNT(1) FROM c"))
+    assert errors and errors[0].startswith("Archive Parquet (manifeste illisible)")
@@ -0,0 +1,62 @@
+"""Questions de suivi de !ask : analyse locale et filtrage du résultat précédent."""
+import datetime
+import os
+import sys
+
+import pytest
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ask_sessions import AskSessionStore, apply_refinement, parse_refinement
+
+NOW = datetime.datetime(2025, 3, 12, 15, 0, tzinfo=pytz.timezone("Europe/Paris"))
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("et seulement ceux de Fly ?", {"authors": ("fly",)}),
+    ("résume plutôt la partie sur le jeu", {"keywords": ("jeu",), "instead": True}),
+    ("et ceux d'hier ?", {"time_range": "yesterday"}),
+    ("et les 10 derniers ?", {"limit": 10}),
+    ("sauf ceux de airzya", {"excluded_authors": ("airzya",)}),
+    ("et seulement ceux de fly sur valorant", {"authors": ("fly",), "keywords": ("valorant",)}),
+])
+def test_refinements(question, expected):
+    refinement = parse_refinement(question)
+    assert refinement is not None
+    for name, value in expected.items():
+        assert getattr(refinement, name) == value
+
+
+@pytest.mark.parametrize("question", [
+    "et ceux de janvier ?",           # Mois, pas un pseudo.
+    "et ceux de 2023",                # Année.
+    "et ceux sans images",            # Pas une exclusion d'auteur.
+    "et seulement ceux sur valorant dans le canal général",  # Portée de salon : nouvelle recherche.
+    "et seulement dans #général",
+    "et qu'est-ce que Fly pense de Valorant ?",
+    "résume les messages de la semaine",
+])
+def test_unsure_questions_go_to_the_full_pipeline(question):
+    assert parse_refinement(question) is None
+
+
+def test_apply_refinement_filters_locally():
+    items = [{"id": str(i), "channel_id": "1", "author_name": ["flyxowl", "airzya"][i % 2],
+              "content": "on lance le jeu ?" if i == 4 else f"message {i}", "timestamp_iso": f"2025-03-11T10:{i:02d}:00Z"}
+             for i in range(10)]
+    assert [item["id"] for item in apply_refinement(items, parse_refinement("et seulement ceux de Fly ?"), NOW)] == \
+        ["0", "2", "4", "6", "8"]
+    # Mot-clé : le message et ses voisins immédiats du même canal.
+    assert [item["id"] for item in apply_refinement(items, parse_refinement("plutôt la partie sur le jeu"), NOW)] == ["3", "4", "5"]
+    assert len(apply_refinement(items, parse_refinement("et ceux d'hier ?"), NOW)) == 10
+
+
+def test_session_store_expires_and_bounds():
+    store = AskSessionStore(ttl_seconds=60, max_sessions=2)
+    for key in range(3):
+        store.start((key, 1), "q", [{"id": str(key)}], request_charge=1.0)
+    assert store.active == 2 and store.get((0, 1)) is None
+    session = store.get((2, 1))
+    session.last_used -= 120
+    assert store.get((2, 1)) is None
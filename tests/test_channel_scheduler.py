@@ -0,0 +1,101 @@
+"""Planification des passes de rattrapage : priorité, un seul passage par canal, plafond global."""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from channel_scheduler import ChannelSyncScheduler, snowflake_to_unix
+
+# Snowflakes Discord de deux instants espacés d'une heure.
+EARLIER = (1_700_000_000_000 - 1420070400000) << 22
+LATER = (1_700_003_600_000 - 1420070400000) << 22
+
+
+class RecordingSync:
+    """sync_channel factice : note l'ordre de départ et le nombre de passes simultanées."""
+
+    def __init__(self, delay=0.01, failing=()):
+        self.delay = delay
+        self.failing = set(failing)
+        self.started = []
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, channel_id):
+        self.started.append(channel_id)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            if channel_id in self.failing:
+                raise RuntimeError("403 Forbidden")
+            return SimpleNamespace(fetched=7)
+        finally:
+            self.running -= 1
+
+
+def test_snowflake_to_unix():
+    assert snowflake_to_unix(EARLIER) == 1_700_000_000.0
+    assert snowflake_to_unix(None) is None
+
+
+def test_channels_are_synced_by_priority():
+    sync = RecordingSync()
+    scheduler = ChannelSyncScheduler(sync, max_concurrent=1)
+    scheduler.record_synced(1, snowflake_to_unix(EARLIER))  # Synchronisé, sans retard connu.
+    scheduler.record_synced(2, snowflake_to_unix(EARLIER))
+    scheduler.observe_latest_message(2, LATER)  # Une heure de retard.
+    scheduler.record_synced(3, snowflake_to_unix(EARLIER))
+    scheduler.record_activity(3, LATER)  # Activité vue en temps réel, pas encore ingérée.
+    scheduler.state_for(4)  # Jamais synchronisé.
+
+    assert [state.channel_id for state in scheduler.lag_report()] == [4, 3, 2, 1]
+    asyncio.run(scheduler.run_pass([1, 2, 3, 4]))
+    assert sync.started == [4, 3, 2, 1]
+    assert scheduler.states[3].unsynced_events == 0 and scheduler.states[2].lag_seconds == 3600
+
+
+def test_live_ingested_activity_is_not_counted_as_lag():
+    scheduler = ChannelSyncScheduler(RecordingSync())
+    scheduler.record_synced(1, snowflake_to_unix(EARLIER))
+    scheduler.record_activity(1, LATER, synced=True)
+    state = scheduler.states[1]
+    assert state.unsynced_events == 0 and state.lag_seconds == 0.0
+
+
+def test_global_cap_and_one_pass_per_channel():
+    sync = RecordingSync(delay=0.05)
+    scheduler = ChannelSyncScheduler(sync, max_concurrent=2)
+
+    async def scenario():
+        first = asyncio.create_task(scheduler.run_pass([1, 2, 3, 4, 5]))
+        await asyncio.sleep(0.01)
+        await scheduler.run_pass([1, 2])  # Déjà en cours (ou en attente d'une place) : ignorés.
+        await first
+
+    asyncio.run(scenario())
+    assert sync.max_running == 2
+    assert sorted(sync.started) == [1, 2, 3, 4, 5]
+
+
+def test_events_seen_during_a_pass_are_kept_and_errors_recorded():
+    scheduler = None
+
+    async def sync_channel(channel_id):
+        scheduler.record_activity(channel_id, LATER)  # Message arrivé pendant la lecture de l'historique.
+        if channel_id == 2:
+            raise RuntimeError("403 Forbidden")
+        return SimpleNamespace(fetched=3)
+
+    scheduler = ChannelSyncScheduler(sync_channel)
+    for channel_id in (1, 2):
+        scheduler.record_activity(channel_id, EARLIER)
+        scheduler.record_activity(channel_id, EARLIER)
+    asyncio.run(scheduler.run_pass([1, 2]))
+
+    ok, failed = scheduler.states[1], scheduler.states[2]
+    assert ok.unsynced_events == 1 and ok.last_pass_messages == 3 and ok.last_error is None
+    assert failed.unsynced_events == 3 and failed.last_error == "403 Forbidden"
+    assert not ok.running and not failed.running and failed.last_pass_duration is not None
@@ -0,0 +1,53 @@
+"""Points de reprise de l'ingestion : ils ne reculent jamais, dans les deux stockages."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkpoints import CosmosCheckpointStore, SqliteCheckpointStore
+from cosmos_repository import InMemoryCosmosRepository
+
+
+def test_sqlite_checkpoint_compares_ids_as_numbers(tmp_path):
+    store = SqliteCheckpointStore(str(tmp_path / "state.sqlite3"))
+
+    async def scenario():
+        assert await store.save(1, "999", 100.0)
+        assert await store.save(1, "1000", 101.0)  # En texte, "1000" < "999".
+        assert not await store.save(1, "998", 99.0)
+        assert await store.save(1, "1000", 101.0)  # Même message : réécriture sans recul.
+        assert await store.save(2, "5", 50.0)
+        return await store.load(1), await store.load(3), await store.load_all()
+
+    checkpoint, missing, everything = asyncio.run(scenario())
+    assert (checkpoint.channel_id, checkpoint.last_message_id, checkpoint.last_timestamp_unix) == ("1", "1000", 101.0)
+    assert missing is None
+    assert {channel: c.last_message_id for channel, c in everything.items()} == {"1": "1000", "2": "5"}
+
+
+def test_sqlite_checkpoint_survives_a_restart(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    asyncio.run(SqliteCheckpointStore(path).save("1", "1234567890123456789", 1700000000.0))
+    reopened = SqliteCheckpointStore(path)
+    assert not asyncio.run(reopened.save("1", "999999999999999999", 1600000000.0))
+    assert asyncio.run(reopened.load("1")).last_message_id == "1234567890123456789"
+
+
+def test_cosmos_checkpoint_does_not_move_backwards():
+    repository = InMemoryCosmosRepository()
+    store = CosmosCheckpointStore(repository)
+
+    async def scenario():
+        assert await store.save(1, "1000", 101.0)
+        assert not await store.save(1, "999", 100.0)
+        reloaded = CosmosCheckpointStore(repository)  # Autre instance : relit le document avant d'écrire.
+        await reloaded.load(1)
+        assert not await reloaded.save(1, "998", 99.0)
+        return await reloaded.load(1), await reloaded.load_all()
+
+    checkpoint, everything = asyncio.run(scenario())
+    assert checkpoint.last_message_id == "1000" and checkpoint.last_timestamp_unix == 101.0
+    assert list(everything) == ["1"]
+    doc = repository.documents["checkpoint-1"]
+    assert "channel_id" not in doc and "timestamp_iso" not in doc  # Invisible des requêtes !ask.
@@ -0,0 +1,150 @@
+"""Schéma compact (v2) : réécriture des requêtes !ask et écritures évitées."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact_schema import (CompactRepository, DocumentHashStore, compact_document, expand_document,
+                            rewrite_query, side_id)
+from cosmos_repository import InMemoryCosmosRepository
+
+GUARD = "NOT IS_DEFINED(c.x)"
+
+
+def message(message_id, **changes):
+    doc = {"id": str(message_id), "message_id_int": message_id, "channel_id": "1", "guild_id": "9",
+           "author_id": "5", "author_name": "hezek112", "author_discriminator": "0", "author_display_name": "Hezek",
+           "author_bot": False, "content": f"message {message_id}", "timestamp_iso": "2024-03-01T10:00:00.000Z",
+           "timestamp_unix": 1709287200, "edited_timestamp_iso": None, "attachments_count": 0,
+           "attachments": [], "reactions": [], "reactions_count": 0, "embeds": []}
+    doc.update(changes)
+    return doc
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM c", f"SELECT * FROM c WHERE {GUARD}"),
+    ("SELECT c.author_name, COUNT(1) AS n FROM c GROUP BY c.author_name",
+     f"SELECT c.an AS author_name, COUNT(1) AS n FROM c WHERE {GUARD} GROUP BY c.an"),
+    ("SELECT * FROM c ORDER BY c.message_id_int DESC", f"SELECT * FROM c WHERE {GUARD} ORDER BY c.m DESC"),
+    ("SELECT * FROM c OFFSET 0 LIMIT 5", f"SELECT * FROM c WHERE {GUARD} OFFSET 0 LIMIT 5"),
+    ("SELECT * FROM c WHERE c.channel_id = '1' OR c.author_bot = true;",
+     f"SELECT * FROM c WHERE {GUARD} AND ( c.ch = '1' OR c.b = true)"),
+    ("SELECT * FROM c WHERE c.channel_id = '1' GROUP BY c.guild_id",
+     f"SELECT * FROM c WHERE {GUARD} AND ( c.ch = '1' ) GROUP BY c.g"),
+])
+def test_side_documents_are_excluded_in_every_clause_layout(sql, expected):
+    assert rewrite_query(sql, mixed=False) == expected
+
+
+def test_simple_projections_keep_their_long_name():
+    assert rewrite_query("SELECT c.content, c.author_name FROM c", mixed=False) == \
+        f"SELECT c.t AS content, c.an AS author_name FROM c WHERE {GUARD}"
+    assert rewrite_query("SELECT TOP 3 c.content FROM c", mixed=False).startswith("SELECT TOP 3 c.t AS content FROM c")
+    assert rewrite_query("SELECT DISTINCT c.channel_id FROM c", mixed=False).startswith("SELECT DISTINCT c.ch AS channel_id FROM")
+    # Alias explicite, expression, VALUE : pas de second alias.
+    assert rewrite_query("SELECT c.content AS texte, UPPER(c.author_name) FROM c", mixed=False) == \
+        f"SELECT c.t AS texte, UPPER(c.an) FROM c WHERE {GUARD}"
+    assert rewrite_query("SELECT VALUE c.content FROM c", mixed=False) == f"SELECT VALUE c.t FROM c WHERE {GUARD}"
+
+
+def test_mixed_reads_both_names_except_where_a_path_is_required():
+    assert rewrite_query("SELECT c.content FROM c WHERE c.channel_id = '1' ORDER BY c.message_id_int") == \
+        f"SELECT (c.t ?? c.content) AS content FROM c WHERE {GUARD} AND ( (c.ch ?? c.channel_id) = '1' ) ORDER BY c.m"
+    assert rewrite_query("SELECT c.reactions[0].emoji FROM c") == f"SELECT c.r[0].emoji FROM c WHERE {GUARD}"
+    assert rewrite_query("SELECT c.timestamp_iso, c.id FROM c") == f"SELECT c.timestamp_iso, c.id FROM c WHERE {GUARD}"
+
+
+def test_omitted_defaults_are_restored_with_coalesce():
+    assert rewrite_query("SELECT * FROM c WHERE c.edited_timestamp_iso != null", mixed=False) == \
+        f"SELECT * FROM c WHERE {GUARD} AND ( (c.e ?? null) != null)"
+    assert rewrite_query("SELECT * FROM c WHERE c.author_discriminator = '0'") == \
+        f"SELECT * FROM c WHERE {GUARD} AND ( (c.ad ?? c.author_discriminator ?? \"0\") = '0')"
+
+
+def test_rewritten_queries_return_v1_results_on_a_mixed_container():
+    async def scenario():
+        primary = InMemoryCosmosRepository()
+        repository = CompactRepository(primary, DocumentHashStore(":memory:"))
+        await primary.upsert_item(message(1, content="ancien v1"))  # Document pas encore converti.
+        await repository.upsert_item(message(2, attachments=[{"url": "https://cdn/a.png"}], attachments_count=1))
+        await repository.upsert_item(message(3, author_name="airzya", edited_timestamp_iso="2024-03-02T10:00:00.000Z"))
+        return (
+            await repository.query_items("SELECT VALUE COUNT(1) FROM c"),
+            await repository.query_items("SELECT c.content FROM c WHERE c.edited_timestamp_iso = null ORDER BY c.timestamp_iso"),
+            await repository.query_items("SELECT c.author_name, COUNT(1) AS n FROM c GROUP BY c.author_name"),
+            await repository.query_items("SELECT * FROM c WHERE c.author_name = 'airzya'"),
+        )
+
+    count, unedited, by_author, full = asyncio.run(scenario())
+    assert count == [3]  # L'annexe du message 2 n'est pas comptée.
+    assert sorted(row["content"] for row in unedited) == ["ancien v1", "message 2"]
+    assert sorted((row["author_name"], row["n"]) for row in by_author) == [("airzya", 1), ("hezek112", 2)]
+    assert full[0]["edited_timestamp_iso"] == "2024-03-02T10:00:00.000Z"
+    assert full[0]["author_discriminator"] == "0" and full[0]["timestamp_unix"] == 1709287200
+
+
+def test_compact_document_round_trip():
+    doc = message(7, embeds=[{"title": "lien"}], reactions=[{"emoji": "👍", "count": 2}], reactions_count=2)
+    main, side = compact_document(doc)
+    assert "ad" not in main and "e" not in main and "timestamp_unix" not in main and main["hx"] == 1
+    assert side == {"id": side_id(7), "x": "7", "em": [{"title": "lien"}]}
+    expanded = expand_document(main)
+    assert expanded == {key: value for key, value in doc.items() if key not in ("attachments", "embeds")}
+
+
+def test_unchanged_message_is_not_rewritten():
+    async def scenario():
+        primary = InMemoryCosmosRepository()
+        repository = CompactRepository(primary, DocumentHashStore(":memory:"))
+        attachment = {"url": "https://cdn/a.png?ex=1&hm=abc"}
+        await repository.upsert_item(message(1, attachments=[attachment], attachments_count=1))
+        # Nouvelle signature du CDN, rien d'autre : pas de réécriture.
+        await repository.upsert_item(message(1, attachments=[{"url": "https://cdn/a.png?ex=2&hm=def"}], attachments_count=1))
+        upserts_after_skip = primary.call_counts["upsert"]
+        await repository.upsert_item(message(1, attachments=[attachment], attachments_count=1, reactions_count=1,
+                                             reactions=[{"emoji": "👍", "count": 1}]))
+        await repository.upsert_item(message(1, attachments=[attachment], attachments_count=1, reactions_count=1,
+                                             reactions=[{"emoji": "👍", "count": 1}]), force=True)
+        return repository, primary, upserts_after_skip
+
+    repository, primary, upserts_after_skip = asyncio.run(scenario())
+    assert upserts_after_skip == 2  # Document principal et annexe, une seule fois.
+    assert repository.stats["skipped"] == 1 and repository.stats["written"] == 3
+    assert primary.documents["1"]["nr"] == 1
+
+
+def test_side_document_is_deleted_when_attachments_and_embeds_go_away():
+    async def scenario():
+        primary = InMemoryCosmosRepository()
+        hashes = DocumentHashStore(":memory:")
+        repository = CompactRepository(primary, hashes)
+        await repository.upsert_item(message(1, embeds=[{"title": "lien"}]))
+        assert side_id(1) in primary.documents and hashes.get("1")[1]
+        await repository.upsert_item(message(1, content="édité, aperçu retiré"))
+        assert side_id(1) not in primary.documents and not hashes.get("1")[1]
+        assert "hx" not in primary.documents["1"]
+
+        await repository.upsert_item(message(2, attachments=[{"url": "https://cdn/b.png"}], attachments_count=1))
+        await repository.delete_message("1", 2)
+        return repository, primary, hashes
+
+    repository, primary, hashes = asyncio.run(scenario())
+    assert set(primary.documents) == {"1"}
+    assert hashes.get("2") is None
+    assert repository.stats["side_deleted"] == 2
+
+
+def test_extras_are_read_from_the_side_document():
+    async def scenario():
+        repository = CompactRepository(InMemoryCosmosRepository(), DocumentHashStore(":memory:"))
+        await repository.upsert_item(message(1, attachments=[{"url": "https://cdn/a.png"}], attachments_count=1))
+        await repository.upsert_item(message(2))
+        return await repository.read_extras(1), await repository.read_extras(2), await repository.read_item("1", "1")
+
+    extras, none, read = asyncio.run(scenario())
+    assert extras == {"attachments": [{"url": "https://cdn/a.png"}], "embeds": []}
+    assert none == {"attachments": [], "embeds": []}
+    assert read["content"] == "message 1" and "attachments" not in read
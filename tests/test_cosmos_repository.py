@@ -0,0 +1,89 @@
+"""Reconnexion de CosmosRepository quand son conteneur a disparu (404)."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from azure.cosmos import exceptions
+
+from cosmos_repository import OWNER_RESOURCE_NOT_FOUND, CosmosRepository
+from startup import VerifiedSchemaStore
+
+
+def not_found(sub_status=None):
+    return exceptions.CosmosResourceNotFoundError(status_code=404, message="introuvable", sub_status=sub_status)
+
+
+class FakeContainer:
+    def __init__(self, missing: bool):
+        self.missing = missing
+        self.items = {}
+
+    async def upsert_item(self, body, response_hook=None):
+        if self.missing:
+            raise not_found(OWNER_RESOURCE_NOT_FOUND)
+        self.items[body["id"]] = body
+        return body
+
+    async def read_item(self, item, partition_key, response_hook=None):
+        if self.missing:
+            raise not_found(OWNER_RESOURCE_NOT_FOUND)
+        if item not in self.items:
+            raise not_found(0)
+        return self.items[item]
+
+
+class FakeClient:
+    async def close(self):
+        pass
+
+
+class ReconnectingRepository(CosmosRepository):
+    """connect() recrée le conteneur au lieu d'appeler Azure, et compte les vérifications complètes."""
+
+    def __init__(self, store):
+        super().__init__("https://exemple", "cle", "db", "messages", verified_schemas=store)
+        self.full_checks = 0
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self._container is not None:
+                return
+            if self.verified_schemas.is_verified(self.schema_key):
+                self._container = FakeContainer(missing=True)  # La marque ment : le conteneur a été supprimé.
+            else:
+                self.full_checks += 1
+                self._container = FakeContainer(missing=False)
+                self.verified_schemas.mark_verified(self.schema_key)
+            self._client = FakeClient()
+
+
+def test_missing_container_forgets_schema_and_reconnects(tmp_path):
+    store = VerifiedSchemaStore(str(tmp_path / "state.sqlite3"))
+
+    async def scenario():
+        repository = ReconnectingRepository(store)
+        store.mark_verified(repository.schema_key)
+        await repository.connect()
+        await asyncio.gather(*(repository.upsert_item({"id": str(i), "content": "salut"}) for i in range(5)))
+        return repository
+
+    repository = asyncio.run(scenario())
+    assert repository.full_checks == 1
+    assert repository.container_reconnects == 1
+    assert len(repository._container.items) == 5
+    assert store.is_verified(repository.schema_key)
+
+
+def test_missing_document_does_not_reconnect(tmp_path):
+    store = VerifiedSchemaStore(str(tmp_path / "state.sqlite3"))
+
+    async def scenario():
+        repository = ReconnectingRepository(store)
+        await repository.connect()
+        return repository, await repository.read_item("absent", "absent")
+
+    repository, result = asyncio.run(scenario())
+    assert result is None
+    assert repository.container_reconnects == 0
@@ -0,0 +1,184 @@
+"""Point de reprise de BackfillPipeline et rejeu des écritures temps réel quand des écritures échouent."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingestion import BackfillPipeline, LiveIngestionBuffer
+
+
+class FlakyRepository:
+    """Dépôt en mémoire dont les upserts des ids `failing` échouent toujours."""
+
+    def __init__(self, failing=()):
+        self.failing = {str(item_id) for item_id in failing}
+        self.items = {}
+        self.total_request_charge = 0.0
+
+    async def upsert_item(self, body, timeout=None):
+        await asyncio.sleep(0)
+        if body["id"] in self.failing:
+            raise RuntimeError(f"écriture refusée pour {body['id']}")
+        self.items[body["id"]] = body
+        return body
+
+
+async def history(count):
+    for index in range(count):
+        yield index
+
+
+def run_pipeline(repository, count=10, checkpoint_every=1):
+    checkpoints = []
+
+    async def on_checkpoint(doc):
+        checkpoints.append(int(doc["id"]))
+
+    pipeline = BackfillPipeline(repository, lambda index: {"id": str(index)}, max_in_flight=4, max_retries=0,
+                                checkpoint_every=checkpoint_every, on_checkpoint=on_checkpoint)
+    stats = asyncio.run(pipeline.run(history(count)))
+    return stats, checkpoints
+
+
+def test_checkpoint_reaches_the_end_without_failures():
+    stats, checkpoints = run_pipeline(FlakyRepository())
+    assert stats.written == 10 and not stats.checkpoint_blocked
+    assert checkpoints[-1] == 9
+    assert checkpoints == sorted(checkpoints)
+
+
+def test_checkpoint_stops_before_first_failed_write():
+    repository = FlakyRepository(failing={3, 4, 7})
+    stats, checkpoints = run_pipeline(repository)
+    assert stats.failed == 3 and stats.written == 7
+    assert stats.checkpoint_blocked
+    assert checkpoints and max(checkpoints) == 2  # Les messages 3 et suivants seront relus à la prochaine passe.
+    assert "8" in repository.items  # Les écritures suivantes ont bien eu lieu, seul le point de reprise est retenu.
+
+
+def test_first_write_failing_saves_no_checkpoint():
+    stats, checkpoints = run_pipeline(FlakyRepository(failing={0}), checkpoint_every=100)
+    assert stats.checkpoint_blocked
+    assert checkpoints == []
+
+
+def test_unformattable_message_does_not_block_the_checkpoint():
+    checkpoints = []
+
+    async def on_checkpoint(doc):
+        checkpoints.append(int(doc["id"]))
+
+    def formatter(index):
+        if index == 5:
+            raise ValueError("message illisible")
+        return {"id": str(index)}
+
+    pipeline = BackfillPipeline(FlakyRepository(), formatter, checkpoint_every=1, on_checkpoint=on_checkpoint)
+    stats = asyncio.run(pipeline.run(history(10)))
+    assert stats.failed == 1 and not stats.checkpoint_blocked
+    assert checkpoints[-1] == 9
+
+
+class LiveRepository(FlakyRepository):
+    """Dépôt en mémoire dont les `fail_times` premières écritures de chaque id de `failing` échouent."""
+
+    def __init__(self, failing=(), fail_times=1):
+        super().__init__(failing)
+        self.remaining_failures = {item_id: fail_times for item_id in self.failing}
+        self.deleted = []
+
+    async def upsert_item(self, body, timeout=None):
+        if self.remaining_failures.get(body["id"], 0) > 0:
+            self.remaining_failures[body["id"]] -= 1
+            raise RuntimeError(f"écriture refusée pour {body['id']}")
+        self.items[body["id"]] = body
+        return body
+
+    async def delete_message(self, channel_id, message_id):
+        if self.remaining_failures.get(str(message_id), 0) > 0:
+            self.remaining_failures[str(message_id)] -= 1
+            raise RuntimeError(f"suppression refusée pour {message_id}")
+        self.items.pop(str(message_id), None)
+        self.deleted.append(str(message_id))
+
+
+def live_doc(message_id, channel_id="1", content="salut"):
+    return {"id": str(message_id), "channel_id": channel_id, "content": content}
+
+
+def test_failed_live_write_is_retried_and_blocks_its_channel_until_it_lands():
+    repository = LiveRepository(failing={"10"})
+    flushes = []
+
+    async def on_flush(written, operations, failed):
+        flushes.append((sorted(doc["id"] for doc in written), failed, buffer.blocked_channels()))
+
+    buffer = LiveIngestionBuffer(repository, on_flush=on_flush)
+
+    async def scenario():
+        buffer.stage_upsert(live_doc(10))
+        buffer.stage_upsert(live_doc(11))
+        buffer.stage_upsert(live_doc(20, channel_id="2"))
+        await buffer.flush()
+        assert len(buffer) == 1  # L'upsert en échec attend le prochain vidage.
+        await buffer.flush()
+
+    asyncio.run(scenario())
+    assert flushes[0] == (["11", "20"], 1, {"1"})  # Seul le canal du message manquant est bloqué.
+    assert flushes[1] == (["10"], 0, set())
+    assert repository.items["10"]["content"] == "salut"
+    assert buffer.stats["requeued"] == 1 and len(buffer) == 0
+
+
+def test_failed_live_operation_is_not_requeued_over_a_newer_one():
+    buffer = None
+
+    class DeletedDuringUpsert(LiveRepository):
+        async def upsert_item(self, body, timeout=None):
+            buffer.stage_delete("1", body["id"])  # Arrive pendant le vidage, avant l'échec de l'upsert.
+            return await super().upsert_item(body, timeout)
+
+    repository = DeletedDuringUpsert(failing={"10"})
+    buffer = LiveIngestionBuffer(repository)
+
+    async def scenario():
+        buffer.stage_upsert(live_doc(10))
+        await buffer.flush()
+        assert buffer._pending["10"] == ("delete", "1")
+        assert buffer.blocked_channels() == {"1"}
+        await buffer.flush()
+
+    asyncio.run(scenario())
+    assert repository.deleted == ["10"] and "10" not in repository.items
+    assert buffer.stats["requeued"] == 0
+    assert buffer.blocked_channels() == set()
+
+
+def test_live_operations_are_coalesced_per_message():
+    repository = LiveRepository()
+    resolved = []
+
+    async def resolve_dirty(channel_id, message_id):
+        resolved.append(message_id)
+        return live_doc(message_id, channel_id, content="avec réaction")
+
+    buffer = LiveIngestionBuffer(repository, resolve_dirty=resolve_dirty)
+
+    async def scenario():
+        buffer.stage_upsert(live_doc(1))
+        buffer.stage_delete("1", 1)  # La suppression annule l'upsert en attente.
+        buffer.mark_dirty("1", 2)
+        buffer.stage_upsert(live_doc(2, content="édité"))  # Relu entier : la réaction n'est plus à résoudre.
+        buffer.stage_upsert(live_doc(3))
+        buffer.mark_dirty("1", 3)  # Déjà en attente d'upsert : ignoré.
+        buffer.mark_dirty("1", 4)
+        buffer.mark_dirty("1", 4)
+        await buffer.flush()
+
+    asyncio.run(scenario())
+    assert buffer.stats["events"] == 8 and buffer.stats["coalesced"] == 4
+    assert repository.deleted == ["1"] and "1" not in repository.items
+    assert repository.items["2"]["content"] == "édité"
+    assert repository.items["3"]["content"] == "salut"
+    assert resolved == ["4"] and repository.items["4"]["content"] == "avec réaction"
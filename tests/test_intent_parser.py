@@ -0,0 +1,48 @@
+"""Analyse locale des questions : corpus annoté de benchmarks/intent_corpus.jsonl."""
+import datetime
+import json
+import os
+import sys
+
+import pytest
+import pytz
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from intent_parser import is_author_name, parse_question
+
+USER_NAME = "FlyXOwl"
+NOW = datetime.datetime(2025, 3, 12, 15, 0, tzinfo=pytz.timezone("Europe/Paris"))
+
+with open(os.path.join(ROOT, "benchmarks", "intent_corpus.jsonl"), encoding="utf-8") as f:
+    CORPUS = [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.mark.parametrize("row", CORPUS, ids=[row["question"] for row in CORPUS])
+def test_corpus(row):
+    result = parse_question(row["question"], USER_NAME, NOW)
+    if not row["intent"]:
+        assert result is None, result and result.sql
+        return
+    assert result is not None
+    expected_author = USER_NAME if row["author"] == "@self" else row["author"]
+    assert (result.intent, result.author, result.time_range, result.limit) == \
+        (row["intent"], expected_author, row["time_range"], row["limit"])
+
+
+@pytest.mark.parametrize("word", ["janvier", "Décembre", "lundi", "2023", "images", "noël", "vidéos"])
+def test_dates_and_common_nouns_are_not_authors(word):
+    assert not is_author_name(word)
+
+
+@pytest.mark.parametrize("word", ["Fly", "azyria", "hezek112", "viv1dvivi", "wkda_ledauphin", ".fantaman"])
+def test_pseudos_are_authors(word):
+    assert is_author_name(word)
+
+
+@pytest.mark.parametrize("question", ["combien de messages a envoyé le bot", "combien de messages du bot",
+                                      "les messages du bot hier", "les 5 derniers messages des bots"])
+def test_questions_about_the_bot_go_to_the_model(question):
+    # Sans filtre sur c.author_bot, ces questions deviendraient un total ou une liste de tous les auteurs.
+    assert parse_question(question, USER_NAME, NOW) is None
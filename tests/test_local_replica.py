@@ -0,0 +1,54 @@
+"""Copie initiale de la réplique locale pendant que des messages sont supprimés."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cosmos_repository import InMemoryCosmosRepository
+from local_replica import LocalReplica, ReplicatedRepository
+
+
+def message(index):
+    return {"id": str(1000 + index), "message_id_int": 1000 + index, "channel_id": "1", "guild_id": "9",
+            "author_id": "5", "author_name": "hezek112", "author_display_name": "Hezek", "author_bot": False,
+            "content": f"message {index}", "timestamp_iso": "2024-03-01T10:00:00", "timestamp_unix": 1709287200 + index,
+            "attachments_count": 0, "reactions_count": 0, "edited_timestamp_iso": None}
+
+
+class DeletingPrimary(InMemoryCosmosRepository):
+    """Cosmos dont chaque page est lue avant que le bot ne supprime un de ses messages."""
+
+    def __init__(self):
+        super().__init__()
+        self.repository = None
+
+    async def query_pages(self, *args, **kwargs):
+        async for page, token in super().query_pages(*args, **kwargs):
+            await self.repository.delete_message("1", page[0]["message_id_int"])
+            yield page, token
+
+
+def test_messages_deleted_during_bootstrap_are_not_reinserted(tmp_path):
+    primary = DeletingPrimary()
+    for index in range(10):
+        primary.documents[str(1000 + index)] = message(index)
+    replica = LocalReplica(str(tmp_path / "replica.sqlite3"))
+    repository = ReplicatedRepository(primary, replica)
+    primary.repository = repository
+
+    asyncio.run(repository.bootstrap(page_size=4))
+
+    assert replica.ready
+    remaining = {row[0] for row in replica.conn.execute("SELECT message_id_int FROM messages")}
+    assert remaining == {int(doc_id) for doc_id in primary.documents}
+    assert {1000, 1004, 1008}.isdisjoint(remaining)
+    assert replica.conn.execute("SELECT COUNT(*) FROM deleted_messages").fetchone()[0] == 0
+
+
+def test_deletes_after_bootstrap_are_not_recorded(tmp_path):
+    replica = LocalReplica(str(tmp_path / "replica.sqlite3"))
+    replica.write_documents([message(0), message(1)])
+    replica.mark_ready()
+    assert replica.remove_messages([1000]) == 1
+    assert replica.conn.execute("SELECT COUNT(*) FROM deleted_messages").fetchone()[0] == 0
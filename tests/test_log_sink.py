@@ -0,0 +1,119 @@
+"""File des logs Discord : regroupement en blocs, doublons (×N) et abandon des plus anciennes entrées."""
+import asyncio
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_sink import DISCORD_MAX_CHARS, LogRecord, LogSink
+
+QUIET = logging.getLogger("bebzia-tests")
+QUIET.addHandler(logging.NullHandler())
+QUIET.propagate = False
+
+
+def make_sink(**kwargs):
+    sent = []
+
+    async def send(text):
+        sent.append(text)
+
+    return LogSink(send, logger=QUIET, **kwargs), sent
+
+
+def record(message, source="TEST", to_discord=True):
+    return LogRecord(source, message, to_discord=to_discord)
+
+
+def test_entries_are_batched_in_one_code_block_in_order():
+    sink, sent = make_sink()
+    for index in range(3):
+        sink.emit(record(f"ligne {index}"))
+    sink.emit(record("console seulement", to_discord=False))
+    assert len(sink) == 3
+
+    assert asyncio.run(sink.flush()) == 1
+    assert sent[0].startswith("```\n") and sent[0].endswith("\n```")
+    lines = [line for line in sent[0].splitlines() if line.startswith("ligne")]
+    assert lines == ["ligne 0", "ligne 1", "ligne 2"]
+    assert "console seulement" not in sent[0]
+    assert sink.stats["records"] == 4 and sink.stats["sent_messages"] == 1 and len(sink) == 0
+
+
+def test_pending_duplicates_are_merged():
+    sink, sent = make_sink()
+    for _ in range(3):
+        sink.emit(record("Cosmos indisponible", source="AUTO-FETCH"))
+    sink.emit(record("Cosmos indisponible", source="ASK-CMD"))  # Autre source : autre entrée.
+    asyncio.run(sink.flush())
+    assert "Cosmos indisponible (×3)" in sent[0]
+    assert sent[0].count("Cosmos indisponible") == 2
+    assert sink.stats["coalesced"] == 2
+
+    sink.emit(record("Cosmos indisponible", source="AUTO-FETCH"))  # Déjà envoyé : nouvelle entrée.
+    asyncio.run(sink.flush())
+    assert "(×" not in sent[1]
+
+
+def test_oldest_entries_are_dropped_under_load_and_summarised():
+    sink, sent = make_sink(max_pending=2)
+    sink.emit(record("a", source="AUTO-FETCH"))
+    sink.emit(record("a", source="AUTO-FETCH"))  # Doublon : l'entrée abandonnée compte pour 2.
+    sink.emit(record("b", source="LIVE-INGEST"))
+    sink.emit(record("c", source="ASK-CMD"))
+    sink.emit(record("d", source="ASK-CMD"))
+    assert len(sink) == 2 and sink.stats["dropped"] == 3
+
+    asyncio.run(sink.flush())
+    text = sent[0]
+    assert "\nc\n" in text and "\nd\n" in text and "\na\n" not in text
+    assert "3 entrée(s) de log abandonnée(s) (surcharge) : AUTO-FETCH×2, LIVE-INGEST×1" in text
+
+    asyncio.run(sink.flush())
+    assert len(sent) == 1  # Résumé envoyé une seule fois.
+
+
+def test_batches_respect_discord_limits_and_the_per_flush_budget():
+    sink, sent = make_sink(max_messages_per_flush=2)
+    for index in range(30):
+        sink.emit(record(f"{index:02d} " + "x" * 300))
+    sink.emit(record("y" * 5000))
+
+    asyncio.run(sink.flush())
+    assert len(sent) == 2 and all(len(text) <= DISCORD_MAX_CHARS for text in sent)
+    assert len(sink) > 0  # Le reste attend le prochain vidage.
+    while len(sink):
+        asyncio.run(sink.flush())
+    assert all(len(text) <= DISCORD_MAX_CHARS for text in sent)
+    assert "... (Tronqué)" in sent[-1]
+    sent_lines = [line[:2] for text in sent for line in text.splitlines() if line[2:4] == " x"]
+    assert sent_lines == [f"{index:02d}" for index in range(30)]
+
+
+def test_send_errors_are_counted_and_do_not_raise():
+    async def failing_send(text):
+        raise RuntimeError("429 Too Many Requests")
+
+    sink = LogSink(failing_send, logger=QUIET)
+    sink.emit(record("perdue"))
+    assert asyncio.run(sink.flush()) == 0
+    assert sink.stats["send_errors"] == 1 and len(sink) == 0
+
+
+def test_background_task_flushes_and_close_drains():
+    async def scenario():
+        sink, sent = make_sink(flush_interval=0.01)
+        sink.start()
+        sink.emit(record("premier"))
+        for _ in range(20):
+            if sent:
+                break
+            await asyncio.sleep(0.005)
+        assert sent and "premier" in sent[0]
+        sink.emit(record("dernier"))
+        await sink.close()
+        return sink, sent
+
+    sink, sent = asyncio.run(scenario())
+    assert "dernier" in sent[-1] and len(sink) == 0
@@ -0,0 +1,75 @@
+"""Copie v1 -> v2 pendant que la double écriture modifie déjà la cible."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from container_layout import LAYOUT_V2
+from cosmos_repository import DualWriteRepository, InMemoryCosmosRepository
+from migrate_container import MigrationProgressStore, copy_container
+
+
+def message(index, content="bonjour", ts=100, edited=None):
+    message_id = (1_700_000_000_000 - 1_420_070_400_000) << 22 | index
+    return {"id": str(message_id), "message_id_int": message_id, "channel_id": "1", "author_name": "hezek112",
+            "timestamp_iso": "2023-11-14T22:13:20", "edited_timestamp_iso": edited, "content": content, "_ts": ts}
+
+
+class RacingSource(InMemoryCosmosRepository):
+    """Source dont la page est lue avant que le bot (double écriture) ne modifie les deux conteneurs."""
+
+    def __init__(self, on_page):
+        super().__init__()
+        self.on_page = on_page
+
+    async def query_pages(self, *args, **kwargs):
+        async for page, token in super().query_pages(*args, **kwargs):
+            await self.on_page()
+            yield page, token
+
+
+def run_copy(tmp_path, docs, on_page):
+    source = RacingSource(on_page)
+    target = InMemoryCosmosRepository(layout=LAYOUT_V2)
+    for doc in docs:
+        source.documents[doc["id"]] = dict(doc)
+    progress = MigrationProgressStore(str(tmp_path / "state.sqlite3"))
+    return source, target, progress
+
+
+def test_newer_edit_and_delete_in_target_are_kept(tmp_path):
+    docs = [message(i) for i in range(3)]
+    edited, deleted = docs[0], docs[1]
+
+    async def bot_writes():
+        await dual.upsert_item(dict(edited, content="modifié", edited_timestamp_iso="2023-11-14T22:20:00", _ts=200))
+        await dual.delete_message("1", deleted["message_id_int"])
+
+    source, target, progress = run_copy(tmp_path, docs, bot_writes)
+    dual = DualWriteRepository(source, target)
+    # Le stockage en mémoire horodate les écritures avec time.time() : les versions de la page sont plus vieilles.
+    for doc in source.documents.values():
+        doc["_ts"] = 100
+
+    copied = asyncio.run(copy_container(source, target, progress, "v1", "v2"))
+
+    assert copied == 3
+    assert target.documents[edited["id"]]["content"] == "modifié"
+    assert deleted["id"] not in target.documents
+    assert target.documents[docs[2]["id"]]["content"] == "bonjour"
+    assert target.documents[docs[2]["id"]]["pk"].startswith("1:")
+
+
+def test_restarted_copy_does_not_rewrite_documents(tmp_path):
+    docs = [message(i) for i in range(5)]
+
+    async def nothing():
+        pass
+
+    source, target, progress = run_copy(tmp_path, docs, nothing)
+    asyncio.run(copy_container(source, target, progress, "v1", "v2"))
+    progress.reset("v1", "v2")
+    writes = target.call_counts["upsert"]
+    asyncio.run(copy_container(source, target, progress, "v1", "v2"))
+    assert target.call_counts["upsert"] == writes
@@ -0,0 +1,41 @@
+"""Cache des lignes formatées de PromptBuilder."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_builder import PromptBuilder
+
+
+def make_item(content="salut", edited=None):
+    return {"id": "42", "author_name": "hezek112", "author_display_name": "Hezek",
+            "timestamp_iso": "2024-03-01T10:15:00", "edited_timestamp_iso": edited, "content": content}
+
+
+def test_documents_are_not_modified():
+    item = make_item()
+    before = dict(item)
+    PromptBuilder().message_line(item)
+    assert item == before
+
+
+def test_cache_is_reused_for_the_same_version():
+    builder = PromptBuilder()
+    first = builder.message_line(make_item())
+    assert builder.message_line(make_item()) is first
+
+
+def test_edited_message_gets_a_new_line():
+    builder = PromptBuilder()
+    builder.message_line(make_item())
+    line, _ = builder.message_line(make_item("salut à tous", edited="2024-03-01T10:20:00"))
+    assert line.endswith("salut à tous")
+    line, _ = builder.message_line(make_item("autre contenu"))  # Même sans horodatage d'édition.
+    assert line.endswith("autre contenu")
+
+
+def test_cache_is_bounded():
+    builder = PromptBuilder(line_cache_size=10)
+    for index in range(25):
+        builder.message_line(dict(make_item(), id=str(index)))
+    assert len(builder._line_cache) <= 10
@@ -0,0 +1,147 @@
+"""Cache des résultats de !ask : invalidation par les écritures de messages, canal par canal."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cosmos_repository import InMemoryCosmosRepository
+from result_cache import (IngestionWatermarks, ResultCache, SharedWatermarks, WatermarkedRepository,
+                          normalize_sql, query_channels)
+from result_fetcher import FetchResult
+
+SQL_CHANNEL_1 = "SELECT c.content FROM c WHERE c.channel_id = '1' ORDER BY c.timestamp_iso DESC"
+SQL_CHANNEL_2 = "SELECT c.content FROM c WHERE c.channel_id = '2'"
+
+
+def message(message_id, channel_id):
+    return {"id": str(message_id), "message_id_int": message_id, "channel_id": channel_id, "content": "salut",
+            "timestamp_iso": "2024-03-01T10:00:00.000Z"}
+
+
+def fetch(*contents):
+    return FetchResult(items=[{"content": content} for content in contents], request_charge=3.0)
+
+
+def cache_and_repository(watermarks=None):
+    watermarks = watermarks or IngestionWatermarks()
+    return ResultCache(watermarks), WatermarkedRepository(InMemoryCosmosRepository(), watermarks)
+
+
+def store(cache, sql, result):
+    cache.store(sql, result, cache.watermark_for(sql))
+
+
+@pytest.mark.parametrize("sql, channels", [
+    (SQL_CHANNEL_1, {"1"}),
+    ("SELECT * FROM c WHERE '1' = c.channel_id AND c.author_name = 'hezek112'", {"1"}),
+    ("SELECT * FROM c WHERE c.channel_id = '1' OR c.channel_id = '2'", {"1", "2"}),
+    ("SELECT * FROM c WHERE c.channel_id IN ('1', '2', '3')", {"1", "2", "3"}),
+    ("SELECT * FROM c WHERE (c.channel_id = '1' OR c.channel_id = '2') AND c.channel_id IN ('2', '3')", {"2"}),
+    ("SELECT * FROM c WHERE c.channel_id = '1' OR c.author_name = 'hezek112'", None),  # L'auteur écrit partout.
+    ("SELECT * FROM c WHERE c.channel_id NOT IN ('1')", None),
+    ("SELECT * FROM c WHERE c.channel_id != '1'", None),
+    ("SELECT * FROM c WHERE NOT (c.channel_id = '1')", None),
+    ("SELECT VALUE COUNT(1) FROM c", None),
+    ("pas du SQL", None),
+])
+def test_query_channels(sql, channels):
+    assert query_channels(sql) == (frozenset(channels) if channels is not None else None)
+
+
+def test_normalized_sql_ignores_layout_but_not_strings():
+    assert normalize_sql("SELECT  c.id\nFROM c WHERE c.channel_id = '1';") == normalize_sql("SELECT c.id FROM c WHERE c.channel_id = '1'")
+    assert normalize_sql("SELECT c.id FROM c WHERE c.content = 'a  b'") != normalize_sql("SELECT c.id FROM c WHERE c.content = 'a b'")
+
+
+def test_write_to_a_channel_invalidates_only_queries_reading_it():
+    cache, repository = cache_and_repository()
+    all_channels = "SELECT VALUE COUNT(1) FROM c"
+    store(cache, SQL_CHANNEL_1, fetch("un"))
+    store(cache, SQL_CHANNEL_2, fetch("deux"))
+    store(cache, all_channels, FetchResult(items=[2]))
+    assert cache.lookup(SQL_CHANNEL_1).fetch.items == [{"content": "un"}]
+
+    asyncio.run(repository.upsert_item(message(10, "2")))
+
+    assert cache.lookup(SQL_CHANNEL_1) is not None
+    assert cache.lookup(SQL_CHANNEL_2) is None
+    assert cache.lookup(all_channels) is None  # Sans filtre de canal : dépend de tous les canaux.
+    assert cache.stats["invalidated"] == 2
+    assert cache.stats["saved_request_charge"] == 6.0
+
+
+def test_deletes_invalidate_their_channel_and_unknown_channels_invalidate_all():
+    cache, repository = cache_and_repository()
+    asyncio.run(repository.upsert_item(message(10, "1")))
+    store(cache, SQL_CHANNEL_1, fetch("un"))
+    store(cache, SQL_CHANNEL_2, fetch("deux"))
+
+    asyncio.run(repository.delete_message("1", 10))
+    assert cache.lookup(SQL_CHANNEL_1) is None and cache.lookup(SQL_CHANNEL_2) is not None
+
+    asyncio.run(repository.delete_item("11", "11"))  # Canal inconnu : toutes les entrées tombent.
+    assert cache.lookup(SQL_CHANNEL_2) is None
+
+
+def test_non_message_documents_do_not_invalidate():
+    cache, repository = cache_and_repository()
+    store(cache, SQL_CHANNEL_1, fetch("un"))
+    asyncio.run(repository.upsert_item({"id": "checkpoint-1", "doc_type": "checkpoint", "channel_id": "1"}))
+    assert cache.lookup(SQL_CHANNEL_1) is not None
+
+
+def test_write_during_the_read_prevents_the_store():
+    cache, repository = cache_and_repository()
+    watermark = cache.watermark_for(SQL_CHANNEL_1)  # Relevé avant la requête.
+    asyncio.run(repository.upsert_item(message(10, "1")))  # Écriture pendant la lecture.
+    cache.store(SQL_CHANNEL_1, fetch("ancien"), watermark)
+    assert cache.lookup(SQL_CHANNEL_1) is None
+
+    watermark = cache.watermark_for(SQL_CHANNEL_1)
+    asyncio.run(repository.upsert_item(message(11, "2")))  # Autre canal : sans effet.
+    cache.store(SQL_CHANNEL_1, fetch("récent"), watermark)
+    assert cache.lookup(SQL_CHANNEL_1).fetch.items == [{"content": "récent"}]
+
+
+def test_summary_is_attached_only_while_the_data_is_unchanged():
+    cache, repository = cache_and_repository()
+    store(cache, SQL_CHANNEL_1, fetch("un"))
+    cache.store_summary(SQL_CHANNEL_1, "Résumé.")
+    assert cache.lookup(SQL_CHANNEL_1).summary == "Résumé."
+
+    store(cache, SQL_CHANNEL_2, fetch("deux"))
+    asyncio.run(repository.upsert_item(message(10, "2")))
+    cache.store_summary(SQL_CHANNEL_2, "Résumé périmé.")
+    assert cache.lookup(SQL_CHANNEL_2) is None
+
+
+def test_lru_bounds():
+    cache = ResultCache(IngestionWatermarks(), max_entries=2)
+    for channel in ("1", "2", "3"):
+        store(cache, f"SELECT * FROM c WHERE c.channel_id = '{channel}'", fetch(channel))
+    assert cache.lookup("SELECT * FROM c WHERE c.channel_id = '1'") is None
+    assert cache.stats["evicted"] == 1
+    assert cache.bytes == sum(entry.size_bytes for entry in cache._entries.values())
+
+
+def test_shared_watermarks_across_two_connections(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    ingestion = WatermarkedRepository(InMemoryCosmosRepository(), SharedWatermarks(path))  # Processus d'ingestion.
+    cache = ResultCache(SharedWatermarks(path))  # Processus des commandes.
+    store(cache, SQL_CHANNEL_1, fetch("un"))
+    store(cache, SQL_CHANNEL_2, fetch("deux"))
+    store(cache, "SELECT VALUE COUNT(1) FROM c", FetchResult(items=[0]))
+
+    asyncio.run(ingestion.upsert_item(message(10, "1")))
+
+    assert cache.lookup(SQL_CHANNEL_1) is None
+    assert cache.lookup(SQL_CHANNEL_2) is not None
+    assert cache.lookup("SELECT VALUE COUNT(1) FROM c") is None
+
+    watermark = cache.watermark_for(SQL_CHANNEL_2)
+    asyncio.run(ingestion.delete_message("2", 11))
+    cache.store(SQL_CHANNEL_2, fetch("ancien"), watermark)
+    assert cache.lookup(SQL_CHANNEL_2) is None
@@ -0,0 +1,61 @@
+"""Calcul initial des rollups pendant que des messages sont supprimés."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cosmos_repository import InMemoryCosmosRepository
+from rollups import RollupRepository, RollupStore
+
+
+def message(index):
+    return {"id": str(1000 + index), "message_id_int": 1000 + index, "channel_id": "1", "guild_id": "9",
+            "author_id": "5", "author_name": "hezek112", "author_display_name": "Hezek", "author_bot": False,
+            "content": f"message {index}", "timestamp_iso": "2024-03-01T10:00:00.000Z",
+            "attachments_count": 0, "reactions_count": 2}
+
+
+class DeletingPrimary(InMemoryCosmosRepository):
+    """Cosmos dont chaque page est lue avant que le bot ne supprime un de ses messages."""
+
+    def __init__(self):
+        super().__init__()
+        self.repository = None
+
+    async def query_pages(self, *args, **kwargs):
+        async for page, token in super().query_pages(*args, **kwargs):
+            await self.repository.delete_message("1", page[0]["id"])
+            yield page, token
+
+
+def test_messages_deleted_during_bootstrap_are_not_counted(tmp_path):
+    primary = DeletingPrimary()
+    for index in range(10):
+        primary.documents[str(1000 + index)] = message(index)
+    store = RollupStore(str(tmp_path / "rollups.sqlite3"))
+    repository = RollupRepository(primary, store)
+    primary.repository = repository
+
+    asyncio.run(repository.bootstrap(page_size=4))
+
+    assert store.ready
+    assert store.count() == len(primary.documents) == 7
+    assert asyncio.run(repository.query_items("SELECT VALUE COUNT(1) FROM c")) == [7]
+    assert asyncio.run(repository.query_items("SELECT VALUE SUM(c.reactions_count) FROM c")) == [14]
+    assert store.conn.execute("SELECT COUNT(*) FROM deleted_messages").fetchone()[0] == 0
+
+
+def test_delete_before_the_page_is_written(tmp_path):
+    store = RollupStore(str(tmp_path / "rollups.sqlite3"))
+    assert store.remove_messages(["1042"]) == 0
+    assert store.write_documents([message(42)], only_missing=True) == 0
+    assert store.count() == 0
+
+
+def test_deletes_after_bootstrap_are_not_recorded(tmp_path):
+    store = RollupStore(str(tmp_path / "rollups.sqlite3"))
+    store.write_documents([message(0), message(1)])
+    store.mark_ready()
+    assert store.remove_messages(["1000"]) == 1
+    assert store.conn.execute("SELECT COUNT(*) FROM deleted_messages").fetchone()[0] == 0
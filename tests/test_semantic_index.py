@@ -0,0 +1,86 @@
+"""Index sémantique : échecs de plongement pendant l'indexation initiale, sauvegarde pendant les ajouts."""
+import asyncio
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cosmos_repository import InMemoryCosmosRepository
+from semantic_index import HashingEmbeddingProvider, IndexedRepository, MessageEmbedder, VectorIndex
+
+
+class FailingProvider(HashingEmbeddingProvider):
+    """Échoue pour les `failures` premiers appels, puis plonge normalement."""
+
+    def __init__(self, failures: int):
+        super().__init__(dim=32)
+        self.failures = failures
+
+    async def embed(self, texts):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("429 Too Many Requests")
+        return await super().embed(texts)
+
+
+def message_doc(index: int) -> dict:
+    return {"id": str(1000 + index), "message_id_int": 1000 + index, "channel_id": "1",
+            "content": f"message numéro {index} sur le jeu", "timestamp_unix": 1_700_000_000 + index}
+
+
+async def stored_repository(count: int) -> InMemoryCosmosRepository:
+    repository = InMemoryCosmosRepository()
+    for index in range(count):
+        await repository.upsert_item(message_doc(index))
+    return repository
+
+
+def test_bootstrap_stops_before_a_page_that_failed():
+    async def scenario():
+        index = VectorIndex()
+        indexed = IndexedRepository(await stored_repository(30), MessageEmbedder(FailingProvider(failures=10**6), index, batch_size=8))
+        try:
+            await indexed.bootstrap(page_size=10)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("l'indexation initiale aurait dû s'arrêter")
+        return index
+
+    index = asyncio.run(scenario())
+    assert len(index) == 0
+    assert not index.meta.get("bootstrap_complete")
+    assert index.meta.get("bootstrap_token") is None
+
+
+def test_bootstrap_resumes_and_embeds_everything_after_an_outage():
+    async def scenario():
+        index = VectorIndex()
+        provider = FailingProvider(failures=1)
+        indexed = IndexedRepository(await stored_repository(30), MessageEmbedder(provider, index, batch_size=8))
+        try:
+            await indexed.bootstrap(page_size=10)
+        except RuntimeError:
+            pass
+        await indexed.bootstrap(page_size=10)  # Redémarrage : reprise au dernier jeton gardé.
+        return index
+
+    index = asyncio.run(scenario())
+    assert len(index) == 30
+    assert index.meta.get("bootstrap_complete")
+
+
+def test_snapshot_is_consistent_while_the_index_grows(tmp_path):
+    provider = HashingEmbeddingProvider(dim=16)
+    index = VectorIndex(capacity=4)
+    texts = [f"texte {i}" for i in range(4)]
+    index.add(range(4), provider.embed_sync(texts))
+    snapshot = index.snapshot()
+    more = [f"autre texte {i}" for i in range(100)]
+    index.add(range(4, 104), provider.embed_sync(more))  # Agrandit et remplace les tableaux.
+    VectorIndex.write_snapshot(snapshot, str(tmp_path))
+    loaded = VectorIndex.load(str(tmp_path))
+    assert len(loaded) == 4
+    assert np.array_equal(loaded.ids, np.arange(4))
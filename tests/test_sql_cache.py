@@ -0,0 +1,91 @@
+"""Cache des requêtes SQL générées : clé exacte du jour, modèles de dates relatives, questions personnelles."""
+import datetime
+import os
+import sys
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sql_cache
+from sql_cache import SqlGenerationCache, make_template, relative_markers, resolve_time_window
+
+PARIS = pytz.timezone("Europe/Paris")
+WEDNESDAY = PARIS.localize(datetime.datetime(2025, 3, 12, 15, 0))
+THURSDAY = PARIS.localize(datetime.datetime(2025, 3, 13, 9, 0))
+NEXT_MONDAY = PARIS.localize(datetime.datetime(2025, 3, 17, 9, 0))
+
+YESTERDAY_SQL = 'SELECT VALUE COUNT(1) FROM c WHERE STARTSWITH(c.timestamp_iso, "2025-03-11")'
+WEEK_SQL = 'SELECT * FROM c WHERE c.timestamp_iso >= "2025-03-10T00:00:00" AND c.timestamp_iso <= "2025-03-16T23:59:59"'
+
+
+def test_same_question_hits_the_exact_key_only_the_same_day():
+    cache = SqlGenerationCache()
+    cache.store("Combien de messages hier ?", "FlyXOwl", WEDNESDAY, YESTERDAY_SQL, 900)
+    assert cache.lookup("combien de  messages HIER", "airzya", WEDNESDAY) == (YESTERDAY_SQL, "exact", 900)
+
+    sql, tier, _ = cache.lookup("Combien de messages hier ?", "FlyXOwl", THURSDAY)
+    assert tier == "modèle"  # Pas la clé exacte de la veille, qui donnerait le 11 mars.
+    assert sql == 'SELECT VALUE COUNT(1) FROM c WHERE STARTSWITH(c.timestamp_iso, "2025-03-12")'
+    assert cache.stats == {"exact_hits": 1, "template_hits": 1, "misses": 0, "saved_tokens": 1800}
+    assert cache.lookup("Combien de messages hier ?", "FlyXOwl", THURSDAY)[1] == "exact"  # Modèle résolu, gardé pour le jour.
+
+
+def test_template_resolves_to_the_concrete_dates_of_the_day():
+    cache = SqlGenerationCache()
+    cache.store("les messages de cette semaine", "FlyXOwl", WEDNESDAY, WEEK_SQL, 500)
+    sql, tier, _ = cache.lookup("les messages de cette semaine", "FlyXOwl", NEXT_MONDAY)
+    assert tier == "modèle"
+    assert sql == 'SELECT * FROM c WHERE c.timestamp_iso >= "2025-03-17T00:00:00" AND c.timestamp_iso <= "2025-03-23T23:59:59"'
+
+    cache.store("combien de messages cette année", "FlyXOwl", WEDNESDAY,
+                'SELECT VALUE COUNT(1) FROM c WHERE STARTSWITH(c.timestamp_iso, "2025")', 500)
+    new_year = PARIS.localize(datetime.datetime(2026, 1, 2, 9, 0))
+    assert cache.lookup("combien de messages cette année", "FlyXOwl", new_year)[0] == \
+        'SELECT VALUE COUNT(1) FROM c WHERE STARTSWITH(c.timestamp_iso, "2026")'
+
+
+def test_unexplained_dates_are_not_templated():
+    cache = SqlGenerationCache()
+    # Borne haute "aujourd'hui" alors que la question ne parle que d'hier : pas de modèle.
+    cache.store("combien de messages hier", "FlyXOwl", WEDNESDAY,
+                'SELECT VALUE COUNT(1) FROM c WHERE c.timestamp_iso >= "2025-03-11" AND c.timestamp_iso < "2025-03-12"', 900)
+    cache.store("messages du 3 mars", "FlyXOwl", WEDNESDAY, 'SELECT * FROM c WHERE STARTSWITH(c.timestamp_iso, "2025-03-03")', 900)
+    assert cache.lookup("combien de messages hier", "FlyXOwl", THURSDAY) is None
+    assert cache.lookup("messages du 3 mars", "FlyXOwl", THURSDAY) is None
+    assert make_template('SELECT * FROM c WHERE STARTSWITH(c.timestamp_iso, "2024")', ["year"],
+                         resolve_time_window(WEDNESDAY)) is None
+
+
+def test_day_before_yesterday_is_not_read_as_yesterday():
+    assert relative_markers("combien de messages avant-hier") == ["day_before_yesterday"]
+    assert relative_markers("messages d'hier et d'avant-hier") == ["day_before_yesterday", "yesterday"]
+    assert relative_markers("messages de hierarchie") == []
+
+
+def test_self_referencing_questions_are_keyed_per_user():
+    cache = SqlGenerationCache()
+    mine = "SELECT * FROM c WHERE c.author_name = 'FlyXOwl' AND STARTSWITH(c.timestamp_iso, \"2025-03-11\")"
+    cache.store("mes messages d'hier", "FlyXOwl", WEDNESDAY, mine, 700)
+    assert cache.lookup("mes messages d'hier", "airzya", WEDNESDAY) is None
+    assert cache.lookup("mes messages d'hier", "airzya", THURSDAY) is None  # Ni par le modèle.
+    assert cache.lookup("mes messages d'hier", "flyxowl", WEDNESDAY)[0] == mine
+    assert "FlyXOwl" in cache.lookup("mes messages d'hier", "FlyXOwl", THURSDAY)[0]
+
+    cache.store("qu'est-ce que j'ai dit hier", "FlyXOwl", WEDNESDAY, mine, 700)
+    assert cache.lookup("qu'est-ce que j'ai dit hier", "airzya", WEDNESDAY) is None
+
+
+def test_ttl_and_persistence(tmp_path, monkeypatch):
+    path = str(tmp_path / "sql_cache.json")
+    cache = SqlGenerationCache(persist_path=path, exact_ttl_seconds=60, template_ttl_seconds=3600)
+    cache.store("combien de messages hier", "FlyXOwl", WEDNESDAY, YESTERDAY_SQL, 900)
+
+    reloaded = SqlGenerationCache(persist_path=path, exact_ttl_seconds=60, template_ttl_seconds=3600)
+    assert reloaded.lookup("combien de messages hier", "FlyXOwl", WEDNESDAY)[1] == "exact"
+
+    stored_at = sql_cache.time.time()
+    monkeypatch.setattr(sql_cache.time, "time", lambda: stored_at + 120)
+    assert reloaded.lookup("combien de messages hier", "FlyXOwl", WEDNESDAY)[1] == "modèle"  # Clé exacte expirée.
+    monkeypatch.setattr(sql_cache.time, "time", lambda: stored_at + 7200)
+    assert reloaded.lookup("combien de messages hier", "FlyXOwl", THURSDAY) is None
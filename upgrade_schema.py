@@ -0,0 +1,93 @@
+"""Mise à niveau en place des documents de message v1 vers le schéma compact (compact_schema).
+
+Relit les messages encore au format v1 (seuls à avoir `message_id_int`) et les réécrit compacts,
+avec leur annexe éventuelle. Un document converti ne correspond plus à la requête : relancer la
+commande reprend là où elle s'était arrêtée, sans progression à enregistrer.
+
+Bascule conseillée :
+  1. MESSAGE_SCHEMA=v2 : le bot écrit en compact et lit les deux schémas (requêtes en `??`).
+  2. python upgrade_schema.py --ru-per-second 200   (relançable)
+  3. python upgrade_schema.py --check   (0 document v1 restant)
+  4. MESSAGE_SCHEMA_UPGRADED=1 : les requêtes n'utilisent plus que les noms courts.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from checkpoints import DEFAULT_STATE_PATH
+from compact_schema import V1_MESSAGES_QUERY, CompactRepository, DocumentHashStore
+from container_layout import LAYOUTS
+from cosmos_repository import CosmosRepository
+from ingestion import RequestUnitThrottle
+
+
+async def upgrade_container(raw, compact: CompactRepository, page_size: int = 200, concurrency: int = 16,
+                            ru_per_second: float | None = None, limit: int | None = None):
+    throttle = RequestUnitThrottle(ru_per_second) if ru_per_second else None
+    in_flight = asyncio.Semaphore(max(1, concurrency))
+    upgraded, started = 0, time.monotonic()
+
+    async def upgrade_one(doc):
+        async with in_flight:
+            if throttle:
+                await throttle.wait(raw.total_request_charge)
+            await compact.upsert_item(doc, force=True)
+
+    async for page, _ in raw.query_pages(V1_MESSAGES_QUERY, page_size=page_size):
+        if limit is not None:
+            page = page[:max(0, limit - upgraded)]
+        await asyncio.gather(*(upgrade_one(doc) for doc in page))
+        upgraded += len(page)
+        elapsed = time.monotonic() - started
+        print(f"{upgraded} messages convertis ({len(page) / max(elapsed, 1e-9):.0f} docs/s sur la dernière page, "
+              f"{raw.total_request_charge:.0f} RU, {compact.stats['bytes_saved'] / 1e6:.1f} Mo économisés)")
+        started = time.monotonic()
+        if limit is not None and upgraded >= limit:
+            break
+    return upgraded
+
+
+async def main_async(args):
+    load_dotenv()
+    endpoint, key = os.getenv("COSMOS_DB_ENDPOINT"), os.getenv("COSMOS_DB_KEY")
+    database_name, container_name = os.getenv("DATABASE_NAME"), os.getenv("CONTAINER_NAME")
+    if not all([endpoint, key, database_name, container_name]):
+        print("ERREUR: COSMOS_DB_ENDPOINT, COSMOS_DB_KEY, DATABASE_NAME et CONTAINER_NAME sont requis.")
+        return 1
+
+    raw = CosmosRepository(endpoint, key, database_name, container_name,
+                           layout=LAYOUTS[os.getenv("CONTAINER_LAYOUT", "v1")], query_timeout=args.page_timeout)
+    try:
+        await raw.connect()
+        if args.check:
+            remaining = await raw.query_value("SELECT VALUE COUNT(1) FROM c WHERE IS_DEFINED(c.message_id_int)")
+            print(f"{remaining} documents encore au format v1.")
+            return 0 if not remaining else 2
+        hashes = DocumentHashStore(os.getenv("LOCAL_STATE_PATH", DEFAULT_STATE_PATH), namespace=container_name)
+        compact = CompactRepository(raw, hashes)
+        upgraded = await upgrade_container(raw, compact, page_size=args.page_size, concurrency=args.concurrency,
+                                           ru_per_second=args.ru_per_second or None, limit=args.limit or None)
+        print(f"Mise à niveau terminée : {upgraded} messages, {compact.stats['side_written']} annexes, "
+              f"{raw.total_request_charge:.0f} RU. Vérifier avec --check.")
+        return 0
+    finally:
+        await raw.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convertit les messages v1 du conteneur au schéma compact.")
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--page-timeout", type=float, default=120.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ru-per-second", type=float, default=0, help="budget RU/s (0 = illimité)")
+    parser.add_argument("--limit", type=int, default=0, help="nombre maximum de messages convertis (0 = tous)")
+    parser.add_argument("--check", action="store_true", help="compte seulement les documents v1 restants")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
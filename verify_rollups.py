@@ -0,0 +1,109 @@
+"""Vérification des rollups par parcours complet du conteneur des messages.
+
+Relit tous les messages de Cosmos, recalcule les seaux (même code que le bot) et les compare à ceux
+du fichier de rollups. À lancer de préférence bot arrêté ou en période calme : les messages écrits
+pendant le parcours peuvent sinon apparaître comme des écarts sur les dernières heures.
+
+    python verify_rollups.py                # compare, code de sortie 2 en cas d'écart
+    python verify_rollups.py --repair       # recalcule les rollups depuis Cosmos (bot arrêté)
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from container_layout import LAYOUTS
+from cosmos_repository import CosmosRepository
+from rollups import DEFAULT_ROLLUP_PATH, SOURCE_QUERY, RollupStore, accumulate_buckets
+
+PERIOD_NAMES = {4: "année", 7: "mois", 10: "jour", 13: "heure"}
+
+
+def describe_bucket(key: tuple) -> str:
+    level, period, dims = key
+    dims = json.loads(dims)
+    return (f"{PERIOD_NAMES.get(level, level)} {period}, canal {dims.get('channel_id')}, "
+            f"auteur {dims.get('author_name')} ({dims.get('author_id')})")
+
+
+async def scan(source, page_size: int, store: RollupStore | None = None) -> tuple[dict, int]:
+    """Seaux recalculés depuis `source` et nombre de messages ; réécrits dans `store` s'il est fourni."""
+    totals, scanned, pages, started = {}, 0, 0, time.monotonic()
+    async for page, _ in source.query_pages(SOURCE_QUERY, page_size=page_size):
+        scanned += accumulate_buckets(totals, page)
+        pages += 1
+        if store:
+            await store.upsert_documents(page)
+        if pages % 20 == 0:
+            print(f"{scanned} messages lus ({scanned / max(time.monotonic() - started, 1e-9):.0f}/s, "
+                  f"{source.total_request_charge:.0f} RU)")
+    return totals, scanned
+
+
+def compare(expected: dict, stored: dict, max_diffs: int) -> int:
+    differences = 0
+    for key in sorted(expected.keys() | stored.keys()):
+        want, have = expected.get(key, [0, 0, 0]), stored.get(key, [0, 0, 0])
+        if want == have:
+            continue
+        differences += 1
+        if differences <= max_diffs:
+            print(f"  ÉCART {describe_bucket(key)} : Cosmos {want[0]} msg / {want[1]} pj / {want[2]} réactions, "
+                  f"rollups {have[0]} / {have[1]} / {have[2]}")
+    if differences > max_diffs:
+        print(f"  ... et {differences - max_diffs} autre(s) écart(s).")
+    return differences
+
+
+async def main_async(args):
+    load_dotenv()
+    endpoint, key = os.getenv("COSMOS_DB_ENDPOINT"), os.getenv("COSMOS_DB_KEY")
+    database_name, container_name = os.getenv("DATABASE_NAME"), os.getenv("CONTAINER_NAME")
+    if not all([endpoint, key, database_name, container_name]):
+        print("ERREUR: COSMOS_DB_ENDPOINT, COSMOS_DB_KEY, DATABASE_NAME et CONTAINER_NAME sont requis.")
+        return 1
+
+    path = args.rollups_path or os.getenv("ROLLUPS_PATH", DEFAULT_ROLLUP_PATH)
+    store = RollupStore(path)
+    source = CosmosRepository(endpoint, key, database_name, container_name,
+                              layout=LAYOUTS[os.getenv("CONTAINER_LAYOUT", "v1")], query_timeout=args.page_timeout)
+    try:
+        await source.connect()
+        if args.repair:
+            store.mark_stale()
+            _, scanned = await scan(source, args.page_size, store)
+            store.mark_ready()
+            print(f"Rollups recalculés : {scanned} messages, {source.total_request_charge:.0f} RU.")
+            return 0
+        if not store.ready:
+            print(f"Rollups '{path}' incomplets (calcul initial non terminé) : comparaison indicative.")
+        expected, scanned = await scan(source, args.page_size)
+        stored = store.bucket_totals()
+        counted = store.count()
+        print(f"Cosmos : {scanned} messages, {len(expected)} seaux. Rollups : {counted} messages, {len(stored)} seaux.")
+        differences = compare(expected, stored, args.max_diffs)
+        if differences or counted != scanned:
+            print(f"{differences} seau(x) en écart. --repair pour recalculer les rollups.")
+            return 2
+        print("Rollups identiques au parcours complet.")
+        return 0
+    finally:
+        await source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vérifie les rollups contre un parcours complet des messages.")
+    parser.add_argument("--rollups-path", help="défaut: ROLLUPS_PATH ou bebzia_rollups.sqlite3")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--page-timeout", type=float, default=120.0)
+    parser.add_argument("--max-diffs", type=int, default=20, help="écarts affichés au plus")
+    parser.add_argument("--repair", action="store_true", help="recalcule les rollups depuis Cosmos au lieu de comparer")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()